@@ -453,6 +453,10 @@ class RunCommand(Command):
 
         parser.add_argument('-m', '--monitor', action='store_true',
                             help='Display progress information during execution.')
+        parser.add_argument('-j', '--jobs', type=int, metavar='JOBS', dest='max_workers',
+                            help='Maximum number of independent Workflow steps executed concurrently. '
+                                 'Applies to Workflow files only. Defaults to the "workflow_max_workers" '
+                                 'configuration setting.')
         parser.add_argument('-o', '--open', action='append', metavar='DS_EXPR', dest='open_args',
                             help='Open a dataset from DS_EXPR.\n'
                                  'The DS_EXPR syntax is NAME=DS[,START[,END]]. '
@@ -493,6 +497,7 @@ class RunCommand(Command):
                                  'KEY and their data types to be used as VALUE.')
 
     def execute(self, command_args):
+        from cate.conf import get_workflow_max_workers
         from cate.core.objectio import find_writer, read_object
         from cate.core.op import OP_REGISTRY
         from cate.core.workflow import Workflow
@@ -564,7 +569,13 @@ class RunCommand(Command):
 
         op_kwargs = OrderedDict([(kw, v['value']) for kw, v in op_kwargs.items() if 'value' in v])
 
-        return_value = op(monitor=monitor, **op_kwargs)
+        if is_workflow:
+            max_workers = command_args.max_workers
+            if max_workers is None:
+                max_workers = get_workflow_max_workers()
+            return_value = op(context=dict(max_workers=max_workers), monitor=monitor, **op_kwargs)
+        else:
+            return_value = op(monitor=monitor, **op_kwargs)
         if op.op_meta_info.has_named_outputs:
             if write_args:
                 for out_name, file, format_name in write_args:
@@ -28,7 +28,9 @@ from typing import Any, Dict, Optional, Sequence, Union
 
 from .defaults import GLOBAL_CONF_FILE, LOCAL_CONF_FILE, LOCATION_FILE, VERSION_CONF_FILE, \
     VARIABLE_DISPLAY_SETTINGS, DEFAULT_DATA_PATH, DEFAULT_VERSION_DATA_PATH, DEFAULT_COLOR_MAP, DEFAULT_RES_PATTERN, \
-    WEBAPI_USE_WORKSPACE_IMAGERY_CACHE, DEFAULT_VARIABLES, DATASET_PERSISTENCE_FORMAT, USER_PREFERENCES_FILE
+    WEBAPI_USE_WORKSPACE_IMAGERY_CACHE, DEFAULT_VARIABLES, DATASET_PERSISTENCE_FORMAT, USER_PREFERENCES_FILE, \
+    WORKFLOW_MAX_WORKERS, WORKSPACE_SAVE_MAX_WORKERS, WORKSPACE_STEP_RESULT_CACHE_CAPACITY, \
+    WORKSPACE_MEMORY_BUDGET, PROCESS_MEMORY_BUDGET
 
 _CONFIG = None
 
@@ -95,6 +97,51 @@ def get_default_res_pattern() -> str:
     return default_res_pattern
 
 
+def get_workflow_max_workers() -> int:
+    """
+    Get the maximum number of independent workflow steps executed concurrently.
+    :return: maximum number of workflow workers, 1 if steps are executed sequentially.
+    """
+    workflow_max_workers = get_config_value('workflow_max_workers', WORKFLOW_MAX_WORKERS)
+    return max(1, int(workflow_max_workers)) if workflow_max_workers else 1
+
+
+def get_workspace_save_max_workers() -> int:
+    """
+    Get the maximum number of workspace resources written concurrently when saving a workspace.
+    :return: maximum number of workers, 1 if resources are written sequentially.
+    """
+    save_max_workers = get_config_value('workspace_save_max_workers', WORKSPACE_SAVE_MAX_WORKERS)
+    return max(1, int(save_max_workers)) if save_max_workers else 1
+
+
+def get_step_result_cache_capacity() -> int:
+    """
+    Get the capacity in bytes of the persistent cache for results of workspace steps.
+    :return: capacity in bytes, 0 if the cache is disabled.
+    """
+    capacity = get_config_value('step_result_cache_capacity', WORKSPACE_STEP_RESULT_CACHE_CAPACITY)
+    return max(0, int(capacity)) if capacity else 0
+
+
+def get_workspace_memory_budget() -> int:
+    """
+    Get the memory budget in bytes for the resources of a workspace.
+    :return: budget in bytes, 0 if the budget is disabled.
+    """
+    budget = get_config_value('workspace_memory_budget', WORKSPACE_MEMORY_BUDGET)
+    return max(0, int(budget)) if budget else 0
+
+
+def get_process_memory_budget() -> int:
+    """
+    Get the memory budget in bytes for the resources of all workspaces of this process.
+    :return: budget in bytes, 0 if the budget is disabled.
+    """
+    budget = get_config_value('process_memory_budget', PROCESS_MEMORY_BUDGET)
+    return max(0, int(budget)) if budget else 0
+
+
 def get_http_proxy() -> Optional[str]:
     """
     Get a valid 'http_proxy' value. Log a warning if it is invalid.
@@ -49,6 +49,21 @@ WORKSPACE_WORKFLOW_FILE_NAME = 'workflow.json'
 
 DEFAULT_RES_PATTERN = 'res_{index}'
 
+#: Maximum number of independent workflow steps executed concurrently, 1 means sequential execution
+WORKFLOW_MAX_WORKERS = 1
+
+#: Maximum number of workspace resources written concurrently when saving a workspace
+WORKSPACE_SAVE_MAX_WORKERS = 4
+
+#: Capacity in bytes of the persistent cache for results of workspace steps, 0 disables the cache
+WORKSPACE_STEP_RESULT_CACHE_CAPACITY = 0
+
+#: Memory budget in bytes for the resources of a workspace, 0 disables the budget
+WORKSPACE_MEMORY_BUDGET = 0
+
+#: Memory budget in bytes for the resources of all workspaces of a process, 0 disables the budget
+PROCESS_MEMORY_BUDGET = 0
+
 NETCDF_COMPRESSION_LEVEL = 9
 
 _ONE_MIB = 1024 * 1024
@@ -66,6 +81,28 @@ WEBAPI_WORKSPACE_FILE_TILE_CACHE_CAPACITY = 1 * _ONE_GIB
 # The number of bytes in a workspace's image in-memory cache
 WEBAPI_WORKSPACE_MEM_TILE_CACHE_CAPACITY = 256 * _ONE_MIB
 
+# The number of bytes in the in-memory cache for decoded chunks of displayed arrays
+WEBAPI_WORKSPACE_MEM_BLOCK_CACHE_CAPACITY = 256 * _ONE_MIB
+
+#: The maximum number of threads computing image tiles, None means the number of CPUs
+WEBAPI_MAX_TILE_WORKERS = None
+
+#: The highest level of a variable's image pyramid whose tiles are prefetched into the tile caches,
+#: when the variable is displayed for the first time, -1 disables prefetching
+WEBAPI_TILE_PREFETCH_MAX_LEVEL = 2
+
+#: The maximum number of bytes of tiles prefetched per image pyramid
+WEBAPI_TILE_PREFETCH_CAPACITY = 32 * _ONE_MIB
+
+#: The maximum time in seconds spent on prefetching the tiles of an image pyramid
+WEBAPI_TILE_PREFETCH_TIMEOUT = 30.0
+
+#: The zlib compression level (0-9) of PNG image tiles, lower levels encode faster but produce larger tiles
+WEBAPI_TILE_PNG_COMPRESS_LEVEL = 1
+
+#: The quality (0-100) of lossy WEBP and JPEG image tiles
+WEBAPI_TILE_QUALITY = 90
+
 #: where the information about a running WebAPI service is stored
 WEBAPI_INFO_FILE = os.path.join(DEFAULT_VERSION_DATA_PATH, 'webapi.json')
 
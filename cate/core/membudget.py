@@ -0,0 +1,319 @@
+# The MIT License (MIT)
+# Copyright (c) 2021 by the ESA CCI Toolbox development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Description
+===========
+
+Provides memory budgets for the values of a :py:class:`cate.core.workflow.ValueCache`,
+e.g. the resources of a workspace.
+
+A budget tracks the approximate in-memory sizes of datasets and data frames, see :py:func:`get_value_size`.
+If the total size exceeds the budget's capacity, the least recently used values are spilled to disk:
+datasets in Zarr format and data frames in Parquet format, see :py:class:`cate.core.resultcache.StepResultStore`.
+Spilled values are reloaded transparently on their next access. Values backed by dask arrays
+or by files have no size, because their data are not held in memory.
+
+Budgets may have a parent budget, e.g. the budget of a workspace has the per-process budget
+returned by :py:func:`get_process_memory_budget` as parent, so that the values of all
+open workspaces are limited too.
+
+Spilled files are removed when their budget is closed, because values reloaded from them,
+and values derived from such, may read their data lazily.
+
+Components
+==========
+"""
+
+import collections
+import logging
+import shutil
+import threading
+import uuid
+import weakref
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+import xarray as xr
+
+from .resultcache import StepResultStore
+from ..conf import conf
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_LOG = logging.getLogger('cate')
+
+# Guards the entries of all budgets, as entries are shared between a budget and its parents
+_LOCK = threading.RLock()
+
+_PROCESS_MEMORY_BUDGET = None
+
+
+def get_value_size(value: Any) -> int:
+    """
+    Get the approximate in-memory size of a value that can be spilled in bytes.
+
+    :param value: The value.
+    :return: The sum of the sizes of the in-memory variables of a dataset, the size of a data frame,
+             or zero for other values.
+    """
+    if isinstance(value, xr.Dataset):
+        size = 0
+        for variable in value.variables.values():
+            # Note, variables read lazily from files or backed by dask arrays are not in memory
+            # noinspection PyProtectedMember
+            if getattr(variable, '_in_memory', False) and variable.chunks is None:
+                size += variable.nbytes
+        return size
+    if type(value) is pd.DataFrame:
+        return int(value.memory_usage(index=True, deep=False).sum())
+    return 0
+
+
+class _Entry:
+    __slots__ = ['budget', 'cache_ref', 'key', 'update_count', 'size']
+
+    def __init__(self, budget: 'MemoryBudget', cache, key, update_count: int, size: int):
+        self.budget = budget
+        self.cache_ref = weakref.ref(cache)
+        self.key = key
+        self.update_count = update_count
+        self.size = size
+
+
+class MemoryBudget:
+    """
+    A memory budget for the values of one or more :py:class:`cate.core.workflow.ValueCache` instances.
+
+    :param capacity: The capacity in bytes, zero means unlimited, e.g. if only the parent's capacity applies.
+    :param spill_dir: The directory into which values of the caches using this budget are spilled.
+           If not given, values are not spilled, but their sizes still count for the budget.
+    :param parent: An optional parent budget.
+    """
+
+    def __init__(self, capacity: int, spill_dir: str = None, parent: 'MemoryBudget' = None):
+        self._capacity = capacity
+        self._store = StepResultStore(spill_dir) if spill_dir else None
+        self._parent = parent
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._num_spills = 0
+        self._num_spilled_bytes = 0
+        self._num_reloads = 0
+
+    @property
+    def capacity(self) -> int:
+        """The capacity in bytes, zero means unlimited."""
+        return self._capacity
+
+    @property
+    def size(self) -> int:
+        """The approximate size of the tracked values in bytes."""
+        return self._size
+
+    @property
+    def parent(self) -> Optional['MemoryBudget']:
+        return self._parent
+
+    @property
+    def spill_dir(self) -> Optional[str]:
+        return self._store.cache_dir if self._store is not None else None
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        """
+        Metrics of this budget. Spills and reloads of values of caches using a child budget are included.
+        """
+        with _LOCK:
+            return dict(capacity=self._capacity,
+                        size=self._size,
+                        num_values=len(self._entries),
+                        num_spills=self._num_spills,
+                        num_spilled_bytes=self._num_spilled_bytes,
+                        num_reloads=self._num_reloads)
+
+    def track_value(self, cache, key, update_count: int, value: Any) -> None:
+        """
+        Track the *value* that has been set or loaded for *key* in *cache*.
+        Spill least recently used values, if the capacity of this budget or of a parent budget is exceeded.
+        """
+        size = get_value_size(value)
+        with _LOCK:
+            self._untrack(cache, key)
+            if size > 0:
+                self._track(cache, key, update_count, size)
+            victims = self._collect_victims()
+        for victim in victims:
+            victim_cache = victim.cache_ref()
+            if victim_cache is not None:
+                victim_cache.spill_value(victim.key, victim.update_count)
+
+    def retrack_value(self, cache, key, update_count: int, value: Any) -> None:
+        """
+        Track the *value* for *key* in *cache* again, after it could not be spilled.
+        Other than :py:meth:`track_value`, no values are spilled, the value counts as most recently used.
+        """
+        size = get_value_size(value)
+        with _LOCK:
+            if size > 0 and (id(cache), key) not in self._entries:
+                self._track(cache, key, update_count, size)
+
+    def untrack_value(self, cache, key) -> None:
+        """Stop tracking the value for *key* in *cache*, e.g. because it has been removed."""
+        with _LOCK:
+            self._untrack(cache, key)
+
+    def touch_value(self, cache, key) -> None:
+        """Mark the value for *key* in *cache* as most recently used."""
+        entry_key = id(cache), key
+        with _LOCK:
+            budget = self
+            while budget is not None:
+                if entry_key in budget._entries:
+                    budget._entries.move_to_end(entry_key)
+                budget = budget._parent
+
+    def rename_value(self, cache, key, new_key) -> None:
+        """Track the value for *key* in *cache* under *new_key*."""
+        with _LOCK:
+            entry = self._entries.get((id(cache), key))
+            self._untrack(cache, key)
+            if entry is not None:
+                entry.key = new_key
+                budget = self
+                while budget is not None:
+                    budget._entries[(id(cache), new_key)] = entry
+                    budget._size += entry.size
+                    budget = budget._parent
+
+    def spill_value(self, key, value: Any) -> Optional[Callable[[], Any]]:
+        """
+        Write *value* into the spill directory of this budget.
+
+        :param key: The value's key, used for logging only.
+        :param value: The value.
+        :return: A function that reloads the value, or ``None``, if the value cannot be spilled.
+        """
+        store = self._store
+        if store is None:
+            return None
+        store_key = uuid.uuid4().hex
+        # noinspection PyBroadException
+        try:
+            if not store.can_store_value(value):
+                return None
+            path, size = store.store_value(store_key, value)
+        except Exception:
+            _LOG.exception('spilling value "%s" failed' % key)
+            return None
+        _LOG.info('spilled value "%s" (%s bytes on disk) to %s' % (key, size, path))
+        with _LOCK:
+            budget = self
+            while budget is not None:
+                budget._num_spills += 1
+                budget._num_spilled_bytes += size
+                budget = budget._parent
+
+        def load_value():
+            reloaded_value = store.restore_value(store_key, path)
+            _LOG.info('reloaded value "%s" from %s' % (key, path))
+            with _LOCK:
+                reloading_budget = self
+                while reloading_budget is not None:
+                    reloading_budget._num_reloads += 1
+                    reloading_budget = reloading_budget._parent
+            return reloaded_value
+
+        return load_value
+
+    def close(self) -> None:
+        """Stop tracking the values of this budget and remove spilled files."""
+        with _LOCK:
+            for entry_key, entry in list(self._entries.items()):
+                if entry.budget is self:
+                    self._untrack_entry(entry_key, entry)
+        spill_dir = self.spill_dir
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def _track(self, cache, key, update_count: int, size: int) -> None:
+        entry = _Entry(self, cache, key, update_count, size)
+        budget = self
+        while budget is not None:
+            budget._entries[(id(cache), key)] = entry
+            budget._size += size
+            budget = budget._parent
+
+    def _untrack(self, cache, key) -> None:
+        entry_key = id(cache), key
+        entry = self._entries.get(entry_key)
+        if entry is not None:
+            self._untrack_entry(entry_key, entry)
+
+    @classmethod
+    def _untrack_entry(cls, entry_key, entry: _Entry) -> None:
+        budget = entry.budget
+        while budget is not None:
+            if budget._entries.get(entry_key) is entry:
+                del budget._entries[entry_key]
+                budget._size -= entry.size
+            budget = budget._parent
+
+    def _collect_victims(self):
+        victims = []
+        budget = self
+        while budget is not None:
+            while 0 < budget._capacity < budget._size and budget._entries:
+                entry_key, entry = next(iter(budget._entries.items()))
+                self._untrack_entry(entry_key, entry)
+                victims.append(entry)
+            budget = budget._parent
+        return victims
+
+
+def get_process_memory_budget() -> Optional[MemoryBudget]:
+    """
+    Get the per-process memory budget for the resources of all workspaces,
+    or ``None``, if the configured process memory budget is zero.
+    """
+    global _PROCESS_MEMORY_BUDGET
+    with _LOCK:
+        if _PROCESS_MEMORY_BUDGET is None:
+            capacity = conf.get_process_memory_budget()
+            if capacity <= 0:
+                return None
+            _PROCESS_MEMORY_BUDGET = MemoryBudget(capacity)
+        return _PROCESS_MEMORY_BUDGET
+
+
+def new_workspace_memory_budget(spill_dir: str) -> Optional[MemoryBudget]:
+    """
+    Create a new memory budget for the resources of a workspace, whose parent is the per-process budget.
+
+    :param spill_dir: The directory into which resources are spilled.
+    :return: A new budget or ``None``, if both the configured workspace and process memory budgets are zero.
+    """
+    capacity = conf.get_workspace_memory_budget()
+    parent = get_process_memory_budget()
+    if capacity <= 0 and parent is None:
+        return None
+    return MemoryBudget(max(0, capacity), spill_dir=spill_dir, parent=parent)
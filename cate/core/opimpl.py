@@ -26,8 +26,9 @@ from typing import Optional, Sequence, Union, Tuple
 import cftime
 import numpy as np
 import xarray as xr
-from matplotlib import path
+from numba import jit
 from shapely.geometry import box, LineString, Polygon
+from shapely.geometry.base import BaseGeometry
 
 from .types import PolygonLike, ValidationError
 from ..util.misc import to_list
@@ -370,12 +371,6 @@ def subset_spatial_impl(ds: xr.Dataset,
     else:
         lat_index = slice(lat_min, lat_max)
 
-    if crosses_antimeridian and not simple_polygon and mask:
-        # Unlikely but plausible
-        raise NotImplementedError('Spatial subsets crossing the anti-meridian'
-                                  ' are currently implemented for simple,'
-                                  ' rectangular polygons only, or complex polygons'
-                                  ' without masking.')
     monitor.progress(1)
     if crosses_antimeridian:
         # TODO (forman): reimplement entirely, respect dask arrays, use roll() array operation
@@ -399,6 +394,8 @@ def subset_spatial_impl(ds: xr.Dataset,
         # Preserve the original longitude dimension, masking elements that
         # do not belong to the polygon with NaN.
         with monitor.observing('subset'):
+            if mask and not simple_polygon:
+                ds_subset = ds_subset.where(get_polygon_mask_impl(ds_subset, polygon, crosses_antimeridian=True))
             return reset_non_spatial(ds, ds_subset.reindex_like(ds.lon))
 
     lon_slice = slice(lon_min, lon_max)
@@ -414,30 +411,13 @@ def subset_spatial_impl(ds: xr.Dataset,
         with monitor.observing('subset'):
             return reset_non_spatial(ds, ds_subset)
 
-    # TODO (forman): reimplement following code entirely, respect dask arrays,
-    #  use efficient mask operations from xcube
-    warnings.warn('Entering inefficient code block that requires refactoring.'
-                  ' Expect long execution time and/or out of memory errors.')
-
     # Create the mask array. The result of this is a lon/lat DataArray where
-    # all pixels falling in the region or on its boundary are denoted with True
-    # and all the rest with False. Works on polygon exterior
-
-    polypath = path.Path(np.column_stack([polygon.exterior.coords.xy[0],
-                                          polygon.exterior.coords.xy[1]]))
-
-    # Handle also a single pixel and 1D edge cases
-    ds_subset_lon_values = ds_subset.lon.values
-    ds_subset__lat_values = ds_subset.lat.values
+    # all pixels with a vertex falling in the region are denoted with True
+    # and all the rest with False.
     if len(ds_subset.lat) == 1 or len(ds_subset.lon) == 1:
-        # Create a mask directly on pixel centers
-        lonm, latm = np.meshgrid(ds_subset.lon.values, ds_subset.lat.values)
-        grid_points = [(lon, lat) for lon, lat in zip(lonm.ravel(), latm.ravel())]
-        mask_arr = polypath.contains_points(grid_points)
-        mask_arr = mask_arr.reshape(lonm.shape)
-        mask_arr = xr.DataArray(mask_arr,
-                                coords={'lon': ds_subset.lon, 'lat': ds_subset.lat},
-                                dims=[ds_subset.lat.dims[0], ds_subset.lon.dims[0]])
+        # Handle also a single pixel and 1D edge cases,
+        # create a mask directly on pixel centers
+        mask_arr = get_polygon_mask_impl(ds_subset, polygon, use_corners=False)
 
         with monitor.observing('subset'):
             # Apply the mask to data
@@ -446,50 +426,8 @@ def subset_spatial_impl(ds: xr.Dataset,
         return reset_non_spatial(ds, ds_subset)
 
     # The normal case
-    # Create a grid of pixel vertices
-    lon_pixel = abs(ds.lon[1] - ds.lon[0])
-    lat_pixel = abs(ds.lat[1] - ds.lat[0])
-    lon_min = ds_subset.lon[0] - lon_pixel / 2
-    lon_max = ds_subset.lon[-1] + lon_pixel / 2
-    lat_min = ds_subset.lat[0] - lat_pixel / 2
-    lat_max = ds_subset.lat[-1] + lat_pixel / 2
-
-    lat_grid = np.linspace(lat_min, lat_max, ds_subset.lat.size + 1, dtype='float32')
-    lon_grid = np.linspace(lon_min, lon_max, ds_subset.lon.size + 1, dtype='float32')
-
-    try:
-        lonm, latm = np.meshgrid(lon_grid, lat_grid)
-    except MemoryError:
-        raise ValidationError('Not enough memory to mask the dataset with the given'
-                              ' polygon. Try subsetting with masking disabled')
-
-    # Mark all grid points falling within the polygon as True
-
-    monitor.progress(1)
-    try:
-        grid_points = np.empty((len(lat_grid) * len(lon_grid), 2), dtype='float32')
-    except MemoryError:
-        raise ValidationError('Not enough memory to mask the dataset with the given'
-                              ' polygon. Try subsetting with masking disabled')
-    for i, el in enumerate(((lon, lat) for lon, lat in zip(lonm.ravel(), latm.ravel()))):
-        grid_points[i] = el
-
-    monitor.progress(1)
-    try:
-        mask_arr = polypath.contains_points(grid_points)
-    except MemoryError:
-        raise ValidationError('Not enough memory to mask the dataset with the given'
-                              ' polygon. Try subsetting with masking disabled')
-
-    monitor.progress(1)
-
-    mask_arr = mask_arr.reshape(lonm.shape)
-    # Vectorized 'rolling window' numpy magic to go from pixel vertices to pixel centers
-    mask_arr = mask_arr[1:, 1:] + mask_arr[1:, :-1] + mask_arr[:-1, 1:] + mask_arr[:-1, :-1]
-
-    mask_arr = xr.DataArray(mask_arr,
-                            coords={'lon': ds_subset_lon_values, 'lat': ds_subset__lat_values},
-                            dims=['lat', 'lon'])
+    mask_arr = get_polygon_mask_impl(ds_subset, polygon)
+    monitor.progress(3)
 
     with monitor.observing('subset'):
         # Apply the mask to data
@@ -499,6 +437,131 @@ def subset_spatial_impl(ds: xr.Dataset,
     return reset_non_spatial(ds, ds_subset)
 
 
+def get_polygon_mask_impl(ds: Union[xr.Dataset, xr.DataArray],
+                          region: BaseGeometry,
+                          use_corners: bool = True,
+                          crosses_antimeridian: bool = False) -> xr.DataArray:
+    """
+    Rasterize a polygon onto the lat/lon grid of the given dataset or data array.
+
+    The polygon is scan-converted row by row using the even-odd rule, so holes
+    of polygons and overlapping parts of multi-polygons are respected.
+
+    :param ds: Dataset or data array with 1D 'lat' and 'lon' coordinates
+    :param region: A shapely Polygon or MultiPolygon
+    :param use_corners: If True, a grid cell is selected if any of its corners
+    falls within the region, otherwise if its center does. Grids with a single
+    row or column always use the cell centers.
+    :param crosses_antimeridian: Whether the region crosses the anti-meridian.
+    If True, negative longitudes of both the region and the grid are shifted
+    by 360 degrees before rasterization.
+    :return: A boolean (lat, lon) data array which is True for selected grid cells,
+    chunked like the spatial dimensions of *ds*.
+    """
+    lon_dim = ds.lon.dims[0]
+    lat_dim = ds.lat.dims[0]
+    lon = ds.lon.values.astype(np.float64)
+    lat = ds.lat.values.astype(np.float64)
+
+    x0, y0, x1, y1 = _get_polygon_edges(region)
+    if crosses_antimeridian:
+        x0 = np.where(x0 < 0, x0 + 360.0, x0)
+        x1 = np.where(x1 < 0, x1 + 360.0, x1)
+        lon = np.where(lon < 0, lon + 360.0, lon)
+
+    # The rasterizer expects ascending coordinates
+    lon_order = np.argsort(lon, kind='stable')
+    lat_order = np.argsort(lat, kind='stable')
+    xs = lon[lon_order]
+    ys = lat[lat_order]
+
+    use_corners = use_corners and xs.size > 1 and ys.size > 1
+    if use_corners:
+        xs = _get_cell_boundaries(xs)
+        ys = _get_cell_boundaries(ys)
+
+    inside = _rasterize_edges(x0, y0, x1, y1, xs, ys, np.zeros((ys.size, xs.size), dtype=np.bool_))
+    if use_corners:
+        inside = inside[1:, 1:] | inside[1:, :-1] | inside[:-1, 1:] | inside[:-1, :-1]
+    inside = inside[np.argsort(lat_order)][:, np.argsort(lon_order)]
+
+    mask = xr.DataArray(inside,
+                        coords={'lon': ds.lon, 'lat': ds.lat},
+                        dims=[lat_dim, lon_dim])
+
+    variables = ds.data_vars.values() if isinstance(ds, xr.Dataset) else [ds]
+    for var in variables:
+        if var.chunks is not None and lat_dim in var.dims and lon_dim in var.dims:
+            chunks = dict(zip(var.dims, var.chunks))
+            return mask.chunk(chunks={lat_dim: chunks[lat_dim], lon_dim: chunks[lon_dim]})
+    return mask
+
+
+def _get_polygon_edges(region: BaseGeometry) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the start and end points of all edges of all rings of a Polygon or MultiPolygon.
+    """
+    polygons = list(region.geoms) if hasattr(region, 'geoms') else [region]
+    rings = []
+    for polygon in polygons:
+        rings.append(polygon.exterior)
+        rings.extend(polygon.interiors)
+    x0, y0, x1, y1 = [], [], [], []
+    for ring in rings:
+        coords = np.asarray(ring.coords, dtype=np.float64)
+        x0.append(coords[:-1, 0])
+        y0.append(coords[:-1, 1])
+        x1.append(coords[1:, 0])
+        y1.append(coords[1:, 1])
+    if not rings:
+        empty = np.zeros(0, dtype=np.float64)
+        return empty, empty, empty, empty
+    return np.concatenate(x0), np.concatenate(y0), np.concatenate(x1), np.concatenate(y1)
+
+
+def _get_cell_boundaries(centers: np.ndarray) -> np.ndarray:
+    """
+    Get the boundaries of grid cells given their ascending centers.
+    """
+    boundaries = np.empty(centers.size + 1, dtype=np.float64)
+    boundaries[1:-1] = 0.5 * (centers[1:] + centers[:-1])
+    boundaries[0] = centers[0] - 0.5 * (centers[1] - centers[0])
+    boundaries[-1] = centers[-1] + 0.5 * (centers[-1] - centers[-2])
+    return boundaries
+
+
+# This function will be JIT-compiled by Numba with nopython=True,
+# therefore all arg types must be either primitive scalars or numpy arrays.
+#
+@jit(nopython=True)
+def _rasterize_edges(x0s, y0s, x1s, y1s, xs, ys, out):
+    """
+    Mark all points of the grid given by ascending *xs* and *ys* that fall within
+    the polygon given by its edges, using the even-odd rule.
+    """
+    num_edges = x0s.shape[0]
+    crossings = np.empty(num_edges, dtype=np.float64)
+    for j in range(ys.shape[0]):
+        y = ys[j]
+        # Collect the x-coordinates where the edges cross the scanline
+        n = 0
+        for e in range(num_edges):
+            ya = y0s[e]
+            yb = y1s[e]
+            if (ya <= y < yb) or (yb <= y < ya):
+                crossings[n] = x0s[e] + (y - ya) * (x1s[e] - x0s[e]) / (yb - ya)
+                n += 1
+        if n < 2:
+            continue
+        row_crossings = np.sort(crossings[:n])
+        for k in range(0, n - 1, 2):
+            i0 = np.searchsorted(xs, row_crossings[k])
+            i1 = np.searchsorted(xs, row_crossings[k + 1], side='right')
+            for i in range(i0, i1):
+                out[j, i] = True
+    return out
+
+
 def _crosses_antimeridian(region: Polygon) -> bool:
     """
     Determine if the given region crosses the Antimeridian line, by converting
@@ -0,0 +1,283 @@
+# The MIT License (MIT)
+# Copyright (c) 2021 by the ESA CCI Toolbox development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Description
+===========
+
+Provides a persistent cache for the results of workflow steps.
+
+Results are keyed by step fingerprints, see :py:meth:`cate.core.workflow.OpStep.compute_fingerprint`.
+A fingerprint changes whenever the step's operation, the operation's version, a constant input value,
+or the fingerprint of any upstream step changes. Hence, unchanged steps can load their results from disk
+instead of recomputing them, e.g. when a workspace is re-opened.
+
+Datasets are stored in Zarr format, data frames in Parquet format. Other results are not cached.
+
+Components
+==========
+"""
+
+import logging
+import os
+import shutil
+import threading
+import uuid
+from typing import Any, Optional
+
+import pandas as pd
+import xarray as xr
+
+from ..util.cache import Cache, CacheStore, POLICY_LRU
+from ..util.undefined import UNDEFINED
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+_LOG = logging.getLogger('cate')
+
+_ZARR_EXT = '.zarr'
+_PARQUET_EXT = '.parquet'
+
+
+class StepResultStore(CacheStore):
+    """
+    A cache store that writes step results into *cache_dir*.
+    Datasets are stored as Zarr directories, data frames as Parquet files.
+
+    :param cache_dir: The cache directory.
+    """
+
+    def __init__(self, cache_dir: str):
+        self._cache_dir = cache_dir
+        # Restored datasets read their data lazily, so their stores must be kept until close()
+        self._pinned_paths = set()
+        self._discarded_paths = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @classmethod
+    def can_store_value(cls, value) -> bool:
+        """Test whether *value* can be stored by this store."""
+        # Note, GeoDataFrame is a DataFrame too, but requires geopandas to restore its geometries.
+        return isinstance(value, xr.Dataset) or type(value) is pd.DataFrame
+
+    @classmethod
+    def get_value_size(cls, value) -> int:
+        """Get the (estimated) size in bytes of a value that can be stored by this store."""
+        if isinstance(value, xr.Dataset):
+            return int(value.nbytes)
+        return int(value.memory_usage(index=True, deep=True).sum())
+
+    def can_load_from_key(self, key) -> bool:
+        return self._find_path(key) is not None
+
+    def load_from_key(self, key):
+        path = self._find_path(key)
+        with self._lock:
+            self._discarded_paths.discard(path)
+        return path, _get_path_size(path)
+
+    def store_value(self, key, value):
+        if isinstance(value, xr.Dataset):
+            path = self._key_to_path(key, _ZARR_EXT)
+            write_value = _write_zarr
+        elif type(value) is pd.DataFrame:
+            path = self._key_to_path(key, _PARQUET_EXT)
+            write_value = _write_parquet
+        else:
+            raise ValueError('cannot store value of type %s' % type(value))
+        with self._lock:
+            if path in self._pinned_paths and os.path.exists(path):
+                # The store holds the result for the same fingerprint and is still read by restored datasets
+                self._discarded_paths.discard(path)
+                return path, _get_path_size(path)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # Write to a temporary path first, so that readers never see incomplete results
+        temp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        try:
+            write_value(value, temp_path)
+            _remove_path(path)
+            os.replace(temp_path, path)
+        finally:
+            _remove_path(temp_path)
+        return path, _get_path_size(path)
+
+    def restore_value(self, key, stored_value):
+        if stored_value.endswith(_ZARR_EXT):
+            dataset = xr.open_zarr(stored_value)
+            with self._lock:
+                self._pinned_paths.add(stored_value)
+            return dataset
+        return pd.read_parquet(stored_value)
+
+    def discard_value(self, key, stored_value):
+        with self._lock:
+            if stored_value in self._pinned_paths:
+                # Removed by close(), restored datasets and results derived from them may still read it
+                self._discarded_paths.add(stored_value)
+                return
+        _remove_path(stored_value)
+
+    def close(self) -> None:
+        """Remove the stores of discarded values that have been kept for restored datasets."""
+        with self._lock:
+            discarded_paths = self._discarded_paths
+            self._pinned_paths = set()
+            self._discarded_paths = set()
+        for path in discarded_paths:
+            _remove_path(path)
+
+    def _find_path(self, key) -> Optional[str]:
+        for ext in (_ZARR_EXT, _PARQUET_EXT):
+            path = self._key_to_path(key, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _key_to_path(self, key, ext: str) -> str:
+        return os.path.join(self._cache_dir, str(key) + ext)
+
+
+class StepResultCache:
+    """
+    A size-bounded, persistent cache for step results. Least recently used results are evicted first.
+
+    Results that are neither datasets nor data frames, results that cannot be written,
+    and results larger than the cache's maximum size are not cached.
+
+    Restored datasets are read lazily from the cache directory. Hence, the stores of restored datasets that are
+    evicted are only removed by :py:meth:`close`, e.g. when the workspace is closed.
+
+    :param cache_dir: The cache directory.
+    :param capacity: The capacity in bytes.
+    :param threshold: Fraction of *capacity* up to which the cache is filled.
+    """
+
+    def __init__(self, cache_dir: str, capacity: int, threshold: float = 0.75):
+        self._store = StepResultStore(cache_dir)
+        self._cache = Cache(store=self._store, capacity=capacity, threshold=threshold, policy=POLICY_LRU)
+
+    @property
+    def cache_dir(self) -> str:
+        return self._store.cache_dir
+
+    @property
+    def capacity(self) -> int:
+        return self._cache.capacity
+
+    @property
+    def size(self) -> int:
+        """The size in bytes of all results known to this cache."""
+        return self._cache.size
+
+    def get(self, fingerprint: Optional[str], default=UNDEFINED) -> Any:
+        """
+        Get the result for the given *fingerprint*.
+
+        :param fingerprint: A step fingerprint or ``None``.
+        :param default: Value returned, if there is no result for *fingerprint*.
+        :return: The result or *default*.
+        """
+        if not fingerprint:
+            return default
+        # noinspection PyBroadException
+        try:
+            value = self._cache.get_value(fingerprint)
+        except Exception:
+            _LOG.exception('reading cached step result "%s" failed' % fingerprint)
+            self._cache.remove_value(fingerprint)
+            return default
+        return default if value is None else value
+
+    def put(self, fingerprint: Optional[str], value: Any) -> bool:
+        """
+        Put the result *value* for the given *fingerprint*.
+
+        :param fingerprint: A step fingerprint or ``None``.
+        :param value: The step result.
+        :return: ``True``, if the result has been cached.
+        """
+        if not fingerprint or not self._store.can_store_value(value):
+            return False
+        if self._store.get_value_size(value) > self._cache.max_size:
+            return False
+        # noinspection PyBroadException
+        try:
+            self._cache.put_value(fingerprint, value)
+        except Exception:
+            _LOG.exception('writing step result "%s" to cache failed' % fingerprint)
+            self._cache.remove_value(fingerprint)
+            return False
+        return True
+
+    def remove(self, fingerprint: str) -> None:
+        """Remove the result for the given *fingerprint*."""
+        self._cache.remove_value(fingerprint)
+
+    def close(self) -> None:
+        """Remove the stored results that have been evicted but kept for restored datasets."""
+        self._store.close()
+
+
+def _write_zarr(dataset: xr.Dataset, path: str) -> None:
+    # Encodings stem from the dataset's original source, e.g. NetCDF, and are often invalid for Zarr
+    dataset = dataset.copy()
+    for var in dataset.variables.values():
+        var.encoding = {}
+    dataset.to_zarr(path, mode='w')
+
+
+def _write_parquet(data_frame: pd.DataFrame, path: str) -> None:
+    data_frame.to_parquet(path)
+
+
+def _get_path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(dir_path, file_name))
+    return size
+
+
+def _remove_path(path: str) -> None:
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        _LOG.exception('removing cached step result "%s" failed' % path)
+
+
+def new_step_result_cache(cache_dir: str, capacity: int) -> Optional[StepResultCache]:
+    """
+    Create a new step result cache, or return ``None`` if *capacity* is not positive.
+
+    :param cache_dir: The cache directory.
+    :param capacity: The capacity in bytes.
+    :return: A new step result cache or ``None``.
+    """
+    return StepResultCache(cache_dir, capacity) if capacity and capacity > 0 else None
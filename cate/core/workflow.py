@@ -113,16 +113,23 @@ Components
 ==========
 """
 
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import threading
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict, namedtuple
 from io import IOBase
 from itertools import chain
-from typing import Optional, Union, List, Dict
+from typing import Optional, Union, List, Dict, Set, Callable, Any
 
 from .op import OP_REGISTRY, Operation, Monitor, new_expression_op, new_subprocess_op
 from ..util.namespace import Namespace
 from ..util.undefined import UNDEFINED
 from ..util.safe import safe_eval
+from ..util.monitor import Cancellation, ChildMonitor
 from ..util.opmetainf import OpMetaInfo
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
@@ -355,6 +362,23 @@ class Node(metaclass=ABCMeta):
         value_cache = context.get('value_cache')
         return value_cache if self.op_meta_info.can_cache else None
 
+    def _get_result_cache(self, context: Dict):
+        """
+        Get the 'result_cache' entry from context
+        only if this node is allowed to cache, otherwise return None.
+        """
+        result_cache = context.get('result_cache')
+        return result_cache if self.op_meta_info.can_cache else None
+
+    def compute_fingerprint(self) -> Optional[str]:
+        """
+        Compute a fingerprint of this node's result that changes whenever any of the node's
+        inputs or computation changes. The default implementation returns ``None``.
+
+        :return: A fingerprint string or ``None``, if the node's result cannot be fingerprinted.
+        """
+        return None
+
     def set_input_values(self, input_values):
         for node_input in self.inputs[:]:
             node_input.value = input_values[node_input.name]
@@ -612,15 +636,24 @@ class Workflow(Node):
                      steps: List['Step'],
                      context: Dict = None,
                      monitor_label: str = None,
-                     monitor=Monitor.NONE) -> None:
+                     monitor=Monitor.NONE,
+                     max_workers: int = None) -> None:
         """
         Invoke just the given steps.
 
+        If *max_workers* is greater than one, steps are invoked as soon as all the steps they require
+        have been invoked, and up to *max_workers* independent steps are invoked concurrently in a thread pool.
+        Otherwise, steps are invoked sequentially in the given order.
+
         :param steps: Selected steps of this workflow.
         :param context: An optional execution context
         :param monitor_label: An optional label for the progress monitor.
         :param monitor: The progress monitor.
+        :param max_workers: Maximum number of steps invoked concurrently.
+               If not given, the "max_workers" entry of *context* is used, if any.
         """
+        if max_workers is None and context:
+            max_workers = context.get('max_workers')
         context = _new_context(context, workflow=self)
         step_count = len(steps)
         if step_count == 1:
@@ -628,8 +661,94 @@ class Workflow(Node):
         elif step_count > 1:
             monitor_label = monitor_label or "Executing {step_count} workflow step(s)"
             with monitor.starting(monitor_label.format(step_count=step_count), step_count):
-                for step in steps:
-                    step.invoke(context=context, monitor=monitor.child(work=1))
+                if max_workers is not None and max_workers > 1:
+                    self._invoke_steps_parallel(steps, context, monitor, max_workers)
+                else:
+                    for step in steps:
+                        step.invoke(context=context, monitor=monitor.child(work=1))
+
+    def _invoke_steps_parallel(self,
+                               steps: List['Step'],
+                               context: Dict,
+                               monitor: Monitor,
+                               max_workers: int) -> None:
+        """
+        Invoke the given steps in the order given by their dependencies using a thread pool.
+
+        If a step fails, no further steps are started, steps still running are asked to cancel
+        through their monitors, and the step's exception is re-raised.
+        """
+        step_set = set(steps)
+        required_steps = {step: self._find_required_steps(step, step_set) for step in steps}
+        dependent_steps = {step: [] for step in steps}
+        for step, step_required_steps in required_steps.items():
+            for required_step in step_required_steps:
+                dependent_steps[required_step].append(step)
+        num_required_steps = {step: len(step_required_steps) for step, step_required_steps in required_steps.items()}
+
+        # Note, monitors are not required to be thread-safe, so steps report progress under a common lock
+        monitor_lock = threading.Lock()
+        failed = threading.Event()
+        ready_steps = [step for step in steps if num_required_steps[step] == 0]
+        futures = {}
+        error = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix='cate-workflow') as executor:
+            while ready_steps or futures:
+                while ready_steps and error is None:
+                    step = ready_steps.pop(0)
+                    step_monitor = _StepMonitor(monitor, 1, monitor_lock, failed)
+                    futures[executor.submit(step.invoke, context=context, monitor=step_monitor)] = step
+                done_futures, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done_futures:
+                    step = futures.pop(future)
+                    if future.cancelled():
+                        continue
+                    future_error = future.exception()
+                    if future_error is not None:
+                        if error is None:
+                            error = future_error
+                            failed.set()
+                        continue
+                    for dependent_step in dependent_steps[step]:
+                        num_required_steps[dependent_step] -= 1
+                        if num_required_steps[dependent_step] == 0:
+                            ready_steps.append(dependent_step)
+                if error is None and monitor.is_cancelled():
+                    error = Cancellation()
+                    failed.set()
+                if error is not None:
+                    ready_steps = []
+                    for future in futures:
+                        future.cancel()
+        if error is not None:
+            raise error
+        if any(num_required_steps.values()):
+            raise ValueError('steps have cyclic dependencies')
+
+    def _find_required_steps(self, step: 'Step', steps: Set['Step']) -> Set['Step']:
+        """
+        Find the steps in *steps* that *step* requires. Sources that are steps of this workflow
+        not contained in *steps* are followed through, sources that are this workflow's inputs are ignored.
+        """
+        required_steps = set()
+        visited_steps = {step}
+        source_steps = [step]
+        while source_steps:
+            source_step = source_steps.pop()
+            for port in source_step.inputs[:]:
+                source = port.source
+                if source is None:
+                    continue
+                source_node = source.node
+                if source_node in visited_steps or source_node.parent_node is not self:
+                    continue
+                visited_steps.add(source_node)
+                if source_node in steps:
+                    required_steps.add(source_node)
+                else:
+                    source_steps.append(source_node)
+        return required_steps
 
     @classmethod
     def load(cls, file_path_or_fp: Union[str, IOBase], registry=OP_REGISTRY) -> 'Workflow':
@@ -974,10 +1093,15 @@ class OpStepBase(Step, metaclass=ABCMeta):
         self._set_context_values(context, input_values)
 
         value_cache = self._get_value_cache(context)
-        if value_cache is not None and self.id in value_cache and value_cache[self.id] is not UNDEFINED:
-            return_value = value_cache[self.id]
-        else:
-            return_value = self._op(monitor=monitor, **input_values)
+        return_value = value_cache.get(self.id, UNDEFINED) if value_cache is not None else UNDEFINED
+        if return_value is UNDEFINED:
+            result_cache = self._get_result_cache(context)
+            fingerprint = self.compute_fingerprint() if result_cache is not None else None
+            return_value = result_cache.get(fingerprint) if fingerprint else UNDEFINED
+            if return_value is UNDEFINED:
+                return_value = self._op(monitor=monitor, **input_values)
+                if fingerprint:
+                    result_cache.put(fingerprint, return_value)
             if value_cache is not None:
                 value_cache[self.id] = return_value
 
@@ -1023,6 +1147,60 @@ class OpStep(OpStepBase):
             op = registry.get_op(operation, fail_if_not_exists=True)
         super(OpStep, self).__init__(op, node_id=node_id)
 
+    def compute_fingerprint(self) -> Optional[str]:
+        """
+        Compute a fingerprint from the operation's qualified name and version, the step's constant input values,
+        and the fingerprints of the upstream steps connected to the step's inputs.
+
+        Inputs of files to be read, i.e. inputs declared with ``file_open_mode='r'``, also contribute
+        the modification times and sizes of the files, so that results change when the files do.
+
+        Operations declared with ``no_cache=True``, operations that receive context values, and operations
+        whose inputs are not JSON-serializable, are connected to steps without fingerprint,
+        or refer to files that do not exist, have no fingerprint.
+
+        :return: A fingerprint string or ``None``.
+        """
+        op_meta_info = self.op_meta_info
+        if not op_meta_info.can_cache:
+            return None
+        if any(input_props.get('context') for input_props in op_meta_info.inputs.values()):
+            return None
+
+        op_version = op_meta_info.header.get('version', UNDEFINED)
+        if op_version is UNDEFINED:
+            # Without an explicit version, results are valid for the current Cate version only
+            from ..version import __version__
+            op_version = 'cate-' + __version__
+
+        input_fingerprints = []
+        for port in self.inputs[:]:
+            source = port.source
+            if source is not None and source.node is not self.parent_node:
+                if source.node is self:
+                    return None
+                source_fingerprint = source.node.compute_fingerprint()
+                if source_fingerprint is None:
+                    return None
+                input_fingerprints.append([port.name, 'source', source_fingerprint, source.name])
+            elif port.has_value:
+                value = port.value
+                input_props = op_meta_info.inputs.get(port.name) or {}
+                if input_props.get('file_open_mode') == 'r' and isinstance(value, str) and value:
+                    file_state = _get_file_state(value)
+                    if file_state is None:
+                        return None
+                    input_fingerprints.append([port.name, 'file', value, file_state])
+                else:
+                    input_fingerprints.append([port.name, 'value', value])
+
+        try:
+            text = json.dumps([op_meta_info.qualified_name, str(op_version), input_fingerprints],
+                              sort_keys=True, allow_nan=True)
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
     @classmethod
     def new_step_from_json_dict(cls, json_dict, registry=OP_REGISTRY):
         op_name = json_dict.get('op', None)
@@ -1250,6 +1428,34 @@ class NoOpStep(Step):
 SourceRef = namedtuple('SourceRef', ['node_id', 'port_name'])
 
 
+class _StepMonitor(ChildMonitor):
+    """
+    A child monitor for a step invoked in a thread pool. Progress is reported to the parent
+    monitor under the given *lock*. The monitor is cancelled if the parent monitor is cancelled
+    or if the *failed* event is set.
+    """
+
+    def __init__(self, parent_monitor: Monitor, partial_work: float, lock: threading.Lock, failed: threading.Event):
+        super().__init__(parent_monitor, partial_work)
+        self._lock = lock
+        self._failed = failed
+
+    def start(self, label: str, total_work: float = None):
+        with self._lock:
+            super().start(label, total_work=total_work)
+
+    def progress(self, work: float = None, msg: str = None):
+        with self._lock:
+            super().progress(work=work, msg=msg)
+
+    def done(self):
+        with self._lock:
+            super().done()
+
+    def is_cancelled(self) -> bool:
+        return self._failed.is_set() or super().is_cancelled()
+
+
 class NodePort:
     """Represents a named input or output port of a :py:class:`Node`. """
 
@@ -1522,17 +1728,44 @@ def _wire_target_port_graph_nodes(target_port, graph_nodes):
     source_gnode.find_port(source_port.name).connect(target_gnode.find_port(target_port.name))
 
 
+class _LazyValue:
+    """A placeholder for a value of a :py:class:`ValueCache` that is loaded on first access."""
+
+    __slots__ = ['load']
+
+    def __init__(self, load: Callable[[], Any]):
+        self.load = load
+
+
 class ValueCache(dict):
     """
     ``ValueCache`` is a closable dictionary that maintains unique IDs for it's keys.
     If a ``ValueCache`` is closed, all closable values are also closed.
     A value is closeable if it has a ``close`` attribute whose value is a callable.
+    Values may be set concurrently, e.g. by workflow steps invoked in parallel.
+
+    Values may also be set lazily using :py:meth:`set_lazy`. A lazy value is loaded
+    when it is first accessed by key, e.g. using ``cache[key]``, ``cache.get(key)``, or ``dict(cache)``,
+    while ``values()`` and ``items()`` return the placeholders of lazy values that have not been loaded yet.
+
+    If a *memory_budget* is given, the approximate sizes of the values are tracked by the budget,
+    see :py:class:`cate.core.membudget.MemoryBudget`. If the budget is exceeded, least recently used
+    values are spilled to disk and replaced by lazy values, which reload them on next access.
+
+    :param memory_budget: An optional memory budget.
     """
 
-    def __init__(self):
+    def __init__(self, memory_budget=None):
         super(ValueCache, self).__init__()
         self._id_infos = dict()
         self._last_id = 0
+        self._lock = threading.RLock()
+        self._memory_budget = memory_budget
+
+    @property
+    def memory_budget(self):
+        """The memory budget of this cache or ``None``."""
+        return self._memory_budget
 
     def __del__(self):
         """Override the ``dict`` method to close any old values."""
@@ -1546,27 +1779,125 @@ class ValueCache(dict):
         Override the ``dict`` method to close any old value and generate a new ID,
         if *key* didn't exist before.
         """
-        old_value = self.get(key)
-        id_info = self._id_infos.get(key)
-        self._set(key, value)
-        if id_info:
-            self._id_infos[key] = id_info[0], id_info[1] + 1
-        else:
-            self._id_infos[key] = self._gen_id(), 0
+        with self._lock:
+            old_value = super(ValueCache, self).get(key)
+            id_info = self._id_infos.get(key)
+            self._set(key, value)
+            if id_info:
+                update_count = id_info[1] + 1
+                self._id_infos[key] = id_info[0], update_count
+            else:
+                update_count = 0
+                self._id_infos[key] = self._gen_id(), update_count
         if old_value is not value:
             self._close_value(old_value)
+        if self._memory_budget is not None:
+            self._memory_budget.track_value(self, key, update_count, value)
 
     def _del(self, key):
         super(ValueCache, self).__delitem__(key)
 
     def __delitem__(self, key):
         """Override the ``dict`` method to close the value and remove its ID."""
-        old_value = self.get(key)
-        self._del(key)
-        del self._id_infos[key]
+        with self._lock:
+            old_value = super(ValueCache, self).get(key)
+            self._del(key)
+            del self._id_infos[key]
+        if self._memory_budget is not None:
+            self._memory_budget.untrack_value(self, key)
         if old_value is not None:
             self._close_value(old_value)
 
+    def __getitem__(self, key):
+        """Override the ``dict`` method to load a lazy value."""
+        value = super(ValueCache, self).__getitem__(key)
+        if isinstance(value, _LazyValue):
+            value = self._load_lazy_value(key, value)
+        elif self._memory_budget is not None:
+            self._memory_budget.touch_value(self, key)
+        return value
+
+    def __iter__(self):
+        """Override the ``dict`` method so that copies, e.g. ``dict(cache)``, load lazy values."""
+        return iter(list(self.keys()))
+
+    def get(self, key, default=None):
+        """Override the ``dict`` method to load a lazy value. Return *default*, if loading fails."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def set_lazy(self, key, load_value: Callable[[], Any]) -> None:
+        """
+        Set a value for *key* that is loaded by calling *load_value* without arguments
+        when it is first accessed. Loading the value does not change the key's update count.
+        If *load_value* raises an exception, the key is removed and the access fails with a ``KeyError``.
+
+        :param key: The key.
+        :param load_value: A callable that returns the value.
+        """
+        self[key] = _LazyValue(load_value)
+
+    def is_lazy(self, key) -> bool:
+        """Return ``True``, if the value for *key* has been set lazily and has not been loaded yet."""
+        return isinstance(super(ValueCache, self).get(key), _LazyValue)
+
+    def _load_lazy_value(self, key, lazy_value: _LazyValue):
+        missing = object()
+        update_count = None
+        with self._lock:
+            value = super(ValueCache, self).get(key, missing)
+            if value is lazy_value:
+                try:
+                    value = lazy_value.load()
+                except Exception as e:
+                    self._del(key)
+                    del self._id_infos[key]
+                    if self._memory_budget is not None:
+                        self._memory_budget.untrack_value(self, key)
+                    raise KeyError(key) from e
+                self._set(key, value)
+                update_count = self._id_infos[key][1]
+        if value is missing:
+            # Removed meanwhile
+            raise KeyError(key)
+        if update_count is not None and self._memory_budget is not None:
+            # Track outside the lock, because tracking may spill values of this cache
+            self._memory_budget.track_value(self, key, update_count, value)
+        # Either loaded by this call or meanwhile, maybe set lazily again
+        return self[key] if isinstance(value, _LazyValue) else value
+
+    def spill_value(self, key, update_count: int) -> bool:
+        """
+        Spill the value for *key* to disk using this cache's memory budget and replace it by a lazy value.
+        Called by memory budgets, if their capacity is exceeded.
+
+        :param key: The key.
+        :param update_count: The update count of the key's value to be spilled.
+        :return: ``True``, if the value has been spilled.
+        """
+        if self._memory_budget is None:
+            return False
+        with self._lock:
+            value = super(ValueCache, self).get(key)
+            if value is None or isinstance(value, _LazyValue) or self.get_update_count(key) != update_count:
+                return False
+        # Write outside the lock, so that other values can be accessed meanwhile
+        load_value = self._memory_budget.spill_value(key, value)
+        if load_value is None:
+            with self._lock:
+                # The value remains in memory, so it must count for the budget again, unless it has changed meanwhile
+                if super(ValueCache, self).get(key) is value and self.get_update_count(key) == update_count:
+                    self._memory_budget.retrack_value(self, key, update_count, value)
+            return False
+        with self._lock:
+            if super(ValueCache, self).get(key) is not value:
+                return False
+            # Other than set_lazy(), don't close the value and don't change the update count
+            self._set(key, _LazyValue(load_value))
+        return True
+
     def get_value_by_id(self, id: int, default=UNDEFINED):
         """Return the value for the given integer *id* or return *default*."""
         key = self.get_key(id)
@@ -1592,9 +1923,10 @@ class ValueCache(dict):
     def child(self, key: str) -> 'ValueCache':
         """Return the child ``ValueCache`` for given *key*."""
         child_key = key + '._child'
-        if child_key not in self:
-            self._set(child_key, ValueCache())
-        return self[child_key]
+        with self._lock:
+            if child_key not in self:
+                self._set(child_key, ValueCache())
+            return self[child_key]
 
     def rename_key(self, key: str, new_key: str) -> None:
         """
@@ -1614,6 +1946,9 @@ class ValueCache(dict):
         del self._id_infos[key]
         self._id_infos[new_key] = id_info
 
+        if self._memory_budget is not None:
+            self._memory_budget.rename_value(self, key, new_key)
+
         child_key = key + '._child'
         if child_key in self:
             child_cache = self[child_key]
@@ -1627,11 +1962,16 @@ class ValueCache(dict):
         if existed_before:
             self._close_value(value)
             del self._id_infos[key]
+            if self._memory_budget is not None:
+                self._memory_budget.untrack_value(self, key)
         return value
 
     def clear(self) -> None:
         """Override the ``dict`` method to closes values and remove all IDs."""
         self._close_values()
+        if self._memory_budget is not None:
+            for key in list(self.keys()):
+                self._memory_budget.untrack_value(self, key)
         super(ValueCache, self).clear()
         self._id_infos.clear()
 
@@ -1640,6 +1980,7 @@ class ValueCache(dict):
         self.clear()
 
     def _close_values(self) -> None:
+        # Note, values() does not load lazy values
         values = list(self.values())
         for value in values:
             self._close_value(value)
@@ -1674,3 +2015,23 @@ def new_workflow_op(workflow_or_path: Union[str, Workflow]) -> Operation:
     """
     workflow = Workflow.load(workflow_or_path) if isinstance(workflow_or_path, str) else workflow_or_path
     return Operation(workflow, op_meta_info=workflow.op_meta_info)
+
+
+def _get_file_state(path: str) -> Optional[List[List[Any]]]:
+    """
+    Get the paths, modification times, and sizes of the files given by *path*, which may be a
+    file, a directory such as a Zarr store, or a glob pattern. Return ``None``, if no file exists.
+    """
+    paths = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+    file_state = []
+    for file_path in paths:
+        if os.path.isdir(file_path):
+            for dir_path, dir_names, file_names in os.walk(file_path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                    file_state.append([os.path.join(dir_path, file_name), stat.st_mtime_ns, stat.st_size])
+        elif os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            file_state.append([file_path, stat.st_mtime_ns, stat.st_size])
+    return file_state or None
@@ -23,20 +23,27 @@
 This module defines the ``Workspace`` class.
 """
 
+import functools
+import json
 import logging
 import os
 import shutil
+import uuid
 from collections import OrderedDict
-from threading import RLock
-from typing import List, Any, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock, RLock
+from typing import List, Any, Dict, Optional, Tuple, MutableMapping
 
 import fiona
 import pandas as pd
 import xarray as xr
 
+from .membudget import new_workspace_memory_budget
+from .resultcache import new_step_result_cache
 from .workflow import Workflow, OpStep, NodePort, ValueCache
 from ..conf import conf
-from ..conf.defaults import WORKSPACE_DATA_DIR_NAME, WORKSPACE_WORKFLOW_FILE_NAME, DEFAULT_SCRATCH_WORKSPACES_PATH
+from ..conf.defaults import WORKSPACE_DATA_DIR_NAME, WORKSPACE_WORKFLOW_FILE_NAME, DEFAULT_SCRATCH_WORKSPACES_PATH, \
+    WORKSPACE_CACHE_DIR_NAME
 from ..core.cdm import get_tiling_scheme
 from ..core.op import OP_REGISTRY
 from ..core.types import GeoDataFrame, ValidationError
@@ -52,8 +59,72 @@ __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
 
 _LOG = logging.getLogger('cate')
 
-_RESOURCE_PERSISTENCE_FORMATS = dict(netcdf4=('nc', xr.open_dataset, 'to_netcdf'),
-                                     zarr=('zarr', xr.open_zarr, 'to_zarr'))
+# The netCDF4/HDF5 library is not thread-safe, so resources are written concurrently in Zarr format only
+# and resource files are read for their descriptors one at a time
+_NETCDF_LOCK = Lock()
+
+
+def _write_netcdf(dataset: xr.Dataset, path: str) -> None:
+    with _NETCDF_LOCK:
+        dataset.to_netcdf(path)
+
+
+def _write_zarr(dataset: xr.Dataset, path: str) -> None:
+    import numcodecs
+    # Encodings stem from the dataset's original source, e.g. NetCDF, and are often invalid for Zarr
+    dataset = dataset.copy()
+    for var in dataset.variables.values():
+        var.encoding = {}
+    # LZ4 at a low level trades a slightly larger size for much faster writes than zlib
+    compressor = numcodecs.Blosc(cname='lz4', clevel=1, shuffle=numcodecs.Blosc.SHUFFLE)
+    encoding = {var_name: dict(compressor=compressor) for var_name in dataset.data_vars}
+    dataset.to_zarr(path, mode='w', encoding=encoding)
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _replace_path(src_path: str, dst_path: str) -> None:
+    """Atomically replace *dst_path* by *src_path*, where both may be files or directories (e.g. Zarr stores)."""
+    if not os.path.isdir(src_path) and not os.path.isdir(dst_path):
+        os.replace(src_path, dst_path)
+        return
+    if not os.path.exists(dst_path):
+        os.rename(src_path, dst_path)
+        return
+    # Directories cannot be replaced atomically, so keep the old one as backup until the new one is in place
+    backup_path = '%s.%s.bak' % (dst_path, uuid.uuid4().hex)
+    os.rename(dst_path, backup_path)
+    try:
+        os.rename(src_path, dst_path)
+    except BaseException:
+        os.rename(backup_path, dst_path)
+        raise
+    # noinspection PyBroadException
+    try:
+        _remove_path(backup_path)
+    except Exception:
+        _LOG.warning('failed to remove backup "%s"' % backup_path)
+
+
+def _open_resource_file(res_name: str, open_dataset, resource_file: str) -> xr.Dataset:
+    try:
+        return open_dataset(resource_file)
+    except Exception:
+        _LOG.exception('reading resource "%s" from file failed' % res_name)
+        raise
+
+
+#: Maps a dataset persistence format name to a tuple (file extension, dataset opener, dataset writer)
+_RESOURCE_PERSISTENCE_FORMATS = dict(netcdf4=('nc', xr.open_dataset, _write_netcdf),
+                                     zarr=('zarr', xr.open_zarr, _write_zarr))
+
+#: Suffix of the files next to the resource files that contain the resource descriptors
+_RESOURCE_DESCRIPTOR_FILE_SUFFIX = '.meta.json'
 
 #: An JSON-serializable operation argument is a one-element dictionary taking two possible forms:
 #: 1. dict(value=Any):  a value which may be any constant Python object which must JSON-serializable
@@ -104,8 +175,17 @@ class Workspace:
         self._is_scratch = (base_dir or '').startswith(DEFAULT_SCRATCH_WORKSPACES_PATH)
         self._is_modified = is_modified
         self._is_closed = False
-        self._resource_cache = ValueCache()
+        self._memory_budget = new_workspace_memory_budget(self.get_spill_dir(base_dir))
+        self._resource_cache = ValueCache(memory_budget=self._memory_budget)
+        self._result_cache = new_step_result_cache(self.get_step_result_cache_dir(base_dir),
+                                                   conf.get_step_result_cache_capacity())
         self._user_data = dict()
+        # Maps resource names to (fingerprint, resource file) of the resources last written or read
+        self._persisted_resources = dict()  # type: Dict[str, Tuple[str, str]]
+        # Maps resource names to the descriptors read for resources that are set lazily
+        self._persisted_resource_descriptors = dict()  # type: Dict[str, Dict[str, Any]]
+        # Maps resource names to (res_id, update count, descriptor) of the descriptors last computed
+        self._resource_descriptors = dict()  # type: Dict[str, Tuple[int, int, Dict[str, Any]]]
         self._lock = RLock()
 
     def __del__(self):
@@ -155,10 +235,23 @@ class Workspace:
     def user_data(self) -> dict:
         return self._user_data
 
+    @property
+    def memory_metrics(self) -> Optional[Dict[str, int]]:
+        """Metrics of this workspace's memory budget, e.g. number of spilled and reloaded resources, if any."""
+        return self._memory_budget.metrics if self._memory_budget is not None else None
+
     @classmethod
     def get_workspace_data_dir(cls, base_dir) -> str:
         return os.path.join(base_dir, WORKSPACE_DATA_DIR_NAME)
 
+    @classmethod
+    def get_step_result_cache_dir(cls, base_dir) -> str:
+        return os.path.join(base_dir, WORKSPACE_CACHE_DIR_NAME, 'results')
+
+    @classmethod
+    def get_spill_dir(cls, base_dir) -> str:
+        return os.path.join(base_dir, WORKSPACE_CACHE_DIR_NAME, 'spill')
+
     @classmethod
     def get_workflow_file(cls, base_dir) -> str:
         return os.path.join(cls.get_workspace_data_dir(base_dir), WORKSPACE_WORKFLOW_FILE_NAME)
@@ -181,13 +274,13 @@ class Workspace:
         workflow = Workflow.load(workflow_file)
         workspace = Workspace(base_dir, workflow)
 
-        # Read resources for persistent steps
+        # Set resources for persistent steps, they are read from their files on first access
         persistent_steps = [step for step in workflow.steps if step.persistent]
         if persistent_steps:
             with monitor.starting('Reading resources', len(persistent_steps)):
                 for step in persistent_steps:
                     workspace._read_resource_from_file(step.id)
-                monitor.progress(1)
+                    monitor.progress(1)
 
         return workspace
 
@@ -196,18 +289,38 @@ class Workspace:
             return
         with self._lock:
             self._resource_cache.close()
-            # Remove all resource files that are no longer required
+            if self._memory_budget is not None:
+                self._memory_budget.close()
+            if self._result_cache is not None:
+                self._result_cache.close()
+            # Remove all resource files that are no longer required,
+            # including files of persistent resources last written in another format
             if os.path.isdir(self.workspace_data_dir):
                 persistent_ids = {step.id for step in self.workflow.steps if step.persistent}
+                exts = {ext for ext, _, _ in _RESOURCE_PERSISTENCE_FORMATS.values()}
                 for filename in os.listdir(self.workspace_data_dir):
+                    res_name, ext = os.path.splitext(filename)
+                    if ext[1:] not in exts:
+                        continue
                     res_file = os.path.join(self.workspace_data_dir, filename)
-                    if os.path.isfile(res_file) and filename.endswith('.nc'):
-                        res_name = filename[0: -3]
-                        if res_name not in persistent_ids:
-                            try:
-                                os.remove(res_file)
-                            except OSError:
-                                _LOG.exception('closing workspace failed')
+                    persisted_resource = self._persisted_resources.get(res_name)
+                    if res_name not in persistent_ids \
+                            or (persisted_resource is not None and persisted_resource[1] != res_file):
+                        try:
+                            _remove_path(res_file)
+                        except OSError:
+                            _LOG.exception('closing workspace failed')
+                # Remove all resource descriptor files whose resource files have been removed
+                for filename in os.listdir(self.workspace_data_dir):
+                    if not filename.endswith(_RESOURCE_DESCRIPTOR_FILE_SUFFIX):
+                        continue
+                    res_file = os.path.join(self.workspace_data_dir,
+                                            filename[0: -len(_RESOURCE_DESCRIPTOR_FILE_SUFFIX)])
+                    if os.path.splitext(res_file)[1][1:] in exts and not os.path.exists(res_file):
+                        try:
+                            os.remove(res_file + _RESOURCE_DESCRIPTOR_FILE_SUFFIX)
+                        except OSError:
+                            _LOG.exception('closing workspace failed')
 
     def save(self, monitor: Monitor = Monitor.NONE):
         self._assert_open()
@@ -220,41 +333,132 @@ class Workspace:
                 os.mkdir(workspace_data_dir)
             self.workflow.store(self.workflow_file)
 
-            # Write resources for all persistent steps
-            persistent_steps = [step for step in self.workflow.steps if step.persistent]
-            if persistent_steps:
-                with monitor.starting('Writing resources', len(persistent_steps)):
-                    for step in persistent_steps:
-                        self._write_resource_to_file(step.id)
-                        monitor.progress(1)
+            # Collect the resources of persistent steps that changed since they were last written
+            format_name = conf.get_dataset_persistence_format()
+            write_jobs = []
+            if format_name in _RESOURCE_PERSISTENCE_FORMATS:
+                for step in self.workflow.steps:
+                    if not step.persistent or step.id not in self._resource_cache:
+                        continue
+                    # Check the fingerprint first, so that unchanged lazy resources are not read
+                    resource_file = self._get_resource_file(step.id, format_name)
+                    fingerprint = self._get_resource_fingerprint(step, format_name)
+                    persisted_resource = self._persisted_resources.get(step.id)
+                    if persisted_resource == (fingerprint, resource_file) and os.path.exists(resource_file):
+                        continue
+                    res_value = self._resource_cache.get(step.id)
+                    if not isinstance(res_value, xr.Dataset):
+                        continue
+                    write_jobs.append((step.id, res_value, format_name, resource_file, fingerprint))
 
             self._is_modified = False
 
-    def _write_resource_to_file(self, res_name):
-        res_value = self._resource_cache.get(res_name)
-        if isinstance(res_value, xr.Dataset):
-            format_props = _RESOURCE_PERSISTENCE_FORMATS.get(conf.get_dataset_persistence_format())
-            if format_props:
-                ext, _, write_attr = format_props
-                if hasattr(res_value, write_attr):
-                    write_method = getattr(res_value, write_attr)
+        # Write resources out of the locked context, so that other requests are not blocked meanwhile
+        if write_jobs:
+            self._write_resources_to_files(write_jobs, monitor)
+
+    def _write_resources_to_files(self, write_jobs: List[Tuple[str, xr.Dataset, str, str, str]], monitor: Monitor):
+        max_workers = min(len(write_jobs), conf.get_workspace_save_max_workers())
+        with monitor.starting('Writing resources', len(write_jobs)):
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [executor.submit(self._write_resource_to_file, *write_job) for write_job in write_jobs]
+                    for future in as_completed(futures):
+                        future.result()
+                        monitor.progress(1)
+            else:
+                for write_job in write_jobs:
+                    self._write_resource_to_file(*write_job)
+                    monitor.progress(1)
+
+    def _write_resource_to_file(self, res_name: str, res_value: xr.Dataset, format_name: str,
+                                resource_file: str, fingerprint: str):
+        _, open_dataset, write_dataset = _RESOURCE_PERSISTENCE_FORMATS[format_name]
+        # Write to a temporary path first, so that a failed or concurrent write never leaves an incomplete file
+        temp_file = '%s.%s.tmp' % (resource_file, uuid.uuid4().hex)
+        # noinspection PyBroadException
+        try:
+            write_dataset(res_value, temp_file)
+            _replace_path(temp_file, resource_file)
+        except Exception:
+            _LOG.exception('writing resource "%s" to file failed' % res_name)
+            return
+        finally:
+            # noinspection PyBroadException
+            try:
+                _remove_path(temp_file)
+            except Exception:
+                pass
+        self._write_resource_descriptor_file(res_name, open_dataset, resource_file)
+        with self._lock:
+            self._persisted_resources[res_name] = fingerprint, resource_file
+
+    @classmethod
+    def _write_resource_descriptor_file(cls, res_name: str, open_dataset, resource_file: str):
+        """
+        Write the descriptor of the resource in *resource_file* next to it, so that the resource
+        can be listed after :py:meth:`open` without reading the resource.
+        """
+        descriptor_file = resource_file + _RESOURCE_DESCRIPTOR_FILE_SUFFIX
+        temp_file = '%s.%s.tmp' % (descriptor_file, uuid.uuid4().hex)
+        # noinspection PyBroadException
+        try:
+            # Describe the resource as it will be read from its file.
+            # Resources are written concurrently, so the file is read under the lock that guards NetCDF writes.
+            with _NETCDF_LOCK:
+                with open_dataset(resource_file) as dataset:
+                    resource_descriptor = cls._get_resource_descriptor(None, None, res_name, dataset)
+            with open(temp_file, 'w') as fp:
+                json.dump(resource_descriptor, fp)
+            os.replace(temp_file, descriptor_file)
+        except Exception:
+            _LOG.exception('writing descriptor of resource "%s" to file failed' % res_name)
+            for path in (temp_file, descriptor_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _read_resource_from_file(self, res_name):
+        # Prefer the configured format, in case files of several formats exist
+        preferred_format_name = conf.get_dataset_persistence_format()
+        format_names = sorted(_RESOURCE_PERSISTENCE_FORMATS.keys(), key=lambda name: name != preferred_format_name)
+        for format_name in format_names:
+            _, open_dataset, _ = _RESOURCE_PERSISTENCE_FORMATS[format_name]
+            resource_file = self._get_resource_file(res_name, format_name)
+            if os.path.exists(resource_file):
+                # Open the resource file on first access only
+                self._resource_cache.set_lazy(res_name,
+                                              functools.partial(_open_resource_file, res_name, open_dataset,
+                                                                resource_file))
+                descriptor_file = resource_file + _RESOURCE_DESCRIPTOR_FILE_SUFFIX
+                if os.path.exists(descriptor_file):
                     # noinspection PyBroadException
                     try:
-                        resource_file = os.path.join(self.workspace_data_dir, res_name + '.' + ext)
-                        write_method(resource_file)
+                        with open(descriptor_file) as fp:
+                            self._persisted_resource_descriptors[res_name] = json.load(fp)
                     except Exception:
-                        _LOG.exception('writing resource "%s" to file failed' % res_name)
+                        _LOG.exception('reading descriptor of resource "%s" from file failed' % res_name)
+                res_step = self.workflow.find_node(res_name)
+                if res_step is not None:
+                    # The resource is unchanged until its step is updated or executed again
+                    self._persisted_resources[res_name] = (self._get_resource_fingerprint(res_step, format_name),
+                                                           resource_file)
+                return
 
-    def _read_resource_from_file(self, res_name):
-        for ext, open_dataset, _ in _RESOURCE_PERSISTENCE_FORMATS.values():
-            res_file = os.path.join(self.workspace_data_dir, res_name + '.' + ext)
-            if os.path.exists(res_file):
-                # noinspection PyBroadException
-                try:
-                    res_value = open_dataset(res_file)
-                    self._resource_cache[res_name] = res_value
-                except Exception:
-                    _LOG.exception('reading resource "%s" from file failed' % res_name)
+    def _get_resource_file(self, res_name: str, format_name: str) -> str:
+        ext, _, _ = _RESOURCE_PERSISTENCE_FORMATS[format_name]
+        return os.path.join(self.workspace_data_dir, res_name + '.' + ext)
+
+    def _get_resource_fingerprint(self, res_step, format_name: str) -> str:
+        """
+        Get a fingerprint for the current value of the resource of step *res_step*.
+        It changes whenever the resource is set again or the step's inputs change.
+        """
+        res_name = res_step.id
+        return json.dumps([res_name,
+                           self._resource_cache.get_id(res_name),
+                           self._resource_cache.get_update_count(res_name),
+                           res_step.to_json_dict(),
+                           format_name], sort_keys=True, default=str)
 
     def set_resource_persistence(self, res_name: str, persistent: bool):
         with self._lock:
@@ -274,37 +478,106 @@ class Workspace:
         workflow = Workflow.from_json_dict(workflow_json)
         return Workspace(base_dir, workflow, is_modified=is_modified)
 
-    def to_json_dict(self):
+    def to_json_dict(self, known_resources: MutableMapping[int, Tuple[int, str]] = None):
+        """
+        Return a JSON-serializable dictionary representation of this workspace.
+
+        If *known_resources* is given, the "resources" entry is replaced by a "resource_changes" entry,
+        which only comprises the descriptors of resources that are unknown or have changed:
+
+        * ``added`` - the descriptors of resources whose IDs are not in *known_resources*;
+        * ``changed`` - the descriptors of resources whose update count or name differ from *known_resources*;
+        * ``removed`` - the IDs in *known_resources* of resources that no longer exist;
+        * ``ids`` - the IDs of all resources in the order of the "resources" entry.
+
+        :param known_resources: Optional mapping from resource IDs to (update count, name)
+               of the resource descriptors known to a client. It is updated to the current resources.
+        :return: A JSON-serializable dictionary.
+        """
         with self._lock:
             self._assert_open()
+            resource_descriptors = self._resources_to_json_list()
+            if known_resources is None:
+                resources_item = ('resources', resource_descriptors)
+            else:
+                resources_item = ('resource_changes', self._get_resource_changes(resource_descriptors,
+                                                                                 known_resources))
             return OrderedDict([('base_dir', self.base_dir),
                                 ('is_scratch', self.is_scratch),
                                 ('is_modified', self.is_modified),
                                 ('is_saved', os.path.exists(self.workspace_data_dir)),
                                 ('workflow', self.workflow.to_json_dict()),
-                                ('resources', self._resources_to_json_list())
+                                resources_item
                                 ])
 
+    @classmethod
+    def _get_resource_changes(cls,
+                              resource_descriptors: List[Dict[str, Any]],
+                              known_resources: MutableMapping[int, Tuple[int, str]]) -> Dict[str, Any]:
+        added = []
+        changed = []
+        ids = []
+        for resource_descriptor in resource_descriptors:
+            res_id = resource_descriptor['id']
+            version = resource_descriptor['updateCount'], resource_descriptor['name']
+            known_version = known_resources.get(res_id)
+            if known_version is None:
+                added.append(resource_descriptor)
+            elif tuple(known_version) != version:
+                changed.append(resource_descriptor)
+            known_resources[res_id] = version
+            ids.append(res_id)
+        id_set = set(ids)
+        removed = [res_id for res_id in known_resources.keys() if res_id not in id_set]
+        for res_id in removed:
+            del known_resources[res_id]
+        return OrderedDict([('added', added), ('changed', changed), ('removed', removed), ('ids', ids)])
+
     def _resources_to_json_list(self):
         resource_descriptors = []
-        resource_cache = dict(self._resource_cache)
-        for res_step in self.workflow.steps:
-            res_name = res_step.id
-            if res_name in resource_cache:
-                res_id = self._resource_cache.get_id(res_name)
-                res_update_count = self._resource_cache.get_update_count(res_name)
-                resource = resource_cache.pop(res_name)
-                resource_descriptor = self._get_resource_descriptor(res_id, res_update_count, res_name, resource)
-                resource_descriptors.append(resource_descriptor)
-        if len(resource_cache) > 0:
-            # We should not get here as all resources should have an associated workflow step!
-            for res_name, resource in resource_cache.items():
-                res_id = self._resource_cache.get_id(res_name)
-                res_update_count = self._resource_cache.get_update_count(res_name)
-                resource_descriptor = self._get_resource_descriptor(res_id, res_update_count, res_name, resource)
+        res_names = list(self._resource_cache.keys())
+        step_res_names = [res_step.id for res_step in self.workflow.steps if res_step.id in self._resource_cache]
+        # We should not get other resource names as all resources should have an associated workflow step!
+        step_res_name_set = set(step_res_names)
+        other_res_names = [res_name for res_name in res_names if res_name not in step_res_name_set]
+        for res_name in step_res_names + other_res_names:
+            resource_descriptor = self._get_cached_resource_descriptor(res_name)
+            if resource_descriptor is not None:
                 resource_descriptors.append(resource_descriptor)
+        # Forget descriptors of removed resources
+        for res_name in [res_name for res_name in self._resource_descriptors if res_name not in self._resource_cache]:
+            del self._resource_descriptors[res_name]
         return resource_descriptors
 
+    def _get_cached_resource_descriptor(self, res_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the descriptor for resource *res_name*. Descriptors are computed only once for
+        a given resource ID and update count, callers must therefore not modify them.
+        """
+        res_id = self._resource_cache.get_id(res_name)
+        res_update_count = self._resource_cache.get_update_count(res_name)
+        cached_descriptor = self._resource_descriptors.get(res_name)
+        if cached_descriptor is not None and cached_descriptor[0:2] == (res_id, res_update_count):
+            return cached_descriptor[2]
+        resource_descriptor = self._compute_resource_descriptor(res_name)
+        if resource_descriptor is not None:
+            resource_descriptor = dict(resource_descriptor, id=res_id, updateCount=res_update_count, name=res_name)
+            self._resource_descriptors[res_name] = res_id, res_update_count, resource_descriptor
+        return resource_descriptor
+
+    def _compute_resource_descriptor(self, res_name: str) -> Optional[Dict[str, Any]]:
+        resource_descriptor = None
+        if self._resource_cache.is_lazy(res_name):
+            # Use the descriptor written with the resource, so we don't need to read the resource
+            resource_descriptor = self._persisted_resource_descriptors.get(res_name)
+        if resource_descriptor is None:
+            resource = self._resource_cache.get(res_name, UNDEFINED)
+            if resource is UNDEFINED and res_name not in self._resource_cache:
+                # Reading a lazy resource failed
+                return None
+            resource_descriptor = self._get_resource_descriptor(None, None, res_name, resource)
+        return resource_descriptor
+
     @classmethod
     def _get_resource_descriptor(cls, res_id: int, res_update_count: int, res_name: str, resource):
         data_type_name = object_to_qualified_name(type(resource))
@@ -495,6 +768,7 @@ class Workspace:
             self.workflow.remove_step(res_step)
             if res_name in self._resource_cache:
                 del self._resource_cache[res_name]
+            self._persisted_resource_descriptors.pop(res_name, None)
 
     def rename_resource(self, res_name: str, new_res_name: str) -> None:
         Workspace._validate_res_name(new_res_name)
@@ -513,6 +787,8 @@ class Workspace:
 
             if res_name in self._resource_cache:
                 self._resource_cache.rename_key(res_name, new_res_name)
+            if res_name in self._persisted_resource_descriptors:
+                self._persisted_resource_descriptors[new_res_name] = self._persisted_resource_descriptors.pop(res_name)
 
     def set_resource(self,
                      op_name: str,
@@ -671,7 +947,10 @@ class Workspace:
             return None
 
     def _new_context(self):
-        return dict(value_cache=self._resource_cache, workspace=self)
+        return dict(value_cache=self._resource_cache,
+                    result_cache=self._result_cache,
+                    workspace=self,
+                    max_workers=conf.get_workflow_max_workers())
 
     def _assert_open(self):
         if self._is_closed:
@@ -28,8 +28,10 @@ This module provides aggregation operations
 Components
 ==========
 """
+import functools
 from datetime import timezone
 
+import dask.array as da
 import numpy as np
 import pandas as pd
 import xarray as xr
@@ -42,7 +44,7 @@ from cate.ops.select import select_var
 from cate.util.monitor import Monitor
 
 
-@op(tags=['aggregate', 'temporal'], version='1.5')
+@op(tags=['aggregate', 'temporal'], version='1.6')
 @op_input('ds', data_type=DatasetLike)
 @op_input('var', value_set_source='ds', data_type=VarNamesLike)
 @op_return(add_history=True)
@@ -108,23 +110,17 @@ def _lta_monthly(ds: xr.Dataset, monitor: Monitor):
     """
     time_min = pd.Timestamp(ds.time.values[0], tzinfo=timezone.utc)
     time_max = pd.Timestamp(ds.time.values[-1], tzinfo=timezone.utc)
-    total_work = 100
-    retset = ds
 
-    with monitor.starting('LTA', total_work=total_work):
-        monitor.progress(work=0)
-        step = total_work / 12
-        kwargs = {'monitor': monitor, 'step': step}
-        retset = retset.groupby('time.month', squeeze=False).apply(_mean, **kwargs)
+    months, codes = np.unique(pd.DatetimeIndex(ds.time.values).month, return_inverse=True)
+    with monitor.starting('LTA', total_work=100):
+        retset = _reduce_groups(ds, codes, len(months), 'mean', monitor.child(100))
 
     # Make the return dataset CF compliant
-    retset = retset.rename({'month': 'time'})
-    retset['time'] = pd.date_range('{}-01-01'.format(time_min.year),
-                                   freq='MS',
-                                   periods=12)
+    retset['time'] = pd.DatetimeIndex([pd.Timestamp(year=time_min.year, month=month, day=1)
+                                       for month in months])
 
     climatology_bounds = xr.DataArray(data=np.tile([time_min, time_max],
-                                                   (12, 1)),
+                                                   (len(months), 1)),
                                       dims=['time', 'nv'],
                                       name='climatology_bounds')
     retset['climatology_bounds'] = climatology_bounds
@@ -134,18 +130,6 @@ def _lta_monthly(ds: xr.Dataset, monitor: Monitor):
     return retset
 
 
-def _groupby_day(ds: xr.Dataset, monitor: Monitor, step: float):
-    """
-    Groupby the given dataset by day of month and apply mean to it
-
-    :param ds: Dataset to aggregate
-    :param monitor: Progress monitor
-    :param step: Progress step
-    """
-    kwargs = {'monitor': monitor, 'step': step}
-    return ds.groupby('time.day', squeeze=False).apply(_mean, **kwargs)
-
-
 def _lta_daily(ds: xr.Dataset):
     """
     Carry out a long term average of a daily dataset
@@ -153,7 +137,11 @@ def _lta_daily(ds: xr.Dataset):
     :param ds: Dataset to aggregate
     :return: Aggregated dataset
     """
-    return ds.groupby('time.dayofyear', squeeze=False).mean('time')
+    days_of_year, codes = np.unique(pd.DatetimeIndex(ds.time.values).dayofyear, return_inverse=True)
+    retset = _reduce_groups(ds, codes, len(days_of_year), 'mean')
+    retset = retset.rename({'time': 'dayofyear'})
+    retset['dayofyear'] = days_of_year
+    return retset
 
 
 def _lta_general(ds: xr.Dataset, monitor: Monitor):
@@ -167,8 +155,6 @@ def _lta_general(ds: xr.Dataset, monitor: Monitor):
     """
     time_min = pd.Timestamp(ds.time.values[0], tzinfo=timezone.utc)
     time_max = pd.Timestamp(ds.time.values[-1], tzinfo=timezone.utc)
-    total_work = 100
-    retset = ds
 
     # The dataset should feature time periods consistent over years
     # and denoted with the same dates each year
@@ -176,30 +162,15 @@ def _lta_general(ds: xr.Dataset, monitor: Monitor):
         raise ValidationError("A long term average dataset can not be created for"
                               " a dataset with inconsistent seasons.")
 
-    # Get 'representative year'
-    c = 0
-    rep_year = 0
-    for group in ds.time.groupby('time.year'):
-        c = c + 1
-        if c == 1:
-            rep_year = group[1].time
-            continue
-        if c == 2 and len(group[1].time) > len(rep_year):
-            rep_year = group[1].time
-            break
-
-    with monitor.starting('LTA', total_work=total_work):
-        monitor.progress(work=0)
-        step = total_work / len(rep_year.time)
-        kwargs = {'monitor': monitor, 'step': step}
-        retset = retset.groupby('time.month', squeeze=False).apply(_groupby_day, **kwargs)
+    time_index = pd.DatetimeIndex(ds.time.values)
+    rep_year = ds.time[_get_representative_year(time_index)]
 
-    # Make the return dataset CF compliant
-    retset = retset.stack(time=('month', 'day'))
+    # Groups are ordered by month and day, as are the dates of the representative year
+    _, codes = np.unique(_get_month_day_keys(time_index), return_inverse=True)
+    with monitor.starting('LTA', total_work=100):
+        retset = _reduce_groups(ds, codes, len(rep_year), 'mean', monitor.child(100))
 
-    # Turn month, day coordinates to time
-    retset = retset.reset_index('time')
-    retset = retset.drop_vars(['month', 'day'])
+    # Make the return dataset CF compliant
     retset['time'] = rep_year.time
 
     climatology_bounds = xr.DataArray(data=np.tile([time_min, time_max],
@@ -220,65 +191,170 @@ def _lta_general(ds: xr.Dataset, monitor: Monitor):
     return retset
 
 
+def _get_month_day_keys(time_index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Get an integer key for the (month, day) date of each timestamp.
+    Keys sort like the dates within a year.
+    """
+    return np.asarray(time_index.month * 100 + time_index.day)
+
+
+def _get_representative_year(time_index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Get a boolean mask selecting the timestamps of the 'representative year',
+    which is the first year, or the second year if it has more timestamps.
+    """
+    years = np.asarray(time_index.year)
+    unique_years, counts = np.unique(years, return_counts=True)
+    rep_year = unique_years[0]
+    if len(unique_years) > 1 and counts[1] > counts[0]:
+        rep_year = unique_years[1]
+    return years == rep_year
+
+
 def _is_seasonal(time: xr.DataArray):
     """
     Check if the given timestamp dataarray features consistent
     seasons. E.g. Each year has the same date-month values in it.
     """
-    c = 0
-    test = None
-    first_days = 0
-    first_months = 0
-    for group in time.groupby('time.year'):
-        # Test (month, day) dates of all years against
-        # (month, day) dates of the first year, or second
-        # year in case the first year is not full
-        c = c + 1
-        np_time = group[1].time.values
-        months = pd.DatetimeIndex(np_time).month
-        days = pd.DatetimeIndex(np_time).day
-        if c == 1:
-            first_months = months
-            first_days = days
-            continue
-        elif c == 2:
-            second_months = months
-            second_days = days
-
-            if len(second_months) > len(first_months):
-                test = list(zip(second_months, second_days))
-                for date in zip(first_months, first_days):
-                    if date not in test:
-                        return False
-            else:
-                test = list(zip(first_months, first_days))
-                for date in zip(second_months, second_days):
-                    if date not in test:
-                        return False
-            continue
-
-        for date in zip(months, days):
-            if date not in test:
-                return False
-
-    return True
-
-
-def _mean(ds: xr.Dataset, monitor: Monitor, step: float):
+    # Test (month, day) dates of all years against
+    # (month, day) dates of the representative year
+    time_index = pd.DatetimeIndex(time.values)
+    keys = _get_month_day_keys(time_index)
+    rep_keys = keys[_get_representative_year(time_index)]
+    return bool(np.isin(keys, rep_keys).all())
+
+
+def _reduce_groups(ds: xr.Dataset,
+                   codes: np.ndarray,
+                   num_groups: int,
+                   method: str,
+                   monitor: Monitor = Monitor.NONE) -> xr.Dataset:
     """
-    Calculate mean of the given dataset and update the given monitor.
+    Reduce the time steps of the numeric variables of the given dataset
+    that share the same group code using the given method.
+
+    Group sums are computed as segment sums, see :py:func:`_sum_groups`.
+    Dask-backed variables are reduced chunk by chunk into the groups each
+    chunk touches, without sorting or splitting them into groups first.
 
-    :param ds: Dataset to take the mean of
-    :param monitor: Monitor to update
-    :param step: Work step
+    Variables without a time dimension are passed through, non-numeric ones
+    are dropped. The 'time' dimension of the returned variables comes first,
+    it has one element per group but no coordinate variable.
+
+    :param ds: Dataset to reduce
+    :param codes: The group code of each time step, in the range 0 to *num_groups* - 1
+    :param num_groups: The number of groups
+    :param method: Either 'mean' or 'sum'
+    :param monitor: A progress monitor
+    :return: The reduced dataset
+    """
+    codes = np.asarray(codes)
+    empty_groups = xr.DataArray(np.bincount(codes, minlength=num_groups) == 0, dims='time')
+    has_empty_groups = bool(empty_groups.values.any())
+
+    coords = {name: coord for name, coord in ds.coords.items() if 'time' not in coord.dims}
+    retset = xr.Dataset(coords=coords, attrs=ds.attrs)
+    with monitor.starting('Reduce groups', total_work=len(ds.data_vars)):
+        for name, var in ds.data_vars.items():
+            if 'time' not in var.dims:
+                retset[name] = var
+            elif np.issubdtype(var.dtype, np.number) or np.issubdtype(var.dtype, np.bool_):
+                var = var.transpose('time', *[dim for dim in var.dims if dim != 'time'])
+                if method == 'mean' or np.issubdtype(var.dtype, np.floating):
+                    sum_dtype = np.dtype(np.float64)
+                else:
+                    # Use the data type numpy uses for sums
+                    sum_dtype = np.sum(np.zeros(1, dtype=var.dtype)).dtype
+                sums = _new_group_array(var, _sum_groups(var.fillna(0).data, codes, num_groups, sum_dtype))
+                if method == 'mean':
+                    counts = _new_group_array(var, _sum_groups(var.notnull().data, codes, num_groups,
+                                                               np.dtype(np.int64)))
+                    result = sums / counts.where(counts > 0)
+                    if np.issubdtype(var.dtype, np.floating):
+                        result = result.astype(var.dtype)
+                elif has_empty_groups:
+                    # Like xarray, empty groups are NaN
+                    result = sums.where(~empty_groups)
+                    if np.issubdtype(var.dtype, np.floating):
+                        result = result.astype(var.dtype)
+                else:
+                    result = sums
+                result.attrs = var.attrs
+                retset[name] = result
+            monitor.progress(work=1)
+    return retset
+
+
+def _new_group_array(var: xr.DataArray, data) -> xr.DataArray:
+    coords = {name: coord for name, coord in var.coords.items() if 'time' not in coord.dims}
+    return xr.DataArray(data, dims=var.dims, coords=coords)
+
+
+def _sum_groups(data, codes: np.ndarray, num_groups: int, dtype: np.dtype):
     """
-    dataset = ds.mean(dim='time', keep_attrs=True)
-    monitor.progress(work=step)
-    return dataset
+    Sum the elements of *data* along its first axis that share the same group code.
+
+    Dask arrays are reduced block by block into the groups present in each block,
+    the partial sums of all blocks are then reduced into the groups at once.
+
+    :param data: A numpy or dask array whose first axis is the time axis
+    :param codes: The group code of each time step
+    :param num_groups: The number of groups
+    :param dtype: The data type of the sums
+    :return: An array of the same kind whose first axis has *num_groups* elements
+    """
+    if not isinstance(data, da.Array):
+        return _sum_segments(np.asarray(data), codes, num_groups, dtype)
+
+    partials = []
+    partial_codes = []
+    offset = 0
+    for size in data.chunks[0]:
+        block_codes = codes[offset: offset + size]
+        block_group_codes = np.unique(block_codes)
+        block = data[offset: offset + size]
+        block_sum = functools.partial(_sum_segments,
+                                      codes=np.searchsorted(block_group_codes, block_codes),
+                                      num_groups=len(block_group_codes),
+                                      dtype=dtype)
+        partials.append(block.map_blocks(block_sum,
+                                         dtype=dtype,
+                                         chunks=((len(block_group_codes),),) + block.chunks[1:]))
+        partial_codes.append(block_group_codes)
+        offset += size
+    # There are only a few partial sums per group, so they fit into a single chunk along the time axis
+    partials = da.concatenate(partials, axis=0).rechunk({0: -1})
+    group_sum = functools.partial(_sum_segments,
+                                  codes=np.concatenate(partial_codes),
+                                  num_groups=num_groups,
+                                  dtype=dtype)
+    return partials.map_blocks(group_sum, dtype=dtype, chunks=((num_groups,),) + partials.chunks[1:])
+
+
+def _sum_segments(values: np.ndarray, codes: np.ndarray, num_groups: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Sum the elements of *values* along the first axis that share the same code.
+
+    The codes of a monotonic time axis are non-decreasing, so the groups are contiguous segments
+    which are summed by ``np.add.reduceat()`` without reordering *values*. Other codes are
+    accumulated by ``np.add.at()``.
+
+    :return: The sums, the first axis has *num_groups* elements
+    """
+    sums = np.zeros((num_groups,) + values.shape[1:], dtype=dtype)
+    if len(codes) == 0:
+        return sums
+    if np.all(codes[1:] >= codes[:-1]):
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        sums[codes[starts]] = np.add.reduceat(values, starts, axis=0, dtype=dtype)
+    else:
+        np.add.at(sums, codes, values)
+    return sums
 
 
 # noinspection PyIncorrectDocstring
-@op(tags=['aggregate', 'temporal'], version='2.0')
+@op(tags=['aggregate', 'temporal'], version='2.1')
 @op_input('ds', data_type=DatasetLike)
 @op_input('method', value_set=['mean', 'max', 'median', 'prod', 'sum', 'std',
                                'var', 'argmax', 'argmin', 'first', 'last'])
@@ -335,8 +411,20 @@ def temporal_aggregation(ds: DatasetLike.TYPE,
     except AttributeError:
         raise ValidationError(f'Provided aggregation method {method} is not valid.')
 
-    with monitor.observing("Resample dataset"):
-        dataset = agg_function(ds.resample(time=period))
+    time_index = ds.indexes['time'] if 'time' in ds.indexes else None
+    if method in ('mean', 'sum') and isinstance(time_index, pd.DatetimeIndex) \
+            and time_index.is_monotonic_increasing:
+        # Same bins as used by xarray's resample()
+        first_items = pd.Series(np.arange(len(time_index)), index=time_index).resample(period).first()
+        non_empty = np.flatnonzero(first_items.notnull().values)
+        first_positions = first_items.values[non_empty].astype(np.int64)
+        codes = non_empty[np.searchsorted(first_positions, np.arange(len(time_index)), side='right') - 1]
+        with monitor.starting("Resample dataset", total_work=100):
+            dataset = _reduce_groups(ds, codes, len(first_items), method, monitor.child(100))
+        dataset['time'] = first_items.index.values
+    else:
+        with monitor.observing("Resample dataset"):
+            dataset = agg_function(ds.resample(time=period))
 
     return adjust_temporal_attrs(dataset)
 
@@ -197,40 +197,19 @@ def _within_bounds(array: np.ndarray, low_bound) -> bool:
     return (array[0] >= low_bound and array[-1] <= abs(low_bound))
 
 
-def _resample_slice(arr_slice: xr.DataArray, w: int, h: int, ds_method: int, us_method: int,
-                    parent_monitor: Monitor) -> xr.DataArray:
-    """
-    Resample a single time slice of a larger xr.DataArray
-
-    :param arr_slice: xr.DataArray single slice
-    :param w: The desired new width (amount of longitudes)
-    :param h: The desired new height (amount of latitudes)
-    :param ds_method: Downsampling method, see resampling.py
-    :param us_method: Upsampling method, see resampling.py
-    :param parent_monitor: the parent progress monitor.
-    :return: resampled slice
-    """
-    monitor = parent_monitor.child(1)
-    with monitor.observing("resample slice"):
-        # In some cases the grouped dimension is not automatically squeezed out
-        result = resampling.resample_2d(np.ma.masked_invalid(arr_slice.squeeze().values),
-                                        w,
-                                        h,
-                                        ds_method,
-                                        us_method)
-        return xr.DataArray(result)
-
-
-def _resample_array(array: xr.DataArray, lon: xr.DataArray, lat: xr.DataArray, method_us: int,
-                    method_ds: int, parent_monitor: Monitor) -> xr.DataArray:
+def _resample_array(array: xr.DataArray, lon: xr.DataArray, lat: xr.DataArray,
+                    plan: resampling.ResamplingPlan, parent_monitor: Monitor) -> xr.DataArray:
     """
     Resample the given xr.DataArray to a new grid defined by lat and lon
 
+    The resampling is lazy. Every dask block of the result is computed from a block of the source array that
+    covers the full spatial extent and any chunk of the other dimensions, which are resampled by a single
+    application of the given resampling plan.
+
     :param array: xr.DataArray with lat,lon and time coordinates
     :param lat: 'lat' xr.DataArray attribute for the new grid
     :param lon: 'lon' xr.DataArray attribute for the new grid
-    :param method_us: Interpolation method to use for upsampling, see resampling.py
-    :param method_ds: Interpolation method to use for downsampling, see resampling.py
+    :param plan: The resampling plan from the array's grid to the new grid
     :param parent_monitor: the parent progress monitor.
     :return: The resampled array
     """
@@ -240,41 +219,30 @@ def _resample_array(array: xr.DataArray, lon: xr.DataArray, lat: xr.DataArray, m
 
     monitor = parent_monitor.child(1)
 
-    kwargs = {'w': width, 'h': height, 'ds_method': method_ds, 'us_method': method_us, 'parent_monitor': monitor}
-
-    groupby_list = list(array.dims)
-    for dim in ['lon', 'lat']:
-        groupby_list.remove(dim)
-
-    if 0 == len(groupby_list):
-        # a 2d dataset, can't do groupby => do a simple slice resample
-        with monitor.starting("coregister dataarray", total_work=1):
-            temp_array = _resample_slice(array, **kwargs)
-            coords = {'lat': lat, 'lon': lon}
-            return xr.DataArray(temp_array.values,
-                                name=array.name,
-                                dims=array.dims,
-                                coords=coords,
-                                attrs=array.attrs).chunk()
-
-    num_steps = 1
-    for dim in groupby_list:
-        num_steps = num_steps * len(array[dim])
-
-    with monitor.starting("coregister dataarray", total_work=num_steps):
-        temp_array = _nested_groupby_apply(array, groupby_list, _resample_slice, kwargs)
-        chunks = {'lat': height, 'lon': width}
-        coords = {'lat': lat, 'lon': lon}
-        for dim in groupby_list:
-            coords[dim] = array[dim]
+    stack_dims = [dim for dim in array.dims if dim not in ('lat', 'lon')]
+
+    with monitor.starting("coregister dataarray", total_work=1):
+        if array.chunks is None:
             # One spatial slice is one dask chunk, e.g. chunking is
             # (1,1,1..1,len(lat),len(lon))
-            chunks[dim] = 1
-        return xr.DataArray(temp_array.values,
+            chunks = {dim: 1 for dim in stack_dims}
+        else:
+            chunks = {}
+        chunks.update(lat=-1, lon=-1)
+        src_array = array.chunk(chunks=chunks).transpose(*stack_dims, 'lat', 'lon')
+        src_data = src_array.data
+        data = src_data.map_blocks(plan.resample,
+                                   dtype=src_data.dtype,
+                                   chunks=src_data.chunks[:-2] + ((height,), (width,)))
+        coords = {'lat': lat, 'lon': lon}
+        for dim in stack_dims:
+            coords[dim] = array[dim]
+        monitor.progress(work=1)
+        return xr.DataArray(data,
                             name=array.name,
-                            dims=array.dims,
+                            dims=src_array.dims,
                             coords=coords,
-                            attrs=array.attrs).chunk(chunks=chunks)
+                            attrs=array.attrs).transpose(*array.dims)
 
 
 def _resample_dataset(ds_master: xr.Dataset, ds_replica: xr.Dataset, method_us: int, method_ds: int, monitor: Monitor) -> xr.Dataset:
@@ -319,7 +287,10 @@ def _resample_dataset(ds_master: xr.Dataset, ds_replica: xr.Dataset, method_us:
         return ds_replica
 
     with monitor.starting("coregister dataset", len(ds_replica.data_vars)):
-        kwargs = {'lon': lon, 'lat': lat, 'method_us': method_us, 'method_ds': method_ds, 'parent_monitor': monitor}
+        # All variables share the replica's grid, so the resampling geometry is computed once
+        plan = resampling.get_resampling_plan(ds_replica['lon'].size, ds_replica['lat'].size, lon.size, lat.size,
+                                              ds_method=method_ds, us_method=method_us)
+        kwargs = {'lon': lon, 'lat': lat, 'plan': plan, 'parent_monitor': monitor}
         retset = ds_replica.apply(_resample_array, keep_attrs=True, **kwargs)
 
     return adjust_spatial_attrs(retset)
@@ -400,25 +371,3 @@ def _find_intersection(first: np.ndarray,
                               ' coregistration on')
 
     return (minimum, maximum)
-
-
-def _nested_groupby_apply(array: xr.DataArray,
-                          groupby: list,
-                          apply_fn: object,
-                          kwargs: dict):
-    """
-    Perform a nested groupby over given dimensions and apply a function on the
-    last 'slice'
-
-    :param array: xr.DataArray to perform groupby on
-    :param groupby: a list of coordinate labels over which to perform groupby
-    :param apply_fn: The function to apply
-    :return: groupby-split-appy result
-    """
-    if len(groupby) == 1:
-        return array.groupby(groupby[0], squeeze=True).apply(apply_fn, **kwargs)
-    else:
-        return array.groupby(groupby[0], squeeze=True).apply(_nested_groupby_apply,
-                                                             groupby=groupby[1:],
-                                                             apply_fn=apply_fn,
-                                                             kwargs=kwargs)
@@ -42,7 +42,6 @@ import xarray as xr
 # os.environ['FOR_DISABLE_CONSOLE_CTRL_HANDLER'] = '1'
 # Unfortunately, if the above is uncommented cate-webapi doesn't handle CTRL-C anymore even though
 # a SIGINT handler is registered.
-from scipy.stats import pearsonr
 from scipy.special import betainc
 
 from cate.core.op import op, op_input, op_return
@@ -113,9 +112,13 @@ def pearson_correlation_scalar(ds_x: DatasetLike.TYPE,
                               f' to perform the correlation. Currently there are {n_vals} values')
 
     with monitor.observing("Calculate Pearson correlation"):
-        cc, pv = pearsonr(array_x.stack(z=array_x.dims), array_y.stack(z=array_y.dims))
+        # Correlate by position, as the coordinates of x and y may differ
+        moments = _pearson_moments(array_x.drop_vars(list(array_x.coords)),
+                                   array_y.drop_vars(list(array_y.coords)),
+                                   list(array_x.dims)).compute()
+        cc, pv = _pearson_from_moments(moments)
 
-    return pd.DataFrame({'corr_coef': [cc], 'p_value': [pv]})
+    return pd.DataFrame({'corr_coef': [float(cc)], 'p_value': [float(pv)]})
 
 
 @op(tags=['utility', 'correlation'], version='1.0')
@@ -178,7 +181,7 @@ def pearson_correlation(ds_x: DatasetLike.TYPE,
                                   ' of a 3D lon/lat/time dataset and a 1D timeseries'
                                   ' is provided.')
 
-        if array_x.values.shape != array_y.values.shape:
+        if array_x.shape != array_y.shape:
             raise ValidationError(f'The provided variables {var_x} and {var_y} do not have the'
                                   ' same shape, Pearson correlation can not be'
                                   ' performed. Please review operation'
@@ -246,47 +249,25 @@ def _pearsonr(x: xr.DataArray, y: xr.DataArray, monitor: Monitor) -> xr.Dataset:
     ----------
     http://www.statsoft.com/textbook/glosp.html#Pearson%20Correlation
     """
-    with monitor.starting("Calculate Pearson correlation", total_work=6):
-        n = len(x['time'])
-
-        xm, ym = x - x.mean(dim='time'), y - y.mean(dim='time')
-        xm['time'] = [i for i in range(0, len(xm.time))]
-        ym['time'] = [i for i in range(0, len(ym.time))]
-        xm_ym = xm * ym
-        r_num = xm_ym.sum(dim='time')
-        xm_squared = np.square(xm)
-        ym_squared = np.square(ym)
-        r_den = np.sqrt(xm_squared.sum(dim='time') * ym_squared.sum(dim='time'))
-        r_den = r_den.where(r_den != 0)
-        r = r_num / r_den
-
-        # Presumably, if abs(r) > 1, then it is only some small artifact of floating
-        # point arithmetic.
-        # At this point r should be a lon/lat dataArray, so it should be safe to
-        # load it in memory explicitly. This may take time as it will kick-start
-        # deferred processing.
-        # Comparing with NaN produces warnings that can be safely ignored
-        default_warning_settings = np.seterr(invalid='ignore')
-        with monitor.child(1).observing("task 1"):
-            negativ_r = r.values < -1.0
-        with monitor.child(1).observing("task 2"):
-            r.values[negativ_r] = -1.0
-        with monitor.child(1).observing("task 3"):
-            positiv_r = r.values > 1.0
-        with monitor.child(1).observing("task 4"):
-            r.values[positiv_r] = 1.0
-        np.seterr(**default_warning_settings)
+    with monitor.starting("Calculate Pearson correlation", total_work=2):
+        # Correlate by time step position, as the time coordinates of x and y may differ
+        moments = _pearson_moments(x.drop_vars('time', errors='ignore'),
+                                   y.drop_vars('time', errors='ignore'),
+                                   'time')
+        # This reads x and y once and loads only the lon/lat moment maps into memory
+        with monitor.child(1).observing("Accumulate moments"):
+            moments = moments.compute()
+
+        with monitor.child(1).observing("Calculate coefficients"):
+            r_values, prob_values = _pearson_from_moments(moments)
+
+        dims = moments['n'].dims
+        coords = moments['n'].coords
+        r = xr.DataArray(r_values, dims=dims, coords=coords)
         r.attrs = {'description': 'Correlation coefficients between'
                    ' {} and {}.'.format(x.name, y.name)}
 
-        df = n - 2
-        t_squared = np.square(r) * (df / ((1.0 - r.where(r != 1)) * (1.0 + r.where(r != -1))))
-
-        prob = df / (df + t_squared)
-        with monitor.child(1).observing("task 5"):
-            prob_values_in = prob.values
-        with monitor.child(1).observing("task 6"):
-            prob.values = betainc(0.5 * df, 0.5, prob_values_in)
+        prob = xr.DataArray(prob_values, dims=dims, coords=coords)
         prob.attrs = {'description': 'Rough indicator of probability of an'
                       ' uncorrelated system producing datasets that have a Pearson'
                       ' correlation at least as extreme as the one computed from'
@@ -296,3 +277,67 @@ def _pearsonr(x: xr.DataArray, y: xr.DataArray, monitor: Monitor) -> xr.Dataset:
         retset = xr.Dataset({'corr_coef': r,
                              'p_value': prob})
     return retset
+
+
+def _pearson_moments(x: xr.DataArray, y: xr.DataArray, dim) -> xr.Dataset:
+    """
+    Build the lazy, single-pass accumulation of the moments needed for Pearson's
+    correlation of x and y along the given dimension(s).
+
+    Only pairs of valid x and y values contribute. To reduce cancellation errors,
+    x and y are shifted by their first element along *dim* before accumulation,
+    or not at all where that element is missing. Any constant shift leaves the
+    correlation unchanged.
+    Computing the returned dataset evaluates all moments in one pass over x and y.
+
+    :param x: The 'x' xr.DataArray
+    :param y: The 'y' xr.DataArray, broadcastable against x
+    :param dim: Name or list of names of the dimensions to reduce
+    :return: A dataset with the variables 'n', 'sx', 'sy', 'sxx', 'syy' and 'sxy'
+    """
+    dims = [dim] if isinstance(dim, str) else list(dim)
+    valid = x.notnull() & y.notnull()
+
+    # Shifting by a float64 value also promotes the deviations to float64
+    x0 = x.isel({d: 0 for d in dims}).astype(np.float64)
+    y0 = y.isel({d: 0 for d in dims}).astype(np.float64)
+    dx = (x - x0.where(x0.notnull(), 0)).where(valid, 0)
+    dy = (y - y0.where(y0.notnull(), 0)).where(valid, 0)
+
+    return xr.Dataset({'n': valid.sum(dim=dims),
+                       'sx': dx.sum(dim=dims),
+                       'sy': dy.sum(dim=dims),
+                       'sxx': (dx * dx).sum(dim=dims),
+                       'syy': (dy * dy).sum(dim=dims),
+                       'sxy': (dx * dy).sum(dim=dims)})
+
+
+def _pearson_from_moments(moments: xr.Dataset):
+    """
+    Calculate Pearson correlation coefficients and p-values from the computed
+    moments returned by :py:func:`_pearson_moments`.
+
+    :param moments: The computed moments
+    :return: A tuple of numpy arrays (r, p_value)
+    """
+    n = moments['n'].values.astype(np.float64)
+    sx = moments['sx'].values
+    sy = moments['sy'].values
+
+    # Comparing with NaN and dividing by zero produce warnings that can be safely ignored
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = moments['sxy'].values - sx * sy / n
+        var_x = np.maximum(moments['sxx'].values - sx * sx / n, 0.0)
+        var_y = np.maximum(moments['syy'].values - sy * sy / n, 0.0)
+        r_den = np.sqrt(var_x * var_y)
+        r = np.where(r_den != 0, cov / r_den, np.nan)
+
+        # Presumably, if abs(r) > 1, then it is only some small artifact of floating
+        # point arithmetic.
+        r = np.clip(r, -1.0, 1.0)
+
+        df = n - 2
+        t_squared = np.square(r) * (df / ((1.0 - r) * (1.0 + r)))
+        prob = np.where(df > 0, betainc(0.5 * df, 0.5, df / (df + t_squared)), np.nan)
+
+    return r, prob
@@ -30,10 +30,11 @@ Functions
 =========
 """
 
+import concurrent.futures
 import functools
 import math
 import warnings
-from typing import Any, Dict, Callable, Optional, Tuple
+from typing import Any, Dict, Callable, List, Optional, Sequence, Tuple
 
 import pyproj
 import geopandas as gpd
@@ -41,6 +42,7 @@ import numpy as np
 import pandas as pd
 import shapely.geometry
 import shapely.ops
+from scipy.spatial import cKDTree
 
 from cate.core.op import op, op_input
 from cate.core.types import DataFrameLike
@@ -50,9 +52,17 @@ from cate.core.types import ValidationError
 from cate.core.types import VarName
 from cate.core.types import VarNamesLike
 from cate.util.monitor import Monitor
+from cate.util.weakcache import WeakIdentityCache
 
 _DEG2RAD = math.pi / 180.
 
+# Tolerance used to pad bounding boxes when prefiltering geometric relationship tests,
+# large enough to cover the tolerance of "almost_equals"
+_BBOX_EPS = 1e-5
+
+# Number of geometries merged at once when computing a cascaded union
+_UNION_BATCH_SIZE = 256
+
 ReprojectionFunc = Callable[[float, float], Tuple[float, float]]
 
 
@@ -223,18 +233,57 @@ def data_frame_subset(gdf: gpd.GeoDataFrame,
     if not var_names and not region:
         return gdf
 
+    if region and region_op:
+        if isinstance(gdf, gpd.GeoDataFrame):
+            gdf = _data_frame_region_subset(gdf, region_op, region)
+        else:
+            geom_str = PolygonLike.format(region)
+            gdf = data_frame_query(gdf, f'@{region_op}("{geom_str}")')
+
     if var_names:
         if 'geometry' not in var_names:
             var_names = ['geometry'] + var_names
         gdf = gdf[var_names]
 
-    if region and region_op:
-        geom_str = PolygonLike.format(region)
-        gdf = data_frame_query(gdf, f'@{region_op}("{geom_str}")')
-
     return gdf
 
 
+def _data_frame_region_subset(gdf: gpd.GeoDataFrame,
+                              region_op: str,
+                              region: shapely.geometry.base.BaseGeometry) -> gpd.GeoDataFrame:
+    """
+    Select the records of *gdf* whose geometry satisfies the geometric relationship test
+    *region_op* with *region*, given in EPSG:4326 coordinates.
+    Only records whose bounding boxes intersect the one of *region* are tested exactly.
+    """
+    if region_op not in REGION_MODES:
+        raise ValidationError(f'Invalid region operation "{region_op}".')
+
+    source_crs = dict(init='epsg:4326')
+    try:
+        target_crs = gdf.crs.to_dict() or source_crs
+    except AttributeError:
+        target_crs = source_crs
+    region = _transform_coordinates(region, _get_reprojection_func(source_crs, target_crs))
+    if region is None:
+        return gdf.iloc[0:0]
+
+    geometry_index = _get_geometry_index(gdf)
+    candidates = geometry_index.get_bbox_candidates(region.bounds)
+    if region_op == 'disjoint':
+        # Records with a finite bounding box not intersecting the region's one are disjoint for sure
+        selection = ~candidates
+    else:
+        selection = np.zeros(len(gdf), dtype=np.bool_)
+
+    if np.any(candidates):
+        geometries = gdf.geometry[candidates]
+        method_name = 'geom_almost_equals' if region_op == 'almost_equals' else region_op
+        selection[candidates] = np.asarray(getattr(geometries, method_name)(region), dtype=np.bool_)
+
+    return _maybe_convert_to_geo_data_frame(gdf, gdf[selection])
+
+
 @op(tags=['filter'], version='1.0')
 @op_input('gdf', data_type=DataFrameLike)
 @op_input('location', data_type=GeometryLike)
@@ -267,72 +316,33 @@ def data_frame_find_closest(gdf: gpd.GeoDataFrame,
     location = GeometryLike.convert(location)
     location_point = location.representative_point()
 
-    target_crs = dict(init='epsg:4326')
-    try:
-        source_crs = gdf.crs or target_crs
-    except AttributeError:
-        source_crs = target_crs
-    reprojection_func = _get_reprojection_func(source_crs, target_crs)
-
-    try:
-        geometries = gdf.geometry
-    except AttributeError as e:
-        raise ValidationError('Missing default geometry column in data frame.') from e
-
-    num_rows = len(geometries)
-    indexes = list()
-
-    # PERF: Note, this operation may be optimized by computing the great-circle distances
-    # using numpy array math!
-
-    total_work = 100
-    num_work_rows = 1 + num_rows // total_work
-    with monitor.starting('Finding closest records', total_work):
-        for i in range(num_rows):
-            geometry = geometries.iloc[i]
-            if geometry is not None:
-                # noinspection PyBroadException
-                try:
-                    representative_point = geometry.representative_point()
-                except BaseException:
-                    # For some geometries shapely.representative_point() raises AttributeError
-                    # or ValueError.
-                    # E.g. features that span the poles will raise ValueError.
-                    # The quick and dirty solution here is to catch such exceptions
-                    # and ignore them.
-                    representative_point = None
-                if representative_point is not None:
-                    representative_point = _transform_coordinates(representative_point,
-                                                                  reprojection_func)
-                    if representative_point is not None:
-                        # noinspection PyTypeChecker
-                        dist = great_circle_distance(location_point, representative_point)
-                        if dist <= max_dist:
-                            indexes.append((i, dist))
-            if i % num_work_rows == 0:
-                monitor.progress(work=1)
-
-    indexes = sorted(indexes, key=lambda item: item[1])
-    num_results = min(max_results, len(indexes))
-    indexes, distances = zip(*indexes[0:num_results])
+    with monitor.starting('Finding closest records', 2):
+        geometry_index = _get_geometry_index(gdf)
+        indexes, distances = geometry_index.find_closest(location_point.x, location_point.y,
+                                                         max_results=max_results,
+                                                         max_dist=max_dist)
+        monitor.progress(work=1)
 
-    new_gdf = gdf.iloc[list(indexes)]
-    if not isinstance(new_gdf, gpd.GeoDataFrame):
-        new_gdf = gpd.GeoDataFrame(new_gdf, crs=source_crs)
+        new_gdf = gdf.iloc[indexes]
+        if not isinstance(new_gdf, gpd.GeoDataFrame):
+            new_gdf = gpd.GeoDataFrame(new_gdf, crs=geometry_index.source_crs)
 
-    if dist_col_name:
-        new_gdf[dist_col_name] = np.array(distances)
+        if dist_col_name:
+            new_gdf[dist_col_name] = distances
+        monitor.progress(work=1)
 
     return new_gdf
 
 
-@op(tags=['arithmetic'], version='1.0')
+@op(tags=['arithmetic'], version='1.1')
 @op_input('df', data_type=DataFrameLike)
 @op_input('var_names', value_set_source='df', data_type=VarNamesLike)
 @op_input('aggregate_geometry', data_type=bool)
+@op_input('parallel_union', data_type=bool)
 def data_frame_aggregate(df: DataFrameLike.TYPE,
                          var_names: VarNamesLike.TYPE = None,
                          aggregate_geometry: bool = False,
+                         parallel_union: bool = False,
                          monitor: Monitor = Monitor.NONE) -> pd.DataFrame:
     """
     Aggregate columns into count, mean, median, sum, std, min, and max. Return a
@@ -346,6 +356,8 @@ def data_frame_aggregate(df: DataFrameLike.TYPE,
     :param var_names: Variables to be aggregated ('None' uses all aggregatable columns)
     :param aggregate_geometry: Aggregate (union like) the geometry and add it
     to the resulting GeoDataFrame
+    :param parallel_union: Whether to merge the geometries in spatially bucketed
+    groups in parallel before merging the partial results
     :param monitor: Monitor for progress bar
     :return: returns either DataFrame or GeoDataFrame. Keeps input data type
     """
@@ -396,27 +408,103 @@ def data_frame_aggregate(df: DataFrameLike.TYPE,
 
     # Aggregate (union) geometry if GeoDataFrame
     if df_is_geo and aggregate_geometry:
-        total_work = 100
-        num_work_rows = 1 + len(df) // total_work
-        with monitor.starting('Aggregating geometry: ', total_work):
-            multi_polygon = shapely.geometry.MultiPolygon()
-            i = 0
-            for rec in df.geometry:
+        multi_polygon = _union_geometries(df.geometry, parallel=parallel_union, monitor=monitor)
+        df_agg = gpd.GeoDataFrame(df_agg, geometry=[multi_polygon], crs=df.crs)
+
+    return df_agg
+
+
+def _union_geometries(geometries: Sequence[shapely.geometry.base.BaseGeometry],
+                      parallel: bool = False,
+                      monitor: Monitor = Monitor.NONE) -> shapely.geometry.base.BaseGeometry:
+    """
+    Compute the union of the given geometries as a cascaded union of batches of geometries,
+    so that the cost does not grow with the complexity of the accumulated result for every
+    single geometry. Missing geometries and geometries that cannot be merged are ignored.
+
+    If *parallel* is True, the geometries are bucketed by a regular grid over their bounding box
+    centers and the buckets are merged in parallel.
+    If the monitor is cancelled, the union of the geometries merged so far is returned.
+    """
+    geometries = [geometry for geometry in geometries if geometry is not None]
+    if parallel:
+        batches = _get_grid_buckets(geometries)
+    else:
+        batches = [geometries[i:i + _UNION_BATCH_SIZE] for i in range(0, len(geometries), _UNION_BATCH_SIZE)]
+
+    partial_unions = []
+    with monitor.starting('Aggregating geometry: ', len(batches) + 1):
+        if parallel and len(batches) > 1:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                futures = [executor.submit(_union_batch, batch) for batch in batches]
+                for future in futures:
+                    if monitor.is_cancelled():
+                        for f in futures:
+                            f.cancel()
+                        break
+                    partial_unions.append(future.result())
+                    monitor.progress(work=1)
+        else:
+            for batch in batches:
                 if monitor.is_cancelled():
                     break
-                # noinspection PyBroadException
-                try:
-                    multi_polygon = multi_polygon.union(other=rec)
-                except Exception:
-                    pass
+                partial_unions.append(_union_batch(batch))
+                monitor.progress(work=1)
 
-                if i % num_work_rows == 0:
-                    monitor.progress(work=1)
-                i += 1
+        partial_unions = [geometry for geometry in partial_unions if geometry is not None]
+        union = _union_batch(partial_unions) if partial_unions else None
+        monitor.progress(work=1)
 
-        df_agg = gpd.GeoDataFrame(df_agg, geometry=[multi_polygon], crs=df.crs)
+    return union if union is not None else shapely.geometry.MultiPolygon()
 
-    return df_agg
+
+def _union_batch(geometries: List[shapely.geometry.base.BaseGeometry]) -> Optional[shapely.geometry.base.BaseGeometry]:
+    if len(geometries) == 1:
+        return geometries[0]
+    # noinspection PyBroadException
+    try:
+        return shapely.ops.unary_union(geometries)
+    except Exception:
+        pass
+    # Some geometry of the batch cannot be merged, fall back to merging one by one and skip failing ones
+    union = None
+    for geometry in geometries:
+        # noinspection PyBroadException
+        try:
+            union = geometry if union is None else union.union(geometry)
+        except Exception:
+            pass
+    return union
+
+
+def _get_grid_buckets(geometries: List[shapely.geometry.base.BaseGeometry]) \
+        -> List[List[shapely.geometry.base.BaseGeometry]]:
+    """
+    Group the given geometries into spatially coherent buckets of about
+    _UNION_BATCH_SIZE geometries using a regular grid over their bounding box centers.
+    """
+    num_geometries = len(geometries)
+    if num_geometries <= _UNION_BATCH_SIZE:
+        return [geometries] if geometries else []
+
+    bounds = np.array([geometry.bounds if not geometry.is_empty else (np.nan,) * 4
+                       for geometry in geometries], dtype=np.float64).reshape((-1, 4))
+    x = 0.5 * (bounds[:, 0] + bounds[:, 2])
+    y = 0.5 * (bounds[:, 1] + bounds[:, 3])
+    finite = np.isfinite(x) & np.isfinite(y)
+    x = np.where(finite, x, 0.)
+    y = np.where(finite, y, 0.)
+
+    grid_size = max(1, int(math.ceil(math.sqrt(num_geometries / _UNION_BATCH_SIZE))))
+    x_min, x_max = x.min(), x.max()
+    y_min, y_max = y.min(), y.max()
+    i = np.clip(((x - x_min) / ((x_max - x_min) or 1.) * grid_size).astype(np.int64), 0, grid_size - 1)
+    j = np.clip(((y - y_min) / ((y_max - y_min) or 1.) * grid_size).astype(np.int64), 0, grid_size - 1)
+    cells = j * grid_size + i
+
+    order = np.argsort(cells, kind='stable')
+    _, starts = np.unique(cells[order], return_index=True)
+    return [[geometries[k] for k in indexes] for indexes in np.split(order, starts[1:])]
 
 
 def great_circle_distance(p1: shapely.geometry.Point, p2: shapely.geometry.Point) -> float:
@@ -457,6 +545,226 @@ def great_circle_distance(p1: shapely.geometry.Point, p2: shapely.geometry.Point
     return math.atan2(y, x) / _DEG2RAD
 
 
+def _great_circle_distances(lon1: np.ndarray, lat1: np.ndarray,
+                            lon2: np.ndarray, lat2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of :py:func:`great_circle_distance`.
+
+    :param lon1: Longitudes of the first points in degrees
+    :param lat1: Latitudes of the first points in degrees
+    :param lon2: Longitudes of the second points in degrees
+    :param lat2: Latitudes of the second points in degrees
+    :return: Great-circle distances in degrees
+    """
+    dlam = np.abs(lon2 - lon1)
+    dlam = np.where(dlam > 180., 360. - dlam, dlam) * _DEG2RAD
+    phi1 = lat1 * _DEG2RAD
+    phi2 = lat2 * _DEG2RAD
+
+    sin_phi1 = np.sin(phi1)
+    cos_phi1 = np.cos(phi1)
+    sin_phi2 = np.sin(phi2)
+    cos_phi2 = np.cos(phi2)
+    sin_dlam = np.sin(dlam)
+    cos_dlam = np.cos(dlam)
+
+    dx = cos_phi2 * sin_dlam
+    dy = cos_phi1 * sin_phi2 - sin_phi1 * cos_phi2 * cos_dlam
+
+    y = np.sqrt(dx * dx + dy * dy)
+    x = sin_phi1 * sin_phi2 + cos_phi1 * cos_phi2 * cos_dlam
+
+    return np.arctan2(y, x) / _DEG2RAD
+
+
+def _lon_lat_to_unit_vectors(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    lam = np.asarray(lon, dtype=np.float64) * _DEG2RAD
+    phi = np.asarray(lat, dtype=np.float64) * _DEG2RAD
+    cos_phi = np.cos(phi)
+    return np.stack([cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)], axis=-1)
+
+
+class _GeometryIndex:
+    """
+    A spatial index for the geometries of a GeoDataFrame.
+
+    Representative points are reprojected to EPSG:4326 and kept in a KD-tree of unit vectors,
+    so that the closest records can be found without visiting every record.
+    Bounding boxes are kept in the data frame's own CRS for prefiltering
+    geometric relationship tests.
+    Both are computed on first use only.
+
+    Use :py:func:`_get_geometry_index` to obtain a cached instance.
+
+    :param gdf: The GeoDataFrame.
+    """
+
+    def __init__(self, gdf: gpd.GeoDataFrame):
+        try:
+            self._geometries = gdf.geometry
+        except AttributeError as e:
+            raise ValidationError('Missing default geometry column in data frame.') from e
+
+        target_crs = dict(init='epsg:4326')
+        try:
+            self._source_crs = gdf.crs or target_crs
+        except AttributeError:
+            self._source_crs = target_crs
+        self._target_crs = target_crs
+
+        self._geometry_values = self._geometries.values
+        self._num_rows = len(self._geometries)
+        # Geometries may be replaced in place, e.g. by gdf.loc[i, 'geometry'] = point, so we keep
+        # the geometry objects, which also keeps their ids unique, and compare their ids on reuse
+        self._geometry_objects = list(self._geometry_values)
+        self._geometry_ids = _get_object_ids(self._geometry_objects)
+        self._indexes = None
+        self._lon = None
+        self._lat = None
+        self._tree = None
+        self._bounds = None
+
+    @property
+    def source_crs(self) -> Any:
+        """The CRS of the indexed geometries."""
+        return self._source_crs
+
+    def is_valid_for(self, gdf: gpd.GeoDataFrame) -> bool:
+        """Test whether this index still reflects the geometries of *gdf*."""
+        try:
+            geometries = gdf.geometry
+        except AttributeError:
+            return False
+        if len(geometries) != self._num_rows:
+            return False
+        geometry_values = geometries.values
+        if geometry_values is not self._geometry_values:
+            return False
+        return np.array_equal(_get_object_ids(geometry_values), self._geometry_ids)
+
+    def find_closest(self,
+                     lon: float,
+                     lat: float,
+                     max_results: int = 1,
+                     max_dist: float = 180) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the records whose representative points are closest to the given location.
+
+        :param lon: Longitude of the location in degrees.
+        :param lat: Latitude of the location in degrees.
+        :param max_results: Maximum number of results.
+        :param max_dist: Maximum great-circle distance in degrees.
+        :return: A pair comprising the integer row indexes and the great-circle distances
+            of the closest records, ordered by increasing distance.
+        """
+        self._ensure_points()
+        num_points = len(self._indexes)
+        k = min(max_results, num_points)
+        if k <= 0 or max_dist < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        # Chord length on the unit sphere is monotonic in the great-circle distance
+        max_chord = 2. * math.sin(0.5 * min(max_dist, 180.) * _DEG2RAD) + 1e-9
+        location = _lon_lat_to_unit_vectors(np.array([lon]), np.array([lat]))[0]
+        _, positions = self._tree.query(location, k=k, distance_upper_bound=max_chord)
+        positions = np.atleast_1d(positions)
+        positions = positions[positions < num_points]
+
+        distances = _great_circle_distances(lon, lat, self._lon[positions], self._lat[positions])
+        valid = distances <= max_dist
+        positions = positions[valid]
+        distances = distances[valid]
+        order = np.lexsort((positions, distances))
+        return self._indexes[positions[order]], distances[order]
+
+    def get_bbox_candidates(self, bounds: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Get a boolean mask of the records which may have a geometric relationship with
+        a geometry of the given *bounds*. Records without a finite bounding box, e.g. missing or
+        empty geometries, are always candidates.
+
+        :param bounds: Bounding box (min_x, min_y, max_x, max_y) in the data frame's CRS.
+        :return: A boolean array with one element per record.
+        """
+        self._ensure_bounds()
+        min_x, min_y, max_x, max_y = bounds
+        b = self._bounds
+        with np.errstate(invalid='ignore'):
+            intersecting = ((b[:, 0] <= max_x + _BBOX_EPS) & (b[:, 2] >= min_x - _BBOX_EPS)
+                            & (b[:, 1] <= max_y + _BBOX_EPS) & (b[:, 3] >= min_y - _BBOX_EPS))
+        return intersecting | ~np.all(np.isfinite(b), axis=1)
+
+    def _ensure_bounds(self):
+        if self._bounds is None:
+            self._bounds = np.asarray(self._geometries.bounds, dtype=np.float64).reshape((-1, 4))
+
+    def _ensure_points(self):
+        if self._tree is not None:
+            return
+
+        try:
+            points = self._geometries.representative_point()
+            indexes = np.arange(self._num_rows)
+        except BaseException:
+            # For some geometries shapely.representative_point() raises AttributeError
+            # or ValueError. E.g. features that span the poles will raise ValueError.
+            # Fall back to computing them one by one and ignore the failing ones.
+            points = []
+            indexes = []
+            for i, geometry in enumerate(self._geometries):
+                if geometry is None:
+                    continue
+                # noinspection PyBroadException
+                try:
+                    points.append(geometry.representative_point())
+                    indexes.append(i)
+                except BaseException:
+                    pass
+            indexes = np.array(indexes, dtype=np.int64)
+
+        valid = np.array([p is not None and not p.is_empty for p in points], dtype=np.bool_)
+        indexes = indexes[valid]
+        x = np.array([p.x for p, v in zip(points, valid) if v], dtype=np.float64)
+        y = np.array([p.y for p, v in zip(points, valid) if v], dtype=np.float64)
+
+        reprojection_func = _get_reprojection_func(self._source_crs, self._target_crs)
+        if reprojection_func is not None and len(x) > 0:
+            # noinspection PyBroadException
+            try:
+                x, y = reprojection_func(x, y)
+                x = np.asarray(x, dtype=np.float64)
+                y = np.asarray(y, dtype=np.float64)
+            except BaseException as e:
+                warnings.warn(f'coordinate transformation failed: {e}')
+                x = y = np.zeros(0, dtype=np.float64)
+                indexes = indexes[0:0]
+
+        finite = np.isfinite(x) & np.isfinite(y)
+        self._indexes = indexes[finite]
+        self._lon = x[finite]
+        self._lat = y[finite]
+        self._tree = cKDTree(_lon_lat_to_unit_vectors(self._lon, self._lat).reshape((-1, 3)))
+
+
+# Maps a GeoDataFrame to its _GeometryIndex
+_GEOMETRY_INDEXES = WeakIdentityCache()
+
+
+def _get_object_ids(objects) -> np.ndarray:
+    return np.fromiter((id(obj) for obj in objects), dtype=np.uint64, count=len(objects))
+
+
+def _get_geometry_index(gdf: gpd.GeoDataFrame) -> _GeometryIndex:
+    """
+    Get the spatial index for the given GeoDataFrame. The index is cached as long as *gdf*
+    is alive and none of its geometries have been replaced, so that repeated queries on
+    the same workspace resource do not have to recompute it.
+    """
+    return _GEOMETRY_INDEXES.get_or_create(gdf,
+                                           lambda: _GeometryIndex(gdf),
+                                           is_valid=lambda geometry_index: geometry_index.is_valid_for(gdf))
+
+
 def _data_frame_geometry_op(instance_method,
                             geometry: GeometryLike,
                             reprojection_func: ReprojectionFunc) -> bool:
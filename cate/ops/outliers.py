@@ -29,18 +29,23 @@ Functions
 =========
 """
 import fnmatch
+from typing import Sequence, Tuple
+
+import dask
+import dask.array as da
 import xarray as xr
 import numpy as np
 
 from cate.core.op import op, op_input, op_return
-from cate.core.types import VarNamesLike, DatasetLike
+from cate.core.types import VarNamesLike, DatasetLike, ValidationError
 from cate.util.monitor import Monitor
 from cate import __version__
 
 
-@op(tags=['filter'], version='1.0')
+@op(tags=['filter'], version='1.1')
 @op_input('ds', data_type=DatasetLike)
 @op_input('var', value_set_source='ds', data_type=VarNamesLike)
+@op_input('quantile_accuracy', value_range=[0, 1])
 @op_return(add_history=True)
 def detect_outliers(ds: xr.Dataset,
                     var: VarNamesLike.TYPE,
@@ -48,6 +53,7 @@ def detect_outliers(ds: xr.Dataset,
                     threshold_high: float = 0.95,
                     quantiles: bool = True,
                     mask: bool = False,
+                    quantile_accuracy: float = 0.0,
                     monitor: Monitor = Monitor.NONE) -> xr.Dataset:
     """
     Detect outliers in the given Dataset.
@@ -68,6 +74,10 @@ def detect_outliers(ds: xr.Dataset,
     :param mask: If True, an ancillary variable containing flag values for
     outliers will be added to the dataset. Otherwise, outliers will be replaced
     with nan directly in the data variables.
+    :param quantile_accuracy: If 0, quantiles are computed exactly, which requires
+    loading the whole variable into memory. Otherwise, quantiles are estimated in a
+    single chunk-wise pass over the data, with a rank error of at most this fraction
+    of the number of values, e.g. 0.001.
     :param monitor: A progress monitor.
     :return: The dataset with outliers masked or replaced with nan
     """
@@ -87,28 +97,100 @@ def detect_outliers(ds: xr.Dataset,
     with monitor.starting("detect_outliers", total_work=len(variables) * 3):
         for var_name in variables:
             if quantiles:
-                # Get threshold values
-                with monitor.child(1).observing("quantile low"):
-                    threshold_low = ret_ds[var_name].quantile(threshold_low)
-                with monitor.child(1).observing("quantile high"):
-                    threshold_high = ret_ds[var_name].quantile(threshold_high)
+                # Get both threshold values at once
+                with monitor.child(2).observing("quantiles"):
+                    low, high = _get_quantiles(ret_ds[var_name], (threshold_low, threshold_high),
+                                               quantile_accuracy)
             else:
+                low, high = threshold_low, threshold_high
                 monitor.progress(2)
             # If not mask, put nans in the data arrays for min/max outliers
             if not mask:
                 arr = ret_ds[var_name]
                 attrs = arr.attrs
-                ret_ds[var_name] = arr.where((arr > threshold_low) & (arr < threshold_high))
+                ret_ds[var_name] = arr.where((arr > low) & (arr < high))
                 ret_ds[var_name].attrs = attrs
             else:
                 # Create and add a data variable containing the mask for this data
                 # variable
-                _mask_outliers(ret_ds, var_name, threshold_low, threshold_high)
+                _mask_outliers(ret_ds, var_name, low, high)
             monitor.progress(1)
 
     return ret_ds
 
 
+def _get_quantiles(arr: xr.DataArray, q: Sequence[float], accuracy: float = 0.0) -> Tuple[float, ...]:
+    """
+    Get quantiles of all valid values of the given data array.
+
+    :param arr: The data array
+    :param q: The quantiles to compute, each in the range 0 to 1
+    :param accuracy: If 0, the quantiles are computed exactly, using a single
+    partial sort of all values. Otherwise, they are estimated from mergeable
+    summaries of the array's chunks, with a rank error of at most *accuracy*
+    times the number of values.
+    :return: The quantile values
+    """
+    if accuracy < 0 or accuracy >= 1:
+        raise ValidationError('quantile_accuracy must be in the range 0 to 1')
+    if not accuracy:
+        values = np.ravel(arr.values)
+        if values.size == 0:
+            return tuple(np.nan for _ in q)
+        return tuple(np.nanquantile(values, q))
+
+    size = int(np.ceil(1.0 / accuracy))
+    data = arr.data
+    if isinstance(data, da.Array):
+        # One pass over all chunks, which are summarized in parallel
+        summaries = dask.compute(*[dask.delayed(_summarize_quantiles)(block, size)
+                                   for block in data.to_delayed().ravel()])
+    else:
+        summaries = [_summarize_quantiles(data, size)]
+    return tuple(_merge_quantile_summaries(summaries, q))
+
+
+def _summarize_quantiles(block: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Summarize the valid values of a block by at most *size* representative values,
+    each standing for an equal share of the block's values.
+
+    :param block: The block
+    :param size: The maximum number of representative values
+    :return: The representative values and their weights
+    """
+    values = np.ravel(block)
+    if np.issubdtype(values.dtype, np.floating):
+        values = values[~np.isnan(values)]
+    if values.size <= size:
+        return np.sort(values), np.ones(values.size)
+    weight = values.size / size
+    positions = ((np.arange(size) + 0.5) * weight).astype(np.int64)
+    return np.partition(values, positions)[positions], np.full(size, weight)
+
+
+def _merge_quantile_summaries(summaries: Sequence[Tuple[np.ndarray, np.ndarray]], q: Sequence[float]) -> np.ndarray:
+    """
+    Compute quantiles from merged block summaries, see :py:func:`_summarize_quantiles`.
+    Like numpy's default, quantiles are linearly interpolated between ranks. If all
+    values are kept in the summaries, the result is exact.
+
+    :param summaries: The block summaries
+    :param q: The quantiles to compute
+    :return: The quantile values
+    """
+    values = np.concatenate([summary[0] for summary in summaries])
+    weights = np.concatenate([summary[1] for summary in summaries])
+    if values.size == 0:
+        return np.full(len(q), np.nan)
+    order = np.argsort(values, kind='stable')
+    values = values[order]
+    weights = weights[order]
+    # The rank of the centre of the values each representative value stands for
+    ranks = np.cumsum(weights) - (weights + 1.0) / 2.0
+    return np.interp(np.asarray(q) * (weights.sum() - 1.0), ranks, values)
+
+
 def _mask_outliers(ds: xr.Dataset, var_name: str, threshold_low: float,
                    threshold_high: float):
     """
@@ -31,8 +31,10 @@ Components
 # http://stackoverflow.com/questions/7075082/what-is-future-in-python-used-for-and-how-when-to-use-it-and-how-it-works
 from __future__ import division
 
+import functools
+
 import numpy as np
-from numba import jit
+from numba import jit, prange
 
 #: Interpolation method for upsampling: Take nearest source grid cell, even if it is invalid.
 US_NEAREST = 10
@@ -162,6 +164,268 @@ def downsample_2d(src, w, h, method=DS_MEAN, fill_value=None, mode_rank=1, out=N
     return _mask_or_not(_downsample_2d(src, mask, use_mask, method, fill_value, mode_rank, out), src, fill_value)
 
 
+def resample_nd(src, w, h, ds_method=DS_MEAN, us_method=US_LINEAR, fill_value=None, mode_rank=1, out=None):
+    """
+    Resample the last two dimensions of an N-D grid to a new resolution.
+
+    All leading dimensions are treated as a stack of 2-D grids, which are resampled by a single call
+    into a compiled kernel. Non-finite source grid cells are treated as missing.
+    The resampling geometry is taken from a cached :py:class:`ResamplingPlan`,
+    see :py:func:`get_resampling_plan`.
+
+    :param src: N-D *ndarray*, with N >= 2, whose last two dimensions are height and width
+    :param w: *int*
+        New grid width
+    :param h:  *int*
+        New grid height
+    :param ds_method: one of the *DS_* constants, optional
+        Grid cell aggregation method for a possible downsampling
+    :param us_method: one of the *US_* constants, optional
+        Grid cell interpolation method for a possible upsampling
+    :param fill_value: *scalar*, optional
+        Value for missing target grid cells. If ``None``, it is NaN for floating point grids,
+        otherwise numpy's default value is used.
+    :param mode_rank: *scalar*, optional
+        The rank of the frequency determined by the *ds_method* ``DS_MODE``. One (the default) means
+        most frequent value, zwo means second most frequent value, and so forth.
+    :param out: N-D *ndarray*, optional
+        Alternate output array in which to place the result. The default is *None*; if provided, it must have the same
+        shape as the expected output.
+    :return: An resampled version of the *src* array.
+    """
+    if src.ndim < 2:
+        raise ValueError('src must have at least two dimensions')
+    src_h, src_w = src.shape[-2:]
+    plan = get_resampling_plan(src_w, src_h, w, h, ds_method=ds_method, us_method=us_method, mode_rank=mode_rank)
+    return plan.resample(src, fill_value=fill_value, out=out)
+
+
+def get_resampling_plan(src_w, src_h, w, h, ds_method=DS_MEAN, us_method=US_LINEAR, mode_rank=1):
+    """
+    Get a possibly cached :py:class:`ResamplingPlan`.
+    Plans are cached for the most recently used source and target grid sizes and methods.
+
+    :param src_w: *int*
+        Source grid width
+    :param src_h: *int*
+        Source grid height
+    :param w: *int*
+        New grid width
+    :param h:  *int*
+        New grid height
+    :param ds_method: one of the *DS_* constants, optional
+        Grid cell aggregation method for a possible downsampling
+    :param us_method: one of the *US_* constants, optional
+        Grid cell interpolation method for a possible upsampling
+    :param mode_rank: *scalar*, optional
+        The rank of the frequency determined by the *ds_method* ``DS_MODE``.
+    :return: A resampling plan.
+    """
+    return _get_resampling_plan(int(src_w), int(src_h), int(w), int(h), ds_method, us_method, mode_rank)
+
+
+@functools.lru_cache(maxsize=64)
+def _get_resampling_plan(src_w, src_h, w, h, ds_method, us_method, mode_rank):
+    return ResamplingPlan(src_w, src_h, w, h, ds_method=ds_method, us_method=us_method, mode_rank=mode_rank)
+
+
+class ResamplingPlan:
+    """
+    A plan for resampling 2-D grids of a given source size to a new resolution.
+
+    The source grid cell indices and weights that contribute to each target grid cell are computed once,
+    when the plan is created. A plan can then be applied to any number of stacks of 2-D grids that have the
+    source grid size. It produces the same results as :py:func:`resample_2d` for grids without a mask.
+
+    :param src_w: *int*
+        Source grid width
+    :param src_h: *int*
+        Source grid height
+    :param w: *int*
+        New grid width
+    :param h:  *int*
+        New grid height
+    :param ds_method: one of the *DS_* constants, optional
+        Grid cell aggregation method for a possible downsampling
+    :param us_method: one of the *US_* constants, optional
+        Grid cell interpolation method for a possible upsampling
+    :param mode_rank: *scalar*, optional
+        The rank of the frequency determined by the *ds_method* ``DS_MODE``. One (the default) means
+        most frequent value, zwo means second most frequent value, and so forth.
+    """
+
+    def __init__(self, src_w, src_h, w, h, ds_method=DS_MEAN, us_method=US_LINEAR, mode_rank=1):
+        if src_w < 1 or src_h < 1 or w < 1 or h < 1:
+            raise ValueError('grid sizes must be >= 1')
+        if ds_method == DS_MODE and mode_rank < 1:
+            raise ValueError('mode_rank must be >= 1')
+        self._src_shape = (src_h, src_w)
+        self._shape = (h, w)
+        self._ds_method = ds_method
+        self._us_method = us_method
+        self._mode_rank = mode_rank
+        # Same decisions as in _resample_2d(): downsample first, then upsample
+        self._stages = []
+        if w < src_w or h < src_h:
+            ds_w = min(w, src_w)
+            ds_h = min(h, src_h)
+            self._stages.append(_DownsamplingStage(src_w, src_h, ds_w, ds_h, ds_method))
+            if w > src_w or h > src_h:
+                self._stages.append(_UpsamplingStage(ds_w, ds_h, w, h, us_method))
+        elif w > src_w or h > src_h:
+            self._stages.append(_UpsamplingStage(src_w, src_h, w, h, us_method))
+
+    @property
+    def src_shape(self):
+        """The shape (height, width) of source grids."""
+        return self._src_shape
+
+    @property
+    def shape(self):
+        """The shape (height, width) of target grids."""
+        return self._shape
+
+    @property
+    def ds_method(self):
+        """The downsampling method."""
+        return self._ds_method
+
+    @property
+    def us_method(self):
+        """The upsampling method."""
+        return self._us_method
+
+    @property
+    def mode_rank(self):
+        """The rank of the frequency determined by the downsampling method ``DS_MODE``."""
+        return self._mode_rank
+
+    def resample(self, src, fill_value=None, out=None):
+        """
+        Resample the last two dimensions of *src*.
+
+        :param src: N-D *ndarray*, with N >= 2, whose last two dimensions are given by *src_shape*.
+            Non-finite and masked source grid cells are treated as missing.
+        :param fill_value: *scalar*, optional
+            Value for missing target grid cells. If ``None``, it is NaN for floating point grids,
+            otherwise numpy's default value is used.
+        :param out: N-D *ndarray*, optional
+            Alternate output array in which to place the result. The default is *None*; if provided, it must have
+            the same shape as the expected output.
+        :return: An resampled version of the *src* array.
+        """
+        if src.ndim < 2:
+            raise ValueError('src must have at least two dimensions')
+        if src.shape[-2:] != self._src_shape:
+            raise ValueError("'src' and plan are incompatible")
+        if isinstance(src, np.ma.MaskedArray):
+            src = src.filled(np.nan) if np.issubdtype(src.dtype, np.floating) else src.filled()
+        shape = src.shape[:-2] + self._shape
+        if not self._stages:
+            if out is None:
+                return src
+            if out.shape != shape:
+                raise ValueError("'shape' and 'out' are incompatible")
+            out[...] = src
+            return out
+        out = _get_out(out, src, shape)
+        if fill_value is None:
+            fill_value = np.nan if np.issubdtype(out.dtype, np.floating) else _get_fill_value(None, src, out)
+        stack = np.ascontiguousarray(src).reshape((-1,) + self._src_shape)
+        out_stack = out.reshape((-1,) + self._shape)
+        for i, stage in enumerate(self._stages):
+            if i == len(self._stages) - 1:
+                stage_out = out_stack
+            else:
+                stage_out = np.zeros((stack.shape[0],) + stage.shape, dtype=src.dtype)
+            stack = stage.apply(stack, fill_value, self._mode_rank, stage_out)
+        if not np.shares_memory(out_stack, out):
+            out[...] = out_stack.reshape(out.shape)
+        return out
+
+
+class _UpsamplingStage:
+    def __init__(self, src_w, src_h, w, h, method):
+        if method != US_NEAREST and method != US_LINEAR:
+            raise ValueError('invalid upsampling method')
+        self.shape = (h, w)
+        self.method = method
+        self.y_index = _get_upsampling_index(src_h, h, method)
+        self.x_index = _get_upsampling_index(src_w, w, method)
+
+    def apply(self, src, fill_value, mode_rank, out):
+        return _upsample_stack(src, self.method, *self.y_index, *self.x_index, fill_value, out)
+
+
+class _DownsamplingStage:
+    def __init__(self, src_w, src_h, w, h, method):
+        if method not in (DS_FIRST, DS_LAST, DS_MEAN, DS_MODE, DS_VAR, DS_STD):
+            raise ValueError('invalid downsampling method')
+        self.shape = (h, w)
+        self.method = method
+        self.y_index = _get_downsampling_index(src_h, h, method)
+        self.x_index = _get_downsampling_index(src_w, w, method)
+        # The DS_MODE value buffer must hold all source grid cells of the largest window
+        y0s, y1s = self.y_index[0], self.y_index[1]
+        x0s, x1s = self.x_index[0], self.x_index[1]
+        self.max_value_count = int(np.max(x1s - x0s + 1)) * int(np.max(y1s - y0s + 1))
+
+    def apply(self, src, fill_value, mode_rank, out):
+        return _downsample_stack(src, self.method, *self.y_index, *self.x_index, fill_value, mode_rank,
+                                 self.max_value_count, out)
+
+
+def _get_upsampling_index(src_size, size, method):
+    """
+    Compute, for each target grid cell along one axis, the indices of the two nearest source grid cells
+    and the interpolation weight of the second one, using the same arithmetic as _upsample_2d().
+    """
+    i0 = np.zeros(size, dtype=np.int64)
+    i1 = np.zeros(size, dtype=np.int64)
+    w = np.zeros(size, dtype=np.float64)
+    if method == US_NEAREST:
+        scale = src_size / size
+        for i in range(size):
+            i0[i] = i1[i] = int(scale * i)
+    else:
+        scale = (src_size - 1.0) / ((size - 1.0) if size > 1 else 1.0)
+        for i in range(size):
+            f = scale * i
+            i0[i] = int(f)
+            w[i] = f - i0[i]
+            i1[i] = i0[i] + 1 if i0[i] + 1 < src_size else i0[i]
+    return i0, i1, w
+
+
+def _get_downsampling_index(src_size, size, method):
+    """
+    Compute, for each target grid cell along one axis, the index range of the contributing source grid cells
+    and the contribution weights of the first and last one, using the same arithmetic as _downsample_2d().
+    """
+    i0 = np.zeros(size, dtype=np.int64)
+    i1 = np.zeros(size, dtype=np.int64)
+    w0 = np.ones(size, dtype=np.float64)
+    w1 = np.ones(size, dtype=np.float64)
+    scale = src_size / size
+    for i in range(size):
+        f0 = scale * i
+        f1 = f0 + scale
+        i0[i] = int(f0)
+        i1[i] = int(f1)
+        if method == DS_FIRST or method == DS_LAST:
+            if i1[i] == f1 and i1[i] > i0[i]:
+                i1[i] -= 1
+        else:
+            w0[i] = 1.0 - (f0 - i0[i])
+            w1[i] = f1 - i1[i]
+            if w1[i] < _EPS:
+                w1[i] = 1.0
+                if i1[i] > i0[i]:
+                    i1[i] -= 1
+        i1[i] = min(i1[i], src_size - 1)
+    return i0, i1, w0, w1
+
+
 def _get_out(out, src, shape):
     if out is None:
         return np.zeros(shape, dtype=src.dtype)
@@ -239,6 +503,194 @@ def _resample_2d(src, mask, use_mask, ds_method, us_method, fill_value, mode_ran
     return src
 
 
+# This function will be JIT-compiled by Numba with nopython=True,
+# therefore all arg types must be either primitive scalars or numpy arrays.
+# Key-value args are not allowed.
+#
+# Applies an upsampling stage of a ResamplingPlan to a stack of 2-D grids.
+# The per-grid arithmetic is the one of _upsample_2d() without mask.
+#
+@jit(nopython=True, parallel=True)
+def _upsample_stack(src, method, y0s, y1s, wys, x0s, x1s, wxs, fill_value, out):
+    out_w = out.shape[-1]
+    out_h = out.shape[-2]
+    for k in prange(src.shape[0]):
+        for out_y in range(out_h):
+            src_y0 = y0s[out_y]
+            src_y1 = y1s[out_y]
+            wy = wys[out_y]
+            for out_x in range(out_w):
+                src_x0 = x0s[out_x]
+                if method == US_NEAREST:
+                    value = src[k, src_y0, src_x0]
+                    if np.isfinite(value):
+                        out[k, out_y, out_x] = value
+                    else:
+                        out[k, out_y, out_x] = fill_value
+                    continue
+                src_x1 = x1s[out_x]
+                wx = wxs[out_x]
+                v00 = src[k, src_y0, src_x0]
+                v01 = src[k, src_y0, src_x1]
+                v10 = src[k, src_y1, src_x0]
+                v11 = src[k, src_y1, src_x1]
+                v00_ok = np.isfinite(v00)
+                v01_ok = np.isfinite(v01)
+                v10_ok = np.isfinite(v10)
+                v11_ok = np.isfinite(v11)
+                if v00_ok and v01_ok and v10_ok and v11_ok:
+                    ok = True
+                    v0 = v00 + wx * (v01 - v00)
+                    v1 = v10 + wx * (v11 - v10)
+                    value = v0 + wy * (v1 - v0)
+                elif wx < 0.5:
+                    # NEAREST according to weight
+                    if wy < 0.5:
+                        ok = v00_ok
+                        value = v00
+                    else:
+                        ok = v10_ok
+                        value = v10
+                else:
+                    # NEAREST according to weight
+                    if wy < 0.5:
+                        ok = v01_ok
+                        value = v01
+                    else:
+                        ok = v11_ok
+                        value = v11
+                if ok:
+                    out[k, out_y, out_x] = value
+                else:
+                    out[k, out_y, out_x] = fill_value
+    return out
+
+
+# This function will be JIT-compiled by Numba with nopython=True,
+# therefore all arg types must be either primitive scalars or numpy arrays.
+# Key-value args are not allowed.
+#
+# Applies a downsampling stage of a ResamplingPlan to a stack of 2-D grids.
+# The per-grid arithmetic is the one of _downsample_2d() without mask.
+#
+@jit(nopython=True, parallel=True)
+def _downsample_stack(src, method, y0s, y1s, wy0s, wy1s, x0s, x1s, wx0s, wx1s, fill_value, mode_rank,
+                      max_value_count, out):
+    out_w = out.shape[-1]
+    out_h = out.shape[-2]
+    value_buffer_size = max_value_count if method == DS_MODE else 1
+    for k in prange(src.shape[0]):
+        values = np.zeros((value_buffer_size,), dtype=src.dtype)
+        frequencies = np.zeros((value_buffer_size,), dtype=np.float64)
+        for out_y in range(out_h):
+            src_y0 = y0s[out_y]
+            src_y1 = y1s[out_y]
+            wy0 = wy0s[out_y]
+            wy1 = wy1s[out_y]
+            for out_x in range(out_w):
+                src_x0 = x0s[out_x]
+                src_x1 = x1s[out_x]
+                wx0 = wx0s[out_x]
+                wx1 = wx1s[out_x]
+
+                if method == DS_FIRST or method == DS_LAST:
+                    done = False
+                    value = fill_value
+                    for src_y in range(src_y0, src_y1 + 1):
+                        for src_x in range(src_x0, src_x1 + 1):
+                            v = src[k, src_y, src_x]
+                            if np.isfinite(v):
+                                value = v
+                                if method == DS_FIRST:
+                                    done = True
+                                    break
+                        if done:
+                            break
+                    out[k, out_y, out_x] = value
+
+                elif method == DS_MODE:
+                    value_count = 0
+                    for src_y in range(src_y0, src_y1 + 1):
+                        wy = wy0 if (src_y == src_y0) else wy1 if (src_y == src_y1) else 1.0
+                        for src_x in range(src_x0, src_x1 + 1):
+                            wx = wx0 if (src_x == src_x0) else wx1 if (src_x == src_x1) else 1.0
+                            v = src[k, src_y, src_x]
+                            if np.isfinite(v):
+                                w = wx * wy
+                                found = False
+                                for i in range(value_count):
+                                    if v == values[i]:
+                                        frequencies[i] += w
+                                        found = True
+                                        break
+                                if not found:
+                                    values[value_count] = v
+                                    frequencies[value_count] = w
+                                    value_count += 1
+                    w_max = -1.
+                    value = fill_value
+                    if mode_rank == 1:
+                        for i in range(value_count):
+                            w = frequencies[i]
+                            if w > w_max:
+                                w_max = w
+                                value = values[i]
+                    elif mode_rank <= max_value_count:
+                        max_frequencies = np.full(mode_rank, -1.0, dtype=np.float64)
+                        indices = np.zeros(mode_rank, dtype=np.int64)
+                        for i in range(value_count):
+                            w = frequencies[i]
+                            for j in range(mode_rank):
+                                if w > max_frequencies[j]:
+                                    max_frequencies[j] = w
+                                    indices[j] = i
+                                    break
+                        value = values[indices[mode_rank - 1]]
+                    out[k, out_y, out_x] = value
+
+                elif method == DS_MEAN:
+                    v_sum = 0.0
+                    w_sum = 0.0
+                    for src_y in range(src_y0, src_y1 + 1):
+                        wy = wy0 if (src_y == src_y0) else wy1 if (src_y == src_y1) else 1.0
+                        for src_x in range(src_x0, src_x1 + 1):
+                            wx = wx0 if (src_x == src_x0) else wx1 if (src_x == src_x1) else 1.0
+                            v = src[k, src_y, src_x]
+                            if np.isfinite(v):
+                                w = wx * wy
+                                v_sum += w * v
+                                w_sum += w
+                    if w_sum < _EPS:
+                        out[k, out_y, out_x] = fill_value
+                    else:
+                        out[k, out_y, out_x] = v_sum / w_sum
+
+                else:
+                    # DS_VAR or DS_STD
+                    w_sum = 0.0
+                    wv_sum = 0.0
+                    wvv_sum = 0.0
+                    for src_y in range(src_y0, src_y1 + 1):
+                        wy = wy0 if (src_y == src_y0) else wy1 if (src_y == src_y1) else 1.0
+                        for src_x in range(src_x0, src_x1 + 1):
+                            wx = wx0 if (src_x == src_x0) else wx1 if (src_x == src_x1) else 1.0
+                            v = src[k, src_y, src_x]
+                            if np.isfinite(v):
+                                w = wx * wy
+                                w_sum += w
+                                wv_sum += w * v
+                                wvv_sum += w * v * v
+                    if w_sum < _EPS:
+                        out[k, out_y, out_x] = fill_value
+                    else:
+                        var = (wvv_sum * w_sum - wv_sum * wv_sum) / w_sum / w_sum
+                        if method == DS_STD:
+                            out[k, out_y, out_x] = np.sqrt(var)
+                        else:
+                            out[k, out_y, out_x] = var
+    return out
+
+
 # This function will be JIT-compiled by Numba with nopython=True,
 # therefore all arg types must be either primitive scalars or numpy arrays.
 # Key-value args are not allowed.
@@ -332,6 +784,25 @@ def _upsample_2d(src, mask, use_mask, method, fill_value, out):
     return out
 
 
+# Computes the maximum number of source grid cells along one axis that contribute to a target grid cell
+# when downsampling with a method other than DS_FIRST or DS_LAST, using the arithmetic of _downsample_2d().
+#
+@jit(nopython=True)
+def _get_max_window_size(src_size, size):
+    scale = src_size / size
+    max_window_size = 1
+    for i in range(size):
+        src_f0 = scale * i
+        src_f1 = src_f0 + scale
+        src_i0 = int(src_f0)
+        src_i1 = int(src_f1)
+        if src_f1 - src_i1 < _EPS and src_i1 > src_i0:
+            src_i1 -= 1
+        src_i1 = min(src_i1, src_size - 1)
+        max_window_size = max(max_window_size, src_i1 - src_i0 + 1)
+    return max_window_size
+
+
 # This function will be JIT-compiled by Numba with nopython=True,
 # therefore all arg types must be either primitive scalars or numpy arrays.
 # Key-value args are not allowed.
@@ -382,9 +853,10 @@ def _downsample_2d(src, mask, use_mask, method, fill_value, mode_rank, out):
                 out[out_y, out_x] = value
 
     elif method == DS_MODE:
-        max_value_count = int(scale_x + 1) * int(scale_y + 1)
+        max_value_count = _get_max_window_size(src_w, out_w) * _get_max_window_size(src_h, out_h)
         values = np.zeros((max_value_count,), dtype=src.dtype)
-        frequencies = np.zeros((max_value_count,), dtype=np.uint32)
+        # Frequencies accumulate the fractional weights of the source grid cells
+        frequencies = np.zeros((max_value_count,), dtype=np.float64)
         for out_y in range(out_h):
             src_yf0 = scale_y * out_y
             src_yf1 = src_yf0 + scale_y
@@ -28,22 +28,26 @@ Subset operations
 Components
 ==========
 """
-from typing import Dict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+import dask
+import numpy as np
 import xarray as xr
 
 from cate.core.op import op, op_input, op_return
 from cate.core.opimpl import subset_spatial_impl, subset_temporal_impl, subset_temporal_index_impl
 from cate.core.types import PolygonLike, TimeRangeLike, DatasetLike, PointLike, DictLike
 from cate.ops.normalize import adjust_spatial_attrs, adjust_temporal_attrs
+from cate.util.cache import Cache, MemoryCacheStore
 from cate.util.misc import to_scalar
 from cate.util.monitor import Monitor
 from cate.util.undefined import UNDEFINED
+from cate.util.weakcache import WeakIdentityCache
 
 from xcube.core.normalize import get_geo_spatial_attrs_from_var
 
 
-@op(tags=['geometric', 'spatial', 'subset'], version='1.0')
+@op(tags=['geometric', 'spatial', 'subset'], version='1.1')
 @op_input('region', data_type=PolygonLike)
 @op_return(add_history=True)
 def subset_spatial(ds: xr.Dataset,
@@ -119,17 +123,81 @@ def extract_point(ds: DatasetLike.TYPE,
            It will only be used, if it is not possible to deduce the resolution of the dataset.
     :return: A dict with the scalar values of all variables and the variable names as keys.
     """
-    ds = DatasetLike.convert(ds)
     point = PointLike.convert(point)
+    return extract_points(ds, [point], indexers=indexers, tolerance_default=tolerance_default)[0]
+
+
+def extract_points(ds: DatasetLike.TYPE,
+                   points: Sequence[PointLike.TYPE],
+                   indexers: DictLike.TYPE = None,
+                   tolerance_default: float = 0.01) -> List[Dict]:
+    """
+    Extract data at the given point locations. Works like :py:func:`extract_point` for
+    multiple points at once.
+
+    The nearest longitude and latitude indexes of all points are looked up at once and
+    all variables are read in a single pass. Chunks of dask-backed variables are kept in a
+    small cache associated with *ds*, so that repeated extractions at nearby points,
+    e.g. while hovering over a map, do not read the same chunks again.
+
+    :param ds: Dataset or dataframe to subset
+    :param points: Geographic points given by longitude and latitude
+    :param indexers: Optional indexers into data array of *var*. The *indexers* is a dictionary
+           or a comma-separated string of key-value pairs that maps the variable's dimension names
+           to constant labels. e.g. "layer=4".
+    :param tolerance_default: The default longitude and latitude tolerance for the nearest
+           neighbour lookup.
+           It will only be used, if it is not possible to deduce the resolution of the dataset.
+    :return: A list with a dict for each point, containing the scalar values of all variables
+           and the variable names as keys.
+    """
+    ds = DatasetLike.convert(ds)
+    points = [PointLike.convert(point) for point in points]
     indexers = DictLike.convert(indexers) or {}
+    return _get_point_extractor(ds).extract(ds, points, indexers, tolerance_default)
+
+
+#: Maximum number of bytes of the chunks kept for extracting points from dask-backed variables of all datasets
+POINT_CHUNK_CACHE_SIZE = 64 * 1024 * 1024
 
-    lon_lat_indexers = {'lon': point.x, 'lat': point.y}
-    tolerance = _get_tolerance(ds, tolerance_default)
+# Maps (dask array name, block ID) to the computed chunk. Dask array names are derived from the arrays'
+# sources and computations, so chunks can be shared by the point extractors of all datasets.
+_POINT_CHUNK_CACHE = Cache(MemoryCacheStore(), capacity=POINT_CHUNK_CACHE_SIZE, threshold=0.75)
+
+
+class _PointExtractor:
+    """
+    Extracts variable values of a dataset at point locations.
+    The extractor does not keep a reference to the dataset, which must be passed to
+    :py:meth:`extract`.
 
-    variable_values = {}
-    var_names = sorted(ds.data_vars.keys())
-    for var_name in var_names:
-        if not var_name.endswith('_bnds'):
+    Use :py:func:`_get_point_extractor` to obtain a cached instance.
+    """
+
+    def __init__(self, ds: xr.Dataset):
+        self._has_lon_lat = 'lon' in ds.coords and 'lat' in ds.coords \
+                            and ds['lon'].ndim == 1 and ds['lat'].ndim == 1
+        if self._has_lon_lat:
+            self._lon = ds['lon'].values
+            self._lat = ds['lat'].values
+            self._lon_order = np.argsort(self._lon, kind='stable')
+            self._lat_order = np.argsort(self._lat, kind='stable')
+        self._tolerances = {}
+
+    def extract(self,
+                ds: xr.Dataset,
+                points: Sequence[Any],
+                indexers: Dict[str, Any],
+                tolerance_default: float) -> List[Dict]:
+        num_points = len(points)
+        if num_points == 0:
+            return []
+
+        # Select the variables and resolve the labels of their "additional" dims to indexes
+        var_indexers = {}
+        for var_name in sorted(ds.data_vars.keys()):
+            if var_name.endswith('_bnds'):
+                continue
             variable = ds.data_vars[var_name]
             effective_indexers = {}
             used_dims = {'lat', 'lon'}
@@ -137,26 +205,183 @@ def extract_point(ds: DatasetLike.TYPE,
                 if dim_name in variable.dims:
                     effective_indexers[dim_name] = dim_value
                     used_dims.add(dim_name)
-            if set(variable.dims) == used_dims:
-                try:
-                    lon_lat_data = variable.sel(**effective_indexers)
-                except KeyError:
-                    # if there is no exact match for the "additional" dims, skip this variable
-                    continue
-                try:
-                    point_data = lon_lat_data.sel(method='nearest',
-                                                  tolerance=tolerance,
-                                                  **lon_lat_indexers)
-                except KeyError:
-                    # if there is no point within the given tolerance, return an empty dict
-                    return {}
-                if not variable_values:
-                    variable_values['lat'] = float(point_data.lat)
-                    variable_values['lon'] = float(point_data.lon)
-                value = to_scalar(point_data.values, ndigits=3)
+            if set(variable.dims) != used_dims:
+                continue
+            index_indexers = _get_index_indexers(ds, effective_indexers)
+            if index_indexers is None:
+                # if there is no exact match for the "additional" dims, skip this variable
+                continue
+            var_indexers[var_name] = index_indexers
+
+        if not var_indexers or not self._has_lon_lat:
+            return [{} for _ in range(num_points)]
+
+        tolerance = self._get_tolerance(ds, tolerance_default)
+        lon_indexes = _get_nearest_indexes(self._lon, self._lon_order,
+                                           np.array([point.x for point in points], dtype=np.float64),
+                                           tolerance)
+        lat_indexes = _get_nearest_indexes(self._lat, self._lat_order,
+                                           np.array([point.y for point in points], dtype=np.float64),
+                                           tolerance)
+        # if there is no point within the given tolerance, return an empty dict
+        valid = np.nonzero((lon_indexes >= 0) & (lat_indexes >= 0))[0]
+        lon_indexes = lon_indexes[valid]
+        lat_indexes = lat_indexes[valid]
+
+        values = self._read_values(ds, var_indexers, lon_indexes, lat_indexes)
+
+        results = [{} for _ in range(num_points)]
+        for k, point_index in enumerate(valid):
+            variable_values = results[point_index]
+            variable_values['lat'] = float(self._lat[lat_indexes[k]])
+            variable_values['lon'] = float(self._lon[lon_indexes[k]])
+            for var_name in var_indexers.keys():
+                value = to_scalar(values[var_name][k], ndigits=3)
                 if value is not UNDEFINED:
                     variable_values[var_name] = value
-    return variable_values
+        return results
+
+    def _get_tolerance(self, ds: xr.Dataset, tolerance_default: float) -> float:
+        tolerance = self._tolerances.get(tolerance_default)
+        if tolerance is None:
+            tolerance = _get_tolerance(ds, tolerance_default)
+            self._tolerances[tolerance_default] = tolerance
+        return tolerance
+
+    def _read_values(self,
+                     ds: xr.Dataset,
+                     var_indexers: Dict[str, Dict[str, int]],
+                     lon_indexes: np.ndarray,
+                     lat_indexes: np.ndarray) -> Dict[str, np.ndarray]:
+        values = {}
+
+        # Group in-memory or lazily loaded variables by their indexers and read each group at once
+        groups = {}
+        chunked_var_names = []
+        for var_name, index_indexers in var_indexers.items():
+            if ds[var_name].chunks is not None:
+                chunked_var_names.append(var_name)
+            else:
+                groups.setdefault(tuple(sorted(index_indexers.items())), []).append(var_name)
+        point_indexers = dict(lon=xr.DataArray(lon_indexes, dims='__point__'),
+                              lat=xr.DataArray(lat_indexes, dims='__point__'))
+        for index_indexers, var_names in groups.items():
+            ds_points = ds[var_names].isel(**point_indexers, **dict(index_indexers))
+            for var_name in var_names:
+                values[var_name] = ds_points[var_name].values
+
+        if not chunked_var_names:
+            return values
+
+        # Locate the chunks of dask-backed variables, compute all missing ones at once
+        point_blocks = {}
+        missing_blocks = {}
+        for var_name in chunked_var_names:
+            variable = ds[var_name]
+            index_indexers = var_indexers[var_name]
+            block_ids = []
+            offsets = []
+            for dim_name, dim_chunks in zip(variable.dims, variable.chunks):
+                if dim_name == 'lon':
+                    indexes = lon_indexes
+                elif dim_name == 'lat':
+                    indexes = lat_indexes
+                else:
+                    indexes = np.full(lon_indexes.size, index_indexers[dim_name], dtype=np.int64)
+                chunk_ends = np.cumsum(dim_chunks)
+                dim_block_ids = np.searchsorted(chunk_ends, indexes, side='right')
+                block_ids.append(dim_block_ids)
+                offsets.append(indexes - (chunk_ends[dim_block_ids] - np.array(dim_chunks)[dim_block_ids]))
+            block_ids = np.stack(block_ids, axis=-1).reshape((lon_indexes.size, variable.ndim))
+            offsets = np.stack(offsets, axis=-1).reshape((lon_indexes.size, variable.ndim))
+            point_blocks[var_name] = block_ids, offsets
+            for block_id in set(map(tuple, block_ids.tolist())):
+                key = variable.data.name, block_id
+                if self._get_chunk(key) is None:
+                    missing_blocks[key] = variable.data.blocks[block_id]
+
+        if missing_blocks:
+            computed_blocks = dask.compute(*missing_blocks.values())
+            for key, block in zip(missing_blocks.keys(), computed_blocks):
+                self._put_chunk(key, np.asarray(block))
+
+        for var_name in chunked_var_names:
+            variable = ds[var_name]
+            block_ids, offsets = point_blocks[var_name]
+            var_values = np.empty(lon_indexes.size, dtype=variable.dtype)
+            for k in range(lon_indexes.size):
+                key = variable.data.name, tuple(block_ids[k].tolist())
+                block = self._get_chunk(key)
+                if block is None:
+                    # Evicted by other chunks of the same request
+                    block = missing_blocks[key].compute() if key in missing_blocks \
+                        else variable.data.blocks[key[1]].compute()
+                var_values[k] = block[tuple(offsets[k].tolist())]
+            values[var_name] = var_values
+        return values
+
+    @classmethod
+    def _get_chunk(cls, key: Tuple) -> Optional[np.ndarray]:
+        return _POINT_CHUNK_CACHE.get_value(key)
+
+    @classmethod
+    def _put_chunk(cls, key: Tuple, chunk: np.ndarray):
+        if chunk.nbytes <= _POINT_CHUNK_CACHE.max_size:
+            _POINT_CHUNK_CACHE.put_value(key, chunk)
+
+
+def _get_index_indexers(ds: xr.Dataset, indexers: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """
+    Resolve the exact labels given by *indexers* to integer indexes.
+    Return None, if there is no exact match for any label.
+    """
+    index_indexers = {}
+    for dim_name, dim_value in indexers.items():
+        try:
+            if dim_name in ds.indexes:
+                index = ds.indexes[dim_name].get_loc(dim_value)
+            else:
+                index = int(dim_value)
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not isinstance(index, (int, np.integer)):
+            return None
+        index_indexers[dim_name] = int(index)
+    return index_indexers
+
+
+def _get_nearest_indexes(coord: np.ndarray,
+                         order: np.ndarray,
+                         targets: np.ndarray,
+                         tolerance: float) -> np.ndarray:
+    """
+    Get the indexes of the coordinate values in *coord* nearest to *targets*,
+    or -1 where the nearest value is farther away than *tolerance*.
+    *order* sorts *coord* in ascending order.
+    """
+    num_values = coord.size
+    if num_values == 0:
+        return np.full(targets.size, -1, dtype=np.int64)
+    sorted_coord = coord[order].astype(np.float64)
+    right = np.clip(np.searchsorted(sorted_coord, targets), 0, num_values - 1)
+    left = np.clip(right - 1, 0, num_values - 1)
+    left_dist = np.abs(targets - sorted_coord[left])
+    right_dist = np.abs(sorted_coord[right] - targets)
+    nearest = np.where(left_dist < right_dist, left, right)
+    dist = np.minimum(left_dist, right_dist)
+    with np.errstate(invalid='ignore'):
+        return np.where(dist <= tolerance, order[nearest], -1).astype(np.int64)
+
+
+# Maps a dataset to its _PointExtractor
+_POINT_EXTRACTORS = WeakIdentityCache()
+
+
+def _get_point_extractor(ds: xr.Dataset) -> _PointExtractor:
+    """
+    Get the point extractor for the given dataset. The extractor is kept as long as *ds* is alive.
+    """
+    return _POINT_EXTRACTORS.get_or_create(ds, lambda: _PointExtractor(ds))
 
 
 def _get_tolerance(ds: xr.Dataset, tolerance_default: float):
@@ -26,6 +26,8 @@ Description
 
 This module defines the :py:class:`Cache` class which represents a general-purpose cache.
 A cache is configured by a :py:class:`CacheStore` which is responsible for storing and reloading cached items.
+The :py:class:`ShardedCache` class has the same interface, but distributes its items over multiple
+independently locked caches so that it can be used efficiently by many threads at the same time.
 
 The default cache stores are
 
@@ -48,11 +50,15 @@ Components
 ==========
 """
 
+import heapq
+import itertools
 import os
 import os.path
+import random
 import sys
 import time
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from threading import RLock
 
 from .misc import is_debug_mode
@@ -227,11 +233,211 @@ POLICY_RR = _policy_rr
 
 _T0 = time.perf_counter()
 
+#: Default number of shards used by a :py:class:`ShardedCache`
+DEFAULT_NUM_SHARDS = 16
+
+
+class _EvictionIndex(metaclass=ABCMeta):
+    """
+    Cache-private index over the items of a :py:class:`Cache` which yields eviction candidates
+    in the order given by a replacement policy without having to sort all items.
+    """
+
+    @abstractmethod
+    def add(self, item):
+        """Add a new item."""
+
+    @abstractmethod
+    def remove(self, item):
+        """Remove an existing item."""
+
+    @abstractmethod
+    def touch(self, item):
+        """Notify the index that an existing item has been accessed."""
+
+    @abstractmethod
+    def iter_victims(self, exclude=None):
+        """
+        Generate items in eviction order.
+        The index must not be modified while the returned iterator is consumed.
+
+        :param exclude: an item that must not be evicted, e.g. the one just added
+        """
+
+
+class _LruIndex(_EvictionIndex):
+    """
+    Least-recently-used order kept in an ordered dictionary, O(1) for all operations.
+    """
+
+    def __init__(self):
+        self._items = OrderedDict()
+
+    def add(self, item):
+        self._items[item.key] = item
+
+    def remove(self, item):
+        del self._items[item.key]
+
+    def touch(self, item):
+        self._items.move_to_end(item.key)
+
+    def iter_victims(self, exclude=None):
+        return (item for item in self._items.values() if item is not exclude)
+
+
+class _MruIndex(_LruIndex):
+    """
+    Most-recently-used order, same as :py:class:`_LruIndex` but iterated in reverse.
+    """
+
+    def iter_victims(self, exclude=None):
+        return (item for item in reversed(self._items.values()) if item is not exclude)
+
+
+class _LfuIndex(_EvictionIndex):
+    """
+    Least-frequently-used order kept in a binary min-heap with lazy deletion.
+    Ties are resolved in the order items were added. O(log n) for all operations.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def add(self, item):
+        self._push(item, next(self._counter))
+
+    def remove(self, item):
+        entry = self._entries.pop(item.key)
+        # Mark as stale, the heap entry is dropped later
+        entry[2] = None
+
+    def touch(self, item):
+        entry = self._entries[item.key]
+        entry[2] = None
+        self._push(item, entry[1])
+
+    def iter_victims(self, exclude=None):
+        # Traverse the heap in key order without modifying it:
+        # the frontier is itself a heap of (entry, index) pairs.
+        heap = self._heap
+        # Drop stale entries from the top, they would be visited over and over again
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if not heap:
+            return
+        frontier = [(heap[0], 0)]
+        while frontier:
+            entry, i = heapq.heappop(frontier)
+            item = entry[2]
+            if item is not None and item is not exclude:
+                yield item
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def _push(self, item, seq):
+        entry = [item.access_count, seq, item]
+        self._entries[item.key] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[2] is not None]
+        heapq.heapify(self._heap)
+
+
+class _RrIndex(_EvictionIndex):
+    """
+    Random replacement order. Items are kept in a list, so that they can be removed in O(1)
+    by swapping them with the last one.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._positions = {}
+
+    def add(self, item):
+        self._positions[item.key] = len(self._items)
+        self._items.append(item)
+
+    def remove(self, item):
+        i = self._positions.pop(item.key)
+        last_item = self._items.pop()
+        if last_item is not item:
+            self._items[i] = last_item
+            self._positions[last_item.key] = i
+
+    def touch(self, item):
+        pass
+
+    def iter_victims(self, exclude=None):
+        items = self._items
+        n = len(items)
+        visited = set()
+        # Sample without replacement. Usually only a few items are evicted at a time,
+        # so we fall back to a full shuffle only if more than half of them are requested.
+        while len(visited) < n // 2:
+            i = random.randrange(n)
+            if i not in visited:
+                visited.add(i)
+                if items[i] is not exclude:
+                    yield items[i]
+        remaining = [i for i in range(n) if i not in visited]
+        random.shuffle(remaining)
+        for i in remaining:
+            if items[i] is not exclude:
+                yield items[i]
+
+
+class _SortedIndex(_EvictionIndex):
+    """
+    Fallback for user-defined policies: items are sorted by the policy key on each eviction.
+    """
+
+    def __init__(self, policy):
+        self._policy = policy
+        self._items = {}
+
+    def add(self, item):
+        self._items[item.key] = item
+
+    def remove(self, item):
+        del self._items[item.key]
+
+    def touch(self, item):
+        pass
+
+    def iter_victims(self, exclude=None):
+        return (item for item in sorted(self._items.values(), key=self._policy) if item is not exclude)
+
+
+_EVICTION_INDEX_CLASSES = {
+    _policy_lru: _LruIndex,
+    _policy_mru: _MruIndex,
+    _policy_lfu: _LfuIndex,
+    _policy_rr: _RrIndex,
+}
+
+
+def _new_eviction_index(policy) -> _EvictionIndex:
+    index_class = _EVICTION_INDEX_CLASSES.get(policy)
+    if index_class is not None:
+        return index_class()
+    return _SortedIndex(policy)
+
 
 class Cache:
     """
     An implementation of a cache.
     See https://en.wikipedia.org/wiki/Cache_algorithms
+
+    Values are looked up, stored and removed in O(1). For the default replacement policies, the cache
+    maintains an index so that eviction candidates are found in O(1) (LRU, MRU, RR) or O(log n) (LFU).
+    Other policy functions are supported too, but require sorting all items when the cache is trimmed.
     """
 
     class Item:
@@ -239,6 +445,8 @@ class Cache:
         Cache-private class representing an item in the cache.
         """
 
+        __slots__ = ('key', 'stored_value', 'stored_size', 'creation_time', 'access_time', 'access_count')
+
         def __init__(self):
             self.key = None
             self.stored_value = None
@@ -302,7 +510,7 @@ class Cache:
         self._size = 0
         self._max_size = self._capacity * self._threshold
         self._item_dict = {}
-        self._item_list = []
+        self._index = _new_eviction_index(policy)
         self._lock = RLock()
 
     @property
@@ -330,107 +538,119 @@ class Cache:
         return self._max_size
 
     def get_value(self, key):
-        self._lock.acquire()
-        item = self._item_dict.get(key)
-        value = None
-        restored = False
-        if item:
-            value = item.restore(self._store, key)
-            restored = True
-            if _DEBUG_CACHE:
-                _debug_print('restored value for key "%s" from cache' % key)
-        elif self._parent_cache:
-            item = self._parent_cache.get_value(key)
+        with self._lock:
+            item = self._item_dict.get(key)
+            value = None
+            restored = False
             if item:
-                value = item.restore(self._parent_cache.store, key)
-                restored = True
-                if _DEBUG_CACHE:
-                    _debug_print('restored value for key "%s" from parent cache' % key)
-        if not restored:
-            item = Cache.Item.load_from_key(self._store, key)
-            if item:
-                self._add_item(item)
                 value = item.restore(self._store, key)
+                self._index.touch(item)
+                restored = True
                 if _DEBUG_CACHE:
                     _debug_print('restored value for key "%s" from cache' % key)
-        self._lock.release()
-        return value
+            elif self._parent_cache:
+                value = self._parent_cache.get_value(key)
+                if value is not None:
+                    restored = True
+                    if _DEBUG_CACHE:
+                        _debug_print('restored value for key "%s" from parent cache' % key)
+            if not restored:
+                item = Cache.Item.load_from_key(self._store, key)
+                if item:
+                    self._add_item(item)
+                    value = item.restore(self._store, key)
+                    self._index.touch(item)
+                    if _DEBUG_CACHE:
+                        _debug_print('restored value for key "%s" from cache' % key)
+            return value
 
     def put_value(self, key, value):
-        self._lock.acquire()
-        if self._parent_cache:
-            # remove value from parent cache, because this cache will now take over
-            self._parent_cache.remove_value(key)
-        item = self._item_dict.get(key)
-        if item:
-            self._remove_item(item)
-            item.discard(self._store, key)
+        with self._lock:
+            if self._parent_cache:
+                # remove value from parent cache, because this cache will now take over
+                self._parent_cache.remove_value(key)
+            item = self._item_dict.get(key)
+            if item:
+                self._remove_item(item)
+                item.discard(self._store, key)
+                if _DEBUG_CACHE:
+                    _debug_print('discarded value for key "%s" from cache' % key)
+            else:
+                item = Cache.Item()
+            item.store(self._store, key, value)
             if _DEBUG_CACHE:
-                _debug_print('discarded value for key "%s" from cache' % key)
-        else:
-            item = Cache.Item()
-        item.store(self._store, key, value)
-        if _DEBUG_CACHE:
-            _debug_print('stored value for key "%s" in cache' % key)
-        self._add_item(item)
-        self._lock.release()
+                _debug_print('stored value for key "%s" in cache' % key)
+            self._add_item(item)
 
     def remove_value(self, key):
-        self._lock.acquire()
-        if self._parent_cache:
-            self._parent_cache.remove_value(key)
-        item = self._item_dict.get(key)
-        if item:
-            self._remove_item(item)
-            item.discard(self._store, key)
-            if _DEBUG_CACHE:
-                _debug_print('cate.util.im.cache.Cache: discarded value for key "%s" from parent cache' % key)
-        self._lock.release()
+        with self._lock:
+            if self._parent_cache:
+                self._parent_cache.remove_value(key)
+            item = self._item_dict.get(key)
+            if item:
+                self._remove_item(item)
+                item.discard(self._store, key)
+                if _DEBUG_CACHE:
+                    _debug_print('cate.util.im.cache.Cache: discarded value for key "%s" from parent cache' % key)
 
     def _add_item(self, item):
         self._item_dict[item.key] = item
-        self._item_list.append(item)
+        self._index.add(item)
         if self._size + item.stored_size > self._max_size:
-            self.trim(item.stored_size)
+            self._trim(item.stored_size, exclude=item)
         self._size += item.stored_size
 
     def _remove_item(self, item):
         self._item_dict.pop(item.key)
-        self._item_list.remove(item)
+        self._index.remove(item)
         self._size -= item.stored_size
 
     def trim(self, extra_size=0):
+        self._trim(extra_size)
+
+    def _trim(self, extra_size, exclude=None):
         if _DEBUG_CACHE:
             _debug_print('trimming...')
-        self._lock.acquire()
-        self._item_list.sort(key=self._policy)
-        keys = []
-        size = self._size
-        max_size = self._max_size
-        for item in self._item_list:
-            if size + extra_size > max_size:
+        with self._lock:
+            self._evict(self._size + extra_size - self._max_size, exclude=exclude)
+
+    def _evict(self, size_to_free, exclude=None):
+        """
+        Evict items according to the replacement policy until at least *size_to_free* units are freed
+        or no more items are left.
+
+        :param size_to_free: the size to be freed
+        :param exclude: an item or the key of an item that must not be evicted
+        :return: the size actually freed
+        """
+        with self._lock:
+            if size_to_free <= 0:
+                return 0
+            if exclude is not None and not isinstance(exclude, Cache.Item):
+                exclude = self._item_dict.get(exclude)
+            keys = []
+            freed_size = 0
+            for item in self._index.iter_victims(exclude=exclude):
                 keys.append(item.key)
-                size -= item.stored_size
-        self._lock.release()
-        # release lock to give another thread a chance then require lock again
-        self._lock.acquire()
-        for key in keys:
-            if self._parent_cache:
-                # Before discarding item fully, put its value into the parent cache
-                value = self.get_value(key)
-                self.remove_value(key)
-                if value:
-                    self._parent_cache.put_value(key, value)
-            else:
-                self.remove_value(key)
-        self._lock.release()
+                freed_size += item.stored_size
+                if freed_size >= size_to_free:
+                    break
+            for key in keys:
+                if self._parent_cache:
+                    # Before discarding item fully, put its value into the parent cache
+                    value = self.get_value(key)
+                    self.remove_value(key)
+                    if value:
+                        self._parent_cache.put_value(key, value)
+                else:
+                    self.remove_value(key)
+            return freed_size
 
     def clear(self, clear_parent=True):
-        self._lock.acquire()
-        if self._parent_cache and clear_parent:
-            self._parent_cache.clear(clear_parent)
-        keys = list(self._item_dict.keys())
-        self._lock.release()
+        with self._lock:
+            if self._parent_cache and clear_parent:
+                self._parent_cache.clear(clear_parent)
+            keys = list(self._item_dict.keys())
         for key in keys:
             if self._parent_cache and not clear_parent:
                 value = self.get_value(key)
@@ -439,6 +659,112 @@ class Cache:
             self.remove_value(key)
 
 
+class ShardedCache:
+    """
+    A cache that distributes its items over a number of independent :py:class:`Cache` instances, the shards,
+    by the hash of their keys. Every shard has its own lock, so that threads accessing different keys
+    rarely block each other, even if values are written to or read from slow stores.
+    All shards share a common capacity: if the total size exceeds the maximum size, items are evicted from
+    the shard that has just grown first, and from the other shards if required.
+
+    The API is the same as for :py:class:`Cache`.
+    """
+
+    def __init__(self, store=MemoryCacheStore(), capacity=1000, threshold=0.75, policy=POLICY_LRU,
+                 num_shards=None):
+        """
+        Constructor.
+
+        :param store: the cache store shared by all shards, see CacheStore interface
+        :param capacity: the total size capacity in units used by the store's store() method
+        :param threshold: a number greater than zero and less than one
+        :param policy: cache replacement policy applied within each shard, see :py:class:`Cache`
+        :param num_shards: number of shards, defaults to :py:data:`DEFAULT_NUM_SHARDS`
+        """
+        num_shards = num_shards if num_shards is not None else DEFAULT_NUM_SHARDS
+        if num_shards < 1:
+            raise ValueError('num_shards must be greater than zero')
+        self._store = store
+        self._capacity = capacity
+        self._threshold = threshold
+        self._policy = policy
+        self._max_size = capacity * threshold
+        # Each shard may take the full budget, the common budget is enforced by this cache
+        self._shards = [Cache(store=store, capacity=capacity, threshold=threshold, policy=policy)
+                        for _ in range(num_shards)]
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @property
+    def size(self):
+        return sum(shard.size for shard in self._shards)
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def num_shards(self):
+        return len(self._shards)
+
+    def get_value(self, key):
+        shard_index = self._get_shard_index(key)
+        value = self._shards[shard_index].get_value(key)
+        if value is not None:
+            # Value may have been loaded from the store
+            self._evict_overflow(shard_index, key)
+        return value
+
+    def put_value(self, key, value):
+        shard_index = self._get_shard_index(key)
+        self._shards[shard_index].put_value(key, value)
+        self._evict_overflow(shard_index, key)
+
+    def remove_value(self, key):
+        self._shards[self._get_shard_index(key)].remove_value(key)
+
+    def trim(self, extra_size=0):
+        size_to_free = self.size + extra_size - self._max_size
+        for shard in self._shards:
+            if size_to_free <= 0:
+                break
+            # noinspection PyProtectedMember
+            size_to_free -= shard._evict(size_to_free)
+
+    def clear(self, clear_parent=True):
+        for shard in self._shards:
+            shard.clear(clear_parent=clear_parent)
+
+    def _get_shard_index(self, key):
+        return hash(key) % len(self._shards)
+
+    def _evict_overflow(self, shard_index, key):
+        size_to_free = self.size - self._max_size
+        if size_to_free <= 0:
+            return
+        num_shards = len(self._shards)
+        for i in range(num_shards):
+            shard = self._shards[(shard_index + i) % num_shards]
+            # noinspection PyProtectedMember
+            size_to_free -= shard._evict(size_to_free, exclude=key if i == 0 else None)
+            if size_to_free <= 0:
+                break
+
+
 def _debug_print(msg):
     print("cate.util.cache.Cache:", msg)
 
@@ -0,0 +1,125 @@
+# The MIT License (MIT)
+# Copyright (c) 2021 by the ESA CCI Toolbox development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+import concurrent.futures
+import itertools
+import os
+import queue
+import threading
+from typing import Callable, Optional
+
+
+class PriorityThreadPoolExecutor(concurrent.futures.Executor):
+    """
+    A thread pool executor with a bounded number of worker threads that executes pending
+    calls in the order of their priority. Calls with a lower priority value are executed first,
+    calls with equal priority are executed in the order they were submitted.
+
+    Pending calls can be cancelled using the ``cancel()`` method of the returned futures.
+
+    :param max_workers: The maximum number of worker threads. Defaults to the number of CPUs.
+    :param thread_name_prefix: Optional prefix for the names of the worker threads.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, thread_name_prefix: str = ''):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers <= 0:
+            raise ValueError('max_workers must be greater than zero')
+        self._max_workers = max_workers
+        self._thread_name_prefix = thread_name_prefix or 'PriorityThreadPoolExecutor'
+        self._work_queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._threads = []
+        self._shutdown = False
+        self._lock = threading.Lock()
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    def submit(self, fn: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Submit a call with priority zero.
+        """
+        return self.submit_with_priority(0, fn, *args, **kwargs)
+
+    def submit_with_priority(self, priority: float, fn: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Submit a call with the given priority.
+
+        :param priority: The priority, lower values are executed first.
+        :param fn: The callable.
+        :param args: Positional arguments passed to *fn*.
+        :param kwargs: Keyword arguments passed to *fn*.
+        :return: A future representing the call.
+        """
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            future = concurrent.futures.Future()
+            self._work_queue.put((priority, next(self._counter), (future, fn, args, kwargs)))
+            self._adjust_thread_count()
+            return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        _, _, work_item = self._work_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if work_item is not None:
+                        work_item[0].cancel()
+            # Sentinels are sorted after all pending calls
+            for _ in self._threads:
+                self._work_queue.put((float('inf'), next(self._counter), None))
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _adjust_thread_count(self):
+        if len(self._threads) < self._max_workers:
+            thread = threading.Thread(name='%s_%d' % (self._thread_name_prefix, len(self._threads)),
+                                      target=self._work,
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            _, _, work_item = self._work_queue.get()
+            if work_item is None:
+                return
+            future, fn, args, kwargs = work_item
+            if not future.set_running_or_notify_cancel():
+                # Cancelled while pending
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
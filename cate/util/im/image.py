@@ -19,7 +19,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import functools
 import io
+import threading
 import time
 import uuid
 from abc import ABCMeta, abstractmethod
@@ -72,6 +74,95 @@ def get_default_tile_cache() -> Optional[Cache]:
     return _DEFAULT_TILE_CACHE
 
 
+class TileComputationTable:
+    """
+    A table of the tile computations currently in progress.
+
+    If a tile is requested while another thread is already computing it, the requesting thread
+    waits for that computation and receives its result (or exception) instead of computing the
+    same tile again.
+    Tiles are identified by their unique tile identifiers, so a single table is shared
+    by all images of a pyramid and by all decorator images derived from them.
+    """
+
+    class _Computation:
+        def __init__(self):
+            self.done = threading.Event()
+            self.tile = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._computations = dict()
+        self._num_hits = 0
+        self._num_misses = 0
+
+    @property
+    def num_hits(self) -> int:
+        """The number of requests that were served by a computation already in progress."""
+        return self._num_hits
+
+    @property
+    def num_misses(self) -> int:
+        """The number of requests that started a new computation."""
+        return self._num_misses
+
+    @property
+    def num_in_flight(self) -> int:
+        """The number of computations currently in progress."""
+        return len(self._computations)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._num_hits = 0
+            self._num_misses = 0
+
+    def compute(self, tile_id: str, compute_tile: Callable[[], Tile]) -> Tile:
+        """
+        Compute the tile with the given identifier, or wait for its computation, if it is already in progress.
+
+        :param tile_id: the unique tile identifier
+        :param compute_tile: a function that computes the tile
+        :return: the computed tile
+        """
+        with self._lock:
+            computation = self._computations.get(tile_id)
+            if computation is None:
+                computation = self._computations[tile_id] = TileComputationTable._Computation()
+                self._num_misses += 1
+                is_owner = True
+            else:
+                self._num_hits += 1
+                is_owner = False
+
+        if not is_owner:
+            computation.done.wait()
+            if computation.error is not None:
+                raise computation.error
+            return computation.tile
+
+        try:
+            computation.tile = compute_tile()
+        except BaseException as error:
+            computation.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._computations[tile_id]
+            computation.done.set()
+        return computation.tile
+
+
+_TILE_COMPUTATION_TABLE = TileComputationTable()
+
+# Chunks covering more than this number of tiles are not read as a whole, see ArrayBlockReader.from_array()
+_MAX_BLOCK_TILE_AREA_RATIO = 64
+
+
+def get_tile_computation_table() -> TileComputationTable:
+    return _TILE_COMPUTATION_TABLE
+
+
 class TiledImage(metaclass=ABCMeta):
     """
     The interface for tiled images.
@@ -230,24 +321,39 @@ class OpImage(AbstractTiledImage, metaclass=ABCMeta):
         return self._tile_cache
 
     def get_tile(self, tile_x: int, tile_y: int) -> Tile:
-        t0 = 0
-        tile_id = None
+        tile_id = self.get_tile_id(tile_x, tile_y)
+        tile = self._get_cached_tile(tile_id)
+        if tile is not None:
+            return tile
+        # Concurrent requests for the same tile wait for a single computation
+        return _TILE_COMPUTATION_TABLE.compute(tile_id,
+                                               lambda: self._compute_and_cache_tile(tile_id, tile_x, tile_y))
+
+    def _get_cached_tile(self, tile_id: str) -> Optional[Tile]:
         cache = self._tile_cache
-        if cache:
-            tile_id = self.get_tile_id(tile_x, tile_y)
-            if _DEBUG_OP_IMAGE:
-                t0 = time.perf_counter()
-            tile = cache.get_value(tile_id)
-            if tile is not None:
-                if _DEBUG_OP_IMAGE:
-                    print('tile "%s": restored from cache, took %.4f sec' % (tile_id, time.perf_counter() - t0))
-                return tile
+        if not cache:
+            return None
+        t0 = 0
+        if _DEBUG_OP_IMAGE:
+            t0 = time.perf_counter()
+        tile = cache.get_value(tile_id)
+        if tile is not None and _DEBUG_OP_IMAGE:
+            print('tile "%s": restored from cache, took %.4f sec' % (tile_id, time.perf_counter() - t0))
+        return tile
+
+    def _compute_and_cache_tile(self, tile_id: str, tile_x: int, tile_y: int) -> Tile:
+        # Another thread may have finished computing the tile in the meantime
+        tile = self._get_cached_tile(tile_id)
+        if tile is not None:
+            return tile
+        t0 = 0
         tw, th = self.tile_size
         if _DEBUG_OP_IMAGE:
             t0 = time.perf_counter()
         tile = self.compute_tile(tile_x, tile_y, (tw * tile_x, th * tile_y, tw, th))
         if _DEBUG_OP_IMAGE:
-            print('tile "%s": computed, took %.4f sec' % (self.get_tile_id(tile_x, tile_y), time.perf_counter() - t0))
+            print('tile "%s": computed, took %.4f sec' % (tile_id, time.perf_counter() - t0))
+        cache = self._tile_cache
         if cache:
             if _DEBUG_OP_IMAGE:
                 t0 = time.perf_counter()
@@ -398,6 +504,9 @@ class ColorMappedRgbaImage(DecoratorImage):
     """
     Creates a color-mapped image from a source image that provide tiles as numpy-like image arrays.
 
+    Source values are quantized into indices of a precomputed color lookup table (LUT) for the given
+    color map and number of colors. Masked, non-finite or no-data values become transparent.
+
     :param source_image: the source image
     :param image_id: optional unique image identifier
     :param no_data_value: optional no-data value for mask creation
@@ -406,7 +515,10 @@ class ColorMappedRgbaImage(DecoratorImage):
     :param num_colors: Number of colors
     :param no_data_value: No-data value
     :param encode: Whether to create tiles that are encoded image bytes according to *format*.
-    :param format: Image format, e.g. "JPEG", "PNG"
+    :param format: Image format, e.g. "JPEG", "PNG", "WEBP". As "JPEG" has no alpha channel,
+           it should be used for opaque layers only.
+    :param encode_options: Optional keyword arguments passed to the PIL image encoder,
+           e.g. ``dict(compress_level=1)`` for fast PNG encoding or ``dict(quality=90)`` for JPEG or WEBP.
     :param tile_cache: optional tile cache
     """
 
@@ -419,53 +531,46 @@ class ColorMappedRgbaImage(DecoratorImage):
                  no_data_value: Union[int, float] = None,
                  encode: bool = False,
                  format: str = None,
+                 encode_options: dict = None,
                  tile_cache=None):
         super().__init__(source_image, image_id=image_id, format=format, mode='RGBA', tile_cache=tile_cache)
         self._value_range = value_range
         self._cmap_name = cmap_name if cmap_name else 'jet'
-        ensure_cmaps_loaded()
-        self._cmap = cm.get_cmap(self._cmap_name, num_colors)
-        self._cmap.set_bad('k', 0)
+        self._num_colors = num_colors
+        self._lut = get_cmap_lut(self._cmap_name, num_colors)
         self._no_data_value = no_data_value
         self._encode = encode
+        self._encode_options = dict(encode_options) if encode_options else {}
 
     def compute_tile_from_source_tile(self,
                                       tile_x: int, tile_y: int,
                                       rectangle: Rectangle2D, source_tile: Tile) -> Tile:
-        value_min, value_max = self._value_range
-        if not np.ma.is_masked(source_tile):
-            if self._no_data_value is not None:
-                array = np.ma.masked_equal(source_tile, self._no_data_value)
-                array = array.clip(value_min, value_max, out=array)
-            elif np.issubdtype(source_tile.dtype, float) or np.issubdtype(source_tile.dtype, complex):
-                array = np.ma.masked_invalid(source_tile)
-                array = array.clip(value_min, value_max, out=array)
-            else:
-                array = source_tile.clip(value_min, value_max)
+        height, width = source_tile.shape[-2], source_tile.shape[-1]
+        if width * height != source_tile.size:
+            # noinspection PyTypeChecker
+            index = tuple([0] * (source_tile.ndim - 2) + [slice(None), slice(None)])
+            source_tile = source_tile[index]
+
+        indices = quantize_ndarray(np.ma.getdata(source_tile).reshape((height, width)),
+                                   self._value_range,
+                                   self._num_colors,
+                                   mask=np.ma.getmask(source_tile),
+                                   no_data_value=self._no_data_value)
+
+        encode = self._encode and self.format
+        if encode:
+            # The RGBA array is no longer needed after encoding, so we can reuse a thread-local buffer
+            rgba = _get_rgba_buffer(height, width)
+            np.take(self._lut, indices, axis=0, out=rgba)
         else:
-            array = source_tile.clip(value_min, value_max)
+            rgba = self._lut[indices]
+        image = Image.fromarray(rgba, mode=self.mode)
 
-        old_shape = array.shape
-        height = old_shape[-2]
-        width = old_shape[-1]
-        if width * height == array.size:
-            array = np.reshape(array, (height, width))
-        else:
-            # noinspection PyTypeChecker
-            index = [0] * (array.ndim - 2) + [slice(None), slice(None)]
-            array = array[index]
-
-        # check if we can optimize the following calls by using Numexpr
-        # see https://github.com/pydata/numexpr/wiki/Numexpr-Users-Guide
-        array -= value_min
-        if value_min != value_max:
-            array *= 1.0 / (value_max - value_min)
-        array = self._cmap(array, bytes=True)
-        image = Image.fromarray(array, mode=self.mode)
-
-        if self._encode and self.format:
+        if encode:
+            if self.format.upper() in ('JPEG', 'JPG'):
+                image = image.convert('RGB')
             ostream = io.BytesIO()
-            image.save(ostream, format=self.format)
+            image.save(ostream, format=self.format, **self._encode_options)
             encoded_image = ostream.getvalue()
             ostream.close()
             return encoded_image
@@ -478,6 +583,80 @@ class ColorMappedRgbaImage(DecoratorImage):
         return ImagePyramid.create_from_image(self, create_pil_downsampling_image, **kwargs)
 
 
+@functools.lru_cache(maxsize=128)
+def get_cmap_lut(cmap_name: str, num_colors: int) -> np.ndarray:
+    """
+    Get the RGBA color lookup table for the given color map.
+
+    :param cmap_name: A Matplotlib color map name
+    :param num_colors: Number of colors
+    :return: A read-only uint8 array of shape (num_colors + 1, 4). The last entry is the
+             transparent color used for masked values.
+    """
+    ensure_cmaps_loaded()
+    cmap = cm.get_cmap(cmap_name, num_colors)
+    lut = np.zeros((num_colors + 1, 4), dtype=np.uint8)
+    lut[:num_colors] = cmap(np.arange(num_colors), bytes=True)
+    lut.setflags(write=False)
+    return lut
+
+
+def quantize_ndarray(array: np.ndarray,
+                     value_range: Tuple[float, float],
+                     num_colors: int,
+                     mask: np.ndarray = None,
+                     no_data_value: Union[int, float] = None) -> np.ndarray:
+    """
+    Quantize the values of *array* into color indices ``0 ... num_colors - 1`` the same way as Matplotlib
+    color maps do for normalized values. Masked, non-finite and no-data values get index *num_colors*.
+
+    :param array: The array
+    :param value_range: The value range mapped to the indices.
+    :param num_colors: Number of colors
+    :param mask: Optional boolean mask, True for masked values
+    :param no_data_value: Optional no-data value
+    :return: An uint8 array if *num_colors* is less than 256, otherwise an uint16 array.
+    """
+    value_min, value_max = value_range
+    if np.issubdtype(array.dtype, np.floating) and array.dtype.itemsize <= 4:
+        float_type = np.float32
+    elif np.issubdtype(array.dtype, np.integer) and array.dtype.itemsize <= 2:
+        float_type = np.float32
+    else:
+        float_type = np.float64
+
+    if value_min != value_max:
+        scaled = np.subtract(array, value_min, dtype=float_type)
+        scaled *= float_type(num_colors / (value_max - value_min))
+        np.clip(scaled, 0, num_colors - 1, out=scaled)
+    else:
+        scaled = np.zeros(array.shape, dtype=float_type)
+
+    invalid = None
+    if np.issubdtype(array.dtype, np.floating) or np.issubdtype(array.dtype, np.complexfloating):
+        invalid = ~np.isfinite(array)
+    if mask is not None and mask is not np.ma.nomask:
+        invalid = mask if invalid is None else invalid | mask
+    if no_data_value is not None:
+        no_data = array == no_data_value
+        invalid = no_data if invalid is None else invalid | no_data
+    if invalid is not None:
+        scaled[invalid] = num_colors
+
+    return scaled.astype(np.uint8 if num_colors < 256 else np.uint16)
+
+
+_RGBA_BUFFERS = threading.local()
+
+
+def _get_rgba_buffer(height: int, width: int) -> np.ndarray:
+    buffer = getattr(_RGBA_BUFFERS, 'buffer', None)
+    if buffer is None or buffer.shape[0] != height or buffer.shape[1] != width:
+        buffer = np.empty((height, width, 4), dtype=np.uint8)
+        _RGBA_BUFFERS.buffer = buffer
+    return buffer
+
+
 class DownsamplingImage(OpImage):
     """
     Abstract base class for images that downsample a tiled source image.
@@ -607,6 +786,158 @@ class NdarrayDownsamplingImage(DownsamplingImage):
         return target_tile
 
 
+class ArrayBlockReader:
+    """
+    Reads rectangular windows from a chunked numpy-like array (e.g. a dask-backed ``xarray.DataArray``)
+    by assembling them from whole chunks, the blocks.
+
+    Blocks are loaded once and kept in a block cache, so that neighbouring tiles and tiles of
+    lower resolution levels which share the same chunks do not read and decompress them again.
+    Concurrent requests for the same block wait for a single read.
+
+    :param array: the numpy-like array, the last two dimensions are y and x
+    :param block_sizes: the chunk sizes along y and x as a pair of integer sequences
+    :param block_cache: the block cache
+    :param array_id: optional unique array identifier used to create block identifiers
+    """
+
+    def __init__(self,
+                 array,
+                 block_sizes: Tuple[Sequence[int], Sequence[int]],
+                 block_cache: Cache,
+                 array_id: str = None):
+        block_sizes_y, block_sizes_x = block_sizes
+        if sum(block_sizes_y) != array.shape[-2] or sum(block_sizes_x) != array.shape[-1]:
+            raise ValueError('block_sizes do not match array shape')
+        self._array = array
+        self._block_offsets_y = np.cumsum((0,) + tuple(block_sizes_y))
+        self._block_offsets_x = np.cumsum((0,) + tuple(block_sizes_x))
+        self._block_cache = block_cache
+        self._array_id = array_id or str(uuid.uuid4())
+        self._block_computations = TileComputationTable()
+
+    @classmethod
+    def from_array(cls,
+                   array,
+                   block_cache: Cache,
+                   array_id: str = None,
+                   tile_size: Size2D = None) -> Optional['ArrayBlockReader']:
+        """
+        Create a block reader for the given array, if it is chunked.
+
+        Chunk sizes are taken from the array's ``chunks`` attribute (dask, zarr, h5py)
+        or from its ``encoding`` (lazily loaded xarray variables).
+
+        No block reader is created, if a single block would not fit into *block_cache*,
+        or if it is much larger than a tile of the given *tile_size*. Reading whole blocks
+        would then cost more than reading the tile windows directly.
+
+        :return: a new block reader or None, if the array is not chunked or its chunks are too large
+        """
+        if block_cache is None or array.ndim < 2:
+            return None
+        height, width = array.shape[-2], array.shape[-1]
+        chunks = getattr(array, 'chunks', None)
+        if not chunks:
+            encoding = getattr(array, 'encoding', None) or {}
+            chunks = encoding.get('chunksizes') or encoding.get('chunks') or encoding.get('preferred_chunks')
+            if isinstance(chunks, dict):
+                dims = array.dims
+                chunks = [chunks.get(dim) for dim in dims] if all(dim in chunks for dim in dims[-2:]) else None
+        if not chunks or len(chunks) < 2:
+            return None
+        block_sizes_y = _normalize_block_sizes(chunks[-2], height)
+        block_sizes_x = _normalize_block_sizes(chunks[-1], width)
+        if len(block_sizes_y) == 1 and len(block_sizes_x) == 1:
+            # A single block, nothing to gain
+            return None
+        block_area = max(block_sizes_y) * max(block_sizes_x)
+        if tile_size is not None and block_area > _MAX_BLOCK_TILE_AREA_RATIO * tile_size[0] * tile_size[1]:
+            return None
+        block_nbytes = block_area * int(np.prod(array.shape[:-2])) * np.dtype(array.dtype).itemsize
+        if block_nbytes > block_cache.max_size:
+            return None
+        return ArrayBlockReader(array, (block_sizes_y, block_sizes_x), block_cache, array_id=array_id)
+
+    @property
+    def block_computations(self) -> TileComputationTable:
+        """The table of block reads in progress, including its hit and miss counts."""
+        return self._block_computations
+
+    def read_window(self, x: int, y: int, w: int, h: int, step: int = 1):
+        """
+        Read the window ``array[..., y:y + h:step, x:x + w:step]`` clipped to the array bounds.
+        """
+        array = self._array
+        height, width = array.shape[-2], array.shape[-1]
+        y_end = min(y + h, height)
+        x_end = min(x + w, width)
+        out_height = max(0, (y_end - y + step - 1) // step)
+        out_width = max(0, (x_end - x + step - 1) // step)
+        window = np.empty(tuple(array.shape[:-2]) + (out_height, out_width), dtype=array.dtype)
+        if out_height == 0 or out_width == 0:
+            return window
+        offsets_y, offsets_x = self._block_offsets_y, self._block_offsets_x
+        block_y_first = int(np.searchsorted(offsets_y, y, side='right')) - 1
+        block_y_last = int(np.searchsorted(offsets_y, y_end - 1, side='right')) - 1
+        block_x_first = int(np.searchsorted(offsets_x, x, side='right')) - 1
+        block_x_last = int(np.searchsorted(offsets_x, x_end - 1, side='right')) - 1
+        for block_y in range(block_y_first, block_y_last + 1):
+            k_y_min, k_y_max, block_y_start = _get_block_step_range(offsets_y[block_y], offsets_y[block_y + 1],
+                                                                    y, step, out_height)
+            if k_y_min >= k_y_max:
+                continue
+            for block_x in range(block_x_first, block_x_last + 1):
+                k_x_min, k_x_max, block_x_start = _get_block_step_range(offsets_x[block_x], offsets_x[block_x + 1],
+                                                                        x, step, out_width)
+                if k_x_min >= k_x_max:
+                    continue
+                block = self.get_block(block_x, block_y)
+                window[..., k_y_min:k_y_max, k_x_min:k_x_max] = \
+                    block[..., block_y_start::step, block_x_start::step][..., :k_y_max - k_y_min, :k_x_max - k_x_min]
+        return window
+
+    def get_block(self, block_x: int, block_y: int) -> np.ndarray:
+        """
+        Get the loaded block at the given block indices.
+        """
+        block_id = '%s/%d/%d' % (self._array_id, block_x, block_y)
+        block = self._block_cache.get_value(block_id)
+        if block is not None:
+            return block
+        return self._block_computations.compute(block_id,
+                                                lambda: self._load_block(block_id, block_x, block_y))
+
+    def _load_block(self, block_id: str, block_x: int, block_y: int) -> np.ndarray:
+        block = self._block_cache.get_value(block_id)
+        if block is not None:
+            return block
+        y0, y1 = self._block_offsets_y[block_y], self._block_offsets_y[block_y + 1]
+        x0, x1 = self._block_offsets_x[block_x], self._block_offsets_x[block_x + 1]
+        block = self._array[..., y0:y1, x0:x1]
+        block = np.asarray(block.values if hasattr(block, 'values') else block)
+        if block.nbytes <= self._block_cache.max_size:
+            self._block_cache.put_value(block_id, block)
+        return block
+
+
+def _normalize_block_sizes(chunks, size: int) -> Tuple[int, ...]:
+    if isinstance(chunks, (int, np.integer)):
+        chunk_size = max(1, int(chunks))
+        return tuple(min(chunk_size, size - offset) for offset in range(0, size, chunk_size))
+    return tuple(int(c) for c in chunks)
+
+
+def _get_block_step_range(block_start: int, block_end: int, start: int, step: int, out_size: int):
+    """
+    Get the range ``k_min:k_max`` of output indices, whose source indices ``start + k * step``
+    are within the block, and the index within the block that corresponds to ``k_min``.
+    """
+    k_min = max(0, -((start - block_start) // step))
+    k_max = min(out_size, -((start - block_end) // step))
+    return k_min, k_max, start + k_min * step - block_start
+
+
 class FastNdarrayDownsamplingImage(OpImage):
     """
     A tiled image created from down-sampling a numpy ndarray-like array.
@@ -616,6 +947,8 @@ class FastNdarrayDownsamplingImage(OpImage):
     :param step_exp: used to compute the step size / image resolution reduction factor: ``step_size = 2 ** step_exp``
     :param image_id: optional unique image identifier
     :param tile_cache: an optional tile cache
+    :param block_reader: an optional block reader for *array*. If given, tiles are assembled from
+           cached array chunks instead of being read from the array directly.
     """
 
     def __init__(self,
@@ -623,7 +956,8 @@ class FastNdarrayDownsamplingImage(OpImage):
                  tile_size: Size2D,
                  step_exp: int,
                  image_id: str = None,
-                 tile_cache: Cache = None):
+                 tile_cache: Cache = None,
+                 block_reader: ArrayBlockReader = None):
         step_size = 1 << step_exp
         source_width, source_height = array.shape[-1], array.shape[-2]
         width, height = source_width // step_size, source_height // step_size
@@ -638,6 +972,7 @@ class FastNdarrayDownsamplingImage(OpImage):
                          tile_cache=tile_cache)
         self._array = array
         self._step_size = step_size
+        self._block_reader = block_reader
 
     def compute_tile(self, tile_x: int, tile_y: int, rectangle: Rectangle2D) -> Tile:
         x, y, w, h = rectangle
@@ -647,6 +982,10 @@ class FastNdarrayDownsamplingImage(OpImage):
         w *= s
         h *= s
 
+        if self._block_reader is not None:
+            tile = self._block_reader.read_window(x, y, w, h, s)
+            return self.pad_tile(tile, self.tile_size)
+
         # For performance, we first read the non-resampled tile data.
         # We could use slices with 'zoom' as step size, but this is incredibly slow when using xarray with dask!
         # 0.4 vs. 0.025 secs for 220x220 pixel tiles for chunked, compressed SST data.
@@ -734,6 +1073,8 @@ class ImagePyramid:
                           array: Union[np.ndarray, DataArray],
                           tiling_scheme: TilingScheme,
                           level_image_id_factory: LevelImageIdFactory = None,
+                          block_cache: Cache = None,
+                          block_id: str = None,
                           **kwargs) -> 'ImagePyramid':
 
         """
@@ -746,10 +1087,16 @@ class ImagePyramid:
                       array[..., y::step, x:step]
         :param tiling_scheme:the tiling scheme
         :param level_image_id_factory: a factory function for unique image identifiers
+        :param block_cache: optional cache for the chunks of a chunked *array*. If given, the tiles of all
+               levels are assembled from chunks read only once, see :py:class:`ArrayBlockReader`.
+        :param block_id: optional unique identifier used for the chunks of *array* in *block_cache*
         :param kwargs: keyword arguments passed to FastNdarrayDownsamplingImage constructor
         :return: a new ImagePyramid instance
         """
         tile_size = tiling_scheme.tile_size
+        block_reader = ArrayBlockReader.from_array(array, block_cache, array_id=block_id, tile_size=tile_size)
+        if block_reader is not None:
+            kwargs = dict(kwargs, block_reader=block_reader)
         num_levels = tiling_scheme.num_levels
         level_images: List[Optional[TiledImage]] = [None] * num_levels
         z_index_max = num_levels - 1
@@ -804,6 +1151,107 @@ class ImagePyramid:
                              for level in range(len(level_images))])
 
 
+class PyramidPrefetcher:
+    """
+    Computes the tiles of the lowest resolution levels of an image pyramid in the background, so that
+    they can be restored from the tile caches of the level images when they are requested later.
+
+    Tiles are submitted to an executor level by level, starting at level zero. Prefetching stops when the
+    maximum number of bytes has been computed, when the maximum duration has elapsed, or when it is cancelled.
+    If the executor has a ``submit_with_priority(priority, fn, *args)`` method, tiles of level *z_index*
+    are submitted with priority ``priority + z_index``.
+
+    :param pyramid: the image pyramid
+    :param max_z_index: the highest level to be prefetched
+    :param max_num_bytes: optional maximum number of bytes of all prefetched tiles
+    :param max_duration: optional maximum duration in seconds
+    """
+
+    def __init__(self,
+                 pyramid: 'ImagePyramid',
+                 max_z_index: int,
+                 max_num_bytes: int = None,
+                 max_duration: float = None):
+        self._pyramid = pyramid
+        self._max_z_index = min(max_z_index, pyramid.num_levels - 1)
+        self._max_num_bytes = max_num_bytes
+        self._max_duration = max_duration
+        self._start_time = None
+        self._num_tiles = 0
+        self._num_bytes = 0
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    @property
+    def num_tiles(self) -> int:
+        """The number of tiles prefetched so far."""
+        return self._num_tiles
+
+    @property
+    def num_bytes(self) -> int:
+        """The number of bytes prefetched so far."""
+        return self._num_bytes
+
+    @property
+    def is_exhausted(self) -> bool:
+        """Whether prefetching has been cancelled or its byte or time budget is exhausted."""
+        if self._cancelled:
+            return True
+        if self._max_num_bytes is not None and self._num_bytes >= self._max_num_bytes:
+            return True
+        if self._max_duration is not None and self._start_time is not None \
+                and time.perf_counter() - self._start_time >= self._max_duration:
+            return True
+        return False
+
+    def start(self, executor, priority: int = 0) -> List[Any]:
+        """
+        Submit the tiles to be prefetched to the given executor.
+
+        :param executor: a ``concurrent.futures.Executor``
+        :param priority: the priority of level zero tiles, if the executor supports priorities
+        :return: the list of futures
+        """
+        self._start_time = time.perf_counter()
+        submit_with_priority = getattr(executor, 'submit_with_priority', None)
+        futures = []
+        for z_index in range(self._max_z_index + 1):
+            num_tiles_x, num_tiles_y = self._pyramid.get_level_image(z_index).num_tiles
+            for tile_y in range(num_tiles_y):
+                for tile_x in range(num_tiles_x):
+                    if submit_with_priority is not None:
+                        future = submit_with_priority(priority + z_index, self._prefetch_tile, tile_x, tile_y, z_index)
+                    else:
+                        future = executor.submit(self._prefetch_tile, tile_x, tile_y, z_index)
+                    futures.append(future)
+        return futures
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def _prefetch_tile(self, tile_x: int, tile_y: int, z_index: int) -> None:
+        if self.is_exhausted:
+            return
+        tile = self._pyramid.get_tile(tile_x, tile_y, z_index)
+        with self._lock:
+            self._num_tiles += 1
+            self._num_bytes += _get_tile_num_bytes(tile)
+
+
+def _get_tile_num_bytes(tile: Tile) -> int:
+    if tile is None:
+        return 0
+    if isinstance(tile, (bytes, bytearray)):
+        return len(tile)
+    if hasattr(tile, 'nbytes'):
+        return tile.nbytes
+    if hasattr(tile, 'size') and hasattr(tile, 'mode'):
+        # A PIL Image instance
+        w, h = tile.size
+        return w * h * len(tile.getbands())
+    return 0
+
+
 # noinspection PyUnusedLocal
 def create_pil_downsampling_image(source_image: TiledImage,
                                   higher_level_image: TiledImage,
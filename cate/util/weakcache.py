@@ -0,0 +1,120 @@
+# The MIT License (MIT)
+# Copyright (c) 2021 by the ESA CCI Toolbox development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Description
+===========
+
+Provides a cache for values derived from objects, e.g. spatial indexes of data frames, that are kept
+for as long as these objects are alive.
+
+Components
+==========
+"""
+
+import threading
+import weakref
+from typing import Any, Callable, Optional
+
+from .undefined import UNDEFINED
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+
+class WeakIdentityCache:
+    """
+    A thread-safe cache that maps objects to values derived from them.
+
+    A value is kept for as long as its object is alive. Other than for a ``weakref.WeakKeyDictionary``,
+    objects are compared by identity, so that unhashable objects such as datasets and data frames can be used.
+    """
+
+    def __init__(self):
+        # Maps id() of an object to a weak reference to it and its value
+        self._entries = dict()
+        # Reentrant, because weak reference callbacks may run while the lock is held
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, obj: Any, default: Any = None) -> Any:
+        """
+        Get the value for the given object.
+
+        :param obj: The object.
+        :param default: Value returned, if there is no value for *obj*.
+        :return: The value or *default*.
+        """
+        with self._lock:
+            entry = self._entries.get(id(obj))
+            if entry is not None and entry[0]() is obj:
+                return entry[1]
+            return default
+
+    def get_or_create(self,
+                      obj: Any,
+                      create_value: Callable[[], Any],
+                      is_valid: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Get the value for the given object, or create it, if there is no value yet or if it is no longer valid.
+
+        The value is created without holding the cache's lock, so that other objects are not blocked meanwhile.
+        If another thread has set a valid value meanwhile, that value is returned.
+        Values of objects that cannot be weakly referenced are not cached.
+
+        :param obj: The object.
+        :param create_value: A function that creates the value.
+        :param is_valid: An optional function that tests whether a cached value is still valid for *obj*.
+        :return: The value.
+        """
+        value = self.get(obj, UNDEFINED)
+        if value is not UNDEFINED and (is_valid is None or is_valid(value)):
+            return value
+
+        new_value = create_value()
+        key = id(obj)
+        try:
+            obj_ref = weakref.ref(obj, lambda ref: self._remove_entry(key, ref))
+        except TypeError:
+            return new_value
+        with self._lock:
+            value = self.get(obj, UNDEFINED)
+            if value is not UNDEFINED and (is_valid is None or is_valid(value)):
+                return value
+            self._entries[key] = obj_ref, new_value
+        return new_value
+
+    def remove(self, obj: Any) -> None:
+        """Remove the value for the given object, if any."""
+        with self._lock:
+            entry = self._entries.get(id(obj))
+            if entry is not None and entry[0]() is obj:
+                del self._entries[id(obj)]
+
+    def _remove_entry(self, key: int, obj_ref: weakref.ref) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            # The id() may have been reused by a new object meanwhile
+            if entry is not None and entry[0] is obj_ref:
+                del self._entries[key]
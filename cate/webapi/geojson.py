@@ -38,16 +38,19 @@ Type Name         | Coordinates
 
 """
 
-import heapq
 import json
 import logging
-from typing import Tuple, List, Callable, Union, Dict, Iterable
+import threading
+from io import BytesIO
+from typing import Any, Tuple, List, Callable, Optional, Union, Dict, Iterable
 
 import fiona
 import numba
 import numpy as np
 import pyproj
 
+from ..util.weakcache import WeakIdentityCache
+
 __author__ = "Norman Fomferra (Brockmann Consult GmbH)"
 
 Point = Tuple[float, float]
@@ -65,6 +68,9 @@ Feature = Dict
 
 _LOG = logging.getLogger('cate')
 
+#: Maximum number of features per record batch of an Arrow IPC stream
+ARROW_BATCH_SIZE = 10000
+
 
 # noinspection PyUnusedLocal conservation_ratio
 def _transform_point(source_prj: pyproj.Proj, target_prj: pyproj.Proj,
@@ -276,18 +282,7 @@ def write_feature_collection(feature_collection: Union[fiona.Collection, Iterabl
             if num_features_written > 0:
                 io.write(',\n')
                 io.flush()
-            # fiona >=1.9 returns features of type fiona.model.Feature
-            # rather than JSON-serializable dictionaries.
-            if hasattr(feature, '__geo_interface__'):
-                # We fall back on the traditional geo-interface:
-                feature = feature.__geo_interface__
-                # Fiona =1.9.0 adds empty "geometries" field
-                # to any "geometry", we fix this too:
-                geometry = feature.get('geometry')
-                if geometry \
-                        and "geometries" in geometry \
-                        and geometry.get("type") != "GeometryCollection":
-                    del geometry["geometries"]
+            feature = _to_feature_dict(feature)
             if res_id is not None:
                 feature['_resId'] = res_id
             feature['_idx'] = feature_index
@@ -407,7 +402,6 @@ def triangle_area(x_data: np.ndarray, y_data: np.ndarray, i0: int, i1: int, i2:
     return 0.5 * abs(dx1 * dy2 - dy1 * dx2)
 
 
-@numba.jit(forceobj=True)
 def simplify_geometry(x_data: np.ndarray, y_data: np.ndarray, conservation_ratio: float) \
         -> Tuple[np.ndarray, np.ndarray]:
     """
@@ -430,116 +424,505 @@ def simplify_geometry(x_data: np.ndarray, y_data: np.ndarray, conservation_ratio
     if old_point_count <= new_point_count:
         return x_data, y_data
 
-    point_heap = PointHeap(x_data, y_data)
-    while point_heap.size > new_point_count:
-        point_heap.pop()
-
-    new_x_data = np.zeros(new_point_count, dtype=x_data.dtype)
-    new_y_data = np.zeros(new_point_count, dtype=y_data.dtype)
-    point = point_heap.first_point
-    i = 0
-    while point is not None:
-        index = point[1]
-        new_x_data[i] = x_data[index]
-        new_y_data[i] = y_data[index]
-        point = point[3]
-        i += 1
-
-    return new_x_data, new_y_data
-
-
-# TODO (forman): Optimize me!
-# This is an non-optimised version of PointHeap for testing only.
-# It uses the pure Python heapq implementation of a min-heap.
-# We should ASAP replace heapq by the jit-compiled cate.webapi.minheap implementation
-# so that we can compile the PointHeap class using @numba.jitclass().
-# See http://numba.pydata.org/numba-doc/dev/user/jitclass.html
-
-# PointHeapSpec = [
-#     ('_x_data', np.float64[:]),
-#     ('_y_data', np.float64[:]),
-#     ('_point_heap', np.int64[:]),
-#     ('_size', np.int64),
-# ]
-# @numba.jitclass(PointHeapSpec)
-class PointHeap:
-    def __init__(self, x_data: np.ndarray, y_data: np.ndarray):
-        size = x_data.size
-        if size < 2:
-            raise ValueError('x_data.size must be greater than 2')
-        if size != y_data.size:
-            raise ValueError('x_data.size must be equal to y_data.size')
-        self._x_data = x_data
-        self._y_data = y_data
-        self._point_heap = []
-        self._size = size
-
-        first_point = None
-        prev_point = None
-        for i in range(size):
-            curr_point = [-1.0, i, prev_point, None]
-            if prev_point is None:
-                first_point = curr_point
+    ranks = get_simplification_ranks(x_data, y_data)
+    keep = ranks >= old_point_count - new_point_count
+    return x_data[keep], y_data[keep]
+
+
+def get_simplification_ranks(x_data: np.ndarray, y_data: np.ndarray, ring_sizes: np.ndarray = None) -> np.ndarray:
+    """
+    Compute the order in which the points of rings or line-strings are removed by :py:func:`simplify_geometry`.
+
+    Inner points are removed by increasing area of the triangle they form with their neighbours,
+    points with equal areas by increasing index. The first and last point of a ring or
+    line-string are never removed.
+    Keeping the points whose rank is greater than or equal to ``n - m`` therefore simplifies
+    a ring or line-string from ``n`` to ``m`` points.
+
+    :param x_data: The x coordinates of all rings or line-strings.
+    :param y_data: The y coordinates of all rings or line-strings.
+    :param ring_sizes: The number of points of each ring or line-string stored consecutively in
+        *x_data* and *y_data*. Defaults to a single ring or line-string.
+    :return: The rank of each point within its ring or line-string. First and last points have
+        the rank ``n``, where ``n`` is the size of their ring or line-string.
+    """
+    x_data = np.asarray(x_data)
+    y_data = np.asarray(y_data)
+    num_points = x_data.size
+    if ring_sizes is None:
+        ring_sizes = np.array([num_points], dtype=np.int64)
+    ring_sizes = np.asarray(ring_sizes, dtype=np.int64)
+    ring_ids = np.repeat(np.arange(ring_sizes.size), ring_sizes)
+    ring_starts = np.cumsum(ring_sizes) - ring_sizes
+    point_sizes = np.repeat(ring_sizes, ring_sizes)
+    local_indexes = np.arange(num_points) - np.repeat(ring_starts, ring_sizes)
+
+    ranks = point_sizes.copy()
+    inner = np.nonzero((local_indexes > 0) & (local_indexes < point_sizes - 1))[0]
+    if inner.size == 0:
+        return ranks
+
+    x0 = x_data[inner]
+    y0 = y_data[inner]
+    dx1 = x_data[inner - 1] - x0
+    dy1 = y_data[inner - 1] - y0
+    dx2 = x_data[inner + 1] - x0
+    dy2 = y_data[inner + 1] - y0
+    areas = 0.5 * np.abs(dx1 * dy2 - dy1 * dx2)
+
+    order = inner[np.lexsort((local_indexes[inner], areas, ring_ids[inner]))]
+    inner_sizes = np.maximum(ring_sizes - 2, 0)
+    inner_starts = np.cumsum(inner_sizes) - inner_sizes
+    ranks[order] = np.arange(order.size) - np.repeat(inner_starts, inner_sizes)
+    return ranks
+
+
+def _get_transformer(crs) -> Optional[pyproj.Transformer]:
+    """
+    Get a cached transformer from *crs* into EPSG:4326 longitudes and latitudes,
+    or None if no transformation is required.
+    """
+    if not crs:
+        return None
+    source_crs = pyproj.CRS.from_user_input(crs)
+    key = source_crs.to_wkt()
+    with _TRANSFORMERS_LOCK:
+        if key not in _TRANSFORMERS:
+            target_crs = pyproj.CRS.from_epsg(4326)
+            if source_crs == target_crs:
+                _TRANSFORMERS[key] = None
             else:
-                prev_point[3] = curr_point
-            if 0 < i < size - 1:
-                curr_point[0] = triangle_area(x_data, y_data, i, i - 1, i + 1)
-                self._push(curr_point)
-            prev_point = curr_point
+                _TRANSFORMERS[key] = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+        return _TRANSFORMERS[key]
 
-        # Must store _first_point, so we can later loop through connected points
-        self._first_point = first_point
-        # _counter is used to generate unique indexes, which don't occur in valid points
-        self._counter = size
 
-    @property
-    def size(self):
-        return self._size
+_TRANSFORMERS: Dict[str, Optional[pyproj.Transformer]] = {}
+_TRANSFORMERS_LOCK = threading.Lock()
+
+
+def _flatten_coordinates(type_name: str, coordinates: Geometry) -> Tuple[List, Tuple[int, ...]]:
+    """
+    Get the rings or line-strings of the given geometry coordinates and the number of
+    rings of each of its parts.
+    """
+    if type_name == 'Point':
+        return [[coordinates]], (1,)
+    if type_name in ('LineString', 'MultiPoint'):
+        return [coordinates], (1,)
+    if type_name in ('Polygon', 'MultiLineString'):
+        return list(coordinates), (len(coordinates),)
+    # MultiPolygon
+    return [ring for polygon in coordinates for ring in polygon], tuple(len(polygon) for polygon in coordinates)
+
+
+def _unflatten_coordinates(type_name: str, rings: List[List[Point]], part_sizes: Tuple[int, ...]) -> Geometry:
+    if type_name == 'Point':
+        return rings[0][0]
+    if type_name in ('LineString', 'MultiPoint'):
+        return rings[0]
+    if type_name in ('Polygon', 'MultiLineString'):
+        return rings
+    # MultiPolygon
+    multi_polygon = []
+    ring_index = 0
+    for part_size in part_sizes:
+        multi_polygon.append(rings[ring_index: ring_index + part_size])
+        ring_index += part_size
+    return multi_polygon
+
+
+def _to_feature_dict(feature) -> Feature:
+    # fiona >=1.9 returns features of type fiona.model.Feature
+    # rather than JSON-serializable dictionaries.
+    if hasattr(feature, '__geo_interface__'):
+        # We fall back on the traditional geo-interface:
+        feature = feature.__geo_interface__
+        # Fiona =1.9.0 adds empty "geometries" field
+        # to any "geometry", we fix this too:
+        geometry = feature.get('geometry')
+        if geometry \
+                and "geometries" in geometry \
+                and geometry.get("type") != "GeometryCollection":
+            del geometry["geometries"]
+    return feature
+
+
+class FeatureLevelStore:
+    """
+    A level-of-detail store for the features of a feature collection.
+
+    The geometry coordinates of all features are kept in flat, columnar arrays together with
+    the rank of each point in the simplification order of :py:func:`simplify_geometry`,
+    so that the features can be written for any *conservation_ratio* by masking the points
+    with a rank threshold instead of simplifying every geometry again.
+    Geometries are reprojected into EPSG:4326 once, when the store is created.
+
+    Use :py:func:`get_feature_level_store` to obtain a cached instance.
+
+    :param features: The features.
+    :param crs: The coordinate reference system of the features' geometries.
+    """
+
+    def __init__(self, features: Iterable[Feature], crs=None):
+        self._features = []
+        # Per feature: (type name, first ring, last ring + 1, ring counts of parts) or None
+        self._geometries = []
+        self._num_points = []
+        ring_x = []
+        ring_y = []
+        for feature in features:
+            feature = dict(_to_feature_dict(feature))
+            geometry = feature.get('geometry')
+            type_name = geometry.get('type') if geometry else None
+            entry = None
+            if get_geometry_transform(type_name) is not None:
+                # noinspection PyBroadException
+                try:
+                    rings, part_sizes = _flatten_coordinates(type_name, geometry['coordinates'])
+                    xs = []
+                    ys = []
+                    for ring in rings:
+                        ring = np.array(ring, dtype=np.float64).reshape((len(ring), -1))
+                        xs.append(ring[:, 0])
+                        ys.append(ring[:, 1])
+                    entry = type_name, len(ring_x), len(ring_x) + len(rings), part_sizes
+                    ring_x.extend(xs)
+                    ring_y.extend(ys)
+                    self._num_points.append(sum(x.size for x in xs))
+                    feature['geometry'] = {k: v for k, v in geometry.items() if k != 'coordinates'}
+                except Exception:
+                    _LOG.exception('transforming feature geometry failed: %s' % type_name)
+                    feature = None
+            if entry is None:
+                self._num_points.append(0)
+            self._features.append(feature)
+            self._geometries.append(entry)
+
+        ring_sizes = np.array([x.size for x in ring_x], dtype=np.int64)
+        x = np.concatenate(ring_x) if ring_x else np.zeros(0, dtype=np.float64)
+        y = np.concatenate(ring_y) if ring_y else np.zeros(0, dtype=np.float64)
+        ring_ends = np.cumsum(ring_sizes)
+        ring_starts = ring_ends - ring_sizes
+        non_empty = ring_sizes > 0
+        is_ring = np.zeros(ring_sizes.size, dtype=np.bool_)
+        is_ring[non_empty] = ((x[ring_starts[non_empty]] == x[ring_ends[non_empty] - 1])
+                              & (y[ring_starts[non_empty]] == y[ring_ends[non_empty] - 1]))
+
+        # Points representing the features, computed in the source CRS like pointify_geometry() does
+        center_x = np.zeros(len(self._geometries), dtype=np.float64)
+        center_y = np.zeros(len(self._geometries), dtype=np.float64)
+        px, py = np.zeros(1, dtype=np.float64), np.zeros(1, dtype=np.float64)
+        for i, entry in enumerate(self._geometries):
+            if entry is None:
+                continue
+            type_name, ring_0, ring_1, _ = entry
+            i0 = ring_starts[ring_0] if ring_0 < ring_1 else 0
+            i1 = ring_ends[ring_1 - 1] if ring_0 < ring_1 else 0
+            if i1 <= i0:
+                _LOG.error('transforming feature geometry failed: %s has no coordinates' % type_name)
+                self._features[i] = None
+                self._geometries[i] = None
+                continue
+            pointify_geometry(x[i0:i1], y[i0:i1], px, py)
+            center_x[i] = px[0]
+            center_y[i] = py[0]
+
+        self._ranks = get_simplification_ranks(x, y, ring_sizes)
+        self._ring_sizes = ring_sizes
+        self._ring_starts = ring_starts
+        self._ring_ends = ring_ends
+        self._is_ring = is_ring
+
+        transformer = _get_transformer(crs)
+        if transformer is not None:
+            x, y = transformer.transform(x, y)
+            center_x, center_y = transformer.transform(center_x, center_y)
+        self._x = np.asarray(x, dtype=np.float64)
+        self._y = np.asarray(y, dtype=np.float64)
+        self._center_x = np.asarray(center_x, dtype=np.float64)
+        self._center_y = np.asarray(center_y, dtype=np.float64)
+        self._levels = {}
+        self._property_columns = None
 
     @property
-    def first_point(self):
-        return self._first_point
-
-    def pop(self):
-        """Remove and return the smallest-area point. Raise KeyError if empty."""
-        while self._point_heap:
-            point = heapq.heappop(self._point_heap)
-            prev_point = point[2]
-            next_point = point[3]
-            has_prev_point = prev_point is not None
-            has_next_point = next_point is not None
-            if has_prev_point or has_next_point:  # Not yet removed?
-                if has_prev_point:
-                    prev_point = self._update_point(prev_point)
-                if has_next_point:
-                    next_point = self._update_point(next_point)
-                if has_prev_point and has_next_point:
-                    prev_point[3] = next_point
-                    next_point[2] = prev_point
-                self._size -= 1
-                return point
-        raise KeyError('pop from an empty priority queue')
-
-    def _push(self, point):
-        heapq.heappush(self._point_heap, point)
-
-    def _update_point(self, point):
-        prev_point = point[2]
-        next_point = point[3]
-        if prev_point is not None and next_point is not None:
-            index = point[1]
-            self._counter += 1  # Generate a unique, invalid index
-            point[1] = self._counter
-            point[2] = point[3] = None  # Mark point as removed / invalid
-            area = triangle_area(self._x_data, self._y_data, index, prev_point[1], next_point[1])
-            new_point = [area, index, prev_point, next_point]
-            if prev_point is not None:
-                prev_point[3] = new_point
-            if next_point is not None:
-                next_point[2] = new_point
-            self._push(new_point)
-            return new_point
-        return point
+    def num_features(self) -> int:
+        """The number of features."""
+        return len(self._features)
+
+    def write_feature_collection(self,
+                                 io,
+                                 res_id: int = None,
+                                 max_num_display_geometries: int = -1,
+                                 max_num_display_geometry_points: int = -1,
+                                 conservation_ratio: float = 1.0) -> int:
+        """
+        Write the features as GeoJSON feature collection. Works like :py:func:`write_feature_collection`.
+
+        :return: The number of features written.
+        """
+        num_features = self.num_features
+        if num_features and 0 <= max_num_display_geometries < num_features:
+            conservation_ratio = 0.0
+
+        x, y, starts, ends = self._get_level(conservation_ratio)
+
+        io.write('{"type": "FeatureCollection", "features": [\n')
+        io.flush()
+
+        num_features_written = 0
+        for feature_index in range(num_features):
+            feature = self._features[feature_index]
+            if feature is None:
+                continue
+            feature = dict(feature)
+            entry = self._geometries[feature_index]
+            if entry is not None:
+                type_name, ring_0, ring_1, part_sizes = entry
+                geometry_conservation_ratio = conservation_ratio
+                if conservation_ratio > 0.0 \
+                        and 0 <= max_num_display_geometry_points < self._num_points[feature_index]:
+                    geometry_conservation_ratio = 0.0
+                geometry = dict(feature['geometry'])
+                if geometry_conservation_ratio == 0.0:
+                    geometry['type'] = 'Point'
+                    geometry['coordinates'] = (float(self._center_x[feature_index]),
+                                               float(self._center_y[feature_index]))
+                else:
+                    rings = []
+                    for ring_index in range(ring_0, ring_1):
+                        i0 = starts[ring_index]
+                        i1 = ends[ring_index]
+                        rings.append(list(zip(x[i0:i1].tolist(), y[i0:i1].tolist())))
+                    geometry['coordinates'] = _unflatten_coordinates(type_name, rings, part_sizes)
+                feature['geometry'] = geometry
+                if geometry_conservation_ratio < 1.0:
+                    # We may mask other simplifications,
+                    # for time being (simp & 0x01) != 0 means, geometry is simplified
+                    feature['_simp'] = 0x01
+
+            if num_features_written > 0:
+                io.write(',\n')
+                io.flush()
+            if res_id is not None:
+                feature['_resId'] = res_id
+            feature['_idx'] = feature_index
+            if 'id' not in feature:
+                feature['id'] = feature_index
+            # Note: io.write(json.dumps(feature)) is 3x faster than json.dump(feature, fp=io)
+            json_text = json.dumps(feature)
+            io.write(json_text)
+            num_features_written += 1
+
+        io.write('\n]}\n')
+        io.flush()
+
+        return num_features_written
+
+    def write_arrow_feature_collection(self,
+                                       io,
+                                       res_id: int = None,
+                                       max_num_display_geometries: int = -1,
+                                       max_num_display_geometry_points: int = -1,
+                                       conservation_ratio: float = 1.0,
+                                       batch_size: int = ARROW_BATCH_SIZE) -> int:
+        """
+        Write the features as Apache Arrow IPC stream, a columnar binary alternative to
+        :py:meth:`write_feature_collection` that is simplified the same way.
+
+        The stream comprises record batches of at most *batch_size* features with the columns
+
+        * ``_idx`` - the feature index;
+        * ``_geometry_type`` - the GeoJSON geometry type, "Point" for geometries represented by a point;
+        * ``_geometry`` - the coordinates as list of parts, each a list of rings or line-strings,
+          each a list of (x, y) pairs. A Polygon has a single part, a LineString a single part
+          with a single line-string, a Point a single part with a single ring of one point;
+        * ``_simp`` - 1, if the geometry has been simplified, else 0;
+
+        followed by one column per feature property. If given, *res_id* is stored in
+        the schema metadata.
+
+        :return: The number of features written.
+        """
+        import pyarrow as pa
+
+        num_features = self.num_features
+        if num_features and 0 <= max_num_display_geometries < num_features:
+            conservation_ratio = 0.0
+
+        x, y, starts, ends = self._get_level(conservation_ratio)
+        xy = np.column_stack((x, y)).ravel()
+
+        valid_indexes, property_columns = self._get_property_columns()
+        geometry_types = []
+        simp_flags = []
+        coord_chunks = []
+        ring_sizes = []
+        part_sizes = []
+        feature_sizes = []
+        for feature_index in valid_indexes:
+            entry = self._geometries[feature_index]
+            if entry is None:
+                geometry_types.append(None)
+                simp_flags.append(0)
+                feature_sizes.append(0)
+                continue
+            type_name, ring_0, ring_1, feature_part_sizes = entry
+            geometry_conservation_ratio = conservation_ratio
+            if conservation_ratio > 0.0 \
+                    and 0 <= max_num_display_geometry_points < self._num_points[feature_index]:
+                geometry_conservation_ratio = 0.0
+            if geometry_conservation_ratio == 0.0:
+                geometry_types.append('Point')
+                coord_chunks.append(np.array([self._center_x[feature_index], self._center_y[feature_index]]))
+                ring_sizes.append(1)
+                part_sizes.append(1)
+                feature_sizes.append(1)
+            else:
+                geometry_types.append(type_name)
+                coord_chunks.append(xy[2 * starts[ring_0]: 2 * ends[ring_1 - 1]])
+                ring_sizes.extend((ends[ring_0:ring_1] - starts[ring_0:ring_1]).tolist())
+                part_sizes.extend(feature_part_sizes)
+                feature_sizes.append(len(feature_part_sizes))
+            simp_flags.append(1 if geometry_conservation_ratio < 1.0 else 0)
+
+        coords = np.concatenate(coord_chunks) if coord_chunks else np.zeros(0, dtype=np.float64)
+        points = pa.FixedSizeListArray.from_arrays(pa.array(coords, type=pa.float64()), 2)
+        rings = pa.ListArray.from_arrays(_to_arrow_offsets(ring_sizes), points)
+        parts = pa.ListArray.from_arrays(_to_arrow_offsets(part_sizes), rings)
+        geometries = pa.ListArray.from_arrays(_to_arrow_offsets(feature_sizes), parts)
+
+        names = ['_idx', '_geometry_type', '_geometry', '_simp']
+        columns = [pa.array(valid_indexes, type=pa.int64()),
+                   pa.array(geometry_types, type=pa.string()),
+                   geometries,
+                   pa.array(simp_flags, type=pa.int8())]
+        for name, column in property_columns:
+            names.append(name)
+            columns.append(column)
+        table = pa.Table.from_arrays(columns, names=names)
+        if res_id is not None:
+            table = table.replace_schema_metadata({'res_id': str(res_id)})
+
+        write_arrow_table(table, io, batch_size=batch_size)
+        return len(valid_indexes)
+
+    def _get_property_columns(self) -> Tuple[List[int], List[Tuple[str, Any]]]:
+        """
+        Get the indexes of the features that can be written and Arrow arrays of their properties.
+        """
+        if self._property_columns is None:
+            import pyarrow as pa
+
+            valid_indexes = [i for i, feature in enumerate(self._features) if feature is not None]
+            properties = [self._features[i].get('properties') or {} for i in valid_indexes]
+            names = []
+            for feature_properties in properties:
+                for name in feature_properties.keys():
+                    if name not in names:
+                        names.append(name)
+            columns = []
+            for name in names:
+                values = [feature_properties.get(name) for feature_properties in properties]
+                try:
+                    column = pa.array(values, from_pandas=True)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                    column = pa.array([None if value is None else str(value) for value in values],
+                                      type=pa.string())
+                columns.append((name, column))
+            self._property_columns = valid_indexes, columns
+        return self._property_columns
+
+    def _get_level(self, conservation_ratio: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the coordinates of all rings simplified to the given *conservation_ratio*
+        and the start and end index of each ring.
+        """
+        if not 0.0 < conservation_ratio < 1.0:
+            return self._x, self._y, self._ring_starts, self._ring_ends
+        level = self._levels.get(conservation_ratio)
+        if level is None:
+            ring_sizes = self._ring_sizes
+            new_sizes = (conservation_ratio * ring_sizes + 0.5).astype(np.int64)
+            new_sizes = np.maximum(new_sizes, np.where(self._is_ring, 4, 2))
+            thresholds = np.maximum(ring_sizes - new_sizes, 0)
+            keep = self._ranks >= np.repeat(thresholds, ring_sizes)
+            offsets = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(keep)])
+            level = (self._x[keep], self._y[keep], offsets[self._ring_starts], offsets[self._ring_ends])
+            self._levels[conservation_ratio] = level
+        return level
+
+
+def write_arrow_table(table, io, batch_size: int = ARROW_BATCH_SIZE) -> None:
+    """
+    Write the given ``pyarrow.Table`` as Apache Arrow IPC stream to *io*.
+    Every record batch of at most *batch_size* rows is written and flushed separately,
+    so that clients can start decoding while the stream is being sent.
+
+    :param table: The table.
+    :param io: An object with ``write(bytes)`` and ``flush()`` methods, e.g. a request handler.
+    :param batch_size: Maximum number of rows per record batch.
+    """
+    import pyarrow as pa
+
+    buffer = BytesIO()
+
+    def _flush_buffer():
+        data = buffer.getvalue()
+        if data:
+            io.write(data)
+            io.flush()
+        buffer.seek(0)
+        buffer.truncate()
+
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=batch_size):
+            writer.write_batch(batch)
+            _flush_buffer()
+    _flush_buffer()
+
+
+def _to_arrow_offsets(sizes: List[int]):
+    import pyarrow as pa
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int32)
+    np.cumsum(sizes, out=offsets[1:])
+    return pa.array(offsets, type=pa.int32())
+
+
+# Maps file paths to the FeatureLevelStores of their features, kept for the lifetime of the process
+_FILE_FEATURE_LEVEL_STORES: Dict[str, FeatureLevelStore] = {}
+_FILE_FEATURE_LEVEL_STORES_LOCK = threading.Lock()
+
+# Maps objects, e.g. workspace resources, to the FeatureLevelStores of their features
+_OBJECT_FEATURE_LEVEL_STORES = WeakIdentityCache()
+
+
+def get_feature_level_store(source: Any,
+                            features: Callable[[], Iterable[Feature]],
+                            crs=None) -> FeatureLevelStore:
+    """
+    Get the cached level-of-detail store for the features of the given *source*,
+    or create it from the features returned by the *features* function.
+
+    If *source* is a string, e.g. a file path, the store is cached for the lifetime of the process,
+    otherwise for as long as the *source* object, e.g. a workspace resource, is alive.
+    Stores are created without holding a global lock, so that requests for other sources are not blocked.
+
+    :param source: The source of the features.
+    :param features: A function that returns the features of *source*.
+    :param crs: The coordinate reference system of the features' geometries.
+    :return: The level-of-detail store.
+    """
+    if not isinstance(source, str):
+        return _OBJECT_FEATURE_LEVEL_STORES.get_or_create(source, lambda: FeatureLevelStore(features(), crs=crs))
+
+    with _FILE_FEATURE_LEVEL_STORES_LOCK:
+        store = _FILE_FEATURE_LEVEL_STORES.get(source)
+    if store is not None:
+        return store
+    store = FeatureLevelStore(features(), crs=crs)
+    with _FILE_FEATURE_LEVEL_STORES_LOCK:
+        # Another request may have created a store for the same file meanwhile
+        return _FILE_FEATURE_LEVEL_STORES.setdefault(source, store)
 
 
 class SeriesJSONEncoder(json.JSONEncoder):
@@ -23,50 +23,69 @@ __author__ = "Norman Fomferra (Brockmann Consult GmbH), " \
              "Marco Zühlke (Brockmann Consult GmbH)" \
              "Helge Dzierzon (Brockmann Consult GmbH)"
 
+import collections
 import concurrent.futures
 import datetime
 import json
 import os
 import sys
 import tempfile
+import threading
 import time
 import zipfile
-from typing import Sequence, Any
+from typing import Sequence, Any, List, Tuple, Union
 
 import fiona
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import tornado.gen
 import tornado.web
 import xarray as xr
 from tornado import escape
 
-from .geojson import write_feature_collection, write_feature
+from .geojson import get_feature_level_store, write_feature, write_arrow_table
+from .varstats import get_variable_statistics
 from ..conf import get_config
 from ..conf.defaults import \
     WORKSPACE_CACHE_DIR_NAME, \
     WEBAPI_WORKSPACE_FILE_TILE_CACHE_CAPACITY, \
     WEBAPI_WORKSPACE_MEM_TILE_CACHE_CAPACITY, \
-    WEBAPI_USE_WORKSPACE_IMAGERY_CACHE
+    WEBAPI_WORKSPACE_MEM_BLOCK_CACHE_CAPACITY, \
+    WEBAPI_USE_WORKSPACE_IMAGERY_CACHE, \
+    WEBAPI_MAX_TILE_WORKERS, \
+    WEBAPI_TILE_PREFETCH_MAX_LEVEL, \
+    WEBAPI_TILE_PREFETCH_CAPACITY, \
+    WEBAPI_TILE_PREFETCH_TIMEOUT, \
+    WEBAPI_TILE_PNG_COMPRESS_LEVEL, \
+    WEBAPI_TILE_QUALITY
 from ..core.cdm import get_tiling_scheme
 from ..core.types import GeoDataFrame
+from ..core.workspace import Workspace
 from ..core.wsmanag import WorkspaceManager
-from ..util.cache import Cache, MemoryCacheStore, FileCacheStore
-from ..util.im import ImagePyramid, TransformArrayImage, ColorMappedRgbaImage
+from ..util.cache import MemoryCacheStore, FileCacheStore, ShardedCache
+from ..util.im import ImagePyramid, TransformArrayImage, ColorMappedRgbaImage, PyramidPrefetcher
 from ..util.im.ds import NaturalEarth2Image
 from ..util.misc import cwd
 from ..util.misc import is_debug_mode
 from ..util.monitor import Monitor, ConsoleMonitor
-from ..util.web.webapi import WebAPIRequestHandler
+from ..util.executor import PriorityThreadPoolExecutor
+from ..util.web.webapi import WebAPIRequestHandler, WebAPIRequestError
 from ..version import __version__
 
 # TODO (forman): We must keep a MemoryCacheStore Cache for each workspace.
 #                We can use the Workspace.user_data dict for this purpose.
 #                However, a global cache is fine as long as we have just one workspace open at a time.
 #
-MEM_TILE_CACHE = Cache(MemoryCacheStore(),
-                       capacity=WEBAPI_WORKSPACE_MEM_TILE_CACHE_CAPACITY,
-                       threshold=0.75)
+# The cache is sharded so that concurrent tile requests do not serialize on a single lock.
+MEM_TILE_CACHE = ShardedCache(MemoryCacheStore(),
+                              capacity=WEBAPI_WORKSPACE_MEM_TILE_CACHE_CAPACITY,
+                              threshold=0.75)
+
+# Decoded chunks of the displayed arrays, shared by all tiles and pyramid levels that overlap them.
+MEM_BLOCK_CACHE = ShardedCache(MemoryCacheStore(),
+                               capacity=WEBAPI_WORKSPACE_MEM_BLOCK_CACHE_CAPACITY,
+                               threshold=0.75)
 
 # Note, the following "get_config()" call in the code will make sure "~/.cate/<version>" is created
 USE_WORKSPACE_IMAGERY_CACHE = get_config().get('use_workspace_imagery_cache', WEBAPI_USE_WORKSPACE_IMAGERY_CACHE)
@@ -75,10 +94,43 @@ TRACE_PERF = is_debug_mode()
 
 THREAD_POOL = concurrent.futures.ThreadPoolExecutor()
 
+#: Bounded executor for image tiles, pending tiles with lower priority values are computed first
+TILE_THREAD_POOL = PriorityThreadPoolExecutor(max_workers=get_config().get('max_tile_workers',
+                                                                           WEBAPI_MAX_TILE_WORKERS),
+                                              thread_name_prefix='cate-tile')
+
+#: Highest pyramid level prefetched when a variable image is requested for the first time, -1 disables prefetching
+TILE_PREFETCH_MAX_LEVEL = get_config().get('tile_prefetch_max_level', WEBAPI_TILE_PREFETCH_MAX_LEVEL)
+#: Maximum number of bytes of the tiles prefetched per pyramid
+TILE_PREFETCH_CAPACITY = get_config().get('tile_prefetch_capacity', WEBAPI_TILE_PREFETCH_CAPACITY)
+#: Maximum time in seconds spent on prefetching the tiles of a pyramid
+TILE_PREFETCH_TIMEOUT = get_config().get('tile_prefetch_timeout', WEBAPI_TILE_PREFETCH_TIMEOUT)
+
+#: Supported tile formats: maps the "format" query argument to the PIL format name,
+#: the content type, and the PIL encoder options
+TILE_FORMATS = {
+    'png': ('PNG', 'image/png', dict(compress_level=get_config().get('tile_png_compress_level',
+                                                                     WEBAPI_TILE_PNG_COMPRESS_LEVEL))),
+    'webp': ('WEBP', 'image/webp', dict(quality=get_config().get('tile_quality', WEBAPI_TILE_QUALITY))),
+    # No alpha channel, use for opaque layers only
+    'jpeg': ('JPEG', 'image/jpeg', dict(quality=get_config().get('tile_quality', WEBAPI_TILE_QUALITY))),
+}
+
+#: Maximum number of variable image pyramids kept, least recently used pyramids are released first
+TILE_MAX_NUM_PYRAMIDS = 256
+
+# Prefetched tiles are computed after all tiles requested by clients with a non-negative priority
+_TILE_PREFETCH_PRIORITY = 1000
+
 _NUM_GEOM_SIMP_LEVELS = 8
 
 _MAX_CSV_ROW_COUNT = 10000
 
+# Number of rows formatted at once when streaming CSV
+_CSV_CHUNK_ROW_COUNT = 1000
+
+_ARROW_STREAM_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+
 # Explicitly load Cate-internal plugins.
 __import__('cate.ds')
 __import__('cate.ops')
@@ -108,16 +160,46 @@ class WorkspaceResourceHandler(WebAPIRequestHandler):
         return workspace, res_id, res_name, resource
 
 
+class _PyramidEntry:
+    """The image pyramid of a pyramid ID, the lock guarding its creation, and its prefetch state."""
+
+    __slots__ = ['lock', 'pyramid', 'is_requested', 'is_prefetched']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pyramid = None
+        self.is_requested = False
+        self.is_prefetched = False
+
+
 # noinspection PyAbstractClass,PyBroadException
 class ResVarTileHandler(WorkspaceResourceHandler):
-    PYRAMIDS = None
+    """
+    Provides the PNG tiles of a variable image pyramid.
+
+    Tiles are computed in the bounded :py:data:`TILE_THREAD_POOL` so that the IOLoop is never blocked.
+    Pending computations are cancelled if the client closes the connection. Clients may pass
+    a ``priority`` query argument, tiles with lower values are computed first, e.g. 0 for tiles
+    within the current viewport. The optional ``format`` query argument selects the image format,
+    see :py:data:`TILE_FORMATS`.
+
+    When a variable image is requested for the first time, the lowest resolution levels of its pyramid
+    and of the pyramids of the previous and next slices along the variable's first dimension
+    (usually time) are prefetched with a low priority, see :py:data:`TILE_PREFETCH_MAX_LEVEL`.
+    """
+    # Maps pyramid IDs to their _PyramidEntry in least recently used order, see TILE_MAX_NUM_PYRAMIDS
+    PYRAMIDS = collections.OrderedDict()
+    PYRAMIDS_LOCK = threading.Lock()
+
+    # noinspection PyAttributeOutsideInit
+    def initialize(self):
+        self._tile_future = None
 
+    @tornado.gen.coroutine
     def get(self, base_dir, res_id, z, y, x):
         try:
             workspace, res_id, res_name, dataset = self.get_workspace_resource(base_dir, res_id)
 
-            # GLOBAL_LOCK.acquire()
-
             if not isinstance(dataset, xr.Dataset):
                 self.write_status_error(message='Resource "%s" must be a Dataset' % res_name)
                 self.finish()
@@ -128,119 +210,215 @@ class ResVarTileHandler(WorkspaceResourceHandler):
             cmap_name = self.get_query_argument('cmap', default='jet')
             cmap_min = self.get_query_argument_float('min', default=float('nan'))
             cmap_max = self.get_query_argument_float('max', default=float('nan'))
+            tile_format = self.get_query_argument('format', default='png').lower()
+            priority = self.get_query_argument_int('priority', default=0)
+            if tile_format not in TILE_FORMATS:
+                raise WebAPIRequestError('format must be one of %s, but was "%s"'
+                                         % (', '.join(TILE_FORMATS.keys()), tile_format))
+
+            self._tile_future = TILE_THREAD_POOL.submit_with_priority(priority,
+                                                                      self._compute_tile,
+                                                                      base_dir, workspace, dataset, res_name,
+                                                                      var_name, var_index,
+                                                                      cmap_name, cmap_min, cmap_max,
+                                                                      tile_format,
+                                                                      int(x), int(y), int(z))
+            tile = yield self._tile_future
+            self._tile_future = None
+
+            self.set_header('Content-Type', TILE_FORMATS[tile_format][1])
+            self.write(tile)
+        except concurrent.futures.CancelledError:
+            # Client has closed the connection
+            pass
+        except WebAPIRequestError as error:
+            self.write_status_error(message=str(error))
+            self.finish()
+        except Exception:
+            self.write_status_error(exc_info=sys.exc_info())
+            self.finish()
 
-            if ResVarTileHandler.PYRAMIDS is None:
-                ResVarTileHandler.PYRAMIDS = dict()
-
-            array_id = '%s-%s-%s' % (res_name,
-                                     var_name,
-                                     ','.join(map(str, var_index)))
-            image_id = '%s-%s-%s-%s' % (array_id,
-                                        cmap_name,
-                                        cmap_min,
-                                        cmap_max)
-
-            pyramid_id = '%s-%s' % (base_dir, image_id)
-
-            if pyramid_id in ResVarTileHandler.PYRAMIDS:
-                pyramid = ResVarTileHandler.PYRAMIDS[pyramid_id]
+    def on_connection_close(self):
+        tile_future = self._tile_future
+        if tile_future is not None:
+            tile_future.cancel()
+        super().on_connection_close()
+
+    @classmethod
+    def _compute_tile(cls, base_dir, workspace, dataset, res_name, var_name, var_index, cmap_name, cmap_min, cmap_max,
+                      tile_format, x, y, z):
+        var_index = _get_image_var_index(dataset, var_name, var_index)
+        image_cmap_min, image_cmap_max = _get_cmap_range(workspace, res_name, var_name, var_index,
+                                                         cmap_min, cmap_max)
+
+        array_id = '%s-%s-%s' % (res_name,
+                                 var_name,
+                                 ','.join(map(str, var_index)))
+        image_id = '%s-%s-%s-%s-%s' % (array_id,
+                                       cmap_name,
+                                       image_cmap_min,
+                                       image_cmap_max,
+                                       tile_format)
+
+        pyramid_id = '%s-%s' % (base_dir, image_id)
+
+        pyramid_entry = cls._get_pyramid_entry(pyramid_id, base_dir, dataset, var_name, var_index,
+                                               cmap_name, image_cmap_min, image_cmap_max, tile_format,
+                                               array_id, image_id)
+        pyramid = pyramid_entry.pyramid
+
+        if TILE_PREFETCH_MAX_LEVEL >= 0:
+            with cls.PYRAMIDS_LOCK:
+                is_first_request = not pyramid_entry.is_requested
+                pyramid_entry.is_requested = True
+            if is_first_request:
+                cls._prefetch_pyramid(pyramid_id, pyramid_entry)
+                for neighbour_index in _get_neighbour_var_indexes(dataset[var_name], var_index):
+                    TILE_THREAD_POOL.submit_with_priority(_TILE_PREFETCH_PRIORITY,
+                                                          cls._prefetch_neighbour_pyramid,
+                                                          base_dir, workspace, dataset, res_name, var_name,
+                                                          neighbour_index, cmap_name, cmap_min, cmap_max, tile_format)
+
+        if TRACE_PERF:
+            print('PERF: >>> Tile:', image_id, z, y, x)
+
+        t1 = time.perf_counter()
+        tile = pyramid.get_tile(x, y, z)
+        t2 = time.perf_counter()
+
+        if TRACE_PERF:
+            print('PERF: <<< Tile:', image_id, z, y, x, 'took', t2 - t1, 'seconds')
+
+        return tile
+
+    @classmethod
+    def _get_pyramid_entry(cls, pyramid_id, base_dir, dataset, var_name, var_index, cmap_name, cmap_min, cmap_max,
+                           tile_format, array_id, image_id) -> '_PyramidEntry':
+        with cls.PYRAMIDS_LOCK:
+            pyramid_entry = cls.PYRAMIDS.get(pyramid_id)
+            if pyramid_entry is None:
+                pyramid_entry = _PyramidEntry()
+                cls.PYRAMIDS[pyramid_id] = pyramid_entry
+                while len(cls.PYRAMIDS) > TILE_MAX_NUM_PYRAMIDS:
+                    cls.PYRAMIDS.popitem(last=False)
             else:
-                variable = dataset[var_name]
-                no_data_value = variable.attrs.get('_FillValue')
-                valid_range = variable.attrs.get('valid_range')
-                if valid_range is None:
-                    valid_min = variable.attrs.get('valid_min')
-                    valid_max = variable.attrs.get('valid_max')
-                    if valid_min is not None and valid_max is not None:
-                        valid_range = [valid_min, valid_max]
-
-                # Make sure we work with 2D image arrays only
-                if variable.ndim == 2:
-                    array = variable
-                elif variable.ndim > 2:
-                    if not var_index or len(var_index) != variable.ndim - 2:
-                        var_index = (0,) * (variable.ndim - 2)
-
-                    # noinspection PyTypeChecker
-                    var_index += (slice(None), slice(None),)
-
-                    # print('var_index =', var_index)
-                    array = variable[var_index]
-                else:
-                    self.write_status_error(message='Variable must be an N-D Dataset with N >= 2, '
-                                                    'but "%s" is only %d-D' % (var_name, variable.ndim))
-                    self.finish()
-                    return
-
-                cmap_min = np.nanmin(array.values) if np.isnan(cmap_min) else cmap_min
-                cmap_max = np.nanmax(array.values) if np.isnan(cmap_max) else cmap_max
-                # print('cmap_min =', cmap_min)
-                # print('cmap_max =', cmap_max)
-
-                if USE_WORKSPACE_IMAGERY_CACHE:
-                    mem_tile_cache = MEM_TILE_CACHE
-                    rgb_tile_cache_dir = os.path.join(base_dir, WORKSPACE_CACHE_DIR_NAME, 'v%s' % __version__, 'tiles')
-                    rgb_tile_cache = Cache(FileCacheStore(rgb_tile_cache_dir, ".png"),
-                                           capacity=WEBAPI_WORKSPACE_FILE_TILE_CACHE_CAPACITY,
-                                           threshold=0.75)
-                else:
-                    mem_tile_cache = MEM_TILE_CACHE
-                    rgb_tile_cache = None
-
-                def array_image_id_factory(level):
-                    return 'arr-%s/%s' % (array_id, level)
-
-                tiling_scheme = get_tiling_scheme(variable)
-                if tiling_scheme is None:
-                    self.write_status_error(
-                        message='Internal error: failed to compute tiling scheme for array_id="%s"' % array_id)
-                    self.finish()
-                    return
-
-                # print('tiling_scheme =', repr(tiling_scheme))
-                pyramid = ImagePyramid.create_from_array(array, tiling_scheme,
-                                                         level_image_id_factory=array_image_id_factory)
-                pyramid = pyramid.apply(lambda image, level:
-                                        TransformArrayImage(image,
-                                                            image_id='tra-%s/%d' % (array_id, level),
-                                                            flip_y=tiling_scheme.geo_extent.inv_y,
-                                                            force_masked=True,
-                                                            no_data_value=no_data_value,
-                                                            valid_range=valid_range,
-                                                            tile_cache=mem_tile_cache))
-                pyramid = pyramid.apply(lambda image, level:
-                                        ColorMappedRgbaImage(image,
-                                                             image_id='rgb-%s/%d' % (image_id, level),
-                                                             value_range=(cmap_min, cmap_max),
-                                                             cmap_name=cmap_name,
-                                                             encode=True,
-                                                             format='PNG',
-                                                             tile_cache=rgb_tile_cache))
-                ResVarTileHandler.PYRAMIDS[pyramid_id] = pyramid
+                cls.PYRAMIDS.move_to_end(pyramid_id)
+
+        # Concurrent requests for a new pyramid must not compute it several times
+        with pyramid_entry.lock:
+            if pyramid_entry.pyramid is None:
+                pyramid = cls._create_pyramid(base_dir, dataset, var_name, var_index,
+                                              cmap_name, cmap_min, cmap_max, tile_format, array_id, image_id)
+                pyramid_entry.pyramid = pyramid
                 if TRACE_PERF:
                     print('Created pyramid "%s":' % pyramid_id)
                     print('  tile_size:', pyramid.tile_size)
                     print('  num_level_zero_tiles:', pyramid.num_level_zero_tiles)
                     print('  num_levels:', pyramid.num_levels)
+        return pyramid_entry
 
-            if TRACE_PERF:
-                print('PERF: >>> Tile:', image_id, z, y, x)
-
-            t1 = time.perf_counter()
-            tile = pyramid.get_tile(int(x), int(y), int(z))
-            t2 = time.perf_counter()
-
-            self.set_header('Content-Type', 'image/png')
-            self.write(tile)
-
-            if TRACE_PERF:
-                print('PERF: <<< Tile:', image_id, z, y, x, 'took', t2 - t1, 'seconds')
-
-            # GLOBAL_LOCK.release()
-
-        except Exception:
-            self.write_status_error(exc_info=sys.exc_info())
-            self.finish()
+    @classmethod
+    def _prefetch_pyramid(cls, pyramid_id, pyramid_entry: '_PyramidEntry'):
+        with cls.PYRAMIDS_LOCK:
+            if pyramid_entry.is_prefetched:
+                return
+            pyramid_entry.is_prefetched = True
+        prefetcher = PyramidPrefetcher(pyramid_entry.pyramid,
+                                       TILE_PREFETCH_MAX_LEVEL,
+                                       max_num_bytes=TILE_PREFETCH_CAPACITY,
+                                       max_duration=TILE_PREFETCH_TIMEOUT)
+        prefetcher.start(TILE_THREAD_POOL, priority=_TILE_PREFETCH_PRIORITY)
+        if TRACE_PERF:
+            print('Prefetching pyramid "%s" up to level %d' % (pyramid_id, TILE_PREFETCH_MAX_LEVEL))
+
+    @classmethod
+    def _prefetch_neighbour_pyramid(cls, base_dir, workspace, dataset, res_name, var_name, var_index,
+                                    cmap_name, cmap_min, cmap_max, tile_format):
+        cmap_min, cmap_max = _get_cmap_range(workspace, res_name, var_name, var_index, cmap_min, cmap_max)
+        array_id = '%s-%s-%s' % (res_name,
+                                 var_name,
+                                 ','.join(map(str, var_index)))
+        image_id = '%s-%s-%s-%s-%s' % (array_id,
+                                       cmap_name,
+                                       cmap_min,
+                                       cmap_max,
+                                       tile_format)
+        pyramid_id = '%s-%s' % (base_dir, image_id)
+        pyramid_entry = cls._get_pyramid_entry(pyramid_id, base_dir, dataset, var_name, var_index,
+                                               cmap_name, cmap_min, cmap_max, tile_format, array_id, image_id)
+        cls._prefetch_pyramid(pyramid_id, pyramid_entry)
+
+    @classmethod
+    def _create_pyramid(cls, base_dir, dataset, var_name, var_index, cmap_name, cmap_min, cmap_max,
+                        tile_format, array_id, image_id):
+        variable = dataset[var_name]
+        no_data_value = variable.attrs.get('_FillValue')
+        valid_range = variable.attrs.get('valid_range')
+        if valid_range is None:
+            valid_min = variable.attrs.get('valid_min')
+            valid_max = variable.attrs.get('valid_max')
+            if valid_min is not None and valid_max is not None:
+                valid_range = [valid_min, valid_max]
+
+        # Make sure we work with 2D image arrays only
+        if variable.ndim == 2:
+            array = variable
+        elif variable.ndim > 2:
+            if not var_index or len(var_index) != variable.ndim - 2:
+                var_index = (0,) * (variable.ndim - 2)
+
+            # noinspection PyTypeChecker
+            var_index += (slice(None), slice(None),)
+
+            # print('var_index =', var_index)
+            array = variable[var_index]
+        else:
+            raise WebAPIRequestError('Variable must be an N-D Dataset with N >= 2, '
+                                     'but "%s" is only %d-D' % (var_name, variable.ndim))
+
+        # print('cmap_min =', cmap_min)
+        # print('cmap_max =', cmap_max)
+
+        if USE_WORKSPACE_IMAGERY_CACHE:
+            mem_tile_cache = MEM_TILE_CACHE
+            rgb_tile_cache_dir = os.path.join(base_dir, WORKSPACE_CACHE_DIR_NAME, 'v%s' % __version__, 'tiles')
+            rgb_tile_cache = ShardedCache(FileCacheStore(rgb_tile_cache_dir, '.' + tile_format),
+                                          capacity=WEBAPI_WORKSPACE_FILE_TILE_CACHE_CAPACITY,
+                                          threshold=0.75)
+        else:
+            mem_tile_cache = MEM_TILE_CACHE
+            rgb_tile_cache = None
+
+        def array_image_id_factory(level):
+            return 'arr-%s/%s' % (array_id, level)
+
+        tiling_scheme = get_tiling_scheme(variable)
+        if tiling_scheme is None:
+            raise WebAPIRequestError('Internal error: failed to compute tiling scheme for array_id="%s"' % array_id)
+
+        # print('tiling_scheme =', repr(tiling_scheme))
+        pyramid = ImagePyramid.create_from_array(array, tiling_scheme,
+                                                 level_image_id_factory=array_image_id_factory,
+                                                 block_cache=MEM_BLOCK_CACHE,
+                                                 block_id='blk-%s' % array_id)
+        pyramid = pyramid.apply(lambda image, level:
+                                TransformArrayImage(image,
+                                                    image_id='tra-%s/%d' % (array_id, level),
+                                                    flip_y=tiling_scheme.geo_extent.inv_y,
+                                                    force_masked=True,
+                                                    no_data_value=no_data_value,
+                                                    valid_range=valid_range,
+                                                    tile_cache=mem_tile_cache))
+        pyramid = pyramid.apply(lambda image, level:
+                                ColorMappedRgbaImage(image,
+                                                     image_id='rgb-%s/%d' % (image_id, level),
+                                                     value_range=(cmap_min, cmap_max),
+                                                     cmap_name=cmap_name,
+                                                     encode=True,
+                                                     format=TILE_FORMATS[tile_format][0],
+                                                     encode_options=TILE_FORMATS[tile_format][2],
+                                                     tile_cache=rgb_tile_cache))
+        return pyramid
 
 
 # noinspection PyAbstractClass,PyBroadException
@@ -273,14 +451,12 @@ class GeoJSONHandler(WebAPIRequestHandler):
     def get(self):
         try:
             level = int(self.get_query_argument('level', default=str(_NUM_GEOM_SIMP_LEVELS)))
-            collection = fiona.open(self._shapefile_path)
             self.set_header('Content-Type', 'application/json')
 
             def job():
                 conservation_ratio = _level_to_conservation_ratio(level, _NUM_GEOM_SIMP_LEVELS)
-                write_feature_collection(collection, self,
-                                         num_features=len(collection),
-                                         conservation_ratio=conservation_ratio)
+                store = get_feature_level_store(self._shapefile_path, self._read_features)
+                store.write_feature_collection(self, conservation_ratio=conservation_ratio)
                 self.finish()
 
             yield [THREAD_POOL.submit(job)]
@@ -288,6 +464,10 @@ class GeoJSONHandler(WebAPIRequestHandler):
             self.write_status_error(exc_info=sys.exc_info())
             self.finish()
 
+    def _read_features(self):
+        with fiona.open(self._shapefile_path) as collection:
+            return list(collection)
+
 
 DEFAULT_COUNTRIES_RESOLUTION = '50m'
 
@@ -317,39 +497,43 @@ class ResFeatureCollectionHandler(WorkspaceResourceHandler):
         try:
             _, res_id, res_name, resource = self.get_workspace_resource(base_dir, res_id)
             level = self.get_query_argument_int('level', default=_NUM_GEOM_SIMP_LEVELS)
+            # "geojson" or "arrow"
+            format_name = self.get_query_argument('format', default='geojson')
 
             if isinstance(resource, fiona.Collection):
                 features = resource
                 crs = features.crs
-                num_features = len(features)
             elif isinstance(resource, GeoDataFrame):
                 features = resource.features
                 crs = features.crs
-                num_features = len(resource)
             elif isinstance(resource, gpd.GeoDataFrame):
                 features = resource.iterfeatures()
                 crs = resource.crs
-                num_features = len(resource)
             else:
                 features = None
                 crs = None
-                num_features = 0
                 self.write_status_error(message='Resource "%s" is not a GeoDataFrame' % res_name)
 
             if features is not None:
                 if TRACE_PERF:
                     print('ResFeatureCollectionHandler: features CRS:', crs)
                     print('ResFeatureCollectionHandler: streaming started at ', datetime.datetime.now())
-                self.set_header('Content-Type', 'application/json')
+                if format_name == 'arrow':
+                    self.set_header('Content-Type', _ARROW_STREAM_CONTENT_TYPE)
+                else:
+                    self.set_header('Content-Type', 'application/json')
 
                 def job():
                     conservation_ratio = _level_to_conservation_ratio(level, _NUM_GEOM_SIMP_LEVELS)
-                    write_feature_collection(features, self,
-                                             crs=crs,
+                    # The geometries are simplified and reprojected once per resource
+                    store = get_feature_level_store(resource, lambda: features, crs=crs)
+                    if format_name == 'arrow':
+                        write_feature_collection = store.write_arrow_feature_collection
+                    else:
+                        write_feature_collection = store.write_feature_collection
+                    write_feature_collection(self,
                                              res_id=res_id,
-                                             num_features=num_features,
                                              max_num_display_geometries=1000,
-                                             max_num_display_geometry_points=100,
                                              conservation_ratio=conservation_ratio)
                     self.finish()
                     if TRACE_PERF:
@@ -453,28 +637,31 @@ class ResVarCsvHandler(WorkspaceResourceHandler):
                     self.finish()
                     return
 
-            # noinspection PyBroadException
-            try:
-                # assume var_data is a pandas.dataframe
-                dataframe = var_data
-                num_rows, _ = dataframe.shape
-                if num_rows > _MAX_CSV_ROW_COUNT:
-                    dataframe = dataframe[:_MAX_CSV_ROW_COUNT]
-                csv = dataframe.to_csv()
-            except Exception:
-                # noinspection PyBroadException
-                try:
-                    # assume var_data is a xarray.dataset or xarray.dataarray
-                    dataframe = var_data.to_dataframe()
-                    num_rows, _ = dataframe.shape
-                    if num_rows > _MAX_CSV_ROW_COUNT:
-                        dataframe = dataframe[:_MAX_CSV_ROW_COUNT]
-                    csv = dataframe.to_csv()
-                except Exception:
-                    csv = var_data.to_series().to_csv()
-
-            self.set_header('Content-Type', 'text/csv')
-            self.write(csv)
+            # Only the rows actually sent are converted and formatted
+            table = _get_table_head(var_data, _MAX_CSV_ROW_COUNT)
+
+            # "csv" or "arrow"
+            format_name = self.get_query_argument('format', default='csv')
+            if format_name == 'arrow':
+                import pyarrow as pa
+                if isinstance(table, pd.Series):
+                    table = table.to_frame()
+                elif isinstance(table, gpd.GeoDataFrame):
+                    # Arrow has no geometry type, send geometries as WKT like the CSV does
+                    geometry_name = table.geometry.name
+                    table = pd.DataFrame(table)
+                    table[geometry_name] = [geometry.wkt if geometry is not None else None
+                                            for geometry in table[geometry_name]]
+                self.set_header('Content-Type', _ARROW_STREAM_CONTENT_TYPE)
+                write_arrow_table(pa.Table.from_pandas(pd.DataFrame(table)), self)
+            else:
+                self.set_header('Content-Type', 'text/csv')
+                num_rows = len(table)
+                if num_rows == 0:
+                    self.write(table.to_csv())
+                for row_index in range(0, num_rows, _CSV_CHUNK_ROW_COUNT):
+                    self.write(table.iloc[row_index: row_index + _CSV_CHUNK_ROW_COUNT].to_csv(header=row_index == 0))
+                    self.flush()
         except Exception:
             self.write_status_error(exc_info=sys.exc_info())
             self.finish()
@@ -482,6 +669,34 @@ class ResVarCsvHandler(WorkspaceResourceHandler):
         self.finish()
 
 
+def _get_table_head(var_data: Any, max_row_count: int) -> Union[pd.DataFrame, pd.Series]:
+    """
+    Get the first *max_row_count* rows of the tabular representation of *var_data*, which may be
+    a pandas DataFrame or Series, or a xarray Dataset or DataArray. For xarray objects,
+    only the leading slices required for these rows are converted.
+    """
+    if isinstance(var_data, (pd.DataFrame, pd.Series)):
+        return var_data.iloc[:max_row_count]
+
+    dim_order = list(var_data.dims)
+    indexers = {}
+    for i, dim in enumerate(dim_order):
+        inner_row_count = int(np.prod([var_data.sizes[d] for d in dim_order[i + 1:]], dtype=np.int64))
+        # Number of leading indexes of this dimension covering max_row_count rows
+        count = min(var_data.sizes[dim], -(-max_row_count // max(inner_row_count, 1)))
+        indexers[dim] = slice(0, count)
+        if count != 1:
+            break
+    var_data = var_data.isel(**indexers)
+
+    # noinspection PyBroadException
+    try:
+        table = var_data.to_dataframe(dim_order=dim_order)
+    except Exception:
+        table = var_data.to_series()
+    return table.iloc[:max_row_count]
+
+
 # noinspection PyAbstractClass,PyBroadException
 class ResVarHtmlHandler(WorkspaceResourceHandler):
     def get(self, base_dir, res_id):
@@ -495,6 +710,42 @@ class ResVarHtmlHandler(WorkspaceResourceHandler):
             self.finish()
 
 
+def _get_image_var_index(dataset: xr.Dataset, var_name: str, var_index: Tuple[int, ...]) -> Tuple[int, ...]:
+    """
+    Get the index of the 2D image slice of a variable, which is the first slice if *var_index* is invalid.
+    """
+    variable = dataset[var_name]
+    if variable.ndim <= 2:
+        return ()
+    if not var_index or len(var_index) != variable.ndim - 2:
+        return (0,) * (variable.ndim - 2)
+    return tuple(var_index)
+
+
+def _get_cmap_range(workspace: Workspace, res_name: str, var_name: str, var_index: Tuple[int, ...],
+                    cmap_min: float, cmap_max: float) -> Tuple[float, float]:
+    """
+    Get the colour map range of an image, use the image's minimum or maximum if *cmap_min* or *cmap_max* is NaN.
+    """
+    if np.isnan(cmap_min) or np.isnan(cmap_max):
+        statistics = get_variable_statistics(workspace, res_name, var_name, var_index)
+        cmap_min = statistics['min'] if np.isnan(cmap_min) else cmap_min
+        cmap_max = statistics['max'] if np.isnan(cmap_max) else cmap_max
+    return cmap_min, cmap_max
+
+
+def _get_neighbour_var_indexes(variable: xr.DataArray, var_index: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    """
+    Get the indexes of the previous and next 2D slices of a variable along its first dimension.
+    """
+    if variable.ndim <= 2 or len(var_index) != variable.ndim - 2:
+        return []
+    size = variable.shape[0]
+    return [(index,) + tuple(var_index[1:])
+            for index in (var_index[0] + 1, var_index[0] - 1)
+            if 0 <= index < size]
+
+
 def save_files(files: Sequence, target_dir: str):
     for file in files:
         file_path = os.path.join(target_dir, file.filename)
@@ -0,0 +1,243 @@
+# The MIT License (MIT)
+# Copyright (c) 2016, 2017 by the ESA CCI Toolbox development team and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+
+Statistics of workspace dataset variables, e.g. for auto-ranging colour bars.
+
+Statistics comprise the minimum, maximum, mean, and count of the valid (finite) values of a variable
+and a histogram with :py:data:`HISTOGRAM_NUM_BINS` bins of equal width between minimum and maximum.
+They are computed in a single pass over the variable's chunks and are cached per workspace
+for a given resource ID, resource update count, variable name, and variable index.
+
+"""
+
+import collections
+import threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import dask
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from ..core.workspace import Workspace
+from ..util.monitor import Monitor
+
+__author__ = "Norman Fomferra (Brockmann Consult GmbH)"
+
+#: Number of bins of variable histograms
+HISTOGRAM_NUM_BINS = 256
+
+#: Maximum number of statistics cached per workspace
+STATISTICS_CACHE_CAPACITY = 1024
+
+_USER_DATA_KEY = 'variable_statistics'
+
+BlockStatistics = Tuple[int, float, float, float, Optional[np.ndarray]]
+
+
+def compute_variable_statistics(variable: xr.DataArray,
+                                num_bins: int = HISTOGRAM_NUM_BINS,
+                                monitor: Monitor = Monitor.NONE) -> Dict[str, Any]:
+    """
+    Compute the statistics of the valid values of *variable* in a single pass over its chunks.
+
+    Each chunk contributes its count, minimum, maximum, sum, and a histogram between its own minimum
+    and maximum. The chunk histograms are then merged into the histogram between the overall minimum
+    and maximum assuming that values are uniformly distributed within a chunk histogram's bins.
+    Hence, the histogram is exact for variables with a single chunk and approximate otherwise.
+
+    :param variable: The variable.
+    :param num_bins: The number of histogram bins.
+    :param monitor: A progress monitor.
+    :return: A dictionary with entries "count", "min", "max", "mean", and "histogram".
+             The histogram is a list of *num_bins* counts of bins of equal width between "min" and "max".
+             If there are no valid values, "min", "max", "mean" are NaN.
+    """
+    data = variable.data
+    if isinstance(data, da.Array):
+        blocks = data.to_delayed().ravel()
+        block_statistics_list = [dask.delayed(_compute_block_statistics)(block, num_bins) for block in blocks]
+        with monitor.observing('Computing statistics'):
+            block_statistics_list = dask.compute(*block_statistics_list)
+    else:
+        with monitor.starting('Computing statistics', total_work=1):
+            block_statistics_list = [_compute_block_statistics(np.asarray(data), num_bins)]
+            monitor.progress(work=1)
+    return _merge_block_statistics(block_statistics_list, num_bins)
+
+
+def get_percentile_range(statistics: Dict[str, Any],
+                         lower: float = 2.0,
+                         upper: float = 98.0) -> Tuple[float, float]:
+    """
+    Estimate the *lower* and *upper* percentiles of a variable from the histogram of its *statistics*,
+    e.g. for a contrast stretch that ignores outliers.
+
+    :param statistics: Statistics as returned by :py:func:`compute_variable_statistics`.
+    :param lower: The lower percentile in the range 0 to 100.
+    :param upper: The upper percentile in the range 0 to 100.
+    :return: The pair of percentiles, NaNs if there are no valid values.
+    """
+    counts = np.asarray(statistics['histogram'], dtype=np.float64)
+    total = counts.sum()
+    if total == 0:
+        return float('nan'), float('nan')
+    value_min = statistics['min']
+    value_max = statistics['max']
+    edges = np.linspace(value_min, value_max, counts.size + 1)
+    cumulative = np.concatenate(([0.0], np.cumsum(counts))) / total
+    lower_value, upper_value = np.interp(np.array([lower, upper]) / 100.0, cumulative, edges)
+    return float(lower_value), float(upper_value)
+
+
+def get_variable_statistics(workspace: Workspace,
+                            res_name: str,
+                            var_name: str,
+                            var_index: Sequence[int] = None,
+                            monitor: Monitor = Monitor.NONE) -> Dict[str, Any]:
+    """
+    Get the statistics of variable *var_name* of dataset resource *res_name*
+    as computed by :py:func:`compute_variable_statistics`.
+
+    Statistics are cached per workspace for the resource's ID and update count.
+    Callers must therefore not modify the returned dictionary.
+
+    :param workspace: The workspace.
+    :param res_name: The name of a dataset resource.
+    :param var_name: The variable name.
+    :param var_index: Optional indexes into the leading dimensions of the variable.
+    :param monitor: A progress monitor.
+    :return: The statistics.
+    """
+    resource_cache = workspace.resource_cache
+    res_id = resource_cache.get_id(res_name)
+    res_update_count = resource_cache.get_update_count(res_name)
+    if res_id is None:
+        raise ValueError('Unknown resource "%s"' % res_name)
+
+    var_index = tuple(var_index) if var_index else ()
+    key = res_id, res_update_count, var_name, var_index
+    cache = _get_statistics_cache(workspace)
+    statistics = cache.get(key)
+    if statistics is not None:
+        return statistics
+
+    dataset = resource_cache.get(res_name)
+    if not isinstance(dataset, xr.Dataset):
+        raise ValueError('Resource "%s" must be a Dataset' % res_name)
+    if var_name not in dataset:
+        raise ValueError('Variable "%s" not found in "%s"' % (var_name, res_name))
+
+    variable = dataset[var_name]
+    if var_index:
+        variable = variable[var_index]
+    statistics = compute_variable_statistics(variable, monitor=monitor)
+    cache.put(key, statistics)
+    return statistics
+
+
+class _StatisticsCache:
+    """A thread-safe LRU mapping of statistics keys to statistics."""
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            statistics = self._entries.get(key)
+            if statistics is not None:
+                self._entries.move_to_end(key)
+            return statistics
+
+    def put(self, key, statistics: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = statistics
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+
+_STATISTICS_CACHE_LOCK = threading.Lock()
+
+
+def _get_statistics_cache(workspace: Workspace) -> _StatisticsCache:
+    with _STATISTICS_CACHE_LOCK:
+        cache = workspace.user_data.get(_USER_DATA_KEY)
+        if cache is None:
+            cache = _StatisticsCache(STATISTICS_CACHE_CAPACITY)
+            workspace.user_data[_USER_DATA_KEY] = cache
+        return cache
+
+
+def _compute_block_statistics(block: np.ndarray, num_bins: int) -> BlockStatistics:
+    values = np.asarray(block).ravel()
+    if values.dtype.kind not in 'iu':
+        values = values[np.isfinite(values)]
+    count = values.size
+    if count == 0:
+        return 0, float('nan'), float('nan'), 0.0, None
+    value_min = float(values.min())
+    value_max = float(values.max())
+    value_sum = float(values.sum(dtype=np.float64))
+    if value_min < value_max:
+        counts, _ = np.histogram(values, bins=num_bins, range=(value_min, value_max))
+    else:
+        counts = None
+    return count, value_min, value_max, value_sum, counts
+
+
+def _merge_block_statistics(block_statistics_list: Sequence[BlockStatistics], num_bins: int) -> Dict[str, Any]:
+    block_statistics_list = [block_statistics for block_statistics in block_statistics_list
+                             if block_statistics[0] > 0]
+    count = sum(block_statistics[0] for block_statistics in block_statistics_list)
+    if count == 0:
+        nan = float('nan')
+        return dict(count=0, min=nan, max=nan, mean=nan, histogram=[0] * num_bins)
+
+    value_min = min(block_statistics[1] for block_statistics in block_statistics_list)
+    value_max = max(block_statistics[2] for block_statistics in block_statistics_list)
+    value_sum = sum(block_statistics[3] for block_statistics in block_statistics_list)
+
+    edges = np.linspace(value_min, value_max, num_bins + 1)
+    histogram = np.zeros(num_bins, dtype=np.float64)
+    for block_count, block_min, block_max, _, block_counts in block_statistics_list:
+        if block_counts is None or value_min == value_max:
+            # All values of the block are equal
+            bin_index = np.searchsorted(edges, block_min, side='right') - 1
+            histogram[min(max(bin_index, 0), num_bins - 1)] += block_count
+        elif block_min == value_min and block_max == value_max:
+            histogram += block_counts
+        else:
+            # Re-bin the cumulative counts of the block, which are piecewise linear within its bins
+            block_edges = np.linspace(block_min, block_max, num_bins + 1)
+            block_cumulative = np.concatenate(([0], np.cumsum(block_counts)))
+            histogram += np.diff(np.interp(edges, block_edges, block_cumulative))
+
+    return dict(count=int(count),
+                min=value_min,
+                max=value_max,
+                mean=value_sum / count,
+                histogram=[int(c) for c in np.round(histogram)])
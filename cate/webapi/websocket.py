@@ -23,10 +23,11 @@ import datetime
 import math
 import os
 import platform
+import threading
 import time
+import weakref
 from typing import List, Sequence, Optional, Any, Tuple, Dict
 
-import xarray as xr
 
 from cate.conf import conf
 from cate.conf.defaults import GLOBAL_CONF_FILE
@@ -36,12 +37,14 @@ from cate.core.ds import add_as_local
 from cate.core.ds import get_data_descriptor
 from cate.core.ds import get_data_store_notices
 from cate.core.ds import get_metadata_from_descriptor
+from cate.core.membudget import get_process_memory_budget
 from cate.core.op import OP_REGISTRY
 from cate.core.workspace import OpKwArgs, Workspace
 from cate.core.wsmanag import WorkspaceManager
 from cate.util.misc import cwd
 from cate.util.monitor import Monitor
 from cate.util.sround import sround_range
+from cate.webapi.varstats import get_variable_statistics, get_percentile_range
 
 __author__ = "Norman Fomferra (Brockmann Consult GmbH), " \
              "Marco Zühlke (Brockmann Consult GmbH)"
@@ -71,6 +74,9 @@ class WebSocketService:
                  auto_stop_info=None):
         self.workspace_manager = workspace_manager
         self.auto_stop_info = auto_stop_info
+        # If not None, maps workspaces to the resources known to the client, see enable_resource_changes()
+        self._known_resources = None  # type: Optional[weakref.WeakKeyDictionary]
+        self._known_resources_lock = threading.Lock()
 
     def _resolve_path(self, path: str) -> str:
         """Resolve incoming path against workspace manager's root path."""
@@ -86,7 +92,12 @@ class WebSocketService:
     def _serialize_workspace(self, workspace: Workspace) -> dict:
         """Serialize outgoing workspace JSON to have base_dir
         relative to workspace manager's root path."""
-        workspace_json = workspace.to_json_dict()
+        with self._known_resources_lock:
+            if self._known_resources is not None:
+                known_resources = self._known_resources.setdefault(workspace, dict())
+                workspace_json = workspace.to_json_dict(known_resources=known_resources)
+            else:
+                workspace_json = workspace.to_json_dict()
         if self.workspace_manager.root_path:
             workspace_json['base_dir'] = \
                 os.path.sep + os.path.relpath(workspace_json['base_dir'],
@@ -108,6 +119,19 @@ class WebSocketService:
             remaining_time=remaining_time
         )
 
+    def enable_resource_changes(self, enabled: bool = True) -> None:
+        """
+        Enable or disable incremental resource descriptors for this connection.
+
+        If enabled, the workspaces returned by this service have a "resource_changes" entry
+        instead of a "resources" entry. It comprises only the descriptors of the resources
+        that have been added or changed since the workspace was last returned to the client,
+        and the IDs of removed resources, see :py:meth:`Workspace.to_json_dict`.
+        The first workspace returned after enabling comprises the descriptors of all resources.
+        """
+        with self._known_resources_lock:
+            self._known_resources = weakref.WeakKeyDictionary() if enabled else None
+
     def get_config(self) -> dict:
         return dict(data_stores_path=conf.get_data_stores_path(),
                     use_workspace_imagery_cache=conf.get_use_workspace_imagery_cache(),
@@ -436,32 +460,50 @@ class WebSocketService:
                                           res_name: str,
                                           var_name: str,
                                           var_index: Sequence[int],
+                                          percentiles: Sequence[float] = None,
                                           monitor=Monitor.NONE):
+        """
+        Get the statistics of a dataset variable, see :py:func:`cate.webapi.varstats.compute_variable_statistics`.
+        Statistics are computed once per resource update and variable index.
+
+        :return: A dictionary with the entries "min" and "max" rounded to two significant digits,
+                 "mean", "count", and "histogram", a dictionary with the "min" and "max" of the histogram
+                 and its bin "counts". If *percentiles* are given, the entry "percentiles" comprises the
+                 estimated values of the given percentiles.
+        """
         base_dir = self._resolve_workspace_dir(base_dir)
         workspace_manager = self.workspace_manager
         workspace = workspace_manager.get_workspace(base_dir)
         if res_name not in workspace.resource_cache:
             raise ValueError('Unknown resource "%s"' % res_name)
 
-        dataset = workspace.resource_cache[res_name]
-        if not isinstance(dataset, xr.Dataset):
-            raise ValueError('Resource "%s" must be a Dataset' % res_name)
-
-        if var_name not in dataset:
-            raise ValueError('Variable "%s" not found in "%s"' % (var_name, res_name))
-
-        variable = dataset[var_name]
-        if var_index:
-            variable = variable[tuple(var_index)]
-
-        with monitor.starting('Computing min/max', total_work=100.):
-            with monitor.child(work=50.).observing('Computing min'):
-                actual_min = float(variable.min(skipna=True))
-            with monitor.child(work=50.).observing('Computing max'):
-                actual_max = float(variable.max(skipna=True))
+        statistics = get_variable_statistics(workspace, res_name, var_name, var_index, monitor=monitor)
+
+        actual_min, actual_max = sround_range((statistics['min'], statistics['max']), ndigits=2)
+        result = dict(min=actual_min,
+                      max=actual_max,
+                      mean=statistics['mean'],
+                      count=statistics['count'],
+                      histogram=dict(min=statistics['min'],
+                                     max=statistics['max'],
+                                     counts=statistics['histogram']))
+        if percentiles:
+            result['percentiles'] = [get_percentile_range(statistics, lower=percentile, upper=percentile)[0]
+                                     for percentile in percentiles]
+        return result
+
+    def get_workspace_memory_metrics(self, base_dir: str) -> dict:
+        """
+        Get the metrics of the memory budgets for workspace resources, see :py:class:`cate.core.membudget.MemoryBudget`.
 
-        actual_min, actual_max = sround_range((actual_min, actual_max), ndigits=2)
-        return dict(min=actual_min, max=actual_max)
+        :return: A dictionary with the entries "workspace" and "process", the metrics of the budget of the given
+                 workspace and of all workspaces, respectively, or ``None`` for budgets that are disabled.
+        """
+        base_dir = self._resolve_workspace_dir(base_dir)
+        workspace = self.workspace_manager.get_workspace(base_dir)
+        process_memory_budget = get_process_memory_budget()
+        return dict(workspace=workspace.memory_metrics,
+                    process=process_memory_budget.metrics if process_memory_budget is not None else None)
 
     def set_preferences(self, prefs: dict):
         set_user_prefs(prefs)
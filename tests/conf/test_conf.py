@@ -3,6 +3,7 @@ import os.path
 import shutil
 import tempfile
 import unittest
+from unittest import mock
 
 import sys
 
@@ -29,6 +30,16 @@ class ConfTest(unittest.TestCase):
         self.assertIsNotNone(default_res_prefix)
         self.assertTrue(default_res_prefix.strip() != '')
 
+    def test_get_workflow_max_workers(self):
+        with mock.patch.dict(conf.get_config(), {}, clear=True):
+            self.assertEqual(conf.get_workflow_max_workers(), 1)
+            conf.set_config({'workflow_max_workers': 4})
+            self.assertEqual(conf.get_workflow_max_workers(), 4)
+            conf.set_config({'workflow_max_workers': None})
+            self.assertEqual(conf.get_workflow_max_workers(), 1)
+            conf.set_config({'workflow_max_workers': -2})
+            self.assertEqual(conf.get_workflow_max_workers(), 1)
+
     def test_get_config_value(self):
         with self.assertRaises(ValueError) as e:
             conf.get_config_value(None)
@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cate.core.membudget import MemoryBudget, get_value_size
+from cate.core.workflow import ValueCache
+
+
+def _new_dataset(value: float) -> xr.Dataset:
+    return xr.Dataset(dict(a=xr.DataArray(np.full((10, 10), value, dtype=np.float64), dims=['y', 'x'])))
+
+
+class GetValueSizeTest(unittest.TestCase):
+    def test_dataset(self):
+        dataset = _new_dataset(1.0)
+        self.assertEqual(get_value_size(dataset), 800)
+        self.assertEqual(get_value_size(dataset.chunk()), 0)
+
+    def test_data_frame(self):
+        data_frame = pd.DataFrame(dict(a=np.arange(100, dtype=np.float64)))
+        self.assertGreaterEqual(get_value_size(data_frame), 800)
+
+    def test_other(self):
+        self.assertEqual(get_value_size(None), 0)
+        self.assertEqual(get_value_size(np.zeros(100)), 0)
+        self.assertEqual(get_value_size('abc'), 0)
+
+
+class MemoryBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp(prefix='cate-test-spill-')
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def test_spill_and_reload(self):
+        budget = MemoryBudget(1000, spill_dir=self.spill_dir)
+        cache = ValueCache(memory_budget=budget)
+        self.assertIs(cache.memory_budget, budget)
+
+        cache['a'] = _new_dataset(1.0)
+        self.assertEqual(budget.size, 800)
+        self.assertFalse(cache.is_lazy('a'))
+
+        cache['b'] = _new_dataset(2.0)
+        self.assertEqual(budget.size, 800)
+        self.assertTrue(cache.is_lazy('a'))
+        self.assertFalse(cache.is_lazy('b'))
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+        self.assertEqual(cache.get_update_count('a'), 0)
+
+        metrics = budget.metrics
+        self.assertEqual(metrics['capacity'], 1000)
+        self.assertEqual(metrics['size'], 800)
+        self.assertEqual(metrics['num_values'], 1)
+        self.assertEqual(metrics['num_spills'], 1)
+        self.assertGreater(metrics['num_spilled_bytes'], 0)
+        self.assertEqual(metrics['num_reloads'], 0)
+
+        # Spilled values are reloaded transparently, their data are read lazily
+        reloaded = cache['a']
+        self.assertFalse(cache.is_lazy('a'))
+        np.testing.assert_equal(reloaded.a.values, np.full((10, 10), 1.0))
+        self.assertEqual(cache.get_update_count('a'), 0)
+        self.assertEqual(budget.metrics['num_reloads'], 1)
+        self.assertEqual(budget.size, 800)
+
+        budget.close()
+        self.assertFalse(os.path.exists(self.spill_dir))
+
+    def test_least_recently_used_is_spilled(self):
+        budget = MemoryBudget(2000, spill_dir=self.spill_dir)
+        cache = ValueCache(memory_budget=budget)
+        cache['a'] = _new_dataset(1.0)
+        cache['b'] = _new_dataset(2.0)
+        self.assertIsNotNone(cache['a'])
+        cache['c'] = _new_dataset(3.0)
+        self.assertFalse(cache.is_lazy('a'))
+        self.assertTrue(cache.is_lazy('b'))
+        self.assertFalse(cache.is_lazy('c'))
+
+    def test_untrack(self):
+        budget = MemoryBudget(2000, spill_dir=self.spill_dir)
+        cache = ValueCache(memory_budget=budget)
+        cache['a'] = _new_dataset(1.0)
+        cache['b'] = _new_dataset(2.0)
+        self.assertEqual(budget.size, 1600)
+        del cache['a']
+        self.assertEqual(budget.size, 800)
+        cache.rename_key('b', 'c')
+        self.assertEqual(budget.size, 800)
+        cache['c'] = 'no longer a dataset'
+        self.assertEqual(budget.size, 0)
+        cache['d'] = _new_dataset(4.0)
+        cache.clear()
+        self.assertEqual(budget.size, 0)
+        self.assertEqual(budget.metrics['num_spills'], 0)
+
+    def test_parent(self):
+        parent = MemoryBudget(1000)
+        budget_1 = MemoryBudget(0, spill_dir=os.path.join(self.spill_dir, '1'), parent=parent)
+        budget_2 = MemoryBudget(0, spill_dir=os.path.join(self.spill_dir, '2'), parent=parent)
+        cache_1 = ValueCache(memory_budget=budget_1)
+        cache_2 = ValueCache(memory_budget=budget_2)
+        cache_1['a'] = _new_dataset(1.0)
+        cache_2['a'] = _new_dataset(2.0)
+        self.assertTrue(cache_1.is_lazy('a'))
+        self.assertFalse(cache_2.is_lazy('a'))
+        self.assertEqual(budget_1.metrics['num_spills'], 1)
+        self.assertEqual(budget_2.metrics['num_spills'], 0)
+        self.assertEqual(parent.metrics['num_spills'], 1)
+        self.assertEqual(parent.size, 800)
+
+        np.testing.assert_equal(cache_1['a'].a.values, np.full((10, 10), 1.0))
+        self.assertEqual(parent.metrics['num_reloads'], 1)
+
+        budget_2.close()
+        self.assertEqual(parent.size, 0)
+
+    def test_without_spill_dir(self):
+        budget = MemoryBudget(1000)
+        cache = ValueCache(memory_budget=budget)
+        cache['a'] = _new_dataset(1.0)
+        cache['b'] = _new_dataset(2.0)
+        self.assertFalse(cache.is_lazy('a'))
+        self.assertFalse(cache.is_lazy('b'))
+        self.assertEqual(budget.metrics['num_spills'], 0)
+        # Values that could not be spilled still count
+        self.assertEqual(budget.size, 1600)
+        self.assertEqual(budget.metrics['num_values'], 2)
+        del cache['a']
+        self.assertEqual(budget.size, 800)
+
+    def test_failed_spill(self):
+        budget = MemoryBudget(1000, spill_dir=self.spill_dir)
+        cache = ValueCache(memory_budget=budget)
+        cache['a'] = _new_dataset(1.0)
+        with mock.patch.object(budget, 'spill_value', return_value=None):
+            cache['b'] = _new_dataset(2.0)
+        self.assertFalse(cache.is_lazy('a'))
+        self.assertEqual(budget.size, 1600)
+        # The value is spilled by the next attempt
+        cache['c'] = _new_dataset(3.0)
+        self.assertTrue(cache.is_lazy('b'))
+        self.assertTrue(cache.is_lazy('a'))
+        self.assertEqual(budget.size, 800)
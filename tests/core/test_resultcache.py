@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cate.core.resultcache import StepResultCache, new_step_result_cache
+from cate.util.undefined import UNDEFINED
+
+
+class StepResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='cate-test-results-')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_dataset(self):
+        cache = StepResultCache(self.cache_dir, 1024 * 1024)
+        dataset = xr.Dataset(dict(a=xr.DataArray(np.arange(12, dtype=np.float64).reshape((3, 4)), dims=['y', 'x'])))
+        dataset.a.encoding.update(zlib=True, complevel=9)
+        self.assertTrue(cache.put('abc', dataset))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'abc.zarr')))
+        self.assertGreater(cache.size, 0)
+
+        restored = cache.get('abc')
+        self.assertIsInstance(restored, xr.Dataset)
+        xr.testing.assert_equal(restored, dataset)
+
+        # A new cache instance finds results stored before
+        cache = StepResultCache(self.cache_dir, 1024 * 1024)
+        self.assertEqual(cache.size, 0)
+        restored = cache.get('abc')
+        xr.testing.assert_equal(restored, dataset)
+        self.assertGreater(cache.size, 0)
+
+        # The store of a restored dataset is kept until the cache is closed, because the dataset reads it lazily
+        cache.remove('abc')
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'abc.zarr')))
+        xr.testing.assert_equal(restored.compute(), dataset)
+        cache.close()
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'abc.zarr')))
+        self.assertIs(cache.get('abc'), UNDEFINED)
+
+    def test_put_restored_dataset(self):
+        cache = StepResultCache(self.cache_dir, 1024 * 1024)
+        dataset = xr.Dataset(dict(a=xr.DataArray(np.arange(12, dtype=np.float64).reshape((3, 4)), dims=['y', 'x'])))
+        self.assertTrue(cache.put('abc', dataset))
+        restored = cache.get('abc')
+        # Putting a result again must not replace the store read by the restored dataset
+        self.assertTrue(cache.put('abc', restored))
+        xr.testing.assert_equal(restored.compute(), dataset)
+        cache.close()
+        xr.testing.assert_equal(cache.get('abc'), dataset)
+
+    def test_data_frame(self):
+        cache = StepResultCache(self.cache_dir, 1024 * 1024)
+        data_frame = pd.DataFrame(dict(a=[1, 2, 3], b=['x', 'y', 'z']))
+        self.assertTrue(cache.put('abc', data_frame))
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, 'abc.parquet')))
+        restored = cache.get('abc')
+        pd.testing.assert_frame_equal(restored, data_frame)
+
+    def test_uncached_values(self):
+        cache = StepResultCache(self.cache_dir, 1024 * 1024)
+        self.assertFalse(cache.put('abc', 42))
+        self.assertFalse(cache.put('abc', dict(a=1)))
+        self.assertFalse(cache.put(None, pd.DataFrame(dict(a=[1, 2, 3]))))
+        # Larger than the cache
+        self.assertFalse(cache.put('abc', pd.DataFrame(dict(a=np.zeros(1024 * 1024)))))
+        self.assertIs(cache.get('abc'), UNDEFINED)
+        self.assertIs(cache.get(None), UNDEFINED)
+        self.assertEqual(cache.get('abc', default=None), None)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_eviction(self):
+        data_frame = pd.DataFrame(dict(a=np.arange(10000, dtype=np.float64)))
+        capacity = 5 * 80000
+        cache = StepResultCache(self.cache_dir, capacity, threshold=1.0)
+        for i in range(10):
+            self.assertTrue(cache.put('df%s' % i, data_frame))
+            cache.get('df0')
+        self.assertLessEqual(cache.size, capacity)
+        file_names = set(os.listdir(self.cache_dir))
+        self.assertIn('df0.parquet', file_names)
+        self.assertIn('df9.parquet', file_names)
+        self.assertNotIn('df1.parquet', file_names)
+
+    def test_corrupt_result(self):
+        os.makedirs(os.path.join(self.cache_dir, 'abc.zarr'))
+        cache = StepResultCache(self.cache_dir, 1024 * 1024)
+        self.assertIs(cache.get('abc'), UNDEFINED)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'abc.zarr')))
+
+    def test_new_step_result_cache(self):
+        self.assertIsNone(new_step_result_cache(self.cache_dir, 0))
+        self.assertIsNone(new_step_result_cache(self.cache_dir, None))
+        self.assertIsInstance(new_step_result_cache(self.cache_dir, 1000), StepResultCache)
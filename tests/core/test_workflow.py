@@ -1,5 +1,8 @@
 import json
 import os.path
+import shutil
+import tempfile
+import threading
 from collections import OrderedDict
 from unittest import TestCase
 
@@ -8,6 +11,7 @@ from cate.core.workflow import OpStep, Workflow, WorkflowStep, NodePort, Express
     SourceRef, new_workflow_op
 from cate.util.undefined import UNDEFINED
 from cate.util.misc import object_to_qualified_name
+from cate.util.monitor import Monitor, Cancellation
 from cate.util.opmetainf import OpMetaInfo
 
 
@@ -30,6 +34,26 @@ def op3(u, v, c=0):
     return {'w': 2 * u + 3 * v + c}
 
 
+class _CancellableMonitor(Monitor):
+    def __init__(self):
+        self._cancelled = False
+
+    def start(self, label: str, total_work: float = None):
+        pass
+
+    def progress(self, work: float = None, msg: str = None):
+        pass
+
+    def done(self):
+        pass
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+
 def get_resource(rel_path):
     return os.path.join(os.path.dirname(__file__), rel_path).replace('\\', '/')
 
@@ -153,6 +177,176 @@ class WorkflowTest(TestCase):
         self.assertEqual(output_value, 2 * (3 + 1) + 3 * (2 * (3 + 1)))
         self.assertEqual(value_cache, dict(op1={'y': 4}, op2={'b': 8}, op3={'w': 32}))
 
+    def test_invoke_parallel(self):
+        _, _, _, workflow = self.create_example_3_steps_workflow()
+
+        value_cache = ValueCache()
+        workflow.inputs.p.value = 3
+        workflow.invoke(context=dict(value_cache=value_cache, max_workers=4))
+        output_value = workflow.outputs.q.value
+        self.assertEqual(output_value, 2 * (3 + 1) + 3 * (2 * (3 + 1)))
+        self.assertEqual(dict(value_cache), dict(op1={'y': 4}, op2={'b': 8}, op3={'w': 32}))
+
+    @classmethod
+    def create_example_parallel_workflow(cls, fn1, fn2):
+        step1 = OpStep(Operation(fn1), node_id='step1')
+        step2 = OpStep(Operation(fn2), node_id='step2')
+        step3 = OpStep(op3, node_id='step3')
+        workflow = Workflow(OpMetaInfo('myWorkflow', inputs=OrderedDict(p={}), outputs=OrderedDict(q={})))
+        workflow.add_steps(step3, step2, step1)
+        step1.inputs.x.source = workflow.inputs.p
+        step2.inputs.x.source = workflow.inputs.p
+        step3.inputs.u.source = step1.outputs['return']
+        step3.inputs.v.source = step2.outputs['return']
+        workflow.outputs.q.source = step3.outputs.w
+        return step1, step2, step3, workflow
+
+    def test_invoke_steps_parallel(self):
+        # Would raise threading.BrokenBarrierError, if steps 1 and 2 were not executed concurrently
+        barrier = threading.Barrier(2, timeout=10)
+
+        def fn1(x: int) -> int:
+            barrier.wait()
+            return x + 1
+
+        def fn2(x: int) -> int:
+            barrier.wait()
+            return x + 2
+
+        step1, step2, step3, workflow = self.create_example_parallel_workflow(fn1, fn2)
+        workflow.inputs.p.value = 3
+        workflow.invoke_steps(workflow.steps, max_workers=2)
+        self.assertEqual(workflow.outputs.q.value, 2 * 4 + 3 * 5)
+
+        # A subset of steps
+        workflow.inputs.p.value = 10
+        workflow.invoke_steps([step1, step2], max_workers=2)
+        self.assertEqual(step1.outputs['return'].value, 11)
+        self.assertEqual(step2.outputs['return'].value, 12)
+
+    def test_invoke_steps_parallel_failure(self):
+        cancelled = threading.Event()
+        started = threading.Event()
+
+        def fn1(x: int, monitor: Monitor = Monitor.NONE) -> int:
+            started.set()
+            while not monitor.is_cancelled():
+                cancelled.wait(0.01)
+            cancelled.set()
+            monitor.check_for_cancellation()
+            return x
+
+        def fn2(x: int) -> int:
+            started.wait(10)
+            raise ValueError('fn2 failed')
+
+        step1, step2, step3, workflow = self.create_example_parallel_workflow(fn1, fn2)
+        workflow.inputs.p.value = 3
+        with self.assertRaises(ValueError) as cm:
+            workflow.invoke_steps(workflow.steps, max_workers=2)
+        self.assertEqual(str(cm.exception), 'fn2 failed')
+        self.assertTrue(cancelled.is_set())
+        self.assertIsNone(step3.outputs.w.value)
+
+    def test_invoke_steps_parallel_cancelled(self):
+        monitor = _CancellableMonitor()
+
+        def fn1(x: int) -> int:
+            monitor.cancel()
+            return x
+
+        def fn2(x: int) -> int:
+            return x
+
+        step1, step2, step3, workflow = self.create_example_parallel_workflow(fn1, fn2)
+        workflow.inputs.p.value = 3
+        with self.assertRaises(Cancellation):
+            workflow.invoke_steps(workflow.steps, monitor=monitor, max_workers=2)
+        self.assertIsNone(step3.outputs.w.value)
+
+    def test_compute_fingerprint(self):
+        step1, step2, step3, workflow = self.create_example_3_steps_workflow()
+        workflow.inputs.p.value = 3
+        fingerprint1 = step1.compute_fingerprint()
+        fingerprint3 = step3.compute_fingerprint()
+        self.assertIsInstance(fingerprint1, str)
+        self.assertIsInstance(fingerprint3, str)
+        self.assertNotEqual(fingerprint1, fingerprint3)
+        self.assertEqual(step3.compute_fingerprint(), fingerprint3)
+
+        # Upstream changes change the fingerprints of all downstream steps
+        workflow.inputs.p.value = 4
+        self.assertNotEqual(step1.compute_fingerprint(), fingerprint1)
+        self.assertNotEqual(step3.compute_fingerprint(), fingerprint3)
+        workflow.inputs.p.value = 3
+        self.assertEqual(step3.compute_fingerprint(), fingerprint3)
+
+        step3.inputs.c.value = 1
+        self.assertEqual(step1.compute_fingerprint(), fingerprint1)
+        self.assertNotEqual(step3.compute_fingerprint(), fingerprint3)
+
+        # Not JSON-serializable
+        workflow.inputs.p.value = object()
+        self.assertIsNone(step1.compute_fingerprint())
+        self.assertIsNone(step3.compute_fingerprint())
+
+        # Steps that are not based on registered operations have no fingerprint
+        step4 = ExpressionStep('a + 1', inputs=OrderedDict(a={}), node_id='expr')
+        self.assertIsNone(step4.compute_fingerprint())
+
+    def test_compute_fingerprint_with_file_input(self):
+        def read_some_file(file):
+            return file
+
+        from cate.core.op import OP_REGISTRY
+
+        temp_dir = tempfile.mkdtemp(prefix='cate-test-fingerprint-')
+        try:
+            op_reg = OP_REGISTRY.add_op(read_some_file)
+            op_reg.op_meta_info.inputs['file']['file_open_mode'] = 'r'
+            step = OpStep(op_reg, node_id='read_step')
+            file = os.path.join(temp_dir, 'data.txt')
+            step.inputs.file.value = file
+            # Missing files have no fingerprint
+            self.assertIsNone(step.compute_fingerprint())
+
+            with open(file, 'w') as fp:
+                fp.write('abc')
+            fingerprint = step.compute_fingerprint()
+            self.assertIsInstance(fingerprint, str)
+            self.assertEqual(step.compute_fingerprint(), fingerprint)
+
+            # Changed files change the fingerprint
+            with open(file, 'w') as fp:
+                fp.write('abcdef')
+            self.assertNotEqual(step.compute_fingerprint(), fingerprint)
+        finally:
+            OP_REGISTRY.remove_op(read_some_file)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def test_invoke_with_result_cache(self):
+        class ResultCache(dict):
+            def get(self, fingerprint, default=UNDEFINED):
+                return super().get(fingerprint, default)
+
+            def put(self, fingerprint, value):
+                self[fingerprint] = value
+                return True
+
+        step1, step2, step3, workflow = self.create_example_3_steps_workflow()
+        result_cache = ResultCache()
+        workflow.inputs.p.value = 3
+        workflow.invoke(context=dict(result_cache=result_cache))
+        self.assertEqual(workflow.outputs.q.value, 32)
+        self.assertEqual(set(result_cache.keys()), {step1.compute_fingerprint(),
+                                                    step2.compute_fingerprint(),
+                                                    step3.compute_fingerprint()})
+
+        # Results are taken from the result cache
+        result_cache[step3.compute_fingerprint()] = {'w': 64}
+        workflow.invoke(context=dict(result_cache=result_cache))
+        self.assertEqual(workflow.outputs.q.value, 64)
+
     def test_invoke_with_context_inputs(self):
         def some_op(context, workflow, workflow_id, step, step_id, invalid):
             return dict(context=context,
@@ -1294,3 +1488,52 @@ class ValueCacheTest(TestCase):
         self.assertIn('bert._child', vc)
         self.assertIs(vc['bert._child'], bibo_child)
         self.assertEqual(vc.get_id('bert'), bibo_id)
+
+    def test_set_lazy(self):
+        num_loads = [0]
+
+        def load_bibo():
+            num_loads[0] += 1
+            return ValueCacheTest.ClosableBibo()
+
+        vc = ValueCache()
+        vc.set_lazy('bibo', load_bibo)
+        bibo_id = vc.get_id('bibo')
+
+        self.assertIn('bibo', vc)
+        self.assertTrue(vc.is_lazy('bibo'))
+        self.assertEqual(0, num_loads[0])
+
+        bibo = vc['bibo']
+        self.assertIsInstance(bibo, ValueCacheTest.ClosableBibo)
+        self.assertFalse(vc.is_lazy('bibo'))
+        self.assertIs(vc.get('bibo'), bibo)
+        self.assertIs(vc.get_value_by_id(bibo_id), bibo)
+        self.assertEqual(1, num_loads[0])
+        self.assertEqual(bibo_id, vc.get_id('bibo'))
+        self.assertEqual(0, vc.get_update_count('bibo'))
+
+        vc.set_lazy('bibo', load_bibo)
+        self.assertTrue(bibo.closed)
+        self.assertEqual(1, vc.get_update_count('bibo'))
+        self.assertIsNot(dict(vc)['bibo'], bibo)
+        self.assertEqual(2, num_loads[0])
+
+    def test_set_lazy_fails(self):
+        def load_bibo():
+            raise IOError('bibo not found')
+
+        vc = ValueCache()
+        vc.set_lazy('bibo', load_bibo)
+        self.assertIsNone(vc.get('bibo'))
+        self.assertNotIn('bibo', vc)
+        self.assertIsNone(vc.get_id('bibo'))
+
+        vc.set_lazy('bibo', load_bibo)
+        with self.assertRaises(KeyError):
+            # noinspection PyStatementEffect
+            vc['bibo']
+
+        vc.set_lazy('bibo', load_bibo)
+        vc.close()
+        self.assertNotIn('bibo', vc)
@@ -1,5 +1,7 @@
 import json
 import os
+import shutil
+import tempfile
 import unittest
 from collections import OrderedDict
 
@@ -9,9 +11,10 @@ import pandas as pd
 import xarray as xr
 from shapely.geometry import Point
 
+from cate.conf import conf
 from cate.core.types import ValidationError
 from cate.core.workflow import Workflow, OpStep
-from cate.core.workspace import Workspace, mk_op_arg, mk_op_args, mk_op_kwargs
+from cate.core.workspace import Workspace, mk_op_arg, mk_op_args, mk_op_kwargs, _replace_path
 from cate.util.opmetainf import OpMetaInfo
 from cate.util.undefined import UNDEFINED
 
@@ -19,6 +22,36 @@ NETCDF_TEST_FILE_1 = os.path.join(os.path.dirname(__file__), '..', 'data', 'prec
 NETCDF_TEST_FILE_2 = os.path.join(os.path.dirname(__file__), '..', 'data', 'precip_and_temp_2.nc')
 
 
+class ReplacePathTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp(prefix='cate-test-ws-')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def _new_dir(self, name, content):
+        path = os.path.join(self.base_dir, name)
+        os.mkdir(path)
+        with open(os.path.join(path, 'data'), 'w') as fp:
+            fp.write(content)
+        return path
+
+    def test_replace_dir(self):
+        dst_path = self._new_dir('x.zarr', 'old')
+        _replace_path(self._new_dir('x.zarr.tmp', 'new'), dst_path)
+        with open(os.path.join(dst_path, 'data')) as fp:
+            self.assertEqual('new', fp.read())
+        self.assertEqual(['x.zarr'], os.listdir(self.base_dir))
+
+    def test_replace_dir_restores_backup_on_failure(self):
+        dst_path = self._new_dir('x.zarr', 'old')
+        with self.assertRaises(OSError):
+            _replace_path(os.path.join(self.base_dir, 'missing'), dst_path)
+        with open(os.path.join(dst_path, 'data')) as fp:
+            self.assertEqual('old', fp.read())
+        self.assertEqual(['x.zarr'], os.listdir(self.base_dir))
+
+
 class WorkspaceTest(unittest.TestCase):
     def test_utilities(self):
         self.assertEqual(mk_op_arg(1), {'value': 1})
@@ -55,6 +88,160 @@ class WorkspaceTest(unittest.TestCase):
         finally:
             OP_REGISTRY.remove_op(some_op)
 
+    def test_workspace_uses_step_result_cache(self):
+        num_calls = [0]
+
+        def make_data_frame(n: int) -> pd.DataFrame:
+            num_calls[0] += 1
+            return pd.DataFrame(dict(a=np.arange(n)))
+
+        from cate.core.op import OP_REGISTRY
+
+        base_dir = tempfile.mkdtemp(prefix='cate-test-ws-')
+        config = conf.get_config()
+        old_config = dict(config)
+        try:
+            conf.set_config(dict(step_result_cache_capacity=1024 * 1024))
+            op_reg = OP_REGISTRY.add_op(make_data_frame)
+            op_name = op_reg.op_meta_info.qualified_name
+
+            ws = Workspace(base_dir, Workspace.new_workflow())
+            ws.set_resource(op_name, mk_op_kwargs(n=10), res_name='df')
+            df = ws.execute_workflow('df')
+            self.assertEqual(len(df), 10)
+            self.assertEqual(num_calls[0], 1)
+            self.assertTrue(os.path.isdir(Workspace.get_step_result_cache_dir(base_dir)))
+            ws.save()
+            ws.close()
+
+            ws = Workspace.open(base_dir)
+            df = ws.execute_workflow('df')
+            self.assertEqual(len(df), 10)
+            self.assertEqual(num_calls[0], 1)
+
+            ws.set_resource(op_name, mk_op_kwargs(n=20), res_name='df', overwrite=True)
+            df = ws.execute_workflow('df')
+            self.assertEqual(len(df), 20)
+            self.assertEqual(num_calls[0], 2)
+            ws.close()
+        finally:
+            OP_REGISTRY.remove_op(make_data_frame)
+            config.clear()
+            config.update(old_config)
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    def test_save_writes_changed_resources_only(self):
+        base_dir = tempfile.mkdtemp(prefix='cate-test-ws-')
+        config = conf.get_config()
+        old_config = dict(config)
+        try:
+            for format_name, ext in [('netcdf4', 'nc'), ('zarr', 'zarr')]:
+                conf.set_config(dict(dataset_persistence_format=format_name, workspace_save_max_workers=2))
+                ws = Workspace(base_dir, Workspace.new_workflow())
+                written_res_names = []
+                write_resource_to_file = ws._write_resource_to_file
+
+                def _write_resource_to_file(res_name, *args):
+                    written_res_names.append(res_name)
+                    write_resource_to_file(res_name, *args)
+
+                ws._write_resource_to_file = _write_resource_to_file
+                ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_1), res_name='X')
+                ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_2), res_name='Y')
+                ws.set_resource_persistence('X', True)
+                ws.set_resource_persistence('Y', True)
+                ws.execute_workflow()
+
+                ws.save()
+                self.assertEqual(['X', 'Y'], sorted(written_res_names))
+                self.assertTrue(os.path.exists(os.path.join(ws.workspace_data_dir, 'X.' + ext)))
+                self.assertTrue(os.path.exists(os.path.join(ws.workspace_data_dir, 'Y.' + ext)))
+                self.assertEqual(['X.' + ext, 'X.' + ext + '.meta.json', 'Y.' + ext, 'Y.' + ext + '.meta.json',
+                                  'workflow.json'],
+                                 sorted(name for name in os.listdir(ws.workspace_data_dir)
+                                        if name.startswith(('X.', 'Y.', 'workflow'))))
+
+                ws.save()
+                self.assertEqual(['X', 'Y'], sorted(written_res_names))
+
+                ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_1),
+                                res_name='Y', overwrite=True)
+                ws.set_resource_persistence('Y', True)
+                ws.execute_workflow('Y')
+                ws.save()
+                self.assertEqual(['X', 'Y', 'Y'], sorted(written_res_names))
+                ws.close()
+
+                # Resources are read from files on first access and are not written again
+                ws = Workspace.open(base_dir)
+                self.assertTrue(ws.resource_cache.is_lazy('X'))
+                self.assertTrue(ws.resource_cache.is_lazy('Y'))
+                resources = ws.to_json_dict()['resources']
+                self.assertEqual(['X', 'Y'], [resource['name'] for resource in resources])
+                self.assertEqual(ws.resource_cache.get_id('X'), resources[0]['id'])
+                self.assertIn('precipitation', [variable['name'] for variable in resources[0]['variables']])
+                self.assertTrue(ws.resource_cache.is_lazy('X'))
+                self.assertTrue(ws.resource_cache.is_lazy('Y'))
+                self.assertIsInstance(ws.resource_cache.get('X'), xr.Dataset)
+                self.assertFalse(ws.resource_cache.is_lazy('X'))
+                expected = ws._get_resource_descriptor(resources[0]['id'], 0, 'X', ws.resource_cache['X'])
+                self.assertEqual(json.loads(json.dumps(expected)), json.loads(json.dumps(resources[0])))
+                written_res_names = []
+                write_resource_to_file = ws._write_resource_to_file
+                ws._write_resource_to_file = _write_resource_to_file
+                ws.save()
+                self.assertEqual([], written_res_names)
+                ws.close()
+                shutil.rmtree(base_dir)
+        finally:
+            config.clear()
+            config.update(old_config)
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    def test_to_json_dict_resource_changes(self):
+        ws = Workspace('/path', Workspace.new_workflow())
+        ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_1), res_name='X')
+        ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_2), res_name='Y')
+        ws.execute_workflow()
+        x_id = ws.resource_cache.get_id('X')
+        y_id = ws.resource_cache.get_id('Y')
+
+        resources = ws.to_json_dict()['resources']
+        self.assertEqual(['X', 'Y'], [resource['name'] for resource in resources])
+        # Descriptors are computed once per resource ID and update count
+        self.assertIs(resources[0], ws.to_json_dict()['resources'][0])
+
+        known_resources = dict()
+        changes = ws.to_json_dict(known_resources=known_resources)['resource_changes']
+        self.assertNotIn('resources', ws.to_json_dict(known_resources=dict()))
+        self.assertEqual(resources, changes['added'])
+        self.assertEqual([], changes['changed'])
+        self.assertEqual([], changes['removed'])
+        self.assertEqual([x_id, y_id], changes['ids'])
+        self.assertEqual({x_id: (0, 'X'), y_id: (0, 'Y')}, known_resources)
+
+        changes = ws.to_json_dict(known_resources=known_resources)['resource_changes']
+        self.assertEqual(dict(added=[], changed=[], removed=[], ids=[x_id, y_id]), changes)
+
+        ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_1),
+                        res_name='Y', overwrite=True)
+        ws.execute_workflow('Y')
+        ws.rename_resource('X', 'Z')
+        ws.set_resource('cate.ops.io.read_netcdf', mk_op_kwargs(file=NETCDF_TEST_FILE_2), res_name='W')
+        ws.execute_workflow('W')
+        w_id = ws.resource_cache.get_id('W')
+        changes = ws.to_json_dict(known_resources=known_resources)['resource_changes']
+        self.assertEqual(['W'], [resource['name'] for resource in changes['added']])
+        self.assertEqual(['Z', 'Y'], [resource['name'] for resource in changes['changed']])
+        self.assertEqual([], changes['removed'])
+        self.assertEqual([x_id, y_id, w_id], changes['ids'])
+
+        ws.delete_resource('Z')
+        changes = ws.to_json_dict(known_resources=known_resources)['resource_changes']
+        self.assertEqual(dict(added=[], changed=[], removed=[x_id], ids=[y_id, w_id]), changes)
+        self.assertEqual({y_id: (2, 'Y'), w_id: (0, 'W')}, known_resources)
+        ws.close()
+
     def test_workspace_can_create_new_res_names(self):
         ws = Workspace('/path', Workflow(OpMetaInfo('workspace_workflow', header=dict(description='Test!'))))
         res_name_1 = ws.set_resource('cate.ops.utility.identity', mk_op_kwargs(value='A'))
@@ -114,6 +114,28 @@ class TestLTA(TestCase):
             long_term_average(ds)
         self.assertIn('inconsistent seasons', str(err.exception))
 
+    def test_values(self):
+        """
+        Test that the long term averages equal grouped means and skip missing values
+        """
+        values = np.random.RandomState(0).uniform(size=(3, 4, 730))
+        values[0, 0, 10:50] = np.nan
+        for freq, periods, group in (('MS', 24, 'time.month'),
+                                     ('QS-DEC', 8, ['time.month', 'time.day']),
+                                     ('D', 730, 'time.dayofyear')):
+            ds = xr.Dataset({
+                'first': (['lat', 'lon', 'time'], values[..., :periods]),
+                'lat': np.linspace(-60, 60, 3),
+                'lon': np.linspace(-135, 135, 4),
+                'time': pd.date_range('2001-01-01', freq=freq, periods=periods)})
+            ds = adjust_temporal_attrs(ds)
+            actual = long_term_average(ds.chunk(chunks={'time': 5}))
+            if isinstance(group, list):
+                expected = ds.groupby(ds.time.dt.month * 100 + ds.time.dt.day).mean('time')
+            else:
+                expected = ds.groupby(group).mean('time')
+            np.testing.assert_almost_equal(actual['first'].values, expected['first'].values)
+
     def test_registered(self):
         """
         Test registered operation execution
@@ -301,6 +323,34 @@ class TestTemporalAggregation(TestCase):
 
         self.assertTrue(actual.broadcast_equals(ex))
 
+    def test_values(self):
+        """
+        Test that aggregated values equal those of xarray's resample
+        """
+        values = np.random.RandomState(0).uniform(size=(3, 4, 366))
+        values[0, 0, 10:50] = np.nan
+        ds = xr.Dataset({
+            'first': (['lat', 'lon', 'time'], values),
+            'second': (['lat', 'lon', 'time'], np.arange(3 * 4 * 366).reshape((3, 4, 366))),
+            'lat': np.linspace(-60, 60, 3),
+            'lon': np.linspace(-135, 135, 4),
+            'time': pd.date_range('2000-01-01', '2000-12-31')})
+        ds = adjust_temporal_attrs(ds)
+        for method in ('mean', 'sum'):
+            for period in ('MS', 'QS-DEC', 'W', '8D', '2D'):
+                actual = temporal_aggregation(ds.chunk(chunks={'time': 30}), method=method, period=period)
+                expected = getattr(ds.resample(time=period), method)()
+                np.testing.assert_equal(actual.time.values, expected.time.values)
+                for var_name in ('first', 'second'):
+                    self.assertEqual(actual[var_name].dims, ('time', 'lat', 'lon'))
+                    np.testing.assert_almost_equal(actual[var_name].values, expected[var_name].values)
+
+        # Time steps with gaps produce empty periods
+        ds_gaps = ds.isel(time=slice(0, 366, 40))
+        actual = temporal_aggregation(ds_gaps, method='mean', period='MS')
+        expected = ds_gaps.resample(time='MS').mean()
+        np.testing.assert_almost_equal(actual['first'].values, expected['first'].values)
+
     def test_registered(self):
         """
         Test registered operation execution
@@ -6,6 +6,9 @@ when using default upsampling/downsampling methods.
 
 """
 
+import os
+import time
+import unittest
 from unittest import TestCase
 
 import numpy as np
@@ -15,7 +18,7 @@ from numpy.testing import assert_almost_equal, assert_array_equal
 from cate.core.op import OP_REGISTRY
 from cate.util.misc import object_to_qualified_name
 
-from cate.ops import coregister
+from cate.ops import coregister, resampling
 from cate.ops.coregistration import _find_intersection
 from ..util.test_monitor import RecordingMonitor
 
@@ -618,6 +621,37 @@ class TestCoregistration(TestCase):
 
         assert_almost_equal(ds_fine_resampled['first'].values, expected['first'].values)
 
+    def test_lazy(self):
+        """
+        Test that the resampled variables are dask arrays chunked like the replica's
+        non-spatial dimensions and computed only on demand
+        """
+        ds_fine = xr.Dataset({
+            'first': (['time', 'lat', 'lon'], np.array([np.eye(4, 8), np.eye(4, 8), np.eye(4, 8)])),
+            'lat': np.linspace(-67.5, 67.5, 4),
+            'lon': np.linspace(-157.5, 157.5, 8),
+            'time': np.array([1, 2, 3])})
+
+        ds_coarse = xr.Dataset({
+            'first': (['time', 'lat', 'lon'], np.array([np.eye(3, 6), np.eye(3, 6), np.eye(3, 6)])),
+            'lat': np.linspace(-60, 60, 3),
+            'lon': np.linspace(-150, 150, 6),
+            'time': np.array([1, 2, 3])})
+
+        ds_chunked = coregister(ds_fine, ds_coarse.chunk(chunks={'time': 2, 'lat': 1, 'lon': 2}))
+        self.assertEqual(ds_chunked['first'].chunks, ((2, 1), (4,), (8,)))
+
+        ds_resampled = coregister(ds_fine, ds_coarse)
+        self.assertEqual(ds_resampled['first'].chunks, ((1, 1, 1), (4,), (8,)))
+
+        expected = np.array([[1., 0.28571429, 0., 0., 0., 0., 0., 0.],
+                             [0.33333333, 0.57142857, 0.38095238, 0., 0., 0., 0., 0.],
+                             [0., 0.47619048, 0.52380952, 0.28571429, 0.04761905, 0., 0., 0.],
+                             [0., 0., 0.42857143, 0.85714286, 0.14285714, 0., 0., 0.]])
+        for i in range(3):
+            assert_almost_equal(ds_resampled['first'].values[i], expected)
+            assert_almost_equal(ds_chunked['first'].values[i], expected)
+
     def test_same_grid(self):
         """
         Test the case when both datasets already have the same geospatial definition
@@ -645,3 +679,39 @@ class TestCoregistration(TestCase):
         ds_coreg = coregister(ds_subset, ds_fine, monitor=rm)
         self.assertEqual([], rm.records)
         assert_almost_equal(ds_coreg['first'].values, ds_subset['first'].values)
+
+
+@unittest.skipUnless(os.environ.get('CATE_ENABLE_PERF_TESTS', None) == '1', 'CATE_ENABLE_PERF_TESTS != 1')
+class CoregistrationPerfTest(TestCase):
+    """
+    Compares the batched coregistration of a daily replica with resampling it slice by slice,
+    which is how coregister() used to work.
+    """
+
+    def test_throughput(self):
+        num_times = 2000
+        ds_master = xr.Dataset({
+            'first': (['lat', 'lon'], np.zeros((180, 360))),
+            'lat': np.linspace(-89.5, 89.5, 180),
+            'lon': np.linspace(-179.5, 179.5, 360)})
+        ds_replica = xr.Dataset({
+            'first': (['time', 'lat', 'lon'], np.random.random((num_times, 72, 144))),
+            'lat': np.linspace(-88.75, 88.75, 72),
+            'lon': np.linspace(-178.75, 178.75, 144),
+            'time': np.arange(num_times)})
+
+        replica = ds_replica['first']
+        t0 = time.perf_counter()
+        slices = [xr.DataArray(resampling.resample_2d(np.ma.masked_invalid(replica.isel(time=i).values), 360, 180))
+                  for i in range(num_times)]
+        expected = xr.concat(slices, dim='time').values
+        duration_sliced = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        actual = coregister(ds_master, ds_replica)['first'].values
+        duration_batched = time.perf_counter() - t0
+
+        assert_almost_equal(actual, expected)
+        print(f'Coregistration of {num_times} time slices: '
+              f'sliced {num_times / duration_sliced:.1f} slices/s, '
+              f'batched {num_times / duration_batched:.1f} slices/s')
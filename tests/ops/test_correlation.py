@@ -209,6 +209,39 @@ class TestPearson(TestCase):
         self.assertTrue(np.all(np.isclose(correlation['p_value'].values,
                                           pv_sp)))
 
+    def test_missing_values_and_offset(self):
+        """
+        Test that only valid pairs contribute and that large offsets don't cancel out
+        """
+        x = 1.0e8 + np.linspace(0, 5, 6)
+        y = np.linspace(0, 5, 6)
+        y[0] = 3
+        x_3d = np.empty((2, 3, 6))
+        y_3d = np.empty((2, 3, 6))
+        x_3d[:] = x
+        y_3d[:] = y
+        x_3d[0, 0, 2] = np.nan
+        y_3d[1, 1, 0] = np.nan
+
+        ds1 = xr.Dataset({
+            'first': (['lat', 'lon', 'time'], x_3d),
+            'lat': np.linspace(-45, 45, 2),
+            'lon': np.linspace(-120, 120, 3),
+            'time': np.linspace(0, 5, 6)}).chunk(chunks={'time': 2})
+
+        ds2 = xr.Dataset({
+            'first': (['lat', 'lon', 'time'], y_3d),
+            'lat': np.linspace(-45, 45, 2),
+            'lon': np.linspace(-120, 120, 3),
+            'time': np.linspace(10, 15, 6)}).chunk(chunks={'time': 3})
+
+        correlation = pearson_correlation(ds1, ds2, 'first', 'first')
+
+        for (i, j), valid in (((0, 0), [0, 1, 3, 4, 5]), ((1, 1), [1, 2, 3, 4, 5]), ((0, 1), slice(None))):
+            cc_sp, pv_sp = pearsonr(x[valid], y[valid])
+            self.assertTrue(np.isclose(correlation['corr_coef'].values[i, j], cc_sp))
+            self.assertTrue(np.isclose(correlation['p_value'].values[i, j], pv_sp))
+
     def test_broadcasting(self):
         """
         Test a (3d, 1d) input pair
@@ -10,7 +10,8 @@ from shapely.geometry import Point
 from cate.core.types import GeoDataFrameProxy
 from cate.core.types import ValidationError
 from cate.ops.data_frame import data_frame_min, data_frame_max, data_frame_query, data_frame_find_closest, \
-    great_circle_distance, data_frame_aggregate, data_frame_subset
+    great_circle_distance, data_frame_aggregate, data_frame_subset, _get_geometry_index, _great_circle_distances, \
+    _union_geometries
 
 test_point = 'POINT (597842.4375881671 5519903.13366397)'
 
@@ -165,6 +166,45 @@ class TestDataFrameOps(TestCase):
         self.assertIsInstance(df2, gpd.GeoDataFrame)
         self.assertEqual(len(df2), 0)
 
+    def test_data_frame_subset_region_ops(self):
+        region = 'POLYGON((-10 0, 25 0, 25 30, -10 0))'
+        for region_op in ['intersects', 'disjoint', 'within', 'contains']:
+            expected = data_frame_query(TestDataFrameOps.gdf, f'@{region_op}("{region}")')
+            actual = data_frame_subset(TestDataFrameOps.gdf, region_op=region_op, region=region)
+            self.assertIsInstance(actual, gpd.GeoDataFrame)
+            self.assertEqual(list(expected['A']), list(actual['A']), msg=region_op)
+
+        df2 = data_frame_subset(TestDataFrameOps.gdf,
+                                region_op='disjoint',
+                                region='POLYGON((30 30, 40 30, 40 40, 30 30))')
+        self.assertEqual(6, len(df2))
+
+    def test_data_frame_find_closest_cached_index(self):
+        gdf = TestDataFrameOps.gdf.copy()
+        geometry_index = _get_geometry_index(gdf)
+        self.assertIs(geometry_index, _get_geometry_index(gdf))
+
+        df2 = data_frame_find_closest(gdf, 'POINT(10 12)', max_results=2, dist_col_name='dist')
+        self.assertEqual([1, 2], list(df2['A']))
+        df2 = data_frame_find_closest(gdf, 'POINT(19 29)', max_results=2, dist_col_name='dist')
+        self.assertEqual([4, 3], list(df2['A']))
+        df2 = data_frame_find_closest(gdf, 'POINT(-60 -60)', max_dist=10.0, dist_col_name='dist')
+        self.assertEqual(0, len(df2))
+        self.assertIs(geometry_index, _get_geometry_index(gdf))
+
+        # Geometries replaced in place invalidate the index
+        gdf.loc[0, 'geometry'] = Point(19, 29)
+        df2 = data_frame_find_closest(gdf, 'POINT(19 29)', dist_col_name='dist')
+        self.assertEqual([1], list(df2['A']))
+        geometry_index = _get_geometry_index(gdf)
+        self.assertIs(geometry_index, _get_geometry_index(gdf))
+
+        gdf['geometry'] = gpd.GeoSeries([Point(-10, -10)] * 6)
+        self.assertIsNot(geometry_index, _get_geometry_index(gdf))
+        df2 = data_frame_find_closest(gdf, 'POINT(-10 -10)', max_results=3, dist_col_name='dist')
+        self.assertEqual(3, len(df2))
+        np.testing.assert_almost_equal([0.0, 0.0, 0.0], df2['dist'])
+
     def test_data_frame_failures(self):
         df2 = data_frame_query(TestDataFrameOps.gdf_32718, "@within('" + test_poly_4326 + "')")
         self.assertIsInstance(df2, gpd.GeoDataFrame)
@@ -273,6 +313,23 @@ class TestDataFrameOps(TestCase):
         rdf = data_frame_aggregate(df=gdf, var_names=var_names_valid, aggregate_geometry=True)
         self.assertIsNotNone(rdf.geometry)
 
+        rdf = data_frame_aggregate(df=gdf, var_names=var_names_valid, aggregate_geometry=True, parallel_union=True)
+        self.assertIsNotNone(rdf.geometry)
+        self.assertEqual(3, len(rdf.geometry.iloc[0].geoms))
+
+    def test_union_geometries(self):
+        # A 40 x 40 grid of overlapping squares, more than a single batch
+        squares = [shapely.geometry.box(i, j, i + 1.5, j + 1.5) for j in range(40) for i in range(40)]
+        squares.insert(10, None)
+        for parallel in [False, True]:
+            union = _union_geometries(squares, parallel=parallel)
+            self.assertIsInstance(union, shapely.geometry.Polygon)
+            self.assertAlmostEqual(40.5 * 40.5, union.area)
+            self.assertEqual((0.0, 0.0, 40.5, 40.5), union.bounds)
+
+        union = _union_geometries([])
+        self.assertTrue(union.is_empty)
+
 
 class GreatCircleDistanceTest(TestCase):
     def test_great_circle_distance(self):
@@ -293,3 +350,12 @@ class GreatCircleDistanceTest(TestCase):
         np.testing.assert_approx_equal(180.0, dist)
         dist = great_circle_distance(Point(0, 0), Point(1, 1))
         np.testing.assert_approx_equal(1.4141777, dist)
+
+    def test_great_circle_distances(self):
+        lon1 = np.array([20., 20., -20., -155., 0., 0., 0.])
+        lat1 = np.array([20., 0., 0., 0., 0., -90., 0.])
+        lon2 = np.array([20., 20., 20., 155., 0., 0., 1.])
+        lat2 = np.array([20., 30., 0., 0., 90., 90., 1.])
+        expected = [great_circle_distance(Point(x1, y1), Point(x2, y2))
+                    for x1, y1, x2, y2 in zip(lon1, lat1, lon2, lat2)]
+        np.testing.assert_almost_equal(expected, _great_circle_distances(lon1, lat1, lon2, lat2))
@@ -82,3 +82,43 @@ class TestOutliers(TestCase):
                          ret_first.attrs['ancillary_variables']))
         self.assertTrue(('second ' in
                          ret_first.attrs['ancillary_variables']))
+
+    def test_multiple_variables(self):
+        ds = xr.Dataset({
+            'first': xr.DataArray(np.arange(16, dtype=float).reshape(4, 4), dims=('x', 'y')),
+            'second': xr.DataArray(np.arange(100, 116, dtype=float).reshape(4, 4), dims=('x', 'y'))
+        })
+        ret_ds = outliers.detect_outliers(ds, 'first,second')
+        for var_name in ('first', 'second'):
+            test = ds[var_name].copy()
+            test[0][0] = np.nan
+            test[3][3] = np.nan
+            self.assertTrue(test.identical(ret_ds[var_name]))
+
+    def test_approximate_quantiles(self):
+        values = np.random.RandomState(0).normal(size=(200, 300))
+        values[10:20, 30:40] = np.nan
+        ds = xr.Dataset({'first': xr.DataArray(values, dims=('y', 'x'))})
+        expected_low, expected_high = np.nanquantile(values, [0.05, 0.95])
+
+        # With summaries holding all values of a chunk, results are exact
+        actual_low, actual_high = outliers._get_quantiles(ds.chunk(chunks={'y': 50, 'x': 100})['first'],
+                                                          (0.05, 0.95), 1.0 / 5000)
+        self.assertAlmostEqual(expected_low, actual_low)
+        self.assertAlmostEqual(expected_high, actual_high)
+
+        for accuracy in (0.01, 0.001):
+            for chunked in (True, False):
+                arr = ds.chunk(chunks={'y': 50, 'x': 100})['first'] if chunked else ds['first']
+                actual_low, actual_high = outliers._get_quantiles(arr, (0.05, 0.95), accuracy)
+                valid = np.sort(values[~np.isnan(values)])
+                for q, actual in ((0.05, actual_low), (0.95, actual_high)):
+                    rank = np.searchsorted(valid, actual)
+                    self.assertLessEqual(abs(rank - q * valid.size), accuracy * valid.size + 1)
+
+        ret_ds = outliers.detect_outliers(ds.chunk(chunks={'y': 50}), 'first', quantile_accuracy=0.001)
+        num_valid = int(ds['first'].count())
+        num_removed = num_valid - int(ret_ds['first'].count())
+        self.assertLessEqual(abs(num_removed - 0.1 * num_valid), 2 * (0.001 * num_valid + 2))
+        with self.assertRaises(ValueError):
+            outliers.detect_outliers(ds, 'first', quantile_accuracy=1.5)
@@ -82,3 +82,116 @@ class Resample2dTest(unittest.TestCase):
                           8, 2, rs.DS_MEAN, rs.US_NEAREST,
                           [[1., 1., 1., 1., 2., 2., 3., 3.],
                            [3.5, 3.5, 3.5, 3.5, 3., 3., 3., 3.]])
+
+
+    def test_aggregate_w_mode(self):
+        # Partially covered source grid cells count with their fractional weight
+        _test_resample_2d([[1.0, 2.0, 2.0, 3.0, 4.0]],
+                          2, 1, rs.DS_MODE, rs.US_NEAREST,
+                          [[2.0, 3.0]])
+
+    def test_get_max_window_size(self):
+        # When downsampling 14 to 5 cells, the window of cell 1 is [2, 5], although int(14 / 5 + 1) is 3
+        self.assertEqual(rs._get_max_window_size(14, 5), 4)
+        self.assertEqual(rs._get_max_window_size(8, 4), 2)
+        self.assertEqual(rs._get_max_window_size(5, 2), 3)
+        self.assertEqual(rs._get_max_window_size(4, 4), 1)
+
+
+class ResampleNdTest(unittest.TestCase):
+    def test_equals_resample_2d(self):
+        src = np.random.RandomState(0).uniform(size=(2, 3, 8, 12))
+        src[0, 1, 2:4, 3:5] = np.nan
+        for w, h in ((6, 4), (24, 16), (6, 16), (24, 4), (12, 8)):
+            for ds_method in (rs.DS_FIRST, rs.DS_MEAN, rs.DS_MODE, rs.DS_STD):
+                for us_method in (rs.US_NEAREST, rs.US_LINEAR):
+                    actual = rs.resample_nd(src, w, h, ds_method=ds_method, us_method=us_method)
+                    self.assertEqual(actual.shape, (2, 3, h, w))
+                    self.assertEqual(actual.dtype, src.dtype)
+                    for i in range(2):
+                        for j in range(3):
+                            expected = rs.resample_2d(src[i, j], w, h, ds_method=ds_method, us_method=us_method,
+                                                      fill_value=np.nan)
+                            assert_almost_equal(actual[i, j], expected)
+
+    def test_missing_values(self):
+        src = np.array([[[1.0, np.nan, 3.0, 4.0],
+                         [1.0, np.nan, 3.0, 4.0]],
+                        [[np.nan, np.nan, 3.0, 4.0],
+                         [np.nan, np.nan, 3.0, 4.0]]])
+        assert_almost_equal(rs.resample_nd(src, 2, 1, ds_method=rs.DS_MEAN),
+                            np.array([[[1.0, 3.5]],
+                                      [[np.nan, 3.5]]]))
+        assert_almost_equal(rs.resample_nd(src, 2, 1, ds_method=rs.DS_MEAN, fill_value=-1.0),
+                            np.array([[[1.0, 3.5]],
+                                      [[-1.0, 3.5]]]))
+
+    def test_int_array(self):
+        src = np.array([np.eye(4, 8, dtype=np.int32), np.eye(4, 8, dtype=np.int32)])
+        actual = rs.resample_nd(src, 4, 2, ds_method=rs.DS_MODE)
+        self.assertEqual(actual.dtype, np.int32)
+        assert_almost_equal(actual, np.array([[[1, 0, 0, 0],
+                                               [0, 1, 0, 0]],
+                                              [[1, 0, 0, 0],
+                                               [0, 1, 0, 0]]]))
+
+    def test_no_op_and_errors(self):
+        src = np.zeros((2, 4, 4))
+        self.assertIs(rs.resample_nd(src, 4, 4), src)
+        with self.assertRaises(ValueError):
+            rs.resample_nd(np.zeros((4,)), 2, 2)
+        with self.assertRaises(ValueError):
+            rs.resample_nd(src, 2, 2, ds_method=rs.DS_MODE, mode_rank=0)
+
+
+class ResamplingPlanTest(unittest.TestCase):
+    def test_equals_resample_2d(self):
+        src = np.random.RandomState(1).uniform(size=(3, 9, 14))
+        src[1, 3:6, 2:7] = np.nan
+        for w, h in ((5, 4), (14, 9), (31, 20), (5, 20), (31, 4), (14, 4), (5, 9)):
+            for ds_method in (rs.DS_FIRST, rs.DS_LAST, rs.DS_MEAN, rs.DS_MODE, rs.DS_VAR, rs.DS_STD):
+                for us_method in (rs.US_NEAREST, rs.US_LINEAR):
+                    plan = rs.ResamplingPlan(14, 9, w, h, ds_method=ds_method, us_method=us_method)
+                    self.assertEqual(plan.src_shape, (9, 14))
+                    self.assertEqual(plan.shape, (h, w))
+                    actual = plan.resample(src)
+                    self.assertEqual(actual.shape, (3, h, w))
+                    for i in range(3):
+                        expected = rs.resample_2d(src[i], w, h, ds_method=ds_method, us_method=us_method,
+                                                  fill_value=np.nan)
+                        assert_almost_equal(actual[i], expected)
+
+    def test_reuse_and_out(self):
+        plan = rs.ResamplingPlan(8, 4, 4, 2)
+        src = np.array([np.eye(4, 8), 2 * np.eye(4, 8)])
+        out = np.zeros((2, 2, 4))
+        self.assertIs(plan.resample(src, out=out), out)
+        assert_almost_equal(out, np.array([[[0.5, 0., 0., 0.],
+                                            [0., 0.5, 0., 0.]],
+                                           [[1., 0., 0., 0.],
+                                            [0., 1., 0., 0.]]]))
+        assert_almost_equal(plan.resample(src[0]), out[0])
+        assert_almost_equal(plan.resample(np.ma.masked_invalid(src[1])), out[1])
+
+    def test_get_resampling_plan(self):
+        plan = rs.get_resampling_plan(8, 4, 4, 2, ds_method=rs.DS_MODE)
+        self.assertIs(rs.get_resampling_plan(8, 4, 4, 2, ds_method=rs.DS_MODE), plan)
+        self.assertIsNot(rs.get_resampling_plan(8, 4, 4, 2, ds_method=rs.DS_MEAN), plan)
+        self.assertEqual(plan.ds_method, rs.DS_MODE)
+        self.assertEqual(plan.us_method, rs.US_LINEAR)
+        self.assertEqual(plan.mode_rank, 1)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            rs.ResamplingPlan(8, 4, 0, 2)
+        with self.assertRaises(ValueError):
+            rs.ResamplingPlan(8, 4, 4, 2, ds_method=rs.US_LINEAR)
+        with self.assertRaises(ValueError):
+            rs.ResamplingPlan(4, 2, 8, 4, us_method=rs.DS_MEAN)
+        with self.assertRaises(ValueError):
+            rs.ResamplingPlan(8, 4, 4, 2, ds_method=rs.DS_MODE, mode_rank=0)
+        plan = rs.ResamplingPlan(8, 4, 4, 2)
+        with self.assertRaises(ValueError):
+            plan.resample(np.zeros((4, 4)))
+        with self.assertRaises(ValueError):
+            plan.resample(np.zeros((4, 8)), out=np.zeros((4, 2)))
@@ -7,9 +7,10 @@ from unittest import TestCase
 import numpy as np
 import xarray as xr
 import pandas as pd
+from shapely.geometry import MultiPolygon, Polygon
 
 from cate.core.op import OP_REGISTRY
-from cate.core.opimpl import subset_spatial_impl
+from cate.core.opimpl import subset_spatial_impl, get_polygon_mask_impl
 from cate.core.types import ValidationError
 from cate.ops import subset
 from cate.util.misc import object_to_qualified_name
@@ -253,9 +254,12 @@ class TestSubsetSpatial(TestCase):
             'lat': np.linspace(-89.5, 89.5, 180),
             'lon': np.linspace(-179.5, 179.5, 360)})
 
-        with self.assertRaises(Exception) as cm:
-            subset.subset_spatial(dataset, antimeridian_pol)
-        self.assertIn('anti-meridian', str(cm.exception))
+        actual = subset.subset_spatial(dataset, antimeridian_pol)
+        self.assertEqual(360, actual.lon.size)
+        self.assertEqual(1.0, actual.first.sel(lon=175.5, lat=25.5).values[0])
+        self.assertEqual(1.0, actual.first.sel(lon=-160.5, lat=25.5).values[0])
+        self.assertTrue(np.isnan(actual.first.sel(lon=0.5, lat=25.5).values[0]))
+        self.assertTrue(np.isnan(actual.second.sel(lon=-150.5, lat=25.5).values[0]))
 
     def test_antimeridian_arbitrary_inverted(self):
         antimeridian_pol = str('POLYGON(('
@@ -273,9 +277,12 @@ class TestSubsetSpatial(TestCase):
             'lat': np.linspace(89.5, -89.5, 180),
             'lon': np.linspace(-179.5, 179.5, 360)})
 
-        with self.assertRaises(Exception) as cm:
-            subset.subset_spatial(dataset, antimeridian_pol)
-        self.assertIn('anti-meridian', str(cm.exception))
+        actual = subset.subset_spatial(dataset, antimeridian_pol)
+        self.assertEqual(360, actual.lon.size)
+        self.assertEqual(1.0, actual.first.sel(lon=175.5, lat=25.5).values[0])
+        self.assertEqual(1.0, actual.first.sel(lon=-160.5, lat=25.5).values[0])
+        self.assertTrue(np.isnan(actual.first.sel(lon=0.5, lat=25.5).values[0]))
+        self.assertTrue(np.isnan(actual.second.sel(lon=-150.5, lat=25.5).values[0]))
 
     def test_select_single_center(self):
         """
@@ -454,6 +461,55 @@ class TestSubsetSpatial(TestCase):
         xr.testing.assert_equal(expected.third, actual.third)
 
 
+class TestGetPolygonMask(TestCase):
+    def setUp(self):
+        self.dataset = xr.Dataset({
+            'first': (['lat', 'lon'], np.ones([10, 20])),
+            'lat': np.linspace(-4.5, 4.5, 10),
+            'lon': np.linspace(-9.5, 9.5, 20)})
+
+    def test_polygon_with_hole(self):
+        polygon = Polygon([(-5, -3), (5, -3), (5, 3), (-5, 3)],
+                          holes=[[(-2, -1), (2, -1), (2, 1), (-2, 1)]])
+        mask = get_polygon_mask_impl(self.dataset, polygon, use_corners=False)
+        self.assertEqual(('lat', 'lon'), mask.dims)
+        self.assertEqual(bool, mask.dtype)
+        self.assertTrue(mask.sel(lon=-4.5, lat=-2.5).values)
+        self.assertTrue(mask.sel(lon=4.5, lat=2.5).values)
+        self.assertFalse(mask.sel(lon=0.5, lat=0.5).values)
+        self.assertFalse(mask.sel(lon=5.5, lat=0.5).values)
+        self.assertEqual(10 * 6 - 4 * 2, int(mask.sum()))
+
+    def test_multi_polygon(self):
+        polygon = MultiPolygon([Polygon([(-9, -4), (-7, -4), (-7, -2), (-9, -2)]),
+                                Polygon([(7, 2), (9, 2), (9, 4), (7, 4)])])
+        mask = get_polygon_mask_impl(self.dataset, polygon, use_corners=False)
+        self.assertEqual(8, int(mask.sum()))
+        self.assertTrue(mask.sel(lon=-8.5, lat=-3.5).values)
+        self.assertTrue(mask.sel(lon=8.5, lat=3.5).values)
+        self.assertFalse(mask.sel(lon=0.5, lat=0.5).values)
+
+    def test_corners(self):
+        polygon = Polygon([(-1.1, -1.1), (1.1, -1.1), (1.1, 1.1), (-1.1, 1.1)])
+        self.assertEqual(4, int(get_polygon_mask_impl(self.dataset, polygon, use_corners=False).sum()))
+        self.assertEqual(16, int(get_polygon_mask_impl(self.dataset, polygon).sum()))
+
+    def test_inverted_lat(self):
+        dataset = self.dataset.isel(lat=slice(None, None, -1))
+        polygon = Polygon([(-9, 0), (9, 0), (9, 4), (-9, 4)])
+        mask = get_polygon_mask_impl(dataset, polygon, use_corners=False)
+        self.assertTrue(mask.sel(lon=0.5, lat=3.5).values)
+        self.assertFalse(mask.sel(lon=0.5, lat=-3.5).values)
+        self.assertEqual(18 * 4, int(mask.sum()))
+
+    def test_chunked(self):
+        dataset = self.dataset.chunk(chunks={'lat': 5, 'lon': 10})
+        polygon = Polygon([(-5, -3), (5, -3), (5, 3), (-5, 3)])
+        mask = get_polygon_mask_impl(dataset, polygon, use_corners=False)
+        self.assertEqual(((5, 5), (10, 10)), mask.chunks)
+        self.assertEqual(10 * 6, int(mask.sum()))
+
+
 class TestSubsetTemporal(TestCase):
     def test_subset_temporal(self):
         # Test general functionality
@@ -617,3 +673,28 @@ class TestExtractPoint(TestCase):
 
         result = subset.extract_point(self._ds, (12.2, 23.2), indexers={'d1': 1.1, 'd2': '2000-03-01'})
         self.assertEqual({'lat': 23.0, 'lon': 12.0, 'v2': 106.0, 'v4': 53.0}, result)
+
+    def test_extract_points(self):
+        points = [(12.2, 23.2), (0, 0), (13.9, 21.6), (14.1, 24.4)]
+        result = subset.extract_points(self._ds, points, indexers={'d1': 2, 'd2': '2000-03-01'})
+        self.assertEqual([{'lat': 23.0, 'lon': 12.0, 'v1': 7.0, 'v2': 106.0, 'v3': 14.0, 'v4': 53.0},
+                          {},
+                          {'lat': 22.0, 'lon': 14.0, 'v1': 5.0, 'v2': 104.0, 'v3': 10.0, 'v4': 52.0},
+                          {'lat': 24.0, 'lon': 14.0, 'v1': 17.0, 'v2': 116.0, 'v3': 34.0, 'v4': 58.0}],
+                         result)
+        self.assertEqual([], subset.extract_points(self._ds, []))
+
+    def test_extract_points_chunked(self):
+        ds = self._ds.chunk(chunks={'lat': 2, 'lon': 2})
+        points = [(12.2, 23.2), (13.9, 21.6), (14.1, 24.4), (12.0, 22.0)]
+        indexers = {'d1': 2, 'd2': '2000-03-01'}
+        expected = subset.extract_points(self._ds, points, indexers=indexers)
+        self.assertEqual(expected, subset.extract_points(ds, points, indexers=indexers))
+        # Now from cached chunks
+        self.assertEqual(expected, subset.extract_points(ds, points, indexers=indexers))
+        self.assertEqual(expected[1], subset.extract_point(ds, points[1], indexers=indexers))
+
+    def test_descending_lat(self):
+        ds = self._ds.isel(lat=slice(None, None, -1))
+        result = subset.extract_point(ds, (12.2, 23.2), indexers={'d1': 2, 'd2': '2000-03-01'})
+        self.assertEqual({'lat': 23.0, 'lon': 12.0, 'v1': 7.0, 'v2': 106.0, 'v3': 14.0, 'v4': 53.0}, result)
@@ -1,10 +1,20 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
 from unittest import TestCase
 
+import dask.array as da
 import numpy as np
+import xarray as xr
 
+from cate.util.cache import Cache, MemoryCacheStore
+from cate.util.executor import PriorityThreadPoolExecutor
 from cate.util.im import TilingScheme, GeoExtent
 from cate.util.im.image import ImagePyramid, OpImage, create_ndarray_downsampling_image, \
-    TransformArrayImage, FastNdarrayDownsamplingImage
+    TransformArrayImage, FastNdarrayDownsamplingImage, TileComputationTable, get_tile_computation_table, \
+    PyramidPrefetcher, ArrayBlockReader, ColorMappedRgbaImage, get_cmap_lut, quantize_ndarray
 from cate.util.im.utils import aggregate_ndarray_mean
 
 
@@ -20,6 +30,87 @@ class MyTiledImage(OpImage):
         return np.full((th, tw), fill_value, np.float32)
 
 
+class BlockingTiledImage(OpImage):
+    def __init__(self, size, tile_size, release_event):
+        super().__init__(size, tile_size, (size[0] // tile_size[0], size[1] // tile_size[1]),
+                         mode='int32', format='ndarray')
+        self.release_event = release_event
+        self.num_computed = 0
+
+    def compute_tile(self, tile_x, tile_y, rectangle):
+        self.num_computed += 1
+        self.release_event.wait()
+        if tile_x < 0:
+            raise ValueError('tile_x must not be negative')
+        x, y, tw, th = rectangle
+        return np.full((th, tw), x + y, np.int32)
+
+
+class TileComputationTableTest(TestCase):
+    def test_concurrent_requests_compute_once(self):
+        release_event = threading.Event()
+        source_image = BlockingTiledImage((8, 8), (4, 4), release_event)
+        target_image = TransformArrayImage(source_image, force_masked=False)
+        table = get_tile_computation_table()
+        table.reset_stats()
+
+        tiles = []
+
+        def get_tile():
+            tiles.append(target_image.get_tile(1, 1))
+
+        threads = [threading.Thread(target=get_tile) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while table.num_hits + table.num_misses < 9:
+            # 8 requests for the target tile + 1 for the source tile
+            release_event.wait(0.01)
+        release_event.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(source_image.num_computed, 1)
+        self.assertEqual(len(tiles), 8)
+        for tile in tiles:
+            self.assertEqual(tile.tolist(), [[8, 8, 8, 8]] * 4)
+        self.assertEqual(table.num_misses, 2)
+        self.assertEqual(table.num_hits, 7)
+        self.assertEqual(table.num_in_flight, 0)
+
+    def test_error_is_propagated_to_waiters(self):
+        table = TileComputationTable()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def compute_tile():
+            started.set()
+            release.wait()
+            raise ValueError('failed')
+
+        def get_tile():
+            try:
+                table.compute('t', compute_tile)
+            except ValueError as e:
+                errors.append(e)
+
+        owner = threading.Thread(target=get_tile)
+        owner.start()
+        started.wait()
+        waiter = threading.Thread(target=get_tile)
+        waiter.start()
+        while table.num_hits < 1:
+            release.wait(0.01)
+        release.set()
+        owner.join()
+        waiter.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+        self.assertEqual(table.num_in_flight, 0)
+        self.assertEqual(table.compute('t', lambda: 42), 42)
+
+
 class NdarrayImageTest(TestCase):
     def test_default(self):
         a = np.arange(0, 24, dtype=np.int32)
@@ -170,6 +261,51 @@ class NdarrayImageTest(TestCase):
                                              [np.nan, np.nan, np.nan, np.nan]]))
 
 
+class ColorMappedRgbaImageTest(TestCase):
+    def test_get_cmap_lut(self):
+        lut = get_cmap_lut('jet', 256)
+        self.assertEqual(lut.shape, (257, 4))
+        self.assertEqual(lut.dtype, np.uint8)
+        self.assertFalse(lut.flags.writeable)
+        self.assertEqual(lut[-1].tolist(), [0, 0, 0, 0])
+        self.assertIs(get_cmap_lut('jet', 256), lut)
+
+    def test_quantize_ndarray(self):
+        a = np.array([[-1.0, 0.0, 0.5, 1.0],
+                      [2.0, np.nan, -999.0, 0.25]], dtype=np.float32)
+        mask = np.array([[False, False, False, False],
+                         [False, False, False, True]])
+        indices = quantize_ndarray(a, (0.0, 1.0), 4, mask=mask, no_data_value=-999.0)
+        self.assertEqual(indices.dtype, np.uint8)
+        self.assertEqual(indices.tolist(), [[0, 0, 2, 3],
+                                            [3, 4, 4, 4]])
+        self.assertEqual(quantize_ndarray(a, (0.0, 1.0), 1024).dtype, np.uint16)
+
+    def test_equals_matplotlib_colors(self):
+        from matplotlib import cm
+        from matplotlib.colors import Normalize
+        a = np.linspace(-0.2, 1.2, 64 * 64, dtype=np.float32).reshape((64, 64))
+        a[0, :] = np.nan
+        image = ColorMappedRgbaImage(FastNdarrayDownsamplingImage(a, (64, 64), 0),
+                                     value_range=(0.0, 1.0), cmap_name='viridis')
+        tile = image.get_tile(0, 0)
+        cmap = cm.get_cmap('viridis', 256)
+        expected = cmap(Normalize(0.0, 1.0)(np.ma.masked_invalid(a)), bytes=True)
+        expected[0, :] = 0
+        np.testing.assert_equal(tile, expected)
+
+    def test_encoded_tiles(self):
+        a = np.linspace(0.0, 1.0, 64 * 64, dtype=np.float32).reshape((64, 64))
+        for format, encode_options, magic in (('PNG', dict(compress_level=1), b'\x89PNG'),
+                                              ('JPEG', dict(quality=80), b'\xff\xd8'),
+                                              ('WEBP', dict(quality=80), b'RIFF')):
+            image = ColorMappedRgbaImage(FastNdarrayDownsamplingImage(a, (64, 64), 0),
+                                         encode=True, format=format, encode_options=encode_options)
+            tile = image.get_tile(0, 0)
+            self.assertIsInstance(tile, bytes, msg=format)
+            self.assertTrue(tile.startswith(magic), msg=format)
+
+
 class ImagePyramidTest(TestCase):
     def test_create_from_image(self):
         width = 8640
@@ -306,3 +442,179 @@ class ImagePyramidTest(TestCase):
         self.assertEqual((1, 270, 270), tile_0_1_0.shape)
         self.assertAlmostEqual(0, tile_0_1_0[..., 0, 0])
         self.assertAlmostEqual(0, tile_0_1_0[..., 269, 269])
+
+
+class PyramidPrefetcherTest(TestCase):
+    @staticmethod
+    def _new_pyramid(cache):
+        array = np.zeros((1, 64, 128), dtype=np.float32)
+        tiling_scheme = TilingScheme.create(128, 64, 16, 16, geo_extent=GeoExtent())
+        return ImagePyramid.create_from_array(array, tiling_scheme,
+                                              level_image_id_factory=lambda z: 'prefetch-test/%d' % z,
+                                              tile_cache=cache)
+
+    def test_prefetch_levels(self):
+        cache = Cache(MemoryCacheStore(), capacity=1024 * 1024)
+        pyramid = self._new_pyramid(cache)
+        self.assertEqual(3, pyramid.num_levels)
+
+        prefetcher = PyramidPrefetcher(pyramid, 1)
+        with PriorityThreadPoolExecutor(max_workers=2) as executor:
+            futures = prefetcher.start(executor, priority=10)
+            for future in futures:
+                future.result()
+
+        # 2 x 1 tiles at level 0, 4 x 2 tiles at level 1
+        self.assertEqual(10, len(futures))
+        self.assertEqual(10, prefetcher.num_tiles)
+        self.assertEqual(10 * 16 * 16 * 4, prefetcher.num_bytes)
+        self.assertIsNotNone(cache.get_value('prefetch-test/0/1/0'))
+        self.assertIsNotNone(cache.get_value('prefetch-test/1/3/1'))
+        self.assertIsNone(cache.get_value('prefetch-test/2/0/0'))
+
+    def test_byte_budget(self):
+        cache = Cache(MemoryCacheStore(), capacity=1024 * 1024)
+        pyramid = self._new_pyramid(cache)
+
+        prefetcher = PyramidPrefetcher(pyramid, 2, max_num_bytes=3 * 16 * 16 * 4)
+        with PriorityThreadPoolExecutor(max_workers=1) as executor:
+            for future in prefetcher.start(executor):
+                future.result()
+
+        self.assertEqual(3, prefetcher.num_tiles)
+        self.assertTrue(prefetcher.is_exhausted)
+
+    def test_cancel(self):
+        pyramid = self._new_pyramid(None)
+        prefetcher = PyramidPrefetcher(pyramid, 2, max_duration=60.)
+        self.assertFalse(prefetcher.is_exhausted)
+        prefetcher.cancel()
+        self.assertTrue(prefetcher.is_exhausted)
+        with PriorityThreadPoolExecutor(max_workers=1) as executor:
+            for future in prefetcher.start(executor):
+                future.result()
+        self.assertEqual(0, prefetcher.num_tiles)
+
+
+class CountingArray:
+    """A numpy-like, chunked array that counts the reads."""
+
+    def __init__(self, array, chunks):
+        self.array = array
+        self.chunks = chunks
+        self.num_reads = 0
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def ndim(self):
+        return self.array.ndim
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def __getitem__(self, item):
+        self.num_reads += 1
+        return self.array[item]
+
+
+class ArrayBlockReaderTest(TestCase):
+    def test_read_window(self):
+        array = np.arange(0, 3 * 37 * 53, dtype=np.int32).reshape((3, 37, 53))
+        reader = ArrayBlockReader(array, ((10, 10, 10, 7), (20, 20, 13)), Cache(capacity=1024 * 1024))
+        for step in (1, 2, 3, 8):
+            for x, y, w, h in ((0, 0, 53, 37), (5, 7, 16, 16), (15, 9, 30, 20), (40, 30, 20, 20), (52, 36, 8, 8)):
+                expected = array[..., y:y + h:step, x:x + w:step]
+                actual = reader.read_window(x, y, w, h, step)
+                self.assertEqual(expected.shape, actual.shape)
+                np.testing.assert_equal(actual, expected)
+
+    def test_blocks_are_read_once(self):
+        source_array = np.random.random((64, 96)).astype(np.float32)
+        array = CountingArray(source_array, (32, 32))
+        tiling_scheme = TilingScheme.create(96, 64, 16, 16, geo_extent=GeoExtent())
+        pyramid = ImagePyramid.create_from_array(array, tiling_scheme,
+                                                 block_cache=Cache(capacity=1024 * 1024))
+        tw, th = pyramid.tile_size
+        for z_index in range(pyramid.num_levels):
+            level_image = pyramid.get_level_image(z_index)
+            step = 1 << (pyramid.num_levels - 1 - z_index)
+            num_tiles_x, num_tiles_y = level_image.num_tiles
+            for tile_y in range(num_tiles_y):
+                for tile_x in range(num_tiles_x):
+                    tile = level_image.get_tile(tile_x, tile_y)
+                    x, y = tw * tile_x * step, th * tile_y * step
+                    expected = source_array[y:y + th * step:step, x:x + tw * step:step]
+                    np.testing.assert_equal(tile, expected)
+        # 2 x 3 chunks
+        self.assertEqual(6, array.num_reads)
+
+    def test_from_array(self):
+        cache = Cache(capacity=1024)
+        self.assertIsNone(ArrayBlockReader.from_array(np.zeros((10, 10)), cache))
+        self.assertIsNone(ArrayBlockReader.from_array(CountingArray(np.zeros((10, 10)), (10, 10)), cache))
+        self.assertIsNone(ArrayBlockReader.from_array(CountingArray(np.zeros((10, 10)), (5, 5)), None))
+
+        reader = ArrayBlockReader.from_array(CountingArray(np.zeros((1, 10, 10)), (1, 4, 5)), cache)
+        self.assertIsNotNone(reader)
+        np.testing.assert_equal(reader.read_window(0, 0, 10, 10), np.zeros((1, 10, 10)))
+
+        dask_array = xr.DataArray(da.zeros((10, 12), chunks=(5, 4)), dims=('lat', 'lon'))
+        reader = ArrayBlockReader.from_array(dask_array, cache)
+        self.assertIsNotNone(reader)
+        np.testing.assert_equal(reader.read_window(3, 3, 6, 6, 2), np.zeros((3, 3)))
+
+        with self.assertRaises(ValueError):
+            ArrayBlockReader(np.zeros((10, 10)), ((5, 4), (5, 5)), cache)
+
+    def test_from_array_with_large_blocks(self):
+        array = CountingArray(np.zeros((256, 256)), (128, 128))
+        self.assertIsNotNone(ArrayBlockReader.from_array(array, Cache(capacity=1024 * 1024), tile_size=(16, 16)))
+        # Blocks that cover too many tiles
+        self.assertIsNone(ArrayBlockReader.from_array(array, Cache(capacity=1024 * 1024), tile_size=(8, 8)))
+        # Blocks that do not fit into the cache
+        self.assertIsNone(ArrayBlockReader.from_array(array, Cache(capacity=64 * 1024)))
+
+    def test_large_blocks_are_not_cached(self):
+        cache = Cache(capacity=1024)
+        reader = ArrayBlockReader(np.ones((20, 20)), ((10, 10), (10, 10)), cache)
+        np.testing.assert_equal(reader.read_window(0, 0, 20, 20), np.ones((20, 20)))
+        self.assertEqual(0, cache.size)
+
+
+@unittest.skipUnless(os.environ.get('CATE_ENABLE_PERF_TESTS', None) == '1', 'CATE_ENABLE_PERF_TESTS != 1')
+class ArrayBlockReaderPerfTest(TestCase):
+    """
+    Compares the tile throughput for a compressed, chunked SST-like variable
+    with and without block reader.
+    """
+
+    def test_tile_throughput(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'sst.nc')
+            height, width = 1800, 3600
+            lat = np.linspace(89.95, -89.95, height)
+            lon = np.linspace(-179.95, 179.95, width)
+            sst = 273.15 + 30 * np.cos(np.radians(lat))[:, np.newaxis] + np.random.random((height, width))
+            xr.Dataset(dict(sst=(('lat', 'lon'), sst.astype(np.float32))), coords=dict(lat=lat, lon=lon)) \
+                .to_netcdf(path, encoding=dict(sst=dict(zlib=True, complevel=5, chunksizes=(500, 500))))
+
+            for use_block_cache in (False, True):
+                with xr.open_dataset(path, chunks=dict(lat=500, lon=500)) as dataset:
+                    tiling_scheme = TilingScheme.create(width, height, 360, 360, geo_extent=GeoExtent())
+                    block_cache = Cache(capacity=256 * 1024 * 1024) if use_block_cache else None
+                    pyramid = ImagePyramid.create_from_array(dataset.sst, tiling_scheme, block_cache=block_cache)
+                    num_tiles = 0
+                    t0 = time.perf_counter()
+                    for z_index in range(pyramid.num_levels):
+                        num_tiles_x, num_tiles_y = pyramid.get_level_image(z_index).num_tiles
+                        for tile_y in range(num_tiles_y):
+                            for tile_x in range(num_tiles_x):
+                                pyramid.get_tile(tile_x, tile_y, z_index)
+                                num_tiles += 1
+                    duration = time.perf_counter() - t0
+                    print(f'{"with" if use_block_cache else "without"} block cache: '
+                          f'{num_tiles} tiles, {num_tiles / duration:.1f} tiles/s')
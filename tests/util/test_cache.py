@@ -1,8 +1,13 @@
 import os
+import random
 import shutil
+import threading
+import time
+import unittest
 from unittest import TestCase
 
-from cate.util.cache import CacheStore, Cache, MemoryCacheStore, FileCacheStore
+from cate.util.cache import CacheStore, Cache, MemoryCacheStore, FileCacheStore, ShardedCache
+from cate.util.cache import POLICY_LRU, POLICY_MRU, POLICY_LFU, POLICY_RR
 
 
 class MemoryCacheStoreTest(TestCase):
@@ -188,3 +193,166 @@ class CacheTest(TestCase):
         self.assertEqual(cache.get_value('k5'), 'yyyy')
         self.assertEqual(cache.size, 600)
         self.assertEqual(cache_store.trace, 'can_load_from_key(k5);load_from_key(k5);restore(k5, S/yyyy);')
+
+
+class CachePolicyTest(TestCase):
+    @staticmethod
+    def _new_cache(policy):
+        cache = Cache(store=TracingCacheStore(), capacity=1000, policy=policy)
+        cache.put_value('k1', 'x')
+        cache.put_value('k2', 'x')
+        cache.put_value('k3', 'x')
+        cache.put_value('k4', 'x')
+        cache.put_value('k5', 'x')
+        return cache
+
+    @staticmethod
+    def _keys(cache):
+        return sorted(key for key in ('k1', 'k2', 'k3', 'k4', 'k5', 'k6', 'k7')
+                      if key in cache._item_dict)
+
+    def test_lru(self):
+        cache = self._new_cache(POLICY_LRU)
+        cache.get_value('k1')
+        cache.get_value('k2')
+        cache.put_value('k6', 'xxxx')
+        self.assertEqual(cache.size, 700)
+        self.assertEqual(self._keys(cache), ['k1', 'k2', 'k5', 'k6'])
+
+    def test_mru(self):
+        cache = self._new_cache(POLICY_MRU)
+        cache.get_value('k1')
+        cache.get_value('k2')
+        cache.put_value('k6', 'xxxx')
+        self.assertEqual(cache.size, 700)
+        self.assertEqual(self._keys(cache), ['k3', 'k4', 'k5', 'k6'])
+
+    def test_lfu(self):
+        cache = self._new_cache(POLICY_LFU)
+        for i in range(3):
+            cache.get_value('k1')
+            cache.get_value('k3')
+        cache.get_value('k5')
+        cache.get_value('k5')
+        cache.get_value('k4')
+        cache.put_value('k6', 'xxxx')
+        self.assertEqual(cache.size, 700)
+        self.assertEqual(self._keys(cache), ['k1', 'k3', 'k5', 'k6'])
+        cache.put_value('k7', 'xx')
+        self.assertEqual(cache.size, 500)
+        self.assertEqual(self._keys(cache), ['k1', 'k3', 'k5', 'k7'])
+
+    def test_rr(self):
+        cache = self._new_cache(POLICY_RR)
+        cache.put_value('k6', 'xxxx')
+        self.assertEqual(cache.size, 700)
+        self.assertIn('k6', self._keys(cache))
+        self.assertEqual(len(self._keys(cache)), 4)
+
+    def test_custom_policy(self):
+        cache = self._new_cache(lambda item: -int(item.key[1:]))
+        cache.put_value('k6', 'xxxx')
+        self.assertEqual(cache.size, 700)
+        self.assertEqual(self._keys(cache), ['k1', 'k2', 'k3', 'k6'])
+
+    def test_remove_and_clear(self):
+        for policy in (POLICY_LRU, POLICY_MRU, POLICY_LFU, POLICY_RR):
+            cache = self._new_cache(policy)
+            cache.remove_value('k3')
+            cache.remove_value('k5')
+            cache.put_value('k1', 'xx')
+            self.assertEqual(cache.size, 400)
+            self.assertEqual(self._keys(cache), ['k1', 'k2', 'k4'])
+            cache.clear()
+            self.assertEqual(cache.size, 0)
+            self.assertEqual(self._keys(cache), [])
+
+
+class ShardedCacheTest(TestCase):
+    def test_store_and_restore_and_discard(self):
+        cache_store = TracingCacheStore()
+        cache = ShardedCache(store=cache_store, capacity=1000, num_shards=4)
+
+        self.assertIs(cache.store, cache_store)
+        self.assertEqual(cache.num_shards, 4)
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.max_size, 750)
+
+        cache.put_value('k1', 'x')
+        cache.put_value('k2', 'xx')
+        self.assertEqual(cache.get_value('k1'), 'x')
+        self.assertEqual(cache.get_value('k2'), 'xx')
+        self.assertEqual(cache.get_value('k3'), None)
+        self.assertEqual(cache.size, 300)
+
+        cache.remove_value('k1')
+        self.assertEqual(cache.get_value('k1'), None)
+        self.assertEqual(cache.size, 200)
+
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+
+    def test_common_capacity(self):
+        cache = ShardedCache(store=TracingCacheStore(), capacity=1000, num_shards=8)
+        for i in range(100):
+            cache.put_value('k%d' % i, 'x')
+            self.assertLessEqual(cache.size, 750)
+            self.assertEqual(cache.get_value('k%d' % i), 'x')
+        self.assertEqual(cache.size, 700)
+        # Most recently used items survive in their shards
+        self.assertEqual(cache.get_value('k99'), 'x')
+        self.assertEqual(cache.get_value('k0'), None)
+
+        cache.put_value('k100', 'xxxxxxx')
+        self.assertLessEqual(cache.size, 750)
+        self.assertEqual(cache.get_value('k100'), 'xxxxxxx')
+
+    def test_invalid_num_shards(self):
+        with self.assertRaises(ValueError):
+            ShardedCache(num_shards=0)
+
+    def test_concurrent_access(self):
+        cache = ShardedCache(store=_UnitSizeCacheStore(), capacity=500, threshold=1.0)
+
+        def run(offset):
+            for i in range(2000):
+                key = (offset + i) % 1000
+                if cache.get_value(key) is None:
+                    cache.put_value(key, key)
+
+        threads = [threading.Thread(target=run, args=(offset,)) for offset in range(0, 800, 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(cache.size, 500)
+
+
+class _UnitSizeCacheStore(MemoryCacheStore):
+    def store_value(self, key, value):
+        return [key, value], 1
+
+
+@unittest.skipUnless(os.environ.get('CATE_ENABLE_PERF_TESTS', None) == '1', 'CATE_ENABLE_PERF_TESTS != 1')
+class CachePerfTest(TestCase):
+    """
+    Measures the steady-state throughput of a full tile cache, where half of the requests are misses
+    followed by a put_value() that evicts another item.
+    """
+
+    def test_steady_state_throughput(self):
+        for policy_name, policy in (('LRU', POLICY_LRU), ('LFU', POLICY_LFU), ('RR', POLICY_RR)):
+            for num_entries in (10_000, 100_000, 1_000_000):
+                cache = Cache(store=_UnitSizeCacheStore(), capacity=num_entries, threshold=1.0, policy=policy)
+                for i in range(num_entries):
+                    cache.put_value(i, i)
+                num_requests = 100_000
+                keys = [random.randrange(2 * num_entries) for _ in range(num_requests)]
+                t0 = time.perf_counter()
+                for key in keys:
+                    if cache.get_value(key) is None:
+                        cache.put_value(key, key)
+                duration = time.perf_counter() - t0
+                self.assertEqual(cache.size, num_entries)
+                print(f'Cache {policy_name} with {num_entries} entries: '
+                      f'{round(num_requests / duration)} requests/s')
@@ -0,0 +1,54 @@
+import threading
+from unittest import TestCase
+
+from cate.util.executor import PriorityThreadPoolExecutor
+
+
+class PriorityThreadPoolExecutorTest(TestCase):
+    def test_priority_order(self):
+        executor = PriorityThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        executed = []
+        blocker = executor.submit(release.wait)
+        futures = [executor.submit_with_priority(priority, executed.append, name)
+                   for priority, name in ((2, 'c'), (0, 'a'), (1, 'b1'), (1, 'b2'), (3, 'd'))]
+        release.set()
+        for future in futures:
+            future.result()
+        self.assertTrue(blocker.result())
+        self.assertEqual(executed, ['a', 'b1', 'b2', 'c', 'd'])
+        executor.shutdown()
+
+    def test_cancel_pending(self):
+        executor = PriorityThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        executed = []
+        executor.submit(release.wait)
+        future1 = executor.submit(executed.append, 1)
+        future2 = executor.submit(executed.append, 2)
+        self.assertTrue(future1.cancel())
+        release.set()
+        future2.result()
+        self.assertTrue(future1.cancelled())
+        self.assertEqual(executed, [2])
+        executor.shutdown()
+
+    def test_exception(self):
+        executor = PriorityThreadPoolExecutor(max_workers=2)
+
+        def fail():
+            raise ValueError('failed')
+
+        future = executor.submit(fail)
+        with self.assertRaises(ValueError):
+            future.result()
+        self.assertEqual(executor.submit(lambda x: 2 * x, 21).result(), 42)
+        executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            executor.submit(fail)
+
+    def test_max_workers(self):
+        self.assertEqual(PriorityThreadPoolExecutor(max_workers=3).max_workers, 3)
+        self.assertGreaterEqual(PriorityThreadPoolExecutor().max_workers, 1)
+        with self.assertRaises(ValueError):
+            PriorityThreadPoolExecutor(max_workers=0)
@@ -0,0 +1,73 @@
+import gc
+import threading
+from unittest import TestCase
+
+from cate.util.weakcache import WeakIdentityCache
+
+
+class _Object:
+    # Unhashable, like datasets and data frames
+    __hash__ = None
+
+
+class WeakIdentityCacheTest(TestCase):
+    def test_get_or_create(self):
+        cache = WeakIdentityCache()
+        obj = _Object()
+        values = []
+
+        def create_value():
+            values.append(len(values))
+            return values[-1]
+
+        self.assertEqual(cache.get_or_create(obj, create_value), 0)
+        self.assertEqual(cache.get_or_create(obj, create_value), 0)
+        self.assertEqual(cache.get(obj), 0)
+        self.assertEqual(len(cache), 1)
+
+        # Invalid values are created again
+        self.assertEqual(cache.get_or_create(obj, create_value, is_valid=lambda value: value > 0), 1)
+        self.assertEqual(cache.get(obj), 1)
+
+        cache.remove(obj)
+        self.assertIsNone(cache.get(obj))
+        self.assertEqual(len(cache), 0)
+
+    def test_values_are_removed_with_their_objects(self):
+        cache = WeakIdentityCache()
+        obj = _Object()
+        cache.get_or_create(obj, lambda: 'a')
+        self.assertEqual(len(cache), 1)
+        del obj
+        gc.collect()
+        self.assertEqual(len(cache), 0)
+
+    def test_objects_without_weak_references_are_not_cached(self):
+        cache = WeakIdentityCache()
+        obj = [1, 2, 3]
+        self.assertEqual(cache.get_or_create(obj, lambda: 'a'), 'a')
+        self.assertEqual(cache.get_or_create(obj, lambda: 'b'), 'b')
+        self.assertEqual(len(cache), 0)
+
+    def test_values_are_created_without_lock(self):
+        cache = WeakIdentityCache()
+        obj1 = _Object()
+        obj2 = _Object()
+        creating = threading.Event()
+        release = threading.Event()
+
+        def create_slowly():
+            creating.set()
+            release.wait(5)
+            return 1
+
+        thread = threading.Thread(target=lambda: cache.get_or_create(obj1, create_slowly))
+        thread.start()
+        try:
+            self.assertTrue(creating.wait(5))
+            # Not blocked by the value created for obj1
+            self.assertEqual(cache.get_or_create(obj2, lambda: 2), 2)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(cache.get(obj1), 1)
@@ -1,3 +1,5 @@
+import copy
+import json
 import os.path
 from collections import OrderedDict
 from unittest import TestCase
@@ -6,7 +8,8 @@ import fiona
 import numpy as np
 import pyproj
 
-from cate.webapi.geojson import get_geometry_transform, write_feature_collection, simplify_geometry
+from cate.webapi.geojson import get_geometry_transform, write_feature_collection, simplify_geometry, \
+    get_simplification_ranks, get_feature_level_store, FeatureLevelStore
 
 source_prj = pyproj.Proj({'init': 'EPSG:4326'})
 target_prj = pyproj.Proj({'init': 'EPSG:3395'})
@@ -186,7 +189,124 @@ class WriteFeatureCollectionTest(TestCase):
         self.assertEqual(num_written, 175)
 
 
+class FeatureLevelStoreTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        file = os.path.join(os.path.dirname(__file__), '..', '..', 'cate', 'ds', 'data', 'countries',
+                            'countries-110m.geojson')
+        with fiona.open(file) as collection:
+            cls.features = [json.loads(json.dumps(getattr(feature, '__geo_interface__', feature)))
+                            for feature in collection]
+
+    def test_equals_write_feature_collection(self):
+        from io import StringIO
+        store = FeatureLevelStore(self.features)
+        self.assertEqual(175, store.num_features)
+        for conservation_ratio in [1.0, 0.5, 0.125, 2 ** -6, 0.0]:
+            expected_io = StringIO()
+            # write_feature_collection() modifies the given features
+            expected_num_written = write_feature_collection(copy.deepcopy(self.features), expected_io,
+                                                            res_id=7, conservation_ratio=conservation_ratio)
+            actual_io = StringIO()
+            actual_num_written = store.write_feature_collection(actual_io,
+                                                                res_id=7, conservation_ratio=conservation_ratio)
+            self.assertEqual(expected_num_written, actual_num_written)
+            self.assertEqual(json.loads(expected_io.getvalue()), json.loads(actual_io.getvalue()))
+
+    def test_max_num_display_geometries(self):
+        from io import StringIO
+        store = FeatureLevelStore(self.features)
+        string_io = StringIO()
+        store.write_feature_collection(string_io, max_num_display_geometries=100)
+        features = json.loads(string_io.getvalue())['features']
+        self.assertEqual(175, len(features))
+        for feature in features:
+            self.assertEqual('Point', feature['geometry']['type'])
+            self.assertEqual(1, feature['_simp'])
+
+    def test_max_num_display_geometry_points(self):
+        from io import StringIO
+        store = FeatureLevelStore(self.features)
+        string_io = StringIO()
+        store.write_feature_collection(string_io, max_num_display_geometry_points=50, conservation_ratio=0.5)
+        features = json.loads(string_io.getvalue())['features']
+        num_points = [sum(len(ring) for ring in feature['geometry']['coordinates'])
+                      if feature['geometry']['type'] == 'Polygon' else
+                      sum(len(ring) for polygon in feature['geometry']['coordinates'] for ring in polygon)
+                      for feature in self.features]
+        for feature, n in zip(features, num_points):
+            self.assertEqual('Point' if n > 50 else self.features[feature['_idx']]['geometry']['type'],
+                             feature['geometry']['type'])
+
+    def test_write_arrow_feature_collection(self):
+        from io import BytesIO, StringIO
+        import pyarrow as pa
+
+        class BytesSink(BytesIO):
+            num_flushes = 0
+
+            def flush(self):
+                self.num_flushes += 1
+
+        store = FeatureLevelStore(self.features)
+        for conservation_ratio in [1.0, 0.125, 0.0]:
+            json_io = StringIO()
+            store.write_feature_collection(json_io, res_id=7, conservation_ratio=conservation_ratio)
+            expected_features = json.loads(json_io.getvalue())['features']
+
+            sink = BytesSink()
+            num_written = store.write_arrow_feature_collection(sink, res_id=7,
+                                                               conservation_ratio=conservation_ratio,
+                                                               batch_size=50)
+            self.assertEqual(175, num_written)
+            self.assertGreaterEqual(sink.num_flushes, 4)
+            table = pa.ipc.open_stream(sink.getvalue()).read_all()
+            self.assertEqual(b'7', table.schema.metadata[b'res_id'])
+            self.assertEqual(175, table.num_rows)
+            rows = table.to_pylist()
+            for expected, actual in zip(expected_features, rows):
+                self.assertEqual(expected['_idx'], actual['_idx'])
+                self.assertEqual(expected['geometry']['type'], actual['_geometry_type'])
+                self.assertEqual(expected.get('_simp', 0), actual['_simp'])
+                self.assertEqual(expected['properties']['name'], actual['name'])
+                coordinates = expected['geometry']['coordinates']
+                if actual['_geometry_type'] == 'Point':
+                    coordinates = [[[coordinates]]]
+                elif actual['_geometry_type'] == 'Polygon':
+                    coordinates = [coordinates]
+                self.assertEqual(coordinates, actual['_geometry'])
+
+    def test_get_feature_level_store(self):
+        class Collection(list):
+            pass
+
+        collection = Collection(self.features)
+        store = get_feature_level_store(collection, lambda: collection)
+        self.assertIs(store, get_feature_level_store(collection, lambda: collection))
+        self.assertIsNot(store, get_feature_level_store(Collection(self.features), lambda: collection))
+
+        # Stores of files are kept for the lifetime of the process
+        file_store = get_feature_level_store('test-get-feature-level-store.shp', lambda: collection)
+        self.assertIsNot(store, file_store)
+        self.assertIs(file_store, get_feature_level_store('test-get-feature-level-store.shp', lambda: []))
+
+
 class SimplifyGeometryTest(TestCase):
+    def test_simplification_ranks(self):
+        x1 = np.array([1, 2, 3, 3, 3, 2, 1, 1, 1])
+        y1 = np.array([1, 1, 1, 2, 3, 3, 3, 2, 1])
+        x2 = np.array([12.0, 13.0, 13.3, 13.0, 12.0])
+        y2 = np.array([53.0, 54.0, 55.1, 56.0, 53.0])
+        ranks = get_simplification_ranks(np.concatenate([x1, x2]), np.concatenate([y1, y2]),
+                                         np.array([x1.size, x2.size]))
+        np.testing.assert_equal(ranks[:x1.size], get_simplification_ranks(x1, y1))
+        np.testing.assert_equal(ranks[x1.size:], get_simplification_ranks(x2, y2))
+        self.assertEqual(9, ranks[0])
+        self.assertEqual(9, ranks[8])
+        self.assertEqual(5, ranks[9])
+        self.assertEqual(5, ranks[13])
+        self.assertEqual([0, 4, 1, 5, 2, 6, 3], list(ranks[1:8]))
+
     def test_simplify_none(self):
         # A triangle (ring)
         x_data = [1, 3, 3, 1]
@@ -1,12 +1,43 @@
+import collections
 import json
 import tempfile
+import threading
 import unittest
-
-from tornado.testing import AsyncHTTPTestCase
-from cate.webapi.rest import _ensure_str
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import tornado.web
+import xarray as xr
+from tornado.httputil import HTTPServerRequest
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from cate.util.executor import PriorityThreadPoolExecutor
+from cate.webapi.rest import _ensure_str, _get_table_head, ResVarTileHandler
 from cate.webapi.start import create_application
 
 
+class TestGetTableHead(unittest.TestCase):
+    def test_dataset(self):
+        ds = xr.Dataset({'a': (['time', 'lat', 'lon'], np.arange(4 * 30 * 40, dtype=np.float64).reshape((4, 30, 40))),
+                         'b': (['lat', 'lon'], np.ones((30, 40)))},
+                        coords={'time': np.arange(4), 'lat': np.arange(30), 'lon': np.arange(40)})
+        for max_row_count in [1, 10, 40, 50, 1200, 1250, 10000]:
+            expected = ds.to_dataframe()[:max_row_count]
+            actual = _get_table_head(ds, max_row_count)
+            pd.testing.assert_frame_equal(expected, actual)
+
+    def test_data_array(self):
+        da = xr.DataArray(np.arange(30 * 40).reshape((30, 40)), dims=['lat', 'lon'])
+        expected = da.to_series()[:50]
+        actual = _get_table_head(da, 50)
+        pd.testing.assert_series_equal(expected, actual)
+
+    def test_data_frame(self):
+        df = pd.DataFrame({'a': np.arange(100)})
+        pd.testing.assert_frame_equal(df[:10], _get_table_head(df, 10))
+        pd.testing.assert_series_equal(df['a'][:10], _get_table_head(df['a'], 10))
+
+
 class TestEnsureStr(unittest.TestCase):
     def test_ensure_str(self):
         expected = 'doofer'
@@ -54,5 +85,49 @@ class TestFileUpload(AsyncHTTPTestCase):
         self.assertEqual('0MBs uploaded.', body['message'])
 
 
+class ResVarTileHandlerTest(AsyncTestCase):
+    @gen_test
+    def test_connection_close_cancels_queued_tile(self):
+        dataset = xr.Dataset(dict(a=xr.DataArray(np.zeros((2, 4)), dims=['lat', 'lon'])))
+        request = HTTPServerRequest(method='GET', uri='/ws/res/ws/0/tile/0/0/0?var=a', connection=mock.Mock())
+        handler = ResVarTileHandler(tornado.web.Application(), request)
+        tile_pool = PriorityThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        try:
+            # Occupy the only worker, so that the tile is queued
+            tile_pool.submit_with_priority(0, release.wait, 5)
+            get_workspace_resource = mock.patch.object(handler, 'get_workspace_resource',
+                                                       return_value=(None, 0, 'res', dataset))
+            with mock.patch('cate.webapi.rest.TILE_THREAD_POOL', tile_pool), get_workspace_resource:
+                with mock.patch.object(ResVarTileHandler, '_compute_tile') as compute_tile:
+                    get_future = handler.get('ws', '0', '0', '0', '0')
+                    tile_future = handler._tile_future
+                    self.assertIsNotNone(tile_future)
+                    self.assertFalse(tile_future.done())
+
+                    handler.on_connection_close()
+                    self.assertTrue(tile_future.cancelled())
+                    # The request ends without writing a tile or an error
+                    yield get_future
+        finally:
+            release.set()
+            tile_pool.shutdown()
+        compute_tile.assert_not_called()
+        self.assertEqual(handler.get_status(), 200)
+
+    def test_pyramids_are_bounded(self):
+        def get_pyramid_entry(pyramid_id):
+            return ResVarTileHandler._get_pyramid_entry(pyramid_id, 'ws', None, 'a', (),
+                                                        'jet', 0., 1., 'png', 'array', 'image')
+
+        with mock.patch('cate.webapi.rest.TILE_MAX_NUM_PYRAMIDS', 2):
+            with mock.patch.object(ResVarTileHandler, 'PYRAMIDS', collections.OrderedDict()):
+                with mock.patch.object(ResVarTileHandler, '_create_pyramid', side_effect=lambda *args: object()):
+                    entries = [get_pyramid_entry('pyramid-%d' % i) for i in range(3)]
+                    self.assertEqual(['pyramid-1', 'pyramid-2'], list(ResVarTileHandler.PYRAMIDS.keys()))
+                    self.assertIs(entries[2], get_pyramid_entry('pyramid-2'))
+                    self.assertIsNotNone(entries[2].pyramid)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+import numpy as np
+import xarray as xr
+
+from cate.core.workspace import Workspace
+from cate.webapi.varstats import compute_variable_statistics, get_percentile_range, get_variable_statistics
+
+
+class ComputeVariableStatisticsTest(TestCase):
+    def test_single_chunk(self):
+        values = np.array([[1.0, 2.0, np.nan], [4.0, np.inf, 10.0]])
+        statistics = compute_variable_statistics(xr.DataArray(values), num_bins=9)
+        self.assertEqual(4, statistics['count'])
+        self.assertEqual(1.0, statistics['min'])
+        self.assertEqual(10.0, statistics['max'])
+        self.assertAlmostEqual(17.0 / 4, statistics['mean'])
+        self.assertEqual([1, 1, 0, 1, 0, 0, 0, 0, 1], statistics['histogram'])
+
+    def test_chunked(self):
+        values = np.random.RandomState(0).normal(size=(100, 80))
+        values[10:20, 10:20] = np.nan
+        expected_counts, _ = np.histogram(values[np.isfinite(values)], bins=16,
+                                          range=(np.nanmin(values), np.nanmax(values)))
+        statistics = compute_variable_statistics(xr.DataArray(values).chunk(dict(dim_0=25, dim_1=40)),
+                                                 num_bins=16)
+        self.assertEqual(8000 - 100, statistics['count'])
+        self.assertEqual(np.nanmin(values), statistics['min'])
+        self.assertEqual(np.nanmax(values), statistics['max'])
+        self.assertAlmostEqual(np.nanmean(values), statistics['mean'])
+        self.assertEqual(16, len(statistics['histogram']))
+        self.assertAlmostEqual(8000 - 100, sum(statistics['histogram']), delta=8)
+        # Histograms of chunks are merged approximately
+        np.testing.assert_allclose(expected_counts, statistics['histogram'], rtol=0.15, atol=25)
+
+    def test_constant_and_empty(self):
+        statistics = compute_variable_statistics(xr.DataArray(np.full((4, 4), 3, dtype=np.int16)).chunk(2),
+                                                 num_bins=4)
+        self.assertEqual(16, statistics['count'])
+        self.assertEqual(3.0, statistics['min'])
+        self.assertEqual(3.0, statistics['max'])
+        self.assertEqual(16, sum(statistics['histogram']))
+
+        statistics = compute_variable_statistics(xr.DataArray(np.full((4, 4), np.nan)), num_bins=4)
+        self.assertEqual(0, statistics['count'])
+        self.assertTrue(np.isnan(statistics['min']))
+        self.assertEqual([0, 0, 0, 0], statistics['histogram'])
+        self.assertTrue(np.isnan(get_percentile_range(statistics)[0]))
+
+    def test_get_percentile_range(self):
+        statistics = compute_variable_statistics(xr.DataArray(np.arange(1001, dtype=np.float64)), num_bins=100)
+        lower, upper = get_percentile_range(statistics, lower=2, upper=98)
+        self.assertAlmostEqual(20.0, lower, delta=1.0)
+        self.assertAlmostEqual(980.0, upper, delta=1.0)
+        self.assertEqual((0.0, 1000.0), get_percentile_range(statistics, lower=0, upper=100))
+
+
+class GetVariableStatisticsTest(TestCase):
+    def test_cached_per_update(self):
+        ws = Workspace('/path', Workspace.new_workflow())
+        ds = xr.Dataset(dict(a=(['time', 'lat', 'lon'], np.arange(24, dtype=np.float64).reshape((2, 3, 4)))))
+        ws.resource_cache['ds'] = ds
+
+        statistics = get_variable_statistics(ws, 'ds', 'a', [1])
+        self.assertEqual(12.0, statistics['min'])
+        self.assertEqual(23.0, statistics['max'])
+        self.assertIs(statistics, get_variable_statistics(ws, 'ds', 'a', (1,)))
+        self.assertIsNot(statistics, get_variable_statistics(ws, 'ds', 'a', [0]))
+
+        ws.resource_cache['ds'] = ds + 1
+        self.assertEqual(13.0, get_variable_statistics(ws, 'ds', 'a', [1])['min'])
+
+        with self.assertRaises(ValueError):
+            get_variable_statistics(ws, 'ds', 'b')
+        with self.assertRaises(ValueError):
+            get_variable_statistics(ws, 'df', 'a')
@@ -185,6 +185,40 @@ class WebSocketServiceTest(unittest.TestCase):
                                                               var_index=[0])
         self.assertAlmostEqual(stat['min'], 5.1)
         self.assertAlmostEqual(stat['max'], 26.2)
+        self.assertGreater(stat['count'], 0)
+        self.assertAlmostEqual(stat['count'], sum(stat['histogram']['counts']), delta=10)
+        self.assertLessEqual(stat['histogram']['min'], stat['mean'])
+        self.assertGreaterEqual(stat['histogram']['max'], stat['mean'])
+        self.assertNotIn('percentiles', stat)
+
+        stat = self.service.get_workspace_variable_statistics(self.get_workspace_path(),
+                                                              res_name='ds',
+                                                              var_name='temperature',
+                                                              var_index=[0],
+                                                              percentiles=[0, 100])
+        self.assertEqual([stat['histogram']['min'], stat['histogram']['max']], stat['percentiles'])
+
+    def test_enable_resource_changes(self):
+        self._load_precip_dataset_in_workspace()
+        self.service.enable_resource_changes()
+        workspace_json = self.service.get_workspace(self.get_workspace_path())
+        self.assertNotIn('resources', workspace_json)
+        changes = workspace_json['resource_changes']
+        self.assertEqual(['ds'], [resource['name'] for resource in changes['added']])
+        self.assertEqual(1, len(changes['ids']))
+
+        changes = self.service.get_workspace(self.get_workspace_path())['resource_changes']
+        self.assertEqual([], changes['added'])
+        self.assertEqual([], changes['changed'])
+        self.assertEqual([], changes['removed'])
+
+        changes = self.service.delete_workspace_resource(self.get_workspace_path(), 'ds')['resource_changes']
+        self.assertEqual(1, len(changes['removed']))
+        self.assertEqual([], changes['ids'])
+
+        self.service.enable_resource_changes(False)
+        workspace_json = self.service.get_workspace(self.get_workspace_path())
+        self.assertEqual([], workspace_json['resources'])
 
     def test_get_resource_values(self):
         workspaces = self.service.get_open_workspaces()